@@ -60,12 +60,122 @@ async function supabaseQuery(
   return response.json();
 }
 
-// Evaluate automation rule conditions
-async function evaluateConditions(
+// Keeps `in.(...)` filters, and so request URLs, short
+const ID_CHUNK_SIZE = 100;
+
+// Fetch the rows whose `column` is one of `ids`, a chunk of ids per request
+async function fetchByIds(
   env: Env,
+  table: string,
+  column: string,
+  ids: string[],
+  select: string = '*',
+  filters: Record<string, string> = {}
+): Promise<any[]> {
+  const uniqueIds = [...new Set(ids.filter(Boolean))];
+  const rows: any[] = [];
+  
+  for (let i = 0; i < uniqueIds.length; i += ID_CHUNK_SIZE) {
+    const chunk = uniqueIds.slice(i, i + ID_CHUNK_SIZE);
+    const result = await supabaseQuery(env, table, {
+      select,
+      filters: { ...filters, [column]: `in.(${chunk.join(',')})` },
+    });
+    if (Array.isArray(result)) {
+      rows.push(...result);
+    }
+  }
+  
+  return rows;
+}
+
+// Get steps from rule (new format) or fall back to legacy action_config
+function ruleSteps(rule: any): any[] {
+  return rule.steps && Array.isArray(rule.steps) && rule.steps.length > 0
+    ? rule.steps
+    : (rule.action_config ? [{ type: 'send_email', ...rule.action_config }] : []);
+}
+
+// Everything a claimed batch reads, loaded up front with a few bulk queries
+interface BatchCache {
+  rules: Map<string, any>;
+  contacts: Map<string, any>;
+  templates: Map<string, any>;
+  // `${contact_id}:${product_id}` for the purchases the batch's product conditions ask about
+  purchases: Set<string>;
+}
+
+async function prefetchBatch(env: Env, actions: any[]): Promise<BatchCache> {
+  const [rules, contacts] = await Promise.all([
+    fetchByIds(env, 'automation_rules', 'id', actions.map((action) => action.automation_rule_id)),
+    fetchByIds(env, 'contacts', 'id', actions.map((action) => action.contact_id)),
+  ]);
+  
+  const cache: BatchCache = {
+    rules: new Map(rules.map((rule) => [rule.id, rule])),
+    contacts: new Map(contacts.map((contact) => [contact.id, contact])),
+    templates: new Map(),
+    purchases: new Set(),
+  };
+  
+  // Templates of the steps about to run, and products named by conditions
+  const templateIds: string[] = [];
+  const productIds = new Set<string>();
+  const productContactIds = new Set<string>();
+  
+  for (const action of actions) {
+    const rule = cache.rules.get(action.automation_rule_id);
+    if (!rule) continue;
+    
+    const step = ruleSteps(rule)[action.step_index ?? 0];
+    if (step?.type === 'send_email' && step.template_id) {
+      templateIds.push(step.template_id);
+    }
+    
+    for (const condition of rule.conditions || []) {
+      if ((condition.type === 'has_product' || condition.type === 'no_product') && condition.product_id) {
+        productIds.add(condition.product_id);
+        productContactIds.add(action.contact_id);
+      }
+    }
+  }
+  
+  const [templates, purchases] = await Promise.all([
+    fetchByIds(env, 'email_templates', 'id', templateIds),
+    productIds.size > 0
+      ? fetchByIds(env, 'contact_products', 'contact_id', [...productContactIds], 'contact_id,product_id', {
+          product_id: `in.(${[...productIds].join(',')})`,
+        })
+      : Promise.resolve([]),
+  ]);
+  
+  for (const template of templates) {
+    cache.templates.set(template.id, template);
+  }
+  for (const purchase of purchases) {
+    cache.purchases.add(`${purchase.contact_id}:${purchase.product_id}`);
+  }
+  
+  return cache;
+}
+
+// Run `task` over `items` with at most `limit` in flight
+async function runWithConcurrency<T>(items: T[], limit: number, task: (item: T) => Promise<void>): Promise<void> {
+  let next = 0;
+  const runners = Array.from({ length: Math.min(limit, items.length) }, async () => {
+    while (next < items.length) {
+      await task(items[next++]);
+    }
+  });
+  await Promise.all(runners);
+}
+
+// Evaluate automation rule conditions
+function evaluateConditions(
+  cache: BatchCache,
   rule: any,
   contact: any
-): Promise<boolean> {
+): boolean {
   const conditions = rule.conditions || [];
   
   for (const condition of conditions) {
@@ -96,30 +206,14 @@ async function evaluateConditions(
     
     if (condition.type === 'has_product') {
       // Check if contact has purchased a specific product
-      const contactProducts = await supabaseQuery(env, 'contact_products', {
-        select: 'product_id',
-        filters: {
-          contact_id: `eq.${contact.id}`,
-          product_id: `eq.${condition.product_id}`,
-        },
-      });
-      const hasProduct = Array.isArray(contactProducts) ? contactProducts.length > 0 : !!contactProducts;
-      if (!hasProduct) {
+      if (!cache.purchases.has(`${contact.id}:${condition.product_id}`)) {
         return false;
       }
     }
     
     if (condition.type === 'no_product') {
       // Check if contact has NOT purchased a specific product
-      const contactProducts = await supabaseQuery(env, 'contact_products', {
-        select: 'product_id',
-        filters: {
-          contact_id: `eq.${contact.id}`,
-          product_id: `eq.${condition.product_id}`,
-        },
-      });
-      const hasProduct = Array.isArray(contactProducts) ? contactProducts.length > 0 : !!contactProducts;
-      if (hasProduct) {
+      if (cache.purchases.has(`${contact.id}:${condition.product_id}`)) {
         return false;
       }
     }
@@ -128,6 +222,9 @@ async function evaluateConditions(
   return true;
 }
 
+// A hung webhook must not hold its action past the lease renewals of the batch
+const WEBHOOK_TIMEOUT_MS = 30_000;
+
 // Send email via webhook
 async function sendEmailViaWebhook(webhookUrl: string, payload: any): Promise<boolean> {
   try {
@@ -135,6 +232,7 @@ async function sendEmailViaWebhook(webhookUrl: string, payload: any): Promise<bo
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(payload),
+      signal: AbortSignal.timeout(WEBHOOK_TIMEOUT_MS),
     });
     return response.ok;
   } catch (error) {
@@ -144,7 +242,7 @@ async function sendEmailViaWebhook(webhookUrl: string, payload: any): Promise<bo
 }
 
 // Execute a single automation step
-async function executeStep(env: Env, step: any, contact: any, rule: any): Promise<boolean> {
+async function executeStep(env: Env, cache: BatchCache, step: any, contact: any, rule: any): Promise<boolean> {
   try {
     if (step.type === 'wait') {
       // Wait steps are handled by scheduling, so this shouldn't be called
@@ -165,6 +263,8 @@ async function executeStep(env: Env, step: any, contact: any, rule: any): Promis
           filters: { id: `eq.${contact.id}` },
           body: { tags: updatedTags },
         });
+        // Later actions of this contact in the batch see the new tags
+        contact.tags = updatedTags;
       }
       return true;
     }
@@ -181,6 +281,7 @@ async function executeStep(env: Env, step: any, contact: any, rule: any): Promis
         filters: { id: `eq.${contact.id}` },
         body: { tags: updatedTags },
       });
+      contact.tags = updatedTags;
       return true;
     }
     
@@ -190,11 +291,7 @@ async function executeStep(env: Env, step: any, contact: any, rule: any): Promis
       let htmlContent = step.html_content || '';
       
       if (step.template_id) {
-        const templates = await supabaseQuery(env, 'email_templates', {
-          select: '*',
-          filters: { id: `eq.${step.template_id}` },
-        });
-        const template = Array.isArray(templates) ? templates[0] : templates;
+        const template = cache.templates.get(step.template_id);
         if (template) {
           subject = template.subject;
           htmlContent = template.html_content;
@@ -249,82 +346,146 @@ async function executeStep(env: Env, step: any, contact: any, rule: any): Promis
   }
 }
 
+// Writes of finished actions, recorded a few dozen actions at a time by
+// record_automation_outcomes: one statement per table, rule counters as atomic deltas.
+// Every entry names the action it comes from; outcomes of actions no longer held by the
+// claim are dropped by the database.
+interface BatchOutcomes {
+  actions: Array<{ id: string; claim_token: string; status: string; executed_at: string; error_message: string | null }>;
+  nextActions: Array<{
+    automation_action_id: string;
+    automation_rule_id: string;
+    contact_id: string;
+    execute_at: string;
+    step_index: number;
+  }>;
+  logs: Array<{
+    automation_rule_id: string;
+    automation_action_id: string;
+    contact_id: string;
+    event_type: string;
+    status: string;
+    message: string;
+  }>;
+  ruleStats: Array<{
+    automation_action_id: string;
+    rule_id: string;
+    succeeded?: number;
+    failed?: number;
+    last_triggered_at?: string;
+  }>;
+}
+
+function emptyOutcomes(): BatchOutcomes {
+  return { actions: [], nextActions: [], logs: [], ruleStats: [] };
+}
+
+function finishAction(outcomes: BatchOutcomes, action: any, status: string, errorMessage: string | null = null) {
+  outcomes.actions.push({
+    id: action.id,
+    claim_token: action.claim_token,
+    status,
+    executed_at: new Date().toISOString(),
+    error_message: errorMessage,
+  });
+}
+
+async function flushOutcomes(env: Env, outcomes: BatchOutcomes): Promise<void> {
+  await supabaseQuery(env, 'rpc/record_automation_outcomes', {
+    method: 'POST',
+    body: {
+      p_actions: outcomes.actions,
+      p_next_actions: outcomes.nextActions,
+      p_logs: outcomes.logs,
+      p_rule_stats: outcomes.ruleStats,
+    },
+  });
+}
+
+// Finished actions are recorded in groups of this size while the rest of the batch runs,
+// so a run that dies mid-batch repeats at most one group's sends
+const OUTCOME_FLUSH_SIZE = 25;
+
+// Collects the outcomes of a batch's actions and records them as groups fill up
+function outcomeRecorder(env: Env) {
+  let pending = emptyOutcomes();
+
+  const merge = (outcomes: BatchOutcomes) => {
+    pending.actions.push(...outcomes.actions);
+    pending.nextActions.push(...outcomes.nextActions);
+    pending.logs.push(...outcomes.logs);
+    pending.ruleStats.push(...outcomes.ruleStats);
+  };
+
+  const take = (): BatchOutcomes => {
+    const taken = pending;
+    pending = emptyOutcomes();
+    return taken;
+  };
+
+  return {
+    async add(outcomes: BatchOutcomes): Promise<void> {
+      merge(outcomes);
+      if (pending.actions.length < OUTCOME_FLUSH_SIZE) return;
+
+      const group = take();
+      try {
+        await flushOutcomes(env, group);
+      } catch (error) {
+        // Retried with the next group
+        console.error('Error recording automation outcomes:', error);
+        merge(group);
+      }
+    },
+
+    // Record whatever is left; if this fails those actions stay executing and are
+    // claimed again once their lease expires
+    async flush(): Promise<void> {
+      if (pending.actions.length > 0) {
+        await flushOutcomes(env, take());
+      }
+    },
+  };
+}
+
 // Process scheduled automation action
-async function processAutomationAction(env: Env, action: any): Promise<void> {
+async function processAutomationAction(env: Env, cache: BatchCache, outcomes: BatchOutcomes, action: any): Promise<void> {
   try {
     // Get automation rule
-    const rules = await supabaseQuery(env, 'automation_rules', {
-      select: '*',
-      filters: { id: `eq.${action.automation_rule_id}` },
-    });
-    const rule = Array.isArray(rules) ? rules[0] : rules;
+    const rule = cache.rules.get(action.automation_rule_id);
     
     if (!rule || !rule.enabled) {
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'skipped',
-          executed_at: new Date().toISOString(),
-          error_message: 'Rule not found or disabled',
-        },
-      });
+      finishAction(outcomes, action, 'skipped', 'Rule not found or disabled');
       return;
     }
     
-    // Get contact (refresh to get latest tags)
-    const contacts = await supabaseQuery(env, 'contacts', {
-      select: '*',
-      filters: { id: `eq.${action.contact_id}` },
-    });
-    let contact = Array.isArray(contacts) ? contacts[0] : contacts;
+    // Get contact (loaded after the claim, updated in place by this batch's tag steps)
+    const contact = cache.contacts.get(action.contact_id);
     
     if (!contact || contact.status !== 'subscribed') {
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'skipped',
-          executed_at: new Date().toISOString(),
-          error_message: 'Contact not found or unsubscribed',
-        },
-      });
+      finishAction(outcomes, action, 'skipped', 'Contact not found or unsubscribed');
       return;
     }
     
     // Evaluate conditions
-    const conditionsMet = await evaluateConditions(env, rule, contact);
+    const conditionsMet = evaluateConditions(cache, rule, contact);
     
     if (!conditionsMet) {
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'skipped',
-          executed_at: new Date().toISOString(),
-          error_message: 'Conditions not met',
-        },
-      });
+      finishAction(outcomes, action, 'skipped', 'Conditions not met');
       
       // Log the skip
-      await supabaseQuery(env, 'automation_logs', {
-        method: 'POST',
-        body: {
-          automation_rule_id: rule.id,
-          automation_action_id: action.id,
-          contact_id: contact.id,
-          event_type: 'action_skipped',
-          status: 'skipped',
-          message: 'Conditions not met',
-        },
+      outcomes.logs.push({
+        automation_rule_id: rule.id,
+        automation_action_id: action.id,
+        contact_id: contact.id,
+        event_type: 'action_skipped',
+        status: 'skipped',
+        message: 'Conditions not met',
       });
       return;
     }
     
-    // Get steps from rule (new format) or fall back to legacy action_config
-    const steps = rule.steps && Array.isArray(rule.steps) && rule.steps.length > 0
-      ? rule.steps
-      : (rule.action_config ? [{ type: 'send_email', ...rule.action_config }] : []);
+    const steps = ruleSteps(rule);
     
     if (steps.length === 0) {
       throw new Error('No steps configured in automation rule');
@@ -336,19 +497,12 @@ async function processAutomationAction(env: Env, action: any): Promise<void> {
       
     if (!currentStep) {
       // All steps completed
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'completed',
-          executed_at: new Date().toISOString(),
-        },
-        });
+      finishAction(outcomes, action, 'completed');
       return;
     }
     
     // Execute current step
-    const stepSuccess = await executeStep(env, currentStep, contact, rule);
+    const stepSuccess = await executeStep(env, cache, currentStep, contact, rule);
     
     if (!stepSuccess) {
       throw new Error(`Failed to execute step: ${currentStep.type}`);
@@ -356,25 +510,15 @@ async function processAutomationAction(env: Env, action: any): Promise<void> {
       
     // If this is a stop step, mark as completed and don't continue
     if (currentStep.type === 'stop') {
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'completed',
-          executed_at: new Date().toISOString(),
-        },
-      });
+      finishAction(outcomes, action, 'completed');
       
-      await supabaseQuery(env, 'automation_logs', {
-        method: 'POST',
-        body: {
-          automation_rule_id: rule.id,
-          automation_action_id: action.id,
-          contact_id: contact.id,
-          event_type: 'action_executed',
-          status: 'success',
-          message: 'Automation stopped at stop step',
-        },
+      outcomes.logs.push({
+        automation_rule_id: rule.id,
+        automation_action_id: action.id,
+        contact_id: contact.id,
+        event_type: 'action_executed',
+        status: 'success',
+        message: 'Automation stopped at stop step',
       });
       return;
     }
@@ -418,137 +562,138 @@ async function processAutomationAction(env: Env, action: any): Promise<void> {
         }
       }
       
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'POST',
-        body: {
+      outcomes.nextActions.push({
+        automation_action_id: action.id,
         automation_rule_id: rule.id,
-          contact_id: contact.id,
-          status: 'pending',
-          execute_at: executeAt.toISOString(),
-          step_index: nextStepIndex,
-        },
-      });
-      
-      // Mark current action as completed
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: {
-          status: 'completed',
-          executed_at: new Date().toISOString(),
-        },
+        contact_id: contact.id,
+        execute_at: executeAt.toISOString(),
+        step_index: nextStepIndex,
       });
-    } else {
-      // All steps completed
-        await supabaseQuery(env, 'automation_actions', {
-          method: 'PATCH',
-          filters: { id: `eq.${action.id}` },
-          body: {
-            status: 'completed',
-            executed_at: new Date().toISOString(),
-          },
-        });
     }
-        
-        // Update rule statistics
-        await supabaseQuery(env, 'automation_rules', {
-          method: 'PATCH',
-          filters: { id: `eq.${rule.id}` },
-          body: {
-            success_count: (rule.success_count || 0) + 1,
-            last_triggered_at: new Date().toISOString(),
-          },
-        });
-        
-        // Log success
-        await supabaseQuery(env, 'automation_logs', {
-          method: 'POST',
-          body: {
-            automation_rule_id: rule.id,
-            automation_action_id: action.id,
-            contact_id: contact.id,
-            event_type: 'action_executed',
-            status: 'success',
-        message: `Step ${stepIndex + 1} executed: ${currentStep.type}`,
-          },
-        });
-  } catch (error: any) {
-    console.error(`Error processing automation action ${action.id}:`, error);
     
-    await supabaseQuery(env, 'automation_actions', {
-      method: 'PATCH',
-      filters: { id: `eq.${action.id}` },
-      body: {
-        status: 'failed',
-        executed_at: new Date().toISOString(),
-        error_message: error.message,
-      },
+    // Mark current action as completed
+    finishAction(outcomes, action, 'completed');
+    
+    // Update rule statistics
+    outcomes.ruleStats.push({
+      automation_action_id: action.id,
+      rule_id: rule.id,
+      succeeded: 1,
+      last_triggered_at: new Date().toISOString(),
     });
     
-    // Update rule failure count
-    const rules = await supabaseQuery(env, 'automation_rules', {
-      select: 'failure_count',
-      filters: { id: `eq.${action.automation_rule_id}` },
+    // Log success
+    outcomes.logs.push({
+      automation_rule_id: rule.id,
+      automation_action_id: action.id,
+      contact_id: contact.id,
+      event_type: 'action_executed',
+      status: 'success',
+      message: `Step ${stepIndex + 1} executed: ${currentStep.type}`,
     });
-    const rule = Array.isArray(rules) ? rules[0] : rules;
+  } catch (error: any) {
+    console.error(`Error processing automation action ${action.id}:`, error);
     
-    if (rule) {
-      await supabaseQuery(env, 'automation_rules', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.automation_rule_id}` },
-        body: {
-          failure_count: (rule.failure_count || 0) + 1,
-        },
-      });
-    }
+    finishAction(outcomes, action, 'failed', error.message);
+    
+    // Update rule failure count
+    outcomes.ruleStats.push({ automation_action_id: action.id, rule_id: action.automation_rule_id, failed: 1 });
     
     // Log failure
-    await supabaseQuery(env, 'automation_logs', {
-      method: 'POST',
-      body: {
-        automation_rule_id: action.automation_rule_id,
-        automation_action_id: action.id,
-        contact_id: action.contact_id,
-        event_type: 'action_failed',
-        status: 'failure',
-        message: error.message,
-      },
+    outcomes.logs.push({
+      automation_rule_id: action.automation_rule_id,
+      automation_action_id: action.id,
+      contact_id: action.contact_id,
+      event_type: 'action_failed',
+      status: 'failure',
+      message: error.message,
     });
   }
 }
 
+// Due actions are claimed in leased batches (claim_due_actions), so overlapping cron runs
+// and other executors never pick up the same action. The lease is renewed while the batch
+// runs; actions of a run that dies are claimed again once it expires, up to
+// claim_due_actions' attempt limit.
+const CLAIM_BATCH_SIZE = 250;
+const CLAIM_LEASE_SECONDS = 300;
+const LEASE_RENEW_AFTER_MS = (CLAIM_LEASE_SECONDS * 1000) / 3;
+const MAX_BATCHES_PER_TICK = 4;
+// Contacts processed at once; a contact's own actions run one after another
+const ACTION_CONCURRENCY = 10;
+
+// Returns a function that renews the batch's lease once a third of it has passed.
+// Runners call it between actions; concurrent calls share one renewal.
+function leaseRenewer(env: Env, claimToken: string): () => Promise<void> {
+  let renewedAt = Date.now();
+  let renewing: Promise<void> | null = null;
+
+  return async () => {
+    if (!renewing && Date.now() - renewedAt >= LEASE_RENEW_AFTER_MS) {
+      renewing = supabaseQuery(env, 'rpc/renew_action_leases', {
+        method: 'POST',
+        body: { p_claim_token: claimToken, p_lease_seconds: CLAIM_LEASE_SECONDS },
+      })
+        .then(() => {
+          renewedAt = Date.now();
+        })
+        .catch((error) => console.error('Error renewing action leases:', error))
+        .finally(() => {
+          renewing = null;
+        });
+    }
+    if (renewing) await renewing;
+  };
+}
+
 // Scheduled trigger handler (runs every hour)
 async function scheduled(event: ScheduledEvent, env: Env, ctx: ExecutionContext): Promise<void> {
   console.log('Running automation engine cron job...');
   
   try {
-    // Get all pending actions that are due
-    const now = new Date().toISOString();
-    const actions = await supabaseQuery(env, 'automation_actions', {
-      select: '*',
-      filters: {
-        status: `eq.pending`,
-        execute_at: `lte.${now}`,
-      },
-    });
+    let claimedTotal = 0;
     
-    const actionArray = Array.isArray(actions) ? actions : (actions ? [actions] : []);
-    console.log(`Found ${actionArray.length} due automation actions`);
-    
-    // Process each action
-    for (const action of actionArray) {
-      // Mark as executing
-      await supabaseQuery(env, 'automation_actions', {
-        method: 'PATCH',
-        filters: { id: `eq.${action.id}` },
-        body: { status: 'executing' },
+    for (let batch = 0; batch < MAX_BATCHES_PER_TICK; batch++) {
+      // Claim a batch of due actions; they come back already marked as executing
+      const actions = await supabaseQuery(env, 'rpc/claim_due_actions', {
+        method: 'POST',
+        body: { p_batch_size: CLAIM_BATCH_SIZE, p_lease_seconds: CLAIM_LEASE_SECONDS },
       });
       
-      // Process the action
-      await processAutomationAction(env, action);
+      const actionArray = Array.isArray(actions) ? actions : (actions ? [actions] : []);
+      claimedTotal += actionArray.length;
+      
+      if (actionArray.length === 0) break;
+      
+      const cache = await prefetchBatch(env, actionArray);
+      
+      // Group by contact so tag steps of the same contact never race
+      const actionsByContact = new Map<string, any[]>();
+      for (const action of actionArray) {
+        const contactActions = actionsByContact.get(action.contact_id) || [];
+        contactActions.push(action);
+        actionsByContact.set(action.contact_id, contactActions);
+      }
+      
+      const renewLease = leaseRenewer(env, actionArray[0].claim_token);
+      const recorder = outcomeRecorder(env);
+      await runWithConcurrency([...actionsByContact.values()], ACTION_CONCURRENCY, async (contactActions) => {
+        for (const action of contactActions) {
+          await renewLease();
+          // Each action writes its own outcomes, so a group flushed while it runs never
+          // picks up half of them
+          const outcomes = emptyOutcomes();
+          await processAutomationAction(env, cache, outcomes, action);
+          await recorder.add(outcomes);
+        }
+      });
+      
+      await recorder.flush();
+      
+      if (actionArray.length < CLAIM_BATCH_SIZE) break;
     }
     
-    console.log('Automation engine cron job completed');
+    console.log(`Automation engine cron job completed: ${claimedTotal} due automation actions claimed`);
   } catch (error) {
     console.error('Error in automation engine cron job:', error);
   }
@@ -586,6 +731,9 @@ async function handleRequest(request: Request, env: Env): Promise<Response> {
         return triggerConfig.type === triggerType;
       });
       
+      // Trigger counts are applied together once the actions are scheduled
+      const triggerDeltas: Array<{ rule_id: string; triggered: number; last_triggered_at: string }> = [];
+      
       // For each matching rule, create scheduled actions
       for (const rule of matchingRules) {
         // Get steps from rule (new format) or fall back to legacy
@@ -664,13 +812,13 @@ async function handleRequest(request: Request, env: Env): Promise<Response> {
         });
         
         // Update rule trigger count
-        await supabaseQuery(env, 'automation_rules', {
-          method: 'PATCH',
-          filters: { id: `eq.${rule.id}` },
-          body: {
-            trigger_count: (rule.trigger_count || 0) + 1,
-            last_triggered_at: new Date().toISOString(),
-          },
+        triggerDeltas.push({ rule_id: rule.id, triggered: 1, last_triggered_at: new Date().toISOString() });
+      }
+      
+      if (triggerDeltas.length > 0) {
+        await supabaseQuery(env, 'rpc/apply_automation_rule_stat_deltas', {
+          method: 'POST',
+          body: { p_deltas: triggerDeltas },
         });
       }
       
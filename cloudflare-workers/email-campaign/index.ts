@@ -272,20 +272,12 @@ export default {
           });
         }
         
-        // Get contacts from lists - need to query each list separately or use a different approach
-        // For now, we'll get all contact_lists and filter
-        const allContactLists = await supabaseQuery(env, 'contact_lists', {
-          select: 'contact_id,list_id,contacts(id,email,first_name,last_name,status)',
+        // Static and dynamic lists resolve to distinct subscribed contacts in the database
+        const validContacts = await supabaseQuery(env, 'rpc/resolve_list_recipients', {
+          method: 'POST',
+          body: { p_list_ids: listIds },
         });
         
-        const validContacts = allContactLists
-          .filter((cl: any) => listIds.includes(cl.list_id) && cl.contacts?.status === 'subscribed')
-          .map((cl: any) => cl.contacts)
-          .filter((c: any) => c)
-          .filter((c: any, index: number, self: any[]) => 
-            index === self.findIndex((t: any) => t.id === c.id)
-          ); // Remove duplicates
-        
         if (validContacts.length === 0) {
           return new Response(JSON.stringify({ error: 'No valid contacts found' }), {
             status: 400,
@@ -396,18 +388,21 @@ export default {
           });
         }
         
-        // Get contacts for pending sends
-        const emails = pendingSends.map((s: any) => s.contact_email);
+        // Get contacts for pending sends (matched case-insensitively via email_normalized)
+        const emails = pendingSends.map((s: any) => s.contact_email.trim().toLowerCase());
         const contacts = await supabaseQuery(env, 'contacts', {
-          select: 'id,email,first_name,last_name',
-          filters: { email: `in.(${emails.join(',')})` },
+          select: 'id,email,email_normalized,first_name,last_name',
+          filters: {
+            user_id: `eq.${campaign.user_id}`,
+            email_normalized: `in.(${emails.map((e: string) => `"${e}"`).join(',')})`,
+          },
         });
         
         const maxRetries = parseInt(env.MAX_RETRIES || '3');
-        const contactMap = new Map((Array.isArray(contacts) ? contacts : [contacts]).map((c: any) => [c.email, c]));
+        const contactMap = new Map((Array.isArray(contacts) ? contacts : [contacts]).map((c: any) => [c.email_normalized, c]));
         
         for (const send of pendingSends) {
-          const contact = contactMap.get(send.contact_email);
+          const contact = contactMap.get(send.contact_email.trim().toLowerCase());
           if (contact) {
             await env.EMAIL_SEND_QUEUE.send({
               campaignId,
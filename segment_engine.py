@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+Segment Engine (reference implementation)
+Keeps one compressed bitmap of contacts per list, tag, product and status, updated
+incrementally as contacts, memberships and purchases change, and evaluates audiences
+as bitmap algebra in memory instead of joins over contact_lists / contacts.
+
+Contacts are interned to dense integers in arrival order. Bitmaps are Roaring-style:
+ids are split into 65536-wide chunks and each chunk is stored as a sorted uint16 array
+while it holds at most 4096 ids, or as a 65536-bit bitset (a Python int) once denser.
+
+Rule evaluation mirrors public.compile_list_rules: the same rule types, globalOperator,
+status filter ('subscribed' unless rule_config.status says otherwise, 'any' for none),
+case-insensitive tags and uuid-only list/product ids. resolve_recipients mirrors
+public.resolve_list_recipients.
+
+Usage:
+  # Evaluate a rule_config against a Postgres copy of the database (needs psycopg2)
+  python segment_engine.py --dsn postgresql://... --user-id <uuid> --rules rule_config.json
+
+  # Resolve a campaign audience
+  python segment_engine.py --dsn postgresql://... --user-id <uuid> --lists <uuid>,<uuid>
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+ARRAY_MAX = 4096
+CHUNK_BYTES = 65536 // 8
+UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
+RULE_TYPES = {
+    "has_any_tags", "has_all_tags", "not_has_tags", "in_any_lists", "in_all_lists", "not_in_lists",
+    "has_any_products", "not_has_products",
+}
+
+
+def normalize_tags(tags):
+    """Python mirror of public.normalize_tag_array"""
+    return sorted({t.strip().lower() for t in tags or [] if t is not None and t.strip()})
+
+
+# --- Containers ---------------------------------------------------------------------------
+# A container is either a sorted array('H') (sparse) or an int bitset (dense).
+
+def _bits_from_array(values):
+    buf = bytearray(CHUNK_BYTES)
+    for v in values:
+        buf[v >> 3] |= 1 << (v & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _array_from_bits(bits):
+    out = array("H")
+    data = bits.to_bytes(CHUNK_BYTES, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    out.append(base + bit)
+    return out
+
+
+def _cardinality(container):
+    return len(container) if isinstance(container, array) else container.bit_count()
+
+
+def _normalize(container):
+    """Pick the cheaper representation; None when empty"""
+    if isinstance(container, array):
+        if not container:
+            return None
+        return _bits_from_array(container) if len(container) > ARRAY_MAX else container
+    count = container.bit_count()
+    if count == 0:
+        return None
+    return _array_from_bits(container) if count <= ARRAY_MAX else container
+
+
+def _bit_tester(bits):
+    """Membership test for a bitset; avoids shifting the whole 8 KB int per probe"""
+    data = bits.to_bytes(CHUNK_BYTES, "little")
+    return lambda v: data[v >> 3] >> (v & 7) & 1
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _normalize(array("H", filter(_bit_tester(b), a)))
+    return _normalize(array("H", sorted(set(a).intersection(b))))
+
+
+def _or(a, b):
+    if isinstance(a, array) and isinstance(b, array) and len(a) + len(b) <= ARRAY_MAX:
+        return _normalize(array("H", sorted(set(a).union(b))))
+    a = a if isinstance(a, int) else _bits_from_array(a)
+    b = b if isinstance(b, int) else _bits_from_array(b)
+    return _normalize(a | b)
+
+
+def _andnot(a, b):
+    if isinstance(a, array):
+        if isinstance(b, int):
+            test = _bit_tester(b)
+            return _normalize(array("H", (v for v in a if not test(v))))
+        excluded = set(b)
+        return _normalize(array("H", (v for v in a if v not in excluded)))
+    b = b if isinstance(b, int) else _bits_from_array(b)
+    return _normalize(a & ~b)
+
+
+class RoaringBitmap:
+    """Set of non-negative integers stored as Roaring-style containers"""
+
+    __slots__ = ("_containers",)
+
+    def __init__(self, values=()):
+        self._containers = {}
+        for value in values:
+            self.add(value)
+
+    @classmethod
+    def from_values(cls, values):
+        """Build from many values at once (much faster than repeated add)"""
+        chunks = defaultdict(set)
+        for value in values:
+            chunks[value >> 16].add(value & 0xFFFF)
+        return cls._from_containers(
+            {high: _normalize(array("H", sorted(lows))) for high, lows in chunks.items()}
+        )
+
+    @classmethod
+    def _from_containers(cls, containers):
+        bitmap = cls()
+        bitmap._containers = containers
+        return bitmap
+
+    def add(self, value):
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array("H", [low])
+        elif isinstance(container, int):
+            self._containers[high] = container | (1 << low)
+        else:
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                insort(container, low)
+                if len(container) > ARRAY_MAX:
+                    self._containers[high] = _bits_from_array(container)
+
+    def discard(self, value):
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _normalize(container & ~(1 << low))
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+            container = container or None
+        if container is None:
+            del self._containers[high]
+        else:
+            self._containers[high] = container
+
+    def __contains__(self, value):
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self._containers.values())
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            values = _array_from_bits(container) if isinstance(container, int) else container
+            base = high << 16
+            for low in values:
+                yield base + low
+
+    def __eq__(self, other):
+        return isinstance(other, RoaringBitmap) and list(self) == list(other)
+
+    def __and__(self, other):
+        containers = {}
+        for high in self._containers.keys() & other._containers.keys():
+            result = _and(self._containers[high], other._containers[high])
+            if result is not None:
+                containers[high] = result
+        return RoaringBitmap._from_containers(containers)
+
+    def __or__(self, other):
+        containers = {high: _copy(c) for high, c in self._containers.items()}
+        for high, container in other._containers.items():
+            mine = containers.get(high)
+            containers[high] = _copy(container) if mine is None else _or(mine, container)
+        return RoaringBitmap._from_containers(containers)
+
+    def __sub__(self, other):
+        containers = {}
+        for high, container in self._containers.items():
+            theirs = other._containers.get(high)
+            result = _copy(container) if theirs is None else _andnot(container, theirs)
+            if result is not None:
+                containers[high] = result
+        return RoaringBitmap._from_containers(containers)
+
+    def copy(self):
+        return RoaringBitmap._from_containers({high: _copy(c) for high, c in self._containers.items()})
+
+    def size_in_bytes(self):
+        """Approximate payload size (2 bytes per sparse id, 8 KB per dense chunk)"""
+        return sum(2 * len(c) if isinstance(c, array) else CHUNK_BYTES for c in self._containers.values())
+
+
+def _copy(container):
+    return array("H", container) if isinstance(container, array) else container
+
+
+def union_all(bitmaps):
+    """Union of many bitmaps, merging each chunk once instead of pairwise"""
+    chunks = defaultdict(list)
+    for bitmap in bitmaps:
+        for high, container in bitmap._containers.items():
+            chunks[high].append(container)
+    containers = {}
+    for high, group in chunks.items():
+        if len(group) == 1:
+            containers[high] = _copy(group[0])
+        elif all(isinstance(c, array) for c in group) and sum(map(len, group)) <= ARRAY_MAX:
+            containers[high] = array("H", sorted(set().union(*group)))
+        else:
+            bits = 0
+            for c in group:
+                bits |= c if isinstance(c, int) else _bits_from_array(c)
+            containers[high] = _normalize(bits)
+    return RoaringBitmap._from_containers(containers)
+
+
+def intersect_all(bitmaps, universe):
+    """Intersection of `bitmaps`; `universe` when there are none (like `@> '{}'`)"""
+    bitmaps = sorted(bitmaps, key=len)
+    if not bitmaps:
+        return universe.copy()
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        if not result:
+            break
+        result = result & bitmap
+    return result.copy() if result is bitmaps[0] else result
+
+
+# --- Segment index ------------------------------------------------------------------------
+
+def uuid_values(values):
+    return sorted({v.lower() for v in values if isinstance(v, str) and UUID_RE.match(v)})
+
+
+def effective_rules(rule_config):
+    """Python mirror of public.dynamic_list_effective_rules"""
+    rule_config = rule_config or {}
+    rules = rule_config.get("rules")
+    if not isinstance(rules, list):
+        required = rule_config.get("requiredTags")
+        rules = [{"type": "has_any_tags", "values": required}] if isinstance(required, list) else []
+    return [
+        (rule["type"], [str(v) for v in rule["values"]])
+        for rule in rules
+        if isinstance(rule, dict) and rule.get("type") in RULE_TYPES
+        and isinstance(rule.get("values"), list) and rule["values"]
+    ]
+
+
+class SegmentIndex:
+    """Bitmaps of one user's contacts, kept current through the apply_* methods"""
+
+    def __init__(self):
+        self._numbers = {}
+        self._contact_ids = []
+        self._contact_tags = {}
+        self._contact_status = {}
+        self.all = RoaringBitmap()
+        self.tags = defaultdict(RoaringBitmap)
+        self.statuses = defaultdict(RoaringBitmap)
+        self.lists = defaultdict(RoaringBitmap)
+        self.products = defaultdict(RoaringBitmap)
+
+    def __len__(self):
+        return len(self.all)
+
+    def _number(self, contact_id):
+        number = self._numbers.get(contact_id)
+        if number is None:
+            number = self._numbers[contact_id] = len(self._contact_ids)
+            self._contact_ids.append(contact_id)
+        return number
+
+    # Writes ---------------------------------------------------------------------------
+
+    def bulk_load(self, contacts, memberships=(), purchases=()):
+        """
+        Initial load of an empty index: contacts as (id, tags, status), memberships as
+        (contact_id, list_id), purchases as (contact_id, product_id, product_name)
+        """
+        tags, statuses, lists, products = (defaultdict(list) for _ in range(4))
+        numbers = []
+        for contact_id, contact_tags, status in contacts:
+            number = self._number(contact_id)
+            normalized = frozenset(normalize_tags(contact_tags))
+            for tag in normalized:
+                tags[tag].append(number)
+            statuses[status].append(number)
+            self._contact_tags[number] = normalized
+            self._contact_status[number] = status
+            numbers.append(number)
+        for contact_id, list_id in memberships:
+            lists[str(list_id).lower()].append(self._number(contact_id))
+        for contact_id, product_id, name in purchases:
+            number = self._number(contact_id)
+            products[str(product_id).lower()].append(number)
+            for key in normalize_tags([name]):
+                products[key].append(number)
+
+        self.all = RoaringBitmap.from_values(numbers)
+        for target, source in ((self.tags, tags), (self.statuses, statuses), (self.lists, lists),
+                               (self.products, products)):
+            for key, values in source.items():
+                target[key] = RoaringBitmap.from_values(values)
+
+    def apply_contact(self, contact_id, tags, status):
+        """Insert or update a contact (a write to public.contacts)"""
+        number = self._number(contact_id)
+        new_tags = frozenset(normalize_tags(tags))
+        old_tags = self._contact_tags.get(number, frozenset())
+        for tag in old_tags - new_tags:
+            self.tags[tag].discard(number)
+        for tag in new_tags - old_tags:
+            self.tags[tag].add(number)
+        self._contact_tags[number] = new_tags
+
+        old_status = self._contact_status.get(number)
+        if old_status != status:
+            if old_status is not None:
+                self.statuses[old_status].discard(number)
+            self.statuses[status].add(number)
+            self._contact_status[number] = status
+        self.all.add(number)
+
+    def remove_contact(self, contact_id):
+        """Delete a contact (or move it to unsubscribed_contacts)"""
+        number = self._numbers.get(contact_id)
+        if number is None or number not in self.all:
+            return
+        for bitmaps in (self.tags, self.statuses, self.lists, self.products):
+            for bitmap in bitmaps.values():
+                bitmap.discard(number)
+        self.all.discard(number)
+        self._contact_tags.pop(number, None)
+        self._contact_status.pop(number, None)
+
+    def apply_membership(self, contact_id, list_id, member=True):
+        """A contact_lists insert (member=True) or delete"""
+        number = self._number(contact_id)
+        if member:
+            self.lists[str(list_id).lower()].add(number)
+        else:
+            self.lists[str(list_id).lower()].discard(number)
+
+    def apply_purchase(self, contact_id, product_id, product_name=None):
+        """A contact_products insert; indexed by product id and normalized name"""
+        number = self._number(contact_id)
+        self.products[str(product_id).lower()].add(number)
+        for name in normalize_tags([product_name]):
+            self.products[name].add(number)
+
+    # Reads ----------------------------------------------------------------------------
+
+    def _union(self, bitmaps, keys):
+        return union_all(bitmaps[k] for k in keys if k in bitmaps)
+
+    def evaluate(self, rule_config):
+        """Contacts matching a dynamic list rule_config, as a bitmap"""
+        rule_config = rule_config or {}
+        parts = []
+        for rule_type, values in effective_rules(rule_config):
+            tags = normalize_tags(values)
+            ids = uuid_values(values)
+            if rule_type == "has_any_tags":
+                parts.append(self._union(self.tags, tags))
+            elif rule_type == "has_all_tags":
+                parts.append(intersect_all([self.tags.get(t, RoaringBitmap()) for t in tags], self.all))
+            elif rule_type == "not_has_tags":
+                parts.append(self.all - self._union(self.tags, tags))
+            elif rule_type == "in_any_lists":
+                parts.append(self._union(self.lists, ids))
+            elif rule_type == "in_all_lists":
+                parts.append(intersect_all([self.lists.get(i, RoaringBitmap()) for i in ids], self.all))
+            elif rule_type == "not_in_lists":
+                parts.append(self.all - self._union(self.lists, ids))
+            elif rule_type == "has_any_products":
+                parts.append(self._union(self.products, ids + tags))
+            elif rule_type == "not_has_products":
+                parts.append(self.all - self._union(self.products, ids + tags))
+
+        if not parts:
+            return RoaringBitmap()
+        if str(rule_config.get("globalOperator") or "and").lower() == "or":
+            result = union_all(parts)
+        else:
+            result = intersect_all(parts, self.all)
+
+        # Memberships and purchases may name contacts that are gone; statuses never do
+        status = rule_config.get("status") or "subscribed"
+        if status == "any":
+            return result & self.all
+        return result & self.statuses.get(status, RoaringBitmap())
+
+    def resolve_recipients(self, list_ids, dynamic_rules=None):
+        """
+        Subscribed contacts of a campaign's lists: static lists from their memberships,
+        dynamic lists (list id -> rule_config in `dynamic_rules`) from their rules
+        """
+        dynamic_rules = dynamic_rules or {}
+        parts = []
+        for list_id in list_ids:
+            key = str(list_id).lower()
+            if key in dynamic_rules:
+                parts.append(self.evaluate(dynamic_rules[key]))
+            elif key in self.lists:
+                parts.append(self.lists[key])
+        return union_all(parts) & self.statuses.get("subscribed", RoaringBitmap())
+
+    def contact_ids(self, bitmap, batch_size=1000):
+        """Stream the contact ids of a bitmap in batches"""
+        batch = []
+        for number in bitmap:
+            batch.append(self._contact_ids[number])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def size_in_bytes(self):
+        bitmaps = [self.all, *self.tags.values(), *self.statuses.values(), *self.lists.values(),
+                   *self.products.values()]
+        return sum(b.size_in_bytes() for b in bitmaps)
+
+
+def load_from_postgres(dsn, user_id):
+    """Build a SegmentIndex for one user; returns (index, dynamic list rule_configs by id)"""
+    import psycopg2
+
+    index = SegmentIndex()
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, tags, status FROM public.contacts WHERE user_id = %s ORDER BY id", (user_id,))
+        contacts = [(str(contact_id), tags, status) for contact_id, tags, status in cur.fetchall()]
+        cur.execute(
+            """
+            SELECT cl.contact_id, cl.list_id
+            FROM public.contact_lists cl
+            JOIN public.email_lists l ON l.id = cl.list_id
+            WHERE l.user_id = %s
+            """,
+            (user_id,),
+        )
+        memberships = [(str(contact_id), str(list_id)) for contact_id, list_id in cur.fetchall()]
+        cur.execute(
+            """
+            SELECT cp.contact_id, p.id, p.name
+            FROM public.contact_products cp
+            JOIN public.products p ON p.id = cp.product_id
+            WHERE p.user_id = %s
+            """,
+            (user_id,),
+        )
+        purchases = [(str(contact_id), str(product_id), name) for contact_id, product_id, name in cur.fetchall()]
+        cur.execute(
+            "SELECT id, rule_config FROM public.email_lists WHERE user_id = %s AND list_type = 'dynamic'",
+            (user_id,),
+        )
+        dynamic_rules = {str(list_id): rule_config for list_id, rule_config in cur.fetchall()}
+    finally:
+        conn.close()
+    index.bulk_load(contacts, memberships, purchases)
+    return index, dynamic_rules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--rules", help="JSON file with a dynamic list rule_config")
+    parser.add_argument("--lists", help="comma-separated list ids to resolve as a campaign audience")
+    parser.add_argument("--show", type=int, default=10, help="contact ids to print")
+    args = parser.parse_args()
+
+    if not args.rules and not args.lists:
+        parser.error("pass --rules or --lists")
+
+    start = time.perf_counter()
+    index, dynamic_rules = load_from_postgres(args.dsn, args.user_id)
+    print(f"📦 Indexed {len(index)} contacts in {time.perf_counter() - start:.1f}s "
+          f"({index.size_in_bytes() / 1024:.0f} KB of bitmaps)")
+
+    start = time.perf_counter()
+    if args.rules:
+        with open(args.rules) as f:
+            result = index.evaluate(json.load(f))
+    else:
+        result = index.resolve_recipients([v.strip() for v in args.lists.split(",") if v.strip()], dynamic_rules)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    print(f"🎯 {len(result)} contacts in {elapsed_ms:.1f} ms")
+    for batch in index.contact_ids(result, batch_size=args.show):
+        for contact_id in batch:
+            print(f"  {contact_id}")
+        break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
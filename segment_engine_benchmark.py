@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Segment Engine Benchmark
+Builds a SegmentIndex over synthetic contacts (1M by default) with list memberships
+and purchases, then measures:
+  - load time and bitmap memory
+  - latency of typical audience expressions (counts), against plain Python sets as
+    the row-at-a-time baseline
+  - streaming the ids of a large audience to a sender in batches
+  - incremental write throughput (retag, membership changes)
+
+Runs entirely in memory; no database needed.
+
+Usage:
+  python segment_engine_benchmark.py [--contacts 1000000] [--tags 8] [--vocabulary 2000]
+"""
+
+import argparse
+import random
+import sys
+import time
+import uuid
+
+from segment_engine import SegmentIndex, normalize_tags
+from synthetic_contacts import generate_contacts, make_tag_vocabulary
+
+LIST_COUNT = 20
+PRODUCT_COUNT = 30
+REPEATS = 5
+
+
+def build_dataset(contact_count, tags_per_contact, vocabulary_size, seed=21):
+    rng = random.Random(seed)
+    vocabulary = make_tag_vocabulary(vocabulary_size, seed=seed)
+    contacts = generate_contacts(contact_count, (1, tags_per_contact * 2 - 1), vocabulary, seed=seed)
+    for contact in contacts:
+        if rng.random() < 0.08:
+            contact["status"] = "bounced"
+    ids = [c["id"] for c in contacts]
+    list_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(LIST_COUNT)]
+    # A few big lists (newsletter, customers) and a long tail of small ones
+    memberships = []
+    for i, list_id in enumerate(list_ids):
+        share = 0.5 if i < 2 else 0.02
+        memberships.extend((cid, list_id) for cid in rng.sample(ids, int(len(ids) * share)))
+    products = [(str(uuid.UUID(int=rng.getrandbits(128))), f"Course {i}") for i in range(PRODUCT_COUNT)]
+    purchases = [(cid, *rng.choice(products)) for cid in rng.sample(ids, len(ids) // 5)]
+    return vocabulary, contacts, list_ids, memberships, products, purchases
+
+
+def audiences(vocabulary, list_ids, products):
+    return {
+        "one tag": {"rules": [{"type": "has_any_tags", "values": vocabulary[:1]}]},
+        "any of 20 tags": {"rules": [{"type": "has_any_tags", "values": vocabulary[:20]}]},
+        "big list minus tag": {"rules": [
+            {"type": "in_any_lists", "values": list_ids[:1]},
+            {"type": "not_has_tags", "values": vocabulary[:5]},
+        ]},
+        "two big lists AND": {"rules": [{"type": "in_all_lists", "values": list_ids[:2]}]},
+        "bought, not in list": {"rules": [
+            {"type": "has_any_products", "values": [products[0][0], products[1][1]]},
+            {"type": "not_in_lists", "values": list_ids[2:6]},
+        ]},
+        "tags OR lists": {"globalOperator": "or", "rules": [
+            {"type": "has_all_tags", "values": vocabulary[:2]},
+            {"type": "in_any_lists", "values": list_ids[5:10]},
+        ]},
+    }
+
+
+class SetBaseline:
+    """The same queries over plain Python sets of contact ids"""
+
+    def __init__(self, contacts, memberships, purchases):
+        self.all = {c["id"] for c in contacts}
+        self.subscribed = {c["id"] for c in contacts if c["status"] == "subscribed"}
+        self.tags, self.lists, self.products = {}, {}, {}
+        for c in contacts:
+            for tag in normalize_tags(c["tags"]):
+                self.tags.setdefault(tag, set()).add(c["id"])
+        for cid, list_id in memberships:
+            self.lists.setdefault(list_id, set()).add(cid)
+        for cid, product_id, name in purchases:
+            self.products.setdefault(product_id, set()).add(cid)
+            self.products.setdefault(name.lower(), set()).add(cid)
+
+    def _union(self, index, keys):
+        return set().union(*(index.get(k, set()) for k in keys))
+
+    def count(self, rule_config):
+        parts = []
+        for rule in rule_config["rules"]:
+            values = [v.lower() for v in rule["values"]]
+            kind = rule["type"]
+            if kind == "has_any_tags":
+                parts.append(self._union(self.tags, values))
+            elif kind == "has_all_tags":
+                parts.append(set.intersection(*(self.tags.get(v, set()) for v in values)))
+            elif kind == "not_has_tags":
+                parts.append(self.all - self._union(self.tags, values))
+            elif kind == "in_any_lists":
+                parts.append(self._union(self.lists, values))
+            elif kind == "in_all_lists":
+                parts.append(set.intersection(*(self.lists.get(v, set()) for v in values)))
+            elif kind == "not_in_lists":
+                parts.append(self.all - self._union(self.lists, values))
+            elif kind == "has_any_products":
+                parts.append(self._union(self.products, values))
+        combined = set.union(*parts) if rule_config.get("globalOperator") == "or" else set.intersection(*parts)
+        return len(combined & self.subscribed)
+
+
+def best_of(fn):
+    best, result = float("inf"), None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=8, help="average tags per contact")
+    parser.add_argument("--vocabulary", type=int, default=2000, help="distinct tags")
+    parser.add_argument("--writes", type=int, default=20_000, help="incremental writes to time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    vocabulary, contacts, list_ids, memberships, products, purchases = build_dataset(
+        args.contacts, args.tags, args.vocabulary)
+    print(f"🧪 Generated {len(contacts)} contacts, {len(memberships)} memberships, {len(purchases)} purchases "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    index = SegmentIndex()
+    start = time.perf_counter()
+    index.bulk_load([(c["id"], c["tags"], c["status"]) for c in contacts], memberships, purchases)
+    print(f"📦 Indexed in {time.perf_counter() - start:.1f}s, "
+          f"{index.size_in_bytes() / 1024 / 1024:.1f} MB of bitmaps "
+          f"({len(index.tags)} tags, {len(index.lists)} lists, {len(index.products)} product keys)")
+
+    start = time.perf_counter()
+    baseline = SetBaseline(contacts, memberships, purchases)
+    print(f"🐢 Set baseline built in {time.perf_counter() - start:.1f}s")
+
+    print(f"\n{'audience':<22} | {'count':>9} | {'bitmap ms':>9} | {'sets ms':>9} | {'speedup':>7}")
+    print("-" * 70)
+    for name, rule_config in audiences(vocabulary, list_ids, products).items():
+        bitmap_ms, bitmap = best_of(lambda: index.evaluate(rule_config))
+        sets_ms, expected = best_of(lambda: baseline.count(rule_config))
+        marker = "" if len(bitmap) == expected else f"  ❌ sets say {expected}"
+        print(f"{name:<22} | {len(bitmap):>9} | {bitmap_ms:>9.2f} | {sets_ms:>9.1f} | "
+              f"{sets_ms / bitmap_ms:>6.1f}x{marker}")
+
+    recipients = index.resolve_recipients(list_ids[:2])
+    start = time.perf_counter()
+    streamed = sum(len(batch) for batch in index.contact_ids(recipients, batch_size=1000))
+    print(f"\n📤 Streamed {streamed} recipient ids in batches of 1000 in {time.perf_counter() - start:.2f}s")
+
+    rng = random.Random(5)
+    sample = rng.sample(contacts, min(args.writes, len(contacts)))
+    start = time.perf_counter()
+    for contact in sample:
+        index.apply_contact(contact["id"], rng.sample(vocabulary, args.tags), contact["status"])
+    retag_us = (time.perf_counter() - start) / len(sample) * 1e6
+    start = time.perf_counter()
+    for contact in sample:
+        index.apply_membership(contact["id"], rng.choice(list_ids), rng.random() < 0.5)
+    membership_us = (time.perf_counter() - start) / len(sample) * 1e6
+    print(f"✏️  Incremental writes: retag {retag_us:.1f} us, membership change {membership_us:.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
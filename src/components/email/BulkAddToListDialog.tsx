@@ -2,7 +2,7 @@ import { useState } from "react";
 import { Button } from "@/components/ui/button";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select";
 import { Dialog, DialogContent, DialogDescription, DialogFooter, DialogHeader, DialogTitle } from "@/components/ui/dialog";
-import { supabase } from "@/integrations/supabase/client";
+import { runBulkContactOperation } from "@/utils/bulkContactOperations";
 import { toast } from "sonner";
 
 interface EmailList {
@@ -31,33 +31,18 @@ export const BulkAddToListDialog = ({ open, onOpenChange, selectedContactIds, em
 
     setIsLoading(true);
     try {
-      // Check which contacts are already in the list
-      const { data: existingData } = await supabase
-        .from('contact_lists')
-        .select('contact_id')
-        .eq('list_id', selectedListId)
-        .in('contact_id', selectedContactIds);
+      const added = await runBulkContactOperation({
+        operation: 'add_to_lists',
+        listIds: [selectedListId],
+        contactIds: selectedContactIds,
+      });
 
-      const existingContactIds = existingData?.map(item => item.contact_id) || [];
-      const newContactIds = selectedContactIds.filter(id => !existingContactIds.includes(id));
-
-      if (newContactIds.length === 0) {
+      if (added === 0) {
         toast.error("All selected contacts are already in this list");
         return;
       }
 
-      const insertData = newContactIds.map(contactId => ({
-        contact_id: contactId,
-        list_id: selectedListId
-      }));
-
-      const { error } = await supabase
-        .from('contact_lists')
-        .insert(insertData);
-
-      if (error) throw error;
-
-      toast.success(`Added ${newContactIds.length} contact(s) to the list`);
+      toast.success(`Added ${added} contact(s) to the list`);
       onSuccess();
       onOpenChange(false);
       setSelectedListId("");
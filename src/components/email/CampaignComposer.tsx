@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useRef } from "react";
+import React, { useState, useEffect, useRef, useMemo } from "react";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -16,6 +16,7 @@ import { EditablePreview } from "./editor/EditablePreview";
 import { SendCampaignModal } from "./SendCampaignModal";
 import { useAuth } from "@/contexts/AuthContext";
 import { api } from "@/lib/api";
+import { createProductAutocomplete } from "@/utils/productAutocomplete";
 
 interface CampaignComposerProps {
   onSave?: (campaignData: any) => void;
@@ -85,7 +86,6 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
   }, [subject, prompt, generatedTemplate, selectedLists, themeColors]);
 
   const [emailLists, setEmailLists] = useState<any[]>([]);
-  const [products, setProducts] = useState<any[]>([]);
   const [pausedCampaigns, setPausedCampaigns] = useState<any[]>([]);
 
   // Product autocomplete state
@@ -93,11 +93,13 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
   const [autocompletePosition, setAutocompletePosition] = useState({ top: 0, left: 0 });
   const [currentMatch, setCurrentMatch] = useState<{product: any, startIndex: number, partialName: string} | null>(null);
   const promptTextareaRef = React.useRef<HTMLTextAreaElement>(null);
+  // Server-side product lookups with a per-session prefix cache
+  const productAutocomplete = useMemo(() => createProductAutocomplete(), [user?.id]);
+  const autocompleteRequestRef = useRef(0);
 
   useEffect(() => {
     if (user?.id) {
       loadEmailLists();
-      loadProducts();
       loadStyleGuide();
       loadPausedCampaigns();
     }
@@ -157,50 +159,22 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
     }
   };
 
-  const loadProducts = async () => {
-    console.log('🔄 Loading products...');
-    try {
-      const { data, error } = await supabase
-        .from('products')
-        .select('*')
-        .eq('user_id', user?.id)
-        .order('created_at', { ascending: false });
-
-      if (error) {
-        console.error('❌ Error loading products:', error);
-        return;
-      }
+  // Products named in the prompt, matched in the database
+  const enhancePromptWithProductDetails = async (originalPrompt: string): Promise<string> => {
+    console.log('🔍 Enhancing prompt with product details');
 
-      console.log('✅ Products loaded:', data?.length || 0);
-      console.log('📦 Product names:', data?.map(p => p.name) || []);
-      setProducts(data || []);
-    } catch (error) {
-      console.error('❌ Error loading products:', error);
-    }
-  };
+    const { data: mentionedProducts, error } = await supabase.rpc('match_products_in_text', {
+      p_text: originalPrompt,
+    });
 
-  const enhancePromptWithProductDetails = (originalPrompt: string): string => {
-    console.log('🔍 Enhancing prompt with product details');
-    console.log('📝 Original prompt:', originalPrompt);
-    console.log('📦 Available products:', products.length);
-    
-    if (!products.length) {
-      console.log('❌ No products loaded');
+    if (error) {
+      console.error('❌ Error matching products:', error);
       return originalPrompt;
     }
 
-    // Find product names mentioned in the prompt (case insensitive)
-    const mentionedProducts = products.filter(product => {
-      const isMatch = originalPrompt.toLowerCase().includes(product.name.toLowerCase());
-      if (isMatch) {
-        console.log('✅ Found product match:', product.name);
-      }
-      return isMatch;
-    });
-
-    console.log('🎯 Mentioned products found:', mentionedProducts.length);
+    console.log('🎯 Mentioned products found:', mentionedProducts?.length || 0);
 
-    if (mentionedProducts.length === 0) {
+    if (!mentionedProducts?.length) {
       console.log('❌ No product names found in prompt');
       return originalPrompt;
     }
@@ -227,7 +201,7 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
 
 
   // Product autocomplete functionality
-  const findProductMatch = (text: string, cursorPosition: number) => {
+  const findProductMatch = async (text: string, cursorPosition: number) => {
     // Find the start of the current word
     let wordStart = cursorPosition;
     while (wordStart > 0 && /\w/.test(text[wordStart - 1])) {
@@ -246,9 +220,7 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
     if (currentWord.length < 3) return null;
     
     // Find matching products
-    const matchingProduct = products.find(product => 
-      product.name.toLowerCase().startsWith(currentWord)
-    );
+    const [matchingProduct] = await productAutocomplete(currentWord);
     
     if (matchingProduct) {
       return {
@@ -261,14 +233,21 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
     return null;
   };
 
-  const handlePromptChange = (e: React.ChangeEvent<HTMLTextAreaElement>) => {
+  const handlePromptChange = async (e: React.ChangeEvent<HTMLTextAreaElement>) => {
     const newPrompt = e.target.value;
     const cursorPosition = e.target.selectionStart;
     
     setPrompt(newPrompt);
     
-    // Check for product matches
-    const match = findProductMatch(newPrompt, cursorPosition);
+    // Check for product matches; only the latest keystroke's lookup may update the dropdown
+    const requestId = ++autocompleteRequestRef.current;
+    let match: Awaited<ReturnType<typeof findProductMatch>> = null;
+    try {
+      match = await findProductMatch(newPrompt, cursorPosition);
+    } catch (error) {
+      console.error('❌ Error looking up products:', error);
+    }
+    if (requestId !== autocompleteRequestRef.current) return;
     
     if (match) {
       setCurrentMatch(match);
@@ -522,7 +501,7 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
 
     try {
       // Enhance the prompt with product details if products are mentioned
-      const enhancedPrompt = enhancePromptWithProductDetails(prompt);
+      const enhancedPrompt = await enhancePromptWithProductDetails(prompt);
       
       const { data, error } = await supabase.functions.invoke('generate-email', {
         body: {
@@ -699,7 +678,7 @@ export const CampaignComposer: React.FC<CampaignComposerProps> = ({ onSave }) =>
 
     try {
       // Enhance the edit prompt with product details if products are mentioned
-      const enhancedEditPrompt = enhancePromptWithProductDetails(aiEditPrompt);
+      const enhancedEditPrompt = await enhancePromptWithProductDetails(aiEditPrompt);
       
       const { data, error } = await supabase.functions.invoke('edit-email', {
         body: {
@@ -303,7 +303,7 @@ export const CampaignHistory: React.FC = () => {
       const { data: contacts, error: contactsError } = await supabase
         .from('contacts')
         .select('id')
-        .in('email', successfulSends.map(send => send.contact_email))
+        .in('email_normalized', successfulSends.map(send => send.contact_email.trim().toLowerCase()))
         .eq('user_id', user?.id);
 
       if (contactsError) throw contactsError;
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
@@ -8,6 +8,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Switch } from "@/components/ui/switch";
 import { TagInput } from "@/components/ui/tag-input";
 import { Plus, X, Tag, List, Users } from "lucide-react";
+import { supabase } from "@/integrations/supabase/client";
 
 interface DynamicRule {
   id: string;
@@ -34,6 +35,25 @@ export const DynamicListRuleBuilder = ({
   const [globalOperator, setGlobalOperator] = useState<'and' | 'or'>(
     ruleConfig?.globalOperator || 'and'
   );
+  const [estimatedCount, setEstimatedCount] = useState<number | null>(null);
+
+  // Count matches with the same compiled predicate the list will use, debounced while editing;
+  // large accounts get a cached sample-based estimate
+  useEffect(() => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      const { data, error } = await supabase.functions.invoke('segments/count', {
+        body: { rule_config: { rules, globalOperator }, mode: 'auto' },
+      });
+      if (!cancelled) {
+        setEstimatedCount(error ? null : Number(data?.count));
+      }
+    }, 400);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [rules, globalOperator]);
 
   const updateParent = (newRules: DynamicRule[], newOperator: 'and' | 'or') => {
     onRuleChange({
@@ -101,9 +121,7 @@ export const DynamicListRuleBuilder = ({
   };
 
   const getEstimatedCount = () => {
-    // This is a simplified estimation - in a real implementation,
-    // you'd query the database with the actual rules
-    return "~50"; // Placeholder
+    return estimatedCount === null ? "…" : estimatedCount.toLocaleString();
   };
 
   return (
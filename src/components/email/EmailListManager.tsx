@@ -42,6 +42,7 @@ type EmailList = {
   created_at: string;
   updated_at: string;
   contact_count?: number;
+  subscribed_count?: number;
 };
 
 type ContactList = {
@@ -56,6 +57,8 @@ export const EmailListManager = () => {
   const [lists, setLists] = useState<EmailList[]>([]);
   const [contacts, setContacts] = useState<Contact[]>([]);
   const [contactLists, setContactLists] = useState<ContactList[]>([]);
+  const [contactsLoaded, setContactsLoaded] = useState(false);
+  const [activeTab, setActiveTab] = useState("lists");
   const [products, setProducts] = useState<Product[]>([]);
   const [contactProductMap, setContactProductMap] = useState<Record<string, string[]>>({});
   const [selectedContacts, setSelectedContacts] = useState<string[]>([]);
@@ -85,81 +88,81 @@ export const EmailListManager = () => {
   const fileInputRef = useRef<HTMLInputElement>(null);
   const { toast } = useToast();
 
-  // Load data on component mount
+  // Load the list overview on mount; contacts and memberships only when they are shown
   useEffect(() => {
     loadData();
   }, []);
 
+  useEffect(() => {
+    if (activeTab === "contacts") {
+      ensureContactsLoaded();
+    }
+  }, [activeTab]);
+
+  // The list overview: one query, member counts are kept current by the database
   const loadData = async () => {
     try {
-      console.log('🚀 Loading data in parallel...');
-      const startTime = performance.now();
+      const { data: listsData, error: listsError } = await supabase
+        .from('email_lists')
+        .select('*, email_list_member_counts(member_count, subscribed_count)')
+        .order('created_at', { ascending: false });
+
+      if (listsError) throw listsError;
+
+      const listsWithCounts = (listsData || []).map(({ email_list_member_counts: counts, ...list }: any) => ({
+        ...list,
+        contact_count: counts?.member_count ?? 0,
+        subscribed_count: counts?.subscribed_count ?? 0,
+      }));
+
+      setLists(listsWithCounts);
+    } catch (error: any) {
+      console.error('Error loading data:', error);
+      toast({
+        title: "Error loading data",
+        description: error.message,
+        variant: "destructive",
+      });
+    }
+  };
 
-      // Load all data in parallel for better performance
+  // Contacts, memberships and products for the contacts tab and the list dialogs
+  const loadContacts = async () => {
+    try {
       const [
         { data: productsData, error: productsError },
-        { data: listsData, error: listsError },
         { data: contactsData, error: contactsError },
         { data: contactListsData, error: contactListsError }
       ] = await Promise.all([
         supabase.from('products').select('*').order('name'),
-        supabase.from('email_lists').select('*').order('created_at', { ascending: false }),
         supabase.from('contacts').select('*').order('created_at', { ascending: false }),
         supabase.from('contact_lists').select('*')
       ]);
 
       if (productsError) throw productsError;
-      if (listsError) throw listsError;
       if (contactsError) throw contactsError;
       if (contactListsError) throw contactListsError;
 
-      // Get accurate contact counts for each list using separate queries
-      const listsWithCounts = await Promise.all((listsData || []).map(async (list: any) => {
-        let contactCount = 0;
-        
-        if (list.list_type === 'dynamic' && list.rule_config) {
-          // For dynamic lists, count based on rules
-          const { count } = await supabase
-            .from('contacts')
-            .select('*', { count: 'exact', head: true })
-            .eq('user_id', user?.id)
-            .eq('status', 'subscribed')
-            .contains('tags', list.rule_config.requiredTags || []);
-          
-          contactCount = count || 0;
-        } else {
-          // For static lists, count from contact_lists table
-          const { count } = await supabase
-            .from('contact_lists')
-            .select('*', { count: 'exact', head: true })
-            .eq('list_id', list.id);
-          
-          contactCount = count || 0;
-        }
-
-        return {
-          ...list,
-          contact_count: contactCount
-        };
-      }));
-
-      setLists(listsWithCounts);
       setContacts(contactsData || []);
       setContactLists(contactListsData || []);
       setProducts(productsData || []);
-
-      const endTime = performance.now();
-      console.log(`✅ Data loaded in ${Math.round(endTime - startTime)}ms`);
+      setContactsLoaded(true);
     } catch (error: any) {
-      console.error('Error loading data:', error);
+      console.error('Error loading contacts:', error);
       toast({
-        title: "Error loading data",
+        title: "Error loading contacts",
         description: error.message,
         variant: "destructive",
       });
     }
   };
 
+  const ensureContactsLoaded = () => {
+    if (!contactsLoaded) {
+      loadContacts();
+    }
+  };
+
   const handleFileUpload = (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
     if (file) {
@@ -320,7 +323,7 @@ export const EmailListManager = () => {
 
       if (error) throw error;
 
-      setLists(lists.map(l => l.id === editingList.id ? { ...data, contact_count: l.contact_count } : l));
+      setLists(lists.map(l => l.id === editingList.id ? { ...data, contact_count: l.contact_count, subscribed_count: l.subscribed_count } : l));
       setEditingList(null);
       setNewListName("");
       setNewListDescription("");
@@ -608,6 +611,7 @@ export const EmailListManager = () => {
       });
       
       setSelectedContacts([]);
+      loadContacts();
       loadData(); // Refresh the data
     } catch (error: any) {
       console.error('Error deleting contacts:', error);
@@ -688,7 +692,7 @@ export const EmailListManager = () => {
 
   return (
     <div className="space-y-4">
-      <Tabs defaultValue="contacts" className="space-y-4">
+      <Tabs value={activeTab} onValueChange={setActiveTab} className="space-y-4">
         <TabsList className="grid w-full grid-cols-2">
           <TabsTrigger value="contacts" className="flex items-center space-x-2">
             <Users className="h-4 w-4" />
@@ -1063,10 +1067,10 @@ export const EmailListManager = () => {
                       <TableRow key={list.id}>
                         <TableCell className="font-medium">{list.name}</TableCell>
                         <TableCell>
-                          <Dialog>
+                          <Dialog onOpenChange={(open) => open && ensureContactsLoaded()}>
                             <DialogTrigger asChild>
                               <Button variant="link" className="p-0">
-                                {list.contact_count || 0} contacts
+                                {list.contact_count || 0} contacts ({list.subscribed_count || 0} subscribed)
                               </Button>
                             </DialogTrigger>
                             <DialogContent className="max-w-4xl">
@@ -27,6 +27,9 @@ interface RecipientDetails {
   error?: string;
 }
 
+// Sample of recipients shown in the preview dialog
+const PREVIEW_SIZE = 50;
+
 export const SendCampaignModal: React.FC<SendCampaignModalProps> = ({
   isOpen,
   onClose,
@@ -94,45 +97,29 @@ export const SendCampaignModal: React.FC<SendCampaignModalProps> = ({
       
       setListNames(lists.map(list => list.name));
       
-      // Load contacts preview
-      const { data: contactsData, error: contactsError } = await supabase
-        .from('contact_lists')
-        .select(`
-          contacts!inner (
-            email,
-            first_name,
-            last_name,
-            status
-          )
-        `)
-        .in('list_id', selectedLists);
-
-      if (contactsError) throw contactsError;
-
-      // Filter for subscribed contacts and prepare preview
-      const subscribedContacts = contactsData
-        ?.filter(cl => (cl.contacts as any).status === 'subscribed')
-        .map(cl => {
-          const contact = cl.contacts as any;
-          const firstName = contact.first_name || contact.email.split('@')[0];
-          const lastName = contact.last_name || '';
-          return {
-            email: contact.email,
-            name: lastName ? `${firstName} ${lastName}` : firstName
-          };
-        }) || [];
-
-      // Remove duplicates
-      const uniqueContacts = subscribedContacts.filter((contact, index, self) => 
-        self.findIndex(c => c.email === contact.email) === index
-      );
+      // Count and preview recipients on the server instead of fetching every membership row
+      const { data: segment, error: segmentError } = await supabase.functions.invoke('segments/count', {
+        body: { list_ids: selectedLists, mode: 'exact', preview: PREVIEW_SIZE },
+      });
+
+      if (segmentError) throw segmentError;
+
+      const previewContacts = (segment?.preview || []).map((contact: any) => {
+        const firstName = contact.first_name || contact.email.split('@')[0];
+        const lastName = contact.last_name || '';
+        return {
+          email: contact.email,
+          name: lastName ? `${firstName} ${lastName}` : firstName
+        };
+      });
+      const recipientCount: number = segment?.count ?? 0;
 
-      setContactsPreview(uniqueContacts);
-      setTotalRecipients(uniqueContacts.length);
+      setContactsPreview(previewContacts);
+      setTotalRecipients(recipientCount);
 
       // Calculate estimated time based on delay setting and sequential sending
-      const totalDelayTime = (uniqueContacts.length - 1) * delayBetweenEmails;
-      const estimatedSendTime = uniqueContacts.length * 2;
+      const totalDelayTime = Math.max(recipientCount - 1, 0) * delayBetweenEmails;
+      const estimatedSendTime = recipientCount * 2;
       const totalEstimatedSeconds = totalDelayTime + estimatedSendTime;
       
       const minutes = Math.floor(totalEstimatedSeconds / 60);
@@ -356,11 +343,12 @@ export const SendCampaignModal: React.FC<SendCampaignModalProps> = ({
       // Get contact details for names
       const { data: contactDetails } = await supabase
         .from('contacts')
-        .select('email, first_name, last_name')
-        .in('email', sends?.map(s => s.contact_email) || []);
+        .select('email_normalized, first_name, last_name')
+        .in('email_normalized', sends?.map(s => s.contact_email.trim().toLowerCase()) || []);
 
+      const contactsByEmail = new Map((contactDetails || []).map(c => [c.email_normalized, c]));
       const details: RecipientDetails[] = sends?.map(send => {
-        const contact = contactDetails?.find(c => c.email === send.contact_email);
+        const contact = contactsByEmail.get(send.contact_email.trim().toLowerCase());
         const firstName = contact?.first_name || send.contact_email.split('@')[0];
         const lastName = contact?.last_name || '';
         const name = lastName ? `${firstName} ${lastName}` : firstName;
@@ -816,7 +804,8 @@ export const SendCampaignModal: React.FC<SendCampaignModalProps> = ({
             <div className="flex-1 overflow-y-auto">
               <div className="space-y-2">
                 <div className="text-sm text-muted-foreground mb-3">
-                  {contactsPreview.length} recipients will receive this campaign:
+                  {totalRecipients} recipients will receive this campaign
+                  {totalRecipients > contactsPreview.length ? ` (showing a sample of ${contactsPreview.length})` : ''}:
                 </div>
                 <div className="border rounded-lg divide-y max-h-60 overflow-y-auto">
                   {contactsPreview.map((contact, index) => (
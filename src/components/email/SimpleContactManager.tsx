@@ -12,6 +12,7 @@ import { toast } from "sonner";
 import { supabase } from "@/integrations/supabase/client";
 import { useAuth } from "@/contexts/AuthContext";
 import { EditContactDialog } from "./EditContactDialog";
+import { runBulkContactOperation } from "@/utils/bulkContactOperations";
 
 interface Contact {
   id: string;
@@ -35,11 +36,17 @@ interface DbContact {
   tags: string[] | null;
 }
 
+interface ContactFilters {
+  search?: string;
+  tags?: string;
+}
+
+const CONTACT_FIELDS = 'id, user_id, created_at, updated_at, email, first_name, last_name, status, tags';
+
 export const SimpleContactManager = () => {
   const { user } = useAuth();
   const [contacts, setContacts] = useState<Contact[]>([]);
   const [filteredContacts, setFilteredContacts] = useState<Contact[]>([]);
-  const [originalContacts, setOriginalContacts] = useState<Contact[]>([]); // Store original loaded contacts
   const [searchTerm, setSearchTerm] = useState("");
   const [tagFilter, setTagFilter] = useState("");
   const [isLoading, setIsLoading] = useState(true);
@@ -52,6 +59,9 @@ export const SimpleContactManager = () => {
   const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [totalContacts, setTotalContacts] = useState(0);
   const CONTACTS_PER_PAGE = 50;
+  // Keyset pagination: filters of the current listing and the last row loaded
+  const activeFiltersRef = useRef<ContactFilters>({});
+  const pageCursorRef = useRef<DbContact | null>(null);
   
   // Bulk operations state
   const [selectedContacts, setSelectedContacts] = useState<Set<string>>(new Set());
@@ -99,7 +109,6 @@ export const SimpleContactManager = () => {
     if (user?.id) {
       loadContacts();
       loadEmailLists();
-      loadContactLists();
       loadAllTags();
     }
   }, [user?.id]);
@@ -152,39 +161,68 @@ export const SimpleContactManager = () => {
       .trim();
   };
 
+  // Map DB rows to UI shape
+  const toUiContacts = (dbContacts: DbContact[]): Contact[] => dbContacts.map(c => {
+    let name = [c.first_name, c.last_name].filter(Boolean).join(' ').trim();
+    // If no name, generate from email
+    if (!name && c.email) {
+      name = generateNameFromEmail(c.email);
+    }
+
+    return {
+      id: c.id,
+      name: name || 'Unknown',
+      email: c.email,
+      phone: "", // No phone column in DB; keep UI consistent
+      tags: c.tags ?? [],
+      created_at: c.created_at,
+    };
+  });
+
+  // One page from list_contacts, newest first, continuing after `cursor` (the last row
+  // already shown). Search, tag and unsub filters run in the database, so pages stay full.
+  const fetchContactPage = async (filters: ContactFilters, cursor: DbContact | null) => {
+    const filterTags = (filters.tags || '').split(',').map(tag => tag.trim()).filter(Boolean);
+    return supabase
+      .rpc('list_contacts', {
+        p_limit: CONTACTS_PER_PAGE,
+        p_after_created_at: cursor?.created_at ?? null,
+        p_after_id: cursor?.id ?? null,
+        p_status: 'subscribed',
+        p_tags: filterTags.length ? filterTags : null,
+        p_exclude_tags: ['unsub'],
+        p_search: filters.search?.trim() || null,
+      })
+      .select(CONTACT_FIELDS);
+  };
+
   const loadContacts = async (page: number = 1, reset: boolean = true) => {
     try {
       if (reset) {
         setIsLoading(true);
         setCurrentPage(1);
+        activeFiltersRef.current = {};
+        pageCursorRef.current = null;
       } else {
         setIsLoadingMore(true);
       }
 
       console.log(`🔄 Loading contacts page ${page}...`);
 
-      const from = (page - 1) * CONTACTS_PER_PAGE;
-      const to = from + CONTACTS_PER_PAGE - 1;
-
-      // Get total count first
-      const { count: totalCount } = await supabase
-        .from('contacts')
-        .select('*', { count: 'exact', head: true })
-        .eq('user_id', user?.id)
-        .eq('status', 'subscribed');
+      if (reset) {
+        // Planner estimate for large accounts instead of an exact count over every row
+        const { count: totalCount } = await supabase
+          .from('contacts')
+          .select('id', { count: 'estimated', head: true })
+          .eq('user_id', user?.id)
+          .eq('status', 'subscribed');
 
-      setTotalContacts(totalCount || 0);
+        setTotalContacts(totalCount || 0);
+      }
 
-      // Load contacts with pagination
-      const { data, error } = await supabase
-        .from('contacts')
-        .select('id, user_id, created_at, updated_at, email, first_name, last_name, status, tags')
-        .eq('user_id', user?.id)
-        .eq('status', 'subscribed')
-        .order('created_at', { ascending: false })
-        .range(from, to);
+      const { data, error } = await fetchContactPage(activeFiltersRef.current, pageCursorRef.current);
 
-      console.log('📊 Contacts query result:', { data, error, count: data?.length, total: totalCount });
+      console.log('📊 Contacts query result:', { count: data?.length, error });
 
       if (error) {
         console.error('Error loading contacts:', error);
@@ -192,48 +230,24 @@ export const SimpleContactManager = () => {
         return;
       }
 
-      const dbContacts: DbContact[] = data || [];
-      // Map DB rows to UI shape
-      const uiContacts: Contact[] = dbContacts.map(c => {
-        let name = [c.first_name, c.last_name].filter(Boolean).join(' ').trim();
-        // If no name, generate from email
-        if (!name && c.email) {
-          name = generateNameFromEmail(c.email);
-        }
-        
-        return {
-          id: c.id,
-          name: name || 'Unknown',
-          email: c.email,
-          phone: "", // No phone column in DB; keep UI consistent
-          tags: c.tags ?? [],
-          created_at: c.created_at,
-        };
-      });
+      const dbContacts = (data || []) as DbContact[];
+      const uiContacts = toUiContacts(dbContacts);
+      pageCursorRef.current = dbContacts[dbContacts.length - 1] ?? pageCursorRef.current;
 
-      const filteredUiContacts = uiContacts.filter(c => !(c.tags || []).some(t => (t || '').trim().toLowerCase() === 'unsub'));
-      
       if (reset) {
-        setContacts(filteredUiContacts);
-        setFilteredContacts(filteredUiContacts);
-        setOriginalContacts(filteredUiContacts); // Store original loaded contacts
+        setContacts(uiContacts);
+        setFilteredContacts(uiContacts);
       } else {
-        const updatedContacts = [...contacts, ...filteredUiContacts];
+        const updatedContacts = [...contacts, ...uiContacts];
         setContacts(updatedContacts);
         setFilteredContacts(updatedContacts);
-        // Update original contacts with the full list when loading more
-        setOriginalContacts(updatedContacts);
       }
-      
-      setHasMoreContacts(filteredUiContacts.length === CONTACTS_PER_PAGE);
+
+      setHasMoreContacts(dbContacts.length === CONTACTS_PER_PAGE);
       setCurrentPage(page);
-      
-      console.log(`✅ Loaded ${filteredUiContacts.length} contacts for page ${page}`);
-      
-      // Load all tags separately for filter suggestions
-      if (reset) {
-        await loadAllTags();
-      }
+      await loadContactLists(uiContacts.map(c => c.id), reset);
+
+      console.log(`✅ Loaded ${uiContacts.length} contacts for page ${page}`);
     } catch (error) {
       console.error('Error loading contacts:', error);
       toast.error("Failed to load contacts");
@@ -243,28 +257,21 @@ export const SimpleContactManager = () => {
     }
   };
 
+  // Tag suggestions come from the per-user tag dictionary, not from every contact row
   const loadAllTags = async () => {
     try {
       const { data, error } = await supabase
-        .from('contacts')
-        .select('tags')
+        .from('tag_dictionary')
+        .select('name')
         .eq('user_id', user?.id)
-        .eq('status', 'subscribed');
+        .order('name_normalized');
 
       if (error) {
         console.error('Error loading tags:', error);
         return;
       }
 
-      const tags = new Set<string>();
-      data?.forEach(contact => {
-        contact.tags?.forEach((tag: string) => {
-          if (tag && tag.trim()) {
-            tags.add(tag.trim());
-          }
-        });
-      });
-      setAllTags(Array.from(tags).sort());
+      setAllTags((data || []).map(tag => tag.name.trim()).filter(Boolean));
     } catch (error) {
       console.error('Error loading tags:', error);
     }
@@ -311,14 +318,21 @@ export const SimpleContactManager = () => {
     }
   };
 
-  const loadContactLists = async () => {
+  // Memberships of the given contacts (the page just loaded, or everything shown)
+  const loadContactLists = async (contactIds: string[] = contacts.map(c => c.id), reset: boolean = true) => {
     try {
+      if (contactIds.length === 0) {
+        if (reset) setContactLists({});
+        return;
+      }
+
       const { data, error } = await supabase
         .from('contact_lists')
         .select(`
           contact_id,
           email_lists!inner(id, name, list_type)
-        `);
+        `)
+        .in('contact_id', contactIds);
 
       if (error) {
         console.error('Error loading contact lists:', error);
@@ -327,14 +341,14 @@ export const SimpleContactManager = () => {
 
       // Group lists by contact ID
       const contactListsMap: Record<string, any[]> = {};
+      contactIds.forEach(id => {
+        contactListsMap[id] = [];
+      });
       data?.forEach((item: any) => {
-        if (!contactListsMap[item.contact_id]) {
-          contactListsMap[item.contact_id] = [];
-        }
         contactListsMap[item.contact_id].push(item.email_lists);
       });
 
-      setContactLists(contactListsMap);
+      setContactLists(prev => (reset ? contactListsMap : { ...prev, ...contactListsMap }));
     } catch (error) {
       console.error('Error loading contact lists:', error);
     }
@@ -346,25 +360,8 @@ export const SimpleContactManager = () => {
       setIsSearching(true); // Use separate search loading state
       console.log(`🔍 Searching contacts: "${searchQuery}", tag: "${tagQuery}"`);
 
-      let query = supabase
-        .from('contacts')
-        .select('id, user_id, created_at, updated_at, email, first_name, last_name, status, tags')
-        .eq('user_id', user?.id)
-        .eq('status', 'subscribed')
-        .order('created_at', { ascending: false })
-        .limit(100); // Limit search results to 100
-
-      // Add search filters
-      if (searchQuery.trim()) {
-        query = query.or(`email.ilike.%${searchQuery}%,first_name.ilike.%${searchQuery}%,last_name.ilike.%${searchQuery}%`);
-      }
-
-      if (tagQuery.trim()) {
-        const filterTags = tagQuery.split(',').map(tag => tag.trim()).filter(Boolean);
-        query = query.contains('tags', filterTags);
-      }
-
-      const { data, error } = await query;
+      const filters = { search: searchQuery, tags: tagQuery };
+      const { data, error } = await fetchContactPage(filters, null);
 
       if (error) {
         console.error('Error searching contacts:', error);
@@ -372,31 +369,18 @@ export const SimpleContactManager = () => {
         return;
       }
 
-      const dbContacts: DbContact[] = data || [];
-      const uiContacts: Contact[] = dbContacts.map(c => {
-        let name = [c.first_name, c.last_name].filter(Boolean).join(' ').trim();
-        if (!name && c.email) {
-          name = generateNameFromEmail(c.email);
-        }
-        
-        return {
-          id: c.id,
-          name: name || 'Unknown',
-          email: c.email,
-          phone: "",
-          tags: c.tags ?? [],
-          created_at: c.created_at,
-        };
-      });
-
-      const filteredUiContacts = uiContacts.filter(c => !(c.tags || []).some(t => (t || '').trim().toLowerCase() === 'unsub'));
-      // Only update contacts when search results are ready
-      setContacts(filteredUiContacts);
-      setFilteredContacts(filteredUiContacts);
-      setHasMoreContacts(false); // Disable pagination for search results
-      // Don't overwrite originalContacts - keep them for restore functionality
-      
-      console.log(`✅ Found ${filteredUiContacts.length} contacts matching search`);
+      const dbContacts = (data || []) as DbContact[];
+      const uiContacts = toUiContacts(dbContacts);
+      // Only update contacts when search results are ready; "load more" continues the search
+      activeFiltersRef.current = filters;
+      pageCursorRef.current = dbContacts[dbContacts.length - 1] ?? null;
+      setContacts(uiContacts);
+      setFilteredContacts(uiContacts);
+      setHasMoreContacts(dbContacts.length === CONTACTS_PER_PAGE);
+      setCurrentPage(1);
+      await loadContactLists(uiContacts.map(c => c.id));
+
+      console.log(`✅ Found ${uiContacts.length} contacts matching search`);
     } catch (error) {
       console.error('Error searching contacts:', error);
       toast.error("Failed to search contacts");
@@ -487,7 +471,7 @@ export const SimpleContactManager = () => {
         .from('contacts')
         .select('id, tags, first_name, last_name')
         .eq('user_id', user?.id)
-        .eq('email', newContact.email)
+        .eq('email_normalized', newContact.email.trim().toLowerCase())
         .maybeSingle();
 
       if (selectError) {
@@ -797,7 +781,7 @@ export const SimpleContactManager = () => {
           for (const row of contactsToInsert) {
             const { error: insertError } = await supabase
               .from('contacts')
-              .upsert(row, { onConflict: 'user_id,email', ignoreDuplicates: true });
+              .upsert(row, { onConflict: 'user_id,email_normalized', ignoreDuplicates: true });
 
             if (insertError) {
               console.error('❌ Insert/upsert error for', row.email, insertError);
@@ -879,53 +863,25 @@ export const SimpleContactManager = () => {
       return;
     }
 
-    try {
-      // Import trigger function dynamically to avoid circular dependencies
-      const { triggerAutomationOnTagChange } = await import('@/utils/automation-trigger');
-      
-      if (bulkTagOperation === 'add') {
-        const tagsToAdd = bulkTags.split(',').map(tag => tag.toLowerCase().trim()).filter(tag => tag.length > 0);
-        
-        for (const contactId of selectedContacts) {
-          const contact = contacts.find(c => c.id === contactId);
-          if (contact) {
-            const existingTags = contact.tags || [];
-            const newTags = [...new Set([...existingTags, ...tagsToAdd])];
-            
-            const { error } = await supabase
-              .from('contacts')
-              .update({ tags: newTags })
-              .eq('id', contactId);
+    const operation = bulkTagOperation === 'add' ? 'add_tags' : 'remove_tags';
+    const tags = (bulkTagOperation === 'add' ? bulkTags : bulkTagsToRemove)
+      .split(',').map(tag => tag.toLowerCase().trim()).filter(tag => tag.length > 0);
+    const progressToast = toast.loading(`Updating tags on ${selectedContacts.size} contacts...`);
 
-            if (error) throw error;
-            
-            // Trigger automation for tag changes
-            await triggerAutomationOnTagChange(contactId, existingTags, newTags);
-          }
-        }
-        toast.success(`Added tags to ${selectedContacts.size} contacts`);
-      } else {
-        const tagsToRemove = bulkTagsToRemove.split(',').map(tag => tag.toLowerCase().trim()).filter(tag => tag.length > 0);
-        
-        for (const contactId of selectedContacts) {
-          const contact = contacts.find(c => c.id === contactId);
-          if (contact) {
-            const existingTags = contact.tags || [];
-            const newTags = existingTags.filter(tag => !tagsToRemove.includes(tag));
-            
-            const { error } = await supabase
-              .from('contacts')
-              .update({ tags: newTags })
-              .eq('id', contactId);
+    try {
+      const changed = await runBulkContactOperation({
+        operation,
+        tags,
+        contactIds: Array.from(selectedContacts),
+        onProgress: (processed, total) => toast.loading(`Updating tags: ${processed}/${total} contacts...`, { id: progressToast }),
+      });
 
-            if (error) throw error;
-            
-            // Trigger automation for tag changes
-            await triggerAutomationOnTagChange(contactId, existingTags, newTags);
-          }
-        }
-        toast.success(`Removed tags from ${selectedContacts.size} contacts`);
-      }
+      toast.success(
+        bulkTagOperation === 'add'
+          ? `Added tags to ${changed} contacts`
+          : `Removed tags from ${changed} contacts`,
+        { id: progressToast }
+      );
 
       setBulkTags('');
       setBulkTagsToRemove('');
@@ -934,7 +890,7 @@ export const SimpleContactManager = () => {
       loadContacts();
     } catch (error) {
       console.error('Error managing bulk tags:', error);
-      toast.error("Failed to manage tags");
+      toast.error("Failed to manage tags", { id: progressToast });
     }
   };
 
@@ -951,39 +907,22 @@ export const SimpleContactManager = () => {
       return;
     }
 
-    try {
-      if (bulkListOperation === 'add') {
-        const memberships = [];
-        for (const contactId of selectedContacts) {
-          for (const listId of selectedBulkLists) {
-            memberships.push({
-              contact_id: contactId,
-              list_id: listId
-            });
-          }
-        }
+    const progressToast = toast.loading(`Updating lists for ${selectedContacts.size} contacts...`);
 
-        const { error } = await supabase
-          .from('contact_lists')
-          .upsert(memberships, { onConflict: 'contact_id,list_id' });
+    try {
+      const changed = await runBulkContactOperation({
+        operation: bulkListOperation === 'add' ? 'add_to_lists' : 'remove_from_lists',
+        listIds: listsToProcess,
+        contactIds: Array.from(selectedContacts),
+        onProgress: (processed, total) => toast.loading(`Updating lists: ${processed}/${total} contacts...`, { id: progressToast }),
+      });
 
-        if (error) throw error;
-        toast.success(`Added ${selectedContacts.size} contacts to ${selectedBulkLists.length} lists`);
-      } else {
-        // Remove from lists
-        for (const contactId of selectedContacts) {
-          for (const listId of selectedBulkListsToRemove) {
-            const { error } = await supabase
-              .from('contact_lists')
-              .delete()
-              .eq('contact_id', contactId)
-              .eq('list_id', listId);
-
-            if (error) throw error;
-          }
-        }
-        toast.success(`Removed ${selectedContacts.size} contacts from ${selectedBulkListsToRemove.length} lists`);
-      }
+      toast.success(
+        bulkListOperation === 'add'
+          ? `Added ${changed} memberships across ${listsToProcess.length} lists`
+          : `Removed ${changed} memberships across ${listsToProcess.length} lists`,
+        { id: progressToast }
+      );
 
       setSelectedBulkLists([]);
       setSelectedBulkListsToRemove([]);
@@ -992,7 +931,7 @@ export const SimpleContactManager = () => {
       loadContactLists(); // Reload to show updated lists
     } catch (error) {
       console.error('Error managing contacts in lists:', error);
-      toast.error("Failed to manage contacts in lists");
+      toast.error("Failed to manage contacts in lists", { id: progressToast });
     }
   };
 
@@ -1420,16 +1359,7 @@ export const SimpleContactManager = () => {
                     onClick={() => {
                       setSearchTerm('');
                       setTagFilter('');
-                      // Restore original loaded contacts instead of fetching from server
-                      if (originalContacts.length > 0) {
-                        setContacts(originalContacts);
-                        setFilteredContacts(originalContacts);
-                        setHasMoreContacts(originalContacts.length === CONTACTS_PER_PAGE);
-                        setCurrentPage(1);
-                      } else {
-                        // Fallback to loading if no original contacts stored
-                        loadContacts(1, true);
-                      }
+                      loadContacts(1, true);
                     }}
                     variant="outline"
                     size="sm"
@@ -1544,11 +1474,13 @@ export const SimpleContactManager = () => {
             )}
             
             {/* Pagination Info and Load More Button */}
-            {!searchTerm && !tagFilter && (
+            {(hasMoreContacts || (!searchTerm && !tagFilter)) && (
               <div className="mt-6 pt-4 border-t border-email-primary/10">
                 <div className="flex items-center justify-between mb-4">
                   <div className="text-sm text-email-muted">
-                    Showing {contacts.length} of {totalContacts} contacts
+                    {searchTerm || tagFilter
+                      ? `Showing ${contacts.length} matching contacts`
+                      : `Showing ${contacts.length} of ${totalContacts} contacts`}
                   </div>
                   {hasMoreContacts && (
                     <Button
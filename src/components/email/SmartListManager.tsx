@@ -82,11 +82,11 @@ export const SmartListManager = () => {
     }
   }, [user?.id]);
 
-  // Listen for contact updates to refresh dynamic lists
+  // Listen for contact updates to refresh list counts
   useEffect(() => {
     const handleContactsUpdated = () => {
-      console.log('🔄 Contacts updated, refreshing dynamic lists...');
-      refreshAllDynamicLists();
+      console.log('🔄 Contacts updated, refreshing list counts...');
+      loadData();
     };
 
     window.addEventListener('contactsUpdated', handleContactsUpdated);
@@ -101,7 +101,7 @@ export const SmartListManager = () => {
       // Load lists first
       const { data: listsData, error: listsError } = await supabase
         .from('email_lists')
-        .select('*')
+        .select('*, email_list_member_counts(member_count)')
         .eq('user_id', user?.id)
         .order('created_at', { ascending: false });
 
@@ -111,76 +111,20 @@ export const SmartListManager = () => {
         return;
       }
 
-      // Get accurate contact counts for each list using separate queries
-      const processedLists: EmailList[] = await Promise.all((listsData || []).map(async (list: any) => {
-        let contactCount = 0;
-        
-        if (list.list_type === 'dynamic' && list.rule_config) {
-          // For dynamic lists, count based on rules
-          const { count } = await supabase
-            .from('contacts')
-            .select('*', { count: 'exact', head: true })
-            .eq('user_id', user?.id)
-            .eq('status', 'subscribed')
-            .contains('tags', list.rule_config.requiredTags || []);
-          
-          contactCount = count || 0;
-        } else {
-          // For static lists, count from contact_lists table
-          const { count } = await supabase
-            .from('contact_lists')
-            .select('*', { count: 'exact', head: true })
-            .eq('list_id', list.id);
-          
-          contactCount = count || 0;
-        }
-
-        return {
-          id: list.id,
-          name: list.name,
-          description: list.description || "",
-          list_type: list.list_type === 'dynamic' ? 'dynamic' : 'static',
-          rule_config: list.rule_config ?? null,
-          created_at: list.created_at,
-          contact_count: contactCount,
-        };
+      // Dynamic list membership and the per-list member counters are maintained by the
+      // database, so the counts are current for every list type
+      const processedLists: EmailList[] = (listsData || []).map((list: any) => ({
+        id: list.id,
+        name: list.name,
+        description: list.description || "",
+        list_type: list.list_type === 'dynamic' ? 'dynamic' : 'static',
+        rule_config: list.rule_config ?? null,
+        created_at: list.created_at,
+        contact_count: list.email_list_member_counts?.member_count ?? 0,
       }));
 
       setLists(processedLists);
 
-      // Populate dynamic lists with current contacts in parallel
-      const dynamicListPromises = processedLists
-        .filter(list => list.list_type === 'dynamic' && list.rule_config)
-        .map(list => populateDynamicList(list.id, list.rule_config!));
-
-      if (dynamicListPromises.length > 0) {
-        await Promise.allSettled(dynamicListPromises);
-      }
-
-      // Get updated counts after populating dynamic lists - use single query again
-      const { data: updatedListsData, error: updatedListsError } = await supabase
-        .from('email_lists')
-        .select(`
-          *,
-          contact_lists(count)
-        `)
-        .eq('user_id', user?.id)
-        .order('created_at', { ascending: false });
-
-      if (!updatedListsError && updatedListsData) {
-        const updatedLists: EmailList[] = updatedListsData.map((list: any) => ({
-          id: list.id,
-          name: list.name,
-          description: list.description || "",
-          list_type: list.list_type === 'dynamic' ? 'dynamic' : 'static',
-          rule_config: list.rule_config ?? null,
-          created_at: list.created_at,
-          contact_count: list.contact_lists?.[0]?.count || 0,
-        }));
-
-        setLists(updatedLists);
-      }
-
       const endTime = performance.now();
       console.log(`✅ Smart lists loaded in ${Math.round(endTime - startTime)}ms`);
 
@@ -311,11 +255,6 @@ export const SmartListManager = () => {
         return;
       }
 
-      // If it's a dynamic list, populate it immediately
-      if (newList.list_type === 'dynamic' && ruleConfig) {
-        await populateDynamicList(listData.id, ruleConfig);
-      }
-
       toast.success("List created successfully!");
       setNewList({
         name: "",
@@ -331,105 +270,6 @@ export const SmartListManager = () => {
     }
   };
 
-  const refreshAllDynamicLists = async () => {
-    try {
-      console.log('🔄 Refreshing all dynamic lists...');
-      
-      // Get all dynamic lists
-      const { data: dynamicLists, error: listsError } = await supabase
-        .from('email_lists')
-        .select('id, name, rule_config')
-        .eq('user_id', user?.id)
-        .eq('list_type', 'dynamic');
-
-      if (listsError) {
-        console.error('Error fetching dynamic lists:', listsError);
-        return;
-      }
-
-      // Refresh each dynamic list
-      for (const list of dynamicLists || []) {
-        if (list.rule_config) {
-          await populateDynamicList(list.id, list.rule_config);
-        }
-      }
-      
-      console.log(`✅ Refreshed ${dynamicLists?.length || 0} dynamic lists`);
-    } catch (error) {
-      console.error('Error refreshing dynamic lists:', error);
-    }
-  };
-
-  const populateDynamicList = async (listId: string, ruleConfig: any) => {
-    try {
-      console.log(`🔄 Populating dynamic list ${listId} with rule:`, ruleConfig);
-      
-      // Extract tags from rule configuration
-      let tagsToMatch: string[] = [];
-      
-      if (ruleConfig.rules && Array.isArray(ruleConfig.rules)) {
-        // New rule format
-        for (const rule of ruleConfig.rules) {
-          if (rule.type === 'has_any_tags' && rule.values) {
-            tagsToMatch = [...tagsToMatch, ...rule.values];
-          }
-        }
-      } else if (ruleConfig.requiredTags && Array.isArray(ruleConfig.requiredTags)) {
-        // Legacy format
-        tagsToMatch = ruleConfig.requiredTags;
-      }
-      
-      console.log(`📋 Tags to match:`, tagsToMatch);
-      
-      if (tagsToMatch.length === 0) {
-        console.log('❌ No tags found in rule configuration');
-        return;
-      }
-
-      // Clear existing memberships first
-      await supabase
-        .from('contact_lists')
-        .delete()
-        .eq('list_id', listId);
-
-      // Add contacts that match any of the tags using PostgreSQL array operations
-      for (const tag of tagsToMatch) {
-        const { data: matchingContacts, error: contactsError } = await supabase
-          .from('contacts')
-          .select('id')
-          .eq('user_id', user?.id)
-          .eq('status', 'subscribed')
-          .contains('tags', [tag]);
-
-        if (contactsError) {
-          console.error('Error fetching contacts for tag:', tag, contactsError);
-          continue;
-        }
-
-        if (matchingContacts && matchingContacts.length > 0) {
-          const memberships = matchingContacts.map(contact => ({
-            contact_id: contact.id,
-            list_id: listId
-          }));
-
-          const { error: insertError } = await supabase
-            .from('contact_lists')
-            .upsert(memberships, { onConflict: 'contact_id,list_id' });
-
-          if (insertError) {
-            console.error('Error inserting contacts for tag:', tag, insertError);
-          } else {
-            console.log(`✅ Added ${matchingContacts.length} contacts for tag: ${tag}`);
-          }
-        }
-      }
-      
-      console.log(`✅ Finished populating dynamic list ${listId}`);
-    } catch (error) {
-      console.error('Error populating dynamic list:', error);
-    }
-  };
-
   const handleDeleteList = async (listId: string) => {
     try {
       // Delete list memberships first
@@ -462,14 +302,10 @@ export const SmartListManager = () => {
     if (list.list_type !== 'dynamic' || !list.rule_config) return;
 
     try {
-      // Clear existing memberships
-      await supabase
-        .from('contact_lists')
-        .delete()
-        .eq('list_id', list.id);
+      // Full rebuild on the server; membership is otherwise kept current by triggers
+      const { error } = await supabase.rpc('rebuild_dynamic_list', { p_list_id: list.id });
+      if (error) throw error;
 
-      // Repopulate with current data
-      await populateDynamicList(list.id, list.rule_config);
       toast.success(`Refreshed ${list.name} with latest contacts`);
       loadData();
     } catch (error) {
@@ -666,11 +502,6 @@ export const SmartListManager = () => {
 
       if (error) throw error;
 
-      // If it's a dynamic list and rules changed, repopulate it
-      if (editListForm.list_type === 'dynamic' && ruleConfig) {
-        await populateDynamicList(editingList.id, ruleConfig);
-      }
-
       toast.success("List updated successfully!");
       setShowEditListDialog(false);
       setEditingList(null);
@@ -683,45 +514,15 @@ export const SmartListManager = () => {
 
   const handleDuplicateList = async (originalList: EmailList) => {
     try {
-      const duplicateName = `${originalList.name} (Copy)`;
-      
-      // Create the duplicate as a static list
-      const { data: newListData, error: createError } = await supabase
-        .from('email_lists')
-        .insert({
-          name: duplicateName,
-          description: `Static copy of ${originalList.name}`,
-          user_id: user?.id,
-          list_type: 'static',
-          rule_config: null
-        })
-        .select()
-        .single();
-
-      if (createError) throw createError;
-
-      // Copy all contacts from the original list
-      const { data: originalContacts, error: fetchError } = await supabase
-        .from('contact_lists')
-        .select('contact_id')
-        .eq('list_id', originalList.id);
-
-      if (fetchError) throw fetchError;
-
-      if (originalContacts && originalContacts.length > 0) {
-        const memberships = originalContacts.map(contact => ({
-          contact_id: contact.contact_id,
-          list_id: newListData.id
-        }));
-
-        const { error: copyError } = await supabase
-          .from('contact_lists')
-          .insert(memberships);
+      // Snapshot the current members into a new static list without moving contacts through the browser
+      const { data, error } = await supabase.rpc('duplicate_list_as_static', {
+        p_list_id: originalList.id,
+      });
 
-        if (copyError) throw copyError;
-      }
+      if (error) throw error;
 
-      toast.success(`Created static copy: ${duplicateName}`);
+      const copied = data?.member_count ?? 0;
+      toast.success(`Created static copy of ${originalList.name} with ${copied} contacts`);
       loadData();
     } catch (error) {
       console.error('Error duplicating list:', error);
@@ -38,6 +38,14 @@ interface TagRule {
   enabled: boolean;
 }
 
+// Contacts re-evaluated per call; each call commits on its own
+const REAPPLY_CHUNK_SIZE = 500;
+
+// Rules that add or remove each other's trigger tags are rejected by the database
+// (check_violation); show its explanation instead of a generic failure
+const ruleSaveErrorMessage = (error: any, fallback: string) =>
+  error?.code === '23514' && error?.message ? `${error.message}. ${error.hint ?? ''}`.trim() : fallback;
+
 export const TagRulesManager = () => {
   const { user } = useAuth();
   const [rules, setRules] = useState<TagRule[]>([]);
@@ -45,6 +53,7 @@ export const TagRulesManager = () => {
   const [editingRule, setEditingRule] = useState<string | null>(null);
   const [allTags, setAllTags] = useState<string[]>([]);
   const [isReapplying, setIsReapplying] = useState(false);
+  const [reapplyProgress, setReapplyProgress] = useState<{ processed: number; total: number } | null>(null);
   const [showDeleteDialog, setShowDeleteDialog] = useState(false);
   const [ruleToDelete, setRuleToDelete] = useState<string | null>(null);
   const [confirmText, setConfirmText] = useState('');
@@ -216,9 +225,10 @@ export const TagRulesManager = () => {
       setNewRule({ name: "", description: "", trigger_tags: [], trigger_match_type: "any", add_tags: [], remove_tags: [], replace_all_tags: false });
       setIsCreating(false);
       loadRules();
+      applyRuleChanges();
     } catch (error) {
       console.error('Error creating tag rule:', error);
-      toast.error('Failed to create tag rule');
+      toast.error(ruleSaveErrorMessage(error, 'Failed to create tag rule'));
     }
   };
 
@@ -248,9 +258,10 @@ export const TagRulesManager = () => {
       toast.success('Tag rule updated successfully');
       setEditingRule(null);
       loadRules();
+      applyRuleChanges();
     } catch (error) {
       console.error('Error updating tag rule:', error);
-      toast.error('Failed to update tag rule');
+      toast.error(ruleSaveErrorMessage(error, 'Failed to update tag rule'));
     }
   };
 
@@ -280,10 +291,11 @@ export const TagRulesManager = () => {
         rule.id === ruleId ? { ...rule, enabled } : rule
       ));
       
-      toast.success(`Rule ${enabled ? 'enabled' : 'disabled'}. Use "Reapply Rules" button to update all contacts.`);
+      toast.success(`Rule ${enabled ? 'enabled' : 'disabled'}`);
+      applyRuleChanges();
     } catch (error) {
       console.error('Error updating rule:', error);
-      toast.error('Failed to update rule');
+      toast.error(ruleSaveErrorMessage(error, 'Failed to update rule'));
     }
   };
 
@@ -301,6 +313,7 @@ export const TagRulesManager = () => {
       setShowDeleteDialog(false);
       setRuleToDelete(null);
       setConfirmText('');
+      applyRuleChanges();
     } catch (error) {
       console.error('Error deleting rule:', error);
       toast.error('Failed to delete rule');
@@ -322,26 +335,77 @@ export const TagRulesManager = () => {
     }
   };
 
-  const reapplyTagRules = async () => {
-    setIsReapplying(true);
+  // Rule changes queue a reapply job scoped to the contacts they can affect.
+  // Process queued jobs chunk by chunk; returns the number of contacts whose tags changed.
+  const drainReapplyJobs = async (jobIds?: string[]) => {
+    let ids = jobIds;
+    if (!ids) {
+      const { data, error } = await supabase
+        .from('tag_rule_reapply_jobs')
+        .select('id')
+        .eq('user_id', user?.id)
+        .eq('status', 'pending')
+        .order('created_at', { ascending: true });
+
+      if (error) throw error;
+      ids = (data || []).map(job => job.id);
+    }
+
+    let updatedContacts = 0;
     try {
-      // Reapply tag rules for both regular and unsubscribed contacts
-      const { error: contactsError } = await supabase.rpc('reapply_tag_rules_for_user', {
-        p_user_id: user?.id
-      });
+      for (const jobId of ids) {
+        for (;;) {
+          const { data: job, error } = await supabase.rpc('run_tag_rule_reapply_job', {
+            p_job_id: jobId,
+            p_chunk_size: REAPPLY_CHUNK_SIZE
+          });
+
+          if (error) throw error;
+          setReapplyProgress({ processed: job.processed, total: job.total ?? job.processed });
+          if (job.status === 'completed') {
+            updatedContacts += job.updated;
+            break;
+          }
+        }
+      }
+    } finally {
+      setReapplyProgress(null);
+    }
 
-      if (contactsError) throw contactsError;
+    if (updatedContacts > 0) {
+      window.dispatchEvent(new CustomEvent('contactsUpdated'));
+    }
+    return updatedContacts;
+  };
+
+  // Apply a saved rule change to the affected contacts in the background
+  const applyRuleChanges = async () => {
+    setIsReapplying(true);
+    try {
+      const updatedContacts = await drainReapplyJobs();
+      if (updatedContacts > 0) {
+        toast.success(`Tag rules applied to ${updatedContacts} contact${updatedContacts === 1 ? '' : 's'}`);
+      }
+    } catch (error) {
+      console.error('Error applying tag rule changes:', error);
+      toast.error('Failed to apply tag rule changes. Use "Reapply Rules" to retry.');
+    } finally {
+      setIsReapplying(false);
+    }
+  };
 
-      const { error: unsubscribedError } = await supabase.rpc('reapply_tag_rules_to_unsubscribed_contacts', {
+  const reapplyTagRules = async () => {
+    setIsReapplying(true);
+    try {
+      // Re-evaluate every contact (regular and unsubscribed) for this user
+      const { data: jobId, error } = await supabase.rpc('enqueue_tag_rule_reapply', {
         p_user_id: user?.id
       });
 
-      if (unsubscribedError) throw unsubscribedError;
+      if (error) throw error;
 
-      toast.success('Tag rules reapplied to all contacts successfully');
-      
-      // Trigger a global refresh of contacts
-      window.dispatchEvent(new CustomEvent('contactsUpdated'));
+      const updatedContacts = await drainReapplyJobs(jobId ? [jobId] : []);
+      toast.success(`Tag rules reapplied to all contacts successfully (${updatedContacts} updated)`);
       
     } catch (error) {
       console.error('Error reapplying tag rules:', error);
@@ -380,7 +444,11 @@ export const TagRulesManager = () => {
             className="flex items-center gap-2"
           >
             <RefreshCw className={`h-4 w-4 ${isReapplying ? 'animate-spin' : ''}`} />
-            {isReapplying ? 'Reapplying...' : 'Reapply Rules'}
+            {isReapplying
+              ? reapplyProgress
+                ? `Reapplying... ${reapplyProgress.processed}/${reapplyProgress.total}`
+                : 'Reapplying...'
+              : 'Reapply Rules'}
           </Button>
           <Button onClick={() => setIsCreating(true)} className="flex items-center gap-2">
             <Plus className="h-4 w-4" />
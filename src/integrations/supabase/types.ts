@@ -103,6 +103,63 @@ export type Database = {
         }
         Relationships: []
       }
+      contact_bulk_jobs: {
+        Row: {
+          changed: number
+          completed_at: string | null
+          contact_ids: string[] | null
+          created_at: string
+          id: string
+          last_changes: Json
+          last_id: string | null
+          list_ids: string[] | null
+          operation: string
+          predicate: string | null
+          processed: number
+          status: string
+          tags: string[] | null
+          total: number | null
+          updated_at: string
+          user_id: string
+        }
+        Insert: {
+          changed?: number
+          completed_at?: string | null
+          contact_ids?: string[] | null
+          created_at?: string
+          id?: string
+          last_changes?: Json
+          last_id?: string | null
+          list_ids?: string[] | null
+          operation: string
+          predicate?: string | null
+          processed?: number
+          status?: string
+          tags?: string[] | null
+          total?: number | null
+          updated_at?: string
+          user_id: string
+        }
+        Update: {
+          changed?: number
+          completed_at?: string | null
+          contact_ids?: string[] | null
+          created_at?: string
+          id?: string
+          last_changes?: Json
+          last_id?: string | null
+          list_ids?: string[] | null
+          operation?: string
+          predicate?: string | null
+          processed?: number
+          status?: string
+          tags?: string[] | null
+          total?: number | null
+          updated_at?: string
+          user_id?: string
+        }
+        Relationships: []
+      }
       contact_lists: {
         Row: {
           contact_id: string
@@ -196,10 +253,12 @@ export type Database = {
         Row: {
           created_at: string
           email: string
+          email_normalized: string | null
           first_name: string | null
           id: string
           last_name: string | null
           status: string
+          tag_ids: number[]
           tags: string[] | null
           updated_at: string
           user_id: string
@@ -228,6 +287,35 @@ export type Database = {
         }
         Relationships: []
       }
+      email_list_member_counts: {
+        Row: {
+          list_id: string
+          member_count: number
+          subscribed_count: number
+          updated_at: string
+        }
+        Insert: {
+          list_id: string
+          member_count?: number
+          subscribed_count?: number
+          updated_at?: string
+        }
+        Update: {
+          list_id?: string
+          member_count?: number
+          subscribed_count?: number
+          updated_at?: string
+        }
+        Relationships: [
+          {
+            foreignKeyName: "email_list_member_counts_list_id_fkey"
+            columns: ["list_id"]
+            isOneToOne: true
+            referencedRelation: "email_lists"
+            referencedColumns: ["id"]
+          },
+        ]
+      }
       email_lists: {
         Row: {
           created_at: string
@@ -236,6 +324,11 @@ export type Database = {
           list_type: string
           name: string
           rule_config: Json | null
+          rule_has_products: boolean | null
+          rule_list_ids: string[] | null
+          rule_needs_tags: boolean | null
+          rule_tags_normalized: string[] | null
+          rule_version: number
           updated_at: string
           user_id: string
         }
@@ -246,6 +339,7 @@ export type Database = {
           list_type?: string
           name: string
           rule_config?: Json | null
+          rule_version?: number
           updated_at?: string
           user_id: string
         }
@@ -256,6 +350,7 @@ export type Database = {
           list_type?: string
           name?: string
           rule_config?: Json | null
+          rule_version?: number
           updated_at?: string
           user_id?: string
         }
@@ -438,9 +533,132 @@ export type Database = {
         }
         Relationships: []
       }
+      tag_dictionary: {
+        Row: {
+          created_at: string
+          id: number
+          name: string
+          name_normalized: string | null
+          user_id: string
+        }
+        Insert: {
+          created_at?: string
+          name: string
+          user_id: string
+        }
+        Update: {
+          created_at?: string
+          name?: string
+          user_id?: string
+        }
+        Relationships: []
+      }
+      tag_rule_execution_summaries: {
+        Row: {
+          contacts_changed: number
+          created_at: string
+          job_id: string
+          rule_id: string
+          updated_at: string
+          user_id: string
+        }
+        Insert: {
+          contacts_changed?: number
+          created_at?: string
+          job_id: string
+          rule_id: string
+          updated_at?: string
+          user_id: string
+        }
+        Update: {
+          contacts_changed?: number
+          created_at?: string
+          job_id?: string
+          rule_id?: string
+          updated_at?: string
+          user_id?: string
+        }
+        Relationships: []
+      }
+      tag_rule_reapply_jobs: {
+        Row: {
+          cache_hits: number
+          cache_misses: number
+          completed_at: string | null
+          created_at: string
+          id: string
+          last_id: string | null
+          phase: string
+          processed: number
+          status: string
+          total: number | null
+          trigger_tags: string[] | null
+          updated: number
+          updated_at: string
+          user_id: string
+        }
+        Insert: {
+          cache_hits?: number
+          cache_misses?: number
+          completed_at?: string | null
+          created_at?: string
+          id?: string
+          last_id?: string | null
+          phase?: string
+          processed?: number
+          status?: string
+          total?: number | null
+          trigger_tags?: string[] | null
+          updated?: number
+          updated_at?: string
+          user_id: string
+        }
+        Update: {
+          cache_hits?: number
+          cache_misses?: number
+          completed_at?: string | null
+          created_at?: string
+          id?: string
+          last_id?: string | null
+          phase?: string
+          processed?: number
+          status?: string
+          total?: number | null
+          trigger_tags?: string[] | null
+          updated?: number
+          updated_at?: string
+          user_id?: string
+        }
+        Relationships: []
+      }
+      tag_rule_sets: {
+        Row: {
+          compiled_at: string
+          cycle_rule_ids: string[]
+          rule_order: string[]
+          user_id: string
+          version: number
+        }
+        Insert: {
+          compiled_at?: string
+          cycle_rule_ids?: string[]
+          rule_order?: string[]
+          user_id: string
+          version?: number
+        }
+        Update: {
+          compiled_at?: string
+          cycle_rule_ids?: string[]
+          rule_order?: string[]
+          user_id?: string
+          version?: number
+        }
+        Relationships: []
+      }
       tag_rules: {
         Row: {
           add_tags: string[] | null
+          add_tags_normalized: string[]
           created_at: string
           description: string | null
           enabled: boolean
@@ -449,10 +667,12 @@ export type Database = {
           password: string | null
           protected: boolean | null
           remove_tags: string[] | null
+          remove_tags_normalized: string[]
           replace_all_tags: boolean | null
           trigger_match_type: string | null
           trigger_tag: string
           trigger_tags: string[] | null
+          trigger_tags_normalized: string[]
           updated_at: string
           user_id: string
         }
@@ -532,10 +752,12 @@ export type Database = {
         Row: {
           created_at: string
           email: string
+          email_normalized: string | null
           first_name: string | null
           id: string
           last_name: string | null
           original_contact_id: string | null
+          tag_rules_pending: boolean
           tags: string[] | null
           unsubscribed_at: string
           user_id: string
@@ -547,6 +769,7 @@ export type Database = {
           id?: string
           last_name?: string | null
           original_contact_id?: string | null
+          tag_rules_pending?: boolean
           tags?: string[] | null
           unsubscribed_at?: string
           user_id: string
@@ -558,6 +781,7 @@ export type Database = {
           id?: string
           last_name?: string | null
           original_contact_id?: string | null
+          tag_rules_pending?: boolean
           tags?: string[] | null
           unsubscribed_at?: string
           user_id?: string
@@ -599,6 +823,9 @@ export type Database = {
           id: string
           max_retries: number | null
           sending_speed: number | null
+          tag_rule_audit_mode: string
+          tag_rule_audit_sample_rate: number
+          unsubscribed_tag_rule_policy: string
           updated_at: string
           user_id: string
           webhook_url: string | null
@@ -613,6 +840,9 @@ export type Database = {
           id?: string
           max_retries?: number | null
           sending_speed?: number | null
+          tag_rule_audit_mode?: string
+          tag_rule_audit_sample_rate?: number
+          unsubscribed_tag_rule_policy?: string
           updated_at?: string
           user_id: string
           webhook_url?: string | null
@@ -627,6 +857,9 @@ export type Database = {
           id?: string
           max_retries?: number | null
           sending_speed?: number | null
+          tag_rule_audit_mode?: string
+          tag_rule_audit_sample_rate?: number
+          unsubscribed_tag_rule_policy?: string
           updated_at?: string
           user_id?: string
           webhook_url?: string | null
@@ -705,10 +938,37 @@ export type Database = {
         Args: { tags_array: string[] }
         Returns: string[]
       }
+      count_list_rule_matches: {
+        Args: { p_rule_config: Json; p_user_id?: string }
+        Returns: number
+      }
       generate_unsubscribe_token: {
         Args: { p_campaign_id?: string; p_email: string; p_user_id?: string }
         Returns: string
       }
+      duplicate_list_as_static: {
+        Args: { p_list_id: string; p_name?: string; p_description?: string }
+        Returns: {
+          member_count: number
+          new_list_id: string
+        }
+      }
+      enqueue_contact_bulk_job: {
+        Args: {
+          p_operation: string
+          p_tags?: string[]
+          p_list_ids?: string[]
+          p_contact_ids?: string[]
+          p_filter_list_ids?: string[]
+          p_filter_rule_config?: Json
+          p_user_id?: string
+        }
+        Returns: string
+      }
+      enqueue_tag_rule_reapply: {
+        Args: { p_user_id: string; p_trigger_tags?: string[] }
+        Returns: string
+      }
       handle_restore_contact: {
         Args: { p_email: string; p_user_id?: string }
         Returns: undefined
@@ -721,10 +981,52 @@ export type Database = {
         Args: Record<PropertyKey, never>
         Returns: boolean
       }
+      list_contacts: {
+        Args: {
+          p_limit?: number
+          p_after_created_at?: string
+          p_after_id?: string
+          p_status?: string
+          p_tags?: string[]
+          p_match_all_tags?: boolean
+          p_exclude_tags?: string[]
+          p_list_id?: string
+          p_product_id?: string
+          p_search?: string
+          p_user_id?: string
+        }
+        Returns: {
+          created_at: string
+          email: string
+          email_normalized: string | null
+          first_name: string | null
+          id: string
+          last_name: string | null
+          status: string
+          tag_ids: number[]
+          tags: string[] | null
+          updated_at: string
+          user_id: string
+        }[]
+      }
       map_user_id: {
         Args: { input_user_id: string }
         Returns: string
       }
+      match_products_in_text: {
+        Args: { p_text: string; p_user_id?: string }
+        Returns: {
+          category: string | null
+          created_at: string
+          description: string | null
+          id: string
+          name: string
+          price: number | null
+          sku: string | null
+          updated_at: string
+          user_id: string
+        }[]
+      }
       merge_all_case_sensitive_duplicates: {
         Args: Record<PropertyKey, never>
         Returns: {
@@ -768,6 +1070,22 @@ export type Database = {
         Args: { tags_array: string[] }
         Returns: string[]
       }
+      preview_list_rule_matches: {
+        Args: { p_rule_config: Json; p_user_id?: string; p_limit?: number }
+        Returns: {
+          created_at: string
+          email: string
+          email_normalized: string | null
+          first_name: string | null
+          id: string
+          last_name: string | null
+          status: string
+          tag_ids: number[]
+          tags: string[] | null
+          updated_at: string
+          user_id: string
+        }[]
+      }
       reapply_tag_rules_for_user: {
         Args: { p_user_id: string }
         Returns: undefined
@@ -776,6 +1094,104 @@ export type Database = {
         Args: { p_user_id: string }
         Returns: undefined
       }
+      rebuild_dynamic_list: {
+        Args: { p_list_id: string }
+        Returns: number
+      }
+      rebuild_dynamic_lists: {
+        Args: { p_user_id: string }
+        Returns: number
+      }
+      resolve_list_recipients: {
+        Args: { p_list_ids: string[] }
+        Returns: {
+          email: string
+          first_name: string | null
+          id: string
+          last_name: string | null
+        }[]
+      }
+      run_contact_bulk_job: {
+        Args: { p_job_id: string; p_chunk_size?: number }
+        Returns: {
+          changed: number
+          completed_at: string | null
+          contact_ids: string[] | null
+          created_at: string
+          id: string
+          last_changes: Json
+          last_id: string | null
+          list_ids: string[] | null
+          operation: string
+          predicate: string | null
+          processed: number
+          status: string
+          tags: string[] | null
+          total: number | null
+          updated_at: string
+          user_id: string
+        }
+      }
+      run_tag_rule_reapply_job: {
+        Args: { p_job_id: string; p_chunk_size?: number }
+        Returns: {
+          cache_hits: number
+          cache_misses: number
+          completed_at: string | null
+          created_at: string
+          id: string
+          last_id: string | null
+          phase: string
+          processed: number
+          status: string
+          total: number | null
+          trigger_tags: string[] | null
+          updated: number
+          updated_at: string
+          user_id: string
+        }
+      }
+      search_contacts: {
+        Args: { p_query: string; p_limit?: number; p_user_id?: string }
+        Returns: {
+          email: string
+          first_name: string | null
+          id: string
+          last_name: string | null
+          score: number
+          status: string
+          tags: string[] | null
+        }[]
+      }
+      search_products: {
+        Args: {
+          p_query: string
+          p_limit?: number
+          p_prefix?: boolean
+          p_user_id?: string
+        }
+        Returns: {
+          category: string | null
+          created_at: string
+          description: string | null
+          id: string
+          name: string
+          price: number | null
+          sku: string | null
+          updated_at: string
+          user_id: string
+        }[]
+      }
+      segment_count: {
+        Args: {
+          p_list_ids?: string[]
+          p_rule_config?: Json
+          p_mode?: string
+          p_preview_limit?: number
+          p_user_id?: string
+        }
+        Returns: Json
+      }
       tag_exists: {
         Args: { search_tag: string; tags_array: string[] }
         Returns: boolean
@@ -0,0 +1,87 @@
+import { supabase } from "@/integrations/supabase/client";
+import { automationApi } from "@/lib/automation-api";
+
+// Bulk tag/list changes run server-side as a contact_bulk_jobs row, one set-based
+// statement per chunk. runBulkContactOperation queues the job and drains it.
+
+export type BulkContactOperation = 'add_tags' | 'remove_tags' | 'add_to_lists' | 'remove_from_lists';
+
+export interface BulkContactOptions {
+  operation: BulkContactOperation;
+  tags?: string[];
+  listIds?: string[];
+  // Selection: explicit contact ids, a segment filter, or both
+  contactIds?: string[];
+  filterListIds?: string[];
+  filterRuleConfig?: any;
+  chunkSize?: number;
+  onProgress?: (processed: number, total: number) => void;
+}
+
+interface TagChange {
+  contact_id: string;
+  added: string[];
+  removed: string[];
+}
+
+const DEFAULT_CHUNK_SIZE = 1000;
+const AUTOMATION_CONCURRENCY = 10;
+
+// Returns the number of contacts (tag operations) or memberships (list operations) changed
+export async function runBulkContactOperation({
+  operation,
+  tags,
+  listIds,
+  contactIds,
+  filterListIds,
+  filterRuleConfig,
+  chunkSize = DEFAULT_CHUNK_SIZE,
+  onProgress,
+}: BulkContactOptions): Promise<number> {
+  const { data: jobId, error } = await supabase.rpc('enqueue_contact_bulk_job', {
+    p_operation: operation,
+    p_tags: tags ?? null,
+    p_list_ids: listIds ?? null,
+    p_contact_ids: contactIds ?? null,
+    p_filter_list_ids: filterListIds ?? null,
+    p_filter_rule_config: filterRuleConfig ?? null,
+  });
+  if (error) throw error;
+
+  for (;;) {
+    const { data: job, error: runError } = await supabase.rpc('run_contact_bulk_job', {
+      p_job_id: jobId,
+      p_chunk_size: chunkSize,
+    });
+    if (runError) throw runError;
+
+    onProgress?.(job.processed, job.total ?? job.processed);
+    await triggerTagAutomations((job.last_changes ?? []) as unknown as TagChange[]);
+    if (job.status === 'completed') {
+      return job.changed;
+    }
+  }
+}
+
+// Tag automations for the contacts a chunk actually changed (including tags added or
+// removed by tag rules). Failures are logged, not thrown, like triggerAutomationOnTagChange.
+async function triggerTagAutomations(changes: TagChange[]) {
+  const triggers: Array<() => Promise<unknown>> = [];
+  for (const change of changes) {
+    for (const tag of change.added) {
+      triggers.push(() => automationApi.triggerAutomation(change.contact_id, 'tag_added', { tag }));
+    }
+    for (const tag of change.removed) {
+      triggers.push(() => automationApi.triggerAutomation(change.contact_id, 'tag_removed', { tag }));
+    }
+  }
+
+  let failed = 0;
+  for (let i = 0; i < triggers.length; i += AUTOMATION_CONCURRENCY) {
+    const results = await Promise.allSettled(triggers.slice(i, i + AUTOMATION_CONCURRENCY).map(trigger => trigger()));
+    failed += results.filter(result => result.status === 'rejected').length;
+  }
+  if (failed > 0) {
+    console.error(`Failed to trigger ${failed} tag automation(s)`);
+  }
+}
@@ -0,0 +1,62 @@
+import { supabase } from "@/integrations/supabase/client";
+
+// Product autocomplete backed by search_products, with a prefix cache: a prefix whose
+// results came back short of the limit holds every product starting with it, so longer
+// prefixes are answered by filtering those locally instead of querying again.
+
+export interface AutocompleteProduct {
+  id: string;
+  name: string;
+  description: string | null;
+  price: number | null;
+  category: string | null;
+  sku: string | null;
+}
+
+interface CacheEntry {
+  products: AutocompleteProduct[];
+  complete: boolean;
+}
+
+const AUTOCOMPLETE_LIMIT = 10;
+
+export function createProductAutocomplete(limit: number = AUTOCOMPLETE_LIMIT) {
+  const cache = new Map<string, Promise<CacheEntry>>();
+
+  const fetchPrefix = (prefix: string) => {
+    let entry = cache.get(prefix);
+    if (!entry) {
+      entry = (async () => {
+        const { data, error } = await supabase.rpc('search_products', {
+          p_query: prefix,
+          p_limit: limit,
+          p_prefix: true,
+        });
+        if (error) throw error;
+        const products = (data || []) as AutocompleteProduct[];
+        return { products, complete: products.length < limit };
+      })();
+      // Failed lookups are retried on the next keystroke
+      entry.catch(() => cache.delete(prefix));
+      cache.set(prefix, entry);
+    }
+    return entry;
+  };
+
+  return async (query: string): Promise<AutocompleteProduct[]> => {
+    const prefix = query.trim().toLowerCase();
+    if (!prefix) return [];
+
+    // Longest cached complete prefix of this one, if any
+    for (let length = prefix.length - 1; length > 0; length--) {
+      const cached = cache.get(prefix.slice(0, length));
+      if (!cached) continue;
+      const entry = await cached.catch(() => null);
+      if (entry?.complete) {
+        return entry.products.filter(product => product.name.toLowerCase().startsWith(prefix));
+      }
+    }
+
+    return (await fetchPrefix(prefix)).products;
+  };
+}
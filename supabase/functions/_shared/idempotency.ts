@@ -0,0 +1,156 @@
+// Idempotent webhook handling: a bounded in-memory TTL cache in front of the
+// durable webhook_idempotency_keys table.
+import { SupabaseClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+
+export interface StoredResponse {
+  status: number;
+  body: string;
+}
+
+export type IdempotencyClaim =
+  | { kind: 'claimed' }
+  | { kind: 'replay'; response: StoredResponse }
+  | { kind: 'in_progress' };
+
+const CACHE_MAX_ENTRIES = 500;
+const CACHE_TTL_MS = 60_000;
+// Explicit Idempotency-Key headers are honoured for a day. Payload hashes only catch
+// retries: an identical payload sent again later (a resubscribe after an unsubscribe)
+// is a new event and must be processed.
+const HEADER_KEY_TTL_SECONDS = 24 * 60 * 60;
+const PAYLOAD_HASH_TTL_SECONDS = 5 * 60;
+// A 'processing' claim older than this is assumed to belong to a crashed invocation
+const STALE_CLAIM_SECONDS = 60;
+// Fraction of completed requests that also prune expired keys from the durable table
+const PRUNE_PROBABILITY = 0.01;
+
+const recentResults = new Map<string, { expiresAt: number; response: StoredResponse }>();
+
+function cacheGet(key: string): StoredResponse | null {
+  const entry = recentResults.get(key);
+  if (!entry) return null;
+  if (entry.expiresAt <= Date.now()) {
+    recentResults.delete(key);
+    return null;
+  }
+  return entry.response;
+}
+
+function cacheSet(key: string, response: StoredResponse) {
+  recentResults.delete(key);
+  recentResults.set(key, { expiresAt: Date.now() + CACHE_TTL_MS, response });
+  // Map keeps insertion order, so the first key is the oldest
+  while (recentResults.size > CACHE_MAX_ENTRIES) {
+    const oldest = recentResults.keys().next().value;
+    if (oldest === undefined) break;
+    recentResults.delete(oldest);
+  }
+}
+
+// Prefer the caller's Idempotency-Key header, otherwise hash the raw payload. The scope
+// must include the tenant, so one tenant's key never replays another tenant's response.
+export async function idempotencyKeyFor(scope: string, req: Request, rawBody: string): Promise<string> {
+  const header = req.headers.get('idempotency-key')?.trim();
+  if (header) return `${scope}:key:${header}`;
+
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(rawBody));
+  const hex = Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+  return `${scope}:sha256:${hex}`;
+}
+
+function ttlSecondsFor(key: string): number {
+  return key.includes(':sha256:') ? PAYLOAD_HASH_TTL_SECONDS : HEADER_KEY_TTL_SECONDS;
+}
+
+export async function claimIdempotencyKey(
+  supabase: SupabaseClient,
+  key: string,
+  attempt = 0
+): Promise<IdempotencyClaim> {
+  const cached = cacheGet(key);
+  if (cached) return { kind: 'replay', response: cached };
+
+  const { data: inserted, error: insertError } = await supabase
+    .from('webhook_idempotency_keys')
+    .upsert({
+      idempotency_key: key,
+      status: 'processing',
+      expires_at: new Date(Date.now() + ttlSecondsFor(key) * 1000).toISOString(),
+    }, { onConflict: 'idempotency_key', ignoreDuplicates: true })
+    .select('idempotency_key');
+
+  if (insertError) {
+    // Dedupe is best-effort: never block ingestion because the dedupe table is unavailable
+    console.error('Idempotency claim failed, processing without dedupe:', insertError);
+    return { kind: 'claimed' };
+  }
+  if (inserted && inserted.length > 0) return { kind: 'claimed' };
+
+  const { data: existing } = await supabase
+    .from('webhook_idempotency_keys')
+    .select('status, response_status, response_body, created_at, expires_at')
+    .eq('idempotency_key', key)
+    .maybeSingle();
+
+  // Row vanished (or was reclaimed) between insert and read: retry once, then process anyway
+  if (!existing) return attempt < 1 ? claimIdempotencyKey(supabase, key, attempt + 1) : { kind: 'claimed' };
+
+  const expired = new Date(existing.expires_at).getTime() <= Date.now();
+  const stale = existing.status === 'processing'
+    && Date.now() - new Date(existing.created_at).getTime() > STALE_CLAIM_SECONDS * 1000;
+
+  if (expired || stale) {
+    await supabase.from('webhook_idempotency_keys').delete().eq('idempotency_key', key);
+    return attempt < 1 ? claimIdempotencyKey(supabase, key, attempt + 1) : { kind: 'claimed' };
+  }
+
+  if (existing.status === 'completed') {
+    const response = { status: existing.response_status, body: JSON.stringify(existing.response_body) };
+    cacheSet(key, response);
+    return { kind: 'replay', response };
+  }
+
+  return { kind: 'in_progress' };
+}
+
+// Give up a claimed key without storing an outcome, so the next delivery is processed
+export async function releaseIdempotencyKey(supabase: SupabaseClient, key: string) {
+  await supabase.from('webhook_idempotency_keys').delete().eq('idempotency_key', key);
+}
+
+// Store the outcome of a claimed key. Server errors release the claim so the
+// sender's retry is processed again instead of replaying the failure.
+export async function completeIdempotencyKey(supabase: SupabaseClient, key: string, response: StoredResponse) {
+  if (response.status >= 500) {
+    await releaseIdempotencyKey(supabase, key);
+    return;
+  }
+
+  cacheSet(key, response);
+
+  let body: unknown = null;
+  try {
+    body = JSON.parse(response.body);
+  } catch {
+    body = { raw: response.body };
+  }
+
+  const { error } = await supabase
+    .from('webhook_idempotency_keys')
+    .update({
+      status: 'completed',
+      response_status: response.status,
+      response_body: body,
+      completed_at: new Date().toISOString(),
+    })
+    .eq('idempotency_key', key);
+
+  if (error) {
+    console.error('Failed to store idempotent response:', error);
+  }
+
+  if (Math.random() < PRUNE_PROBABILITY) {
+    const { error: pruneError } = await supabase.rpc('prune_webhook_idempotency_keys');
+    if (pruneError) console.error('Failed to prune idempotency keys:', pruneError);
+  }
+}
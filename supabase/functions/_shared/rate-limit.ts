@@ -0,0 +1,136 @@
+// Per-tenant token bucket rate limiting for ingestion endpoints.
+// Each isolate leases a few tokens at a time from the shared ingest_rate_limits
+// table and spends them from memory; when the shared bucket is empty the tenant
+// is throttled locally until the refill time, without further database calls.
+import { SupabaseClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+
+export interface RateLimitConfig {
+  // Burst size per tenant
+  capacity: number;
+  // Sustained requests per second per tenant
+  refillPerSecond: number;
+  // Tokens leased from the shared bucket per round trip
+  leaseSize: number;
+}
+
+export type RateLimitDecision =
+  | { allowed: true }
+  | { allowed: false; retryAfterSeconds: number };
+
+interface LocalBucket {
+  tokens: number;
+  blockedUntil: number;
+  admitted: number;
+  throttled: number;
+  lastFlush: number;
+}
+
+// Counters are flushed to ingest_rate_limit_metrics at least this often
+const METRICS_FLUSH_MS = 30_000;
+const LOCAL_BUCKETS_MAX = 1000;
+// Fraction of shared-store calls that also prune old metric windows
+const PRUNE_PROBABILITY = 0.01;
+
+const localBuckets = new Map<string, LocalBucket>();
+
+export function rateLimitConfigFromEnv(prefix: string, defaults: RateLimitConfig): RateLimitConfig {
+  const read = (name: string, fallback: number) => {
+    const value = Number(Deno.env.get(`${prefix}_${name}`));
+    return Number.isFinite(value) && value > 0 ? value : fallback;
+  };
+  return {
+    capacity: read('RATE_CAPACITY', defaults.capacity),
+    refillPerSecond: read('RATE_PER_SECOND', defaults.refillPerSecond),
+    leaseSize: Math.max(1, Math.floor(read('RATE_LEASE_SIZE', defaults.leaseSize))),
+  };
+}
+
+function localBucket(key: string): LocalBucket {
+  let bucket = localBuckets.get(key);
+  if (!bucket) {
+    if (localBuckets.size >= LOCAL_BUCKETS_MAX) {
+      // Drop the oldest tenant; its unflushed counters are lost, its tokens return to the shared bucket on refill
+      const oldest = localBuckets.keys().next().value;
+      if (oldest !== undefined) localBuckets.delete(oldest);
+    }
+    bucket = { tokens: 0, blockedUntil: 0, admitted: 0, throttled: 0, lastFlush: Date.now() };
+    localBuckets.set(key, bucket);
+  }
+  return bucket;
+}
+
+async function acquireShared(
+  supabase: SupabaseClient,
+  key: string,
+  bucket: LocalBucket,
+  requested: number,
+  config: RateLimitConfig
+): Promise<{ granted: number; retryAfterSeconds: number } | null> {
+  const admitted = bucket.admitted;
+  const throttled = bucket.throttled;
+
+  const { data, error } = await supabase.rpc('acquire_ingest_tokens', {
+    p_bucket_key: key,
+    p_requested: requested,
+    p_capacity: config.capacity,
+    p_refill_per_second: config.refillPerSecond,
+    p_admitted: admitted,
+    p_throttled: throttled,
+  });
+
+  if (error) {
+    console.error('Rate limit store unavailable:', error);
+    return null;
+  }
+
+  bucket.admitted -= admitted;
+  bucket.throttled -= throttled;
+  bucket.lastFlush = Date.now();
+
+  if (Math.random() < PRUNE_PROBABILITY) {
+    const { error: pruneError } = await supabase.rpc('prune_ingest_rate_limit_metrics');
+    if (pruneError) console.error('Failed to prune rate limit metrics:', pruneError);
+  }
+
+  const row = Array.isArray(data) ? data[0] : data;
+  return { granted: row?.granted ?? 0, retryAfterSeconds: row?.retry_after_seconds ?? 0 };
+}
+
+// Take one token for `key` (e.g. "sync-contacts:<user_id>")
+export async function takeToken(
+  supabase: SupabaseClient,
+  key: string,
+  config: RateLimitConfig
+): Promise<RateLimitDecision> {
+  const bucket = localBucket(key);
+  const now = Date.now();
+
+  if (bucket.tokens < 1 && now < bucket.blockedUntil) {
+    bucket.throttled++;
+    if (now - bucket.lastFlush > METRICS_FLUSH_MS) {
+      await acquireShared(supabase, key, bucket, 0, config);
+    }
+    return { allowed: false, retryAfterSeconds: Math.ceil((bucket.blockedUntil - now) / 1000) };
+  }
+
+  if (bucket.tokens < 1) {
+    const lease = await acquireShared(supabase, key, bucket, config.leaseSize, config);
+    if (!lease) {
+      // Fail open: a broken limiter must not stop ingestion
+      bucket.admitted++;
+      return { allowed: true };
+    }
+    bucket.tokens += lease.granted;
+    if (lease.granted === 0) {
+      bucket.blockedUntil = Date.now() + Math.max(1, lease.retryAfterSeconds) * 1000;
+      bucket.throttled++;
+      return { allowed: false, retryAfterSeconds: Math.max(1, Math.ceil(lease.retryAfterSeconds)) };
+    }
+  } else if (now - bucket.lastFlush > METRICS_FLUSH_MS) {
+    await acquireShared(supabase, key, bucket, 0, config);
+  }
+
+  bucket.tokens--;
+  bucket.admitted++;
+  return { allowed: true };
+}
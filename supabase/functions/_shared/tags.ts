@@ -0,0 +1,79 @@
+// Shared tag normalization for the contact pipeline.
+// Tags compare case-insensitively after trimming; the first spelling seen is kept for display.
+
+// Comma, semicolon and newline separated lists, compiled once per isolate
+const TAG_SEPARATOR = /[,;\n]/;
+
+const CANONICAL_CACHE_MAX = 10_000;
+const canonicalCache = new Map<string, string>();
+
+// Canonical (comparison) form of a tag, memoized because the same few hundred
+// tag spellings are seen on almost every request
+export function canonicalTag(tag: string): string {
+  let canonical = canonicalCache.get(tag);
+  if (canonical === undefined) {
+    canonical = tag.trim().toLowerCase();
+    if (canonicalCache.size >= CANONICAL_CACHE_MAX) canonicalCache.clear();
+    canonicalCache.set(tag, canonical);
+  }
+  return canonical;
+}
+
+export function splitTags(input: string): string[] {
+  const parts: string[] = [];
+  for (const part of input.split(TAG_SEPARATOR)) {
+    const trimmed = part.trim();
+    if (trimmed) parts.push(trimmed);
+  }
+  return parts;
+}
+
+// Merge tag lists in one pass, dropping blanks and case-insensitive duplicates.
+// Earlier lists win, so existing spellings are preserved over incoming ones.
+export function mergeTags(...lists: Iterable<unknown>[]): string[] {
+  const seen = new Set<string>();
+  const merged: string[] = [];
+  for (const list of lists) {
+    for (const tag of list) {
+      if (typeof tag !== 'string') continue;
+      const trimmed = tag.trim();
+      if (!trimmed) continue;
+      const canonical = canonicalTag(trimmed);
+      if (seen.has(canonical)) continue;
+      seen.add(canonical);
+      merged.push(trimmed);
+    }
+  }
+  return merged;
+}
+
+// Accepts an array of strings (each may itself be a separated list) or a single string
+export function parseTags(input: unknown): string[] {
+  if (!input) return [];
+  if (typeof input === 'string') return mergeTags(splitTags(input));
+  if (Array.isArray(input)) {
+    return mergeTags(input.flatMap((t) => (typeof t === 'string' ? splitTags(t) : [])));
+  }
+  return [];
+}
+
+export function canonicalTagSet(tags: Iterable<unknown>): Set<string> {
+  const set = new Set<string>();
+  for (const tag of tags) {
+    if (typeof tag === 'string' && tag.trim()) set.add(canonicalTag(tag));
+  }
+  return set;
+}
+
+export function hasTag(tags: Iterable<unknown>, tag: string): boolean {
+  const target = canonicalTag(tag);
+  for (const t of tags) {
+    if (typeof t === 'string' && canonicalTag(t) === target) return true;
+  }
+  return false;
+}
+
+export function withoutTag(tags: string[], tag: string): string[] {
+  const target = canonicalTag(tag);
+  return tags.filter((t) => canonicalTag(t) !== target);
+}
@@ -7,6 +7,10 @@ const corsHeaders = {
   'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
 }
 
+const CLAIM_BATCH_SIZE = 50
+// Longer than a batch takes; actions of a run that dies are claimed again once it expires
+const CLAIM_LEASE_SECONDS = 300
+
 serve(async (req) => {
   // Handle CORS preflight
   if (req.method === 'OPTIONS') {
@@ -19,15 +23,18 @@ serve(async (req) => {
     const supabaseServiceKey = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!
     const supabase = createClient(supabaseUrl, supabaseServiceKey)
 
-    // Get all pending actions that are due
-    const now = new Date().toISOString()
-    const { data: actions, error: actionsError } = await supabase
-      .from('automation_actions')
-      .select('*')
-      .eq('status', 'pending')
-      .lte('execute_at', now)
-      .order('execute_at', { ascending: true })
-      .limit(50) // Process in batches
+    // Finish tag rule reapply jobs left pending by rule edits outside the Tag Rules screen
+    await drainTagRuleReapplyJobs(supabase)
+    await flushTagRuleAudit(supabase)
+    await applyDeferredUnsubscribedTagRules(supabase)
+    await pruneSegmentCountCache(supabase)
+
+    // Claim a batch of due actions; they come back already marked as executing, and
+    // concurrent runs (or the automation-engine worker) get disjoint batches
+    const { data: actions, error: actionsError } = await supabase.rpc('claim_due_actions', {
+      p_batch_size: CLAIM_BATCH_SIZE,
+      p_lease_seconds: CLAIM_LEASE_SECONDS,
+    })
 
     if (actionsError) throw actionsError
 
@@ -44,12 +51,6 @@ serve(async (req) => {
     // Process each action
     for (const action of actions) {
       try {
-        // Mark as executing
-        await supabase
-          .from('automation_actions')
-          .update({ status: 'executing' })
-          .eq('id', action.id)
-
         // Get automation rule
         const { data: rule, error: ruleError } = await supabase
           .from('automation_rules')
@@ -58,14 +59,11 @@ serve(async (req) => {
           .single()
 
         if (ruleError || !rule || !rule.enabled) {
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'skipped',
-              executed_at: new Date().toISOString(),
-              error_message: 'Rule not found or disabled'
-            })
-            .eq('id', action.id)
+          await finishAction(supabase, action, {
+            status: 'skipped',
+            executed_at: new Date().toISOString(),
+            error_message: 'Rule not found or disabled'
+          })
           continue
         }
 
@@ -77,14 +75,11 @@ serve(async (req) => {
           .single()
 
         if (contactError || !contact || contact.status !== 'subscribed') {
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'skipped',
-              executed_at: new Date().toISOString(),
-              error_message: 'Contact not found or unsubscribed'
-            })
-            .eq('id', action.id)
+          await finishAction(supabase, action, {
+            status: 'skipped',
+            executed_at: new Date().toISOString(),
+            error_message: 'Contact not found or unsubscribed'
+          })
           continue
         }
 
@@ -94,14 +89,11 @@ serve(async (req) => {
           : (rule.action_config ? [{ type: 'send_email', ...rule.action_config }] : [])
 
         if (steps.length === 0) {
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'failed',
-              executed_at: new Date().toISOString(),
-              error_message: 'No steps configured'
-            })
-            .eq('id', action.id)
+          await finishAction(supabase, action, {
+            status: 'failed',
+            executed_at: new Date().toISOString(),
+            error_message: 'No steps configured'
+          })
           failed++
           continue
         }
@@ -112,13 +104,10 @@ serve(async (req) => {
 
         if (!currentStep) {
           // All steps completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id)
+          await finishAction(supabase, action, {
+            status: 'completed',
+            executed_at: new Date().toISOString()
+          })
           processed++
           continue
         }
@@ -145,14 +134,11 @@ serve(async (req) => {
           }
           
           if (shouldSkip) {
-            await supabase
-              .from('automation_actions')
-              .update({
-                status: 'skipped',
-                executed_at: new Date().toISOString(),
-                error_message: 'Tag check condition not met'
-              })
-              .eq('id', action.id)
+            await finishAction(supabase, action, {
+              status: 'skipped',
+              executed_at: new Date().toISOString(),
+              error_message: 'Tag check condition not met'
+            })
             
             await supabase
               .from('automation_logs')
@@ -267,13 +253,10 @@ serve(async (req) => {
 
           stepSuccess = webhookResponse.ok
         } else if (currentStep.type === 'stop') {
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id)
+          await finishAction(supabase, action, {
+            status: 'completed',
+            executed_at: new Date().toISOString()
+          })
           
           await supabase
             .from('automation_logs')
@@ -293,6 +276,17 @@ serve(async (req) => {
           throw new Error(`Failed to execute step: ${currentStep.type}`)
         }
 
+        // Complete the action before scheduling the next step: if the lease ran out and
+        // another executor re-claimed it, that executor schedules it instead
+        const stillHeld = await finishAction(supabase, action, {
+          status: 'completed',
+          executed_at: new Date().toISOString()
+        })
+        if (!stillHeld) {
+          console.warn(`Action ${action.id} was re-claimed by another executor; leaving its next step to it`)
+          continue
+        }
+
         // Check if there's a next step
         const nextStepIndex = stepIndex + 1
         const nextStep = steps[nextStepIndex]
@@ -344,34 +338,15 @@ serve(async (req) => {
               execute_at: executeAt.toISOString(),
               step_index: nextStepIndex,
             })
-
-          // Mark current action as completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id)
-        } else {
-          // All steps completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id)
         }
 
-        // Update rule statistics
-        await supabase
-          .from('automation_rules')
-          .update({
-            success_count: (rule.success_count || 0) + 1,
-            last_triggered_at: new Date().toISOString()
-          })
-          .eq('id', rule.id)
+        // Update rule statistics; applied as deltas so concurrent executors don't lose counts
+        const { error: statsError } = await supabase.rpc('apply_automation_rule_stat_deltas', {
+          p_deltas: [{ rule_id: rule.id, succeeded: 1, last_triggered_at: new Date().toISOString() }],
+        })
+        if (statsError) {
+          console.error(`Error updating statistics of rule ${rule.id}:`, statsError)
+        }
 
         // Log success
         await supabase
@@ -389,14 +364,19 @@ serve(async (req) => {
       } catch (error: any) {
         console.error(`Error processing action ${action.id}:`, error)
         
-        await supabase
-          .from('automation_actions')
-          .update({
-            status: 'failed',
-            executed_at: new Date().toISOString(),
-            error_message: error.message
+        const stillHeld = await finishAction(supabase, action, {
+          status: 'failed',
+          executed_at: new Date().toISOString(),
+          error_message: error.message
+        })
+        if (stillHeld) {
+          const { error: statsError } = await supabase.rpc('apply_automation_rule_stat_deltas', {
+            p_deltas: [{ rule_id: action.automation_rule_id, failed: 1 }],
           })
-          .eq('id', action.id)
+          if (statsError) {
+            console.error(`Error updating statistics of rule ${action.automation_rule_id}:`, statsError)
+          }
+        }
 
         await supabase
           .from('automation_logs')
@@ -434,3 +414,119 @@ serve(async (req) => {
   }
 })
 
+
+// Record the outcome of a claimed action and release its lease. The write only lands
+// while this run still holds the claim, so a run that outlived its lease cannot overwrite
+// an action another executor has re-claimed. Returns whether the claim was still held.
+async function finishAction(supabase: any, action: any, fields: Record<string, unknown>) {
+  const { data, error } = await supabase
+    .from('automation_actions')
+    .update({ ...fields, lease_expires_at: null, claim_token: null })
+    .eq('id', action.id)
+    .eq('claim_token', action.claim_token)
+    .eq('status', 'executing')
+    .select('id')
+
+  if (error) {
+    console.error(`Error recording outcome of action ${action.id}:`, error)
+    return false
+  }
+  return data.length > 0
+}
+
+// Bounded so a large reapply can't starve the automation actions below
+const REAPPLY_MAX_CHUNKS_PER_RUN = 20
+const REAPPLY_CHUNK_SIZE = 500
+
+async function drainTagRuleReapplyJobs(supabase: any) {
+  const { data: jobs, error } = await supabase
+    .from('tag_rule_reapply_jobs')
+    .select('id')
+    .eq('status', 'pending')
+    .order('created_at', { ascending: true })
+    .limit(5)
+
+  if (error) {
+    console.error('Error loading tag rule reapply jobs:', error)
+    return
+  }
+
+  let chunks = 0
+  for (const { id } of jobs || []) {
+    while (chunks < REAPPLY_MAX_CHUNKS_PER_RUN) {
+      chunks++
+      const { data: job, error: runError } = await supabase.rpc('run_tag_rule_reapply_job', {
+        p_job_id: id,
+        p_chunk_size: REAPPLY_CHUNK_SIZE,
+      })
+      if (runError) {
+        console.error(`Error running tag rule reapply job ${id}:`, runError)
+        break
+      }
+      if (job.status === 'completed') {
+        const lookups = job.cache_hits + job.cache_misses
+        const hitRate = lookups > 0 ? `${Math.round((job.cache_hits / lookups) * 100)}%` : 'n/a'
+        console.log(`Tag rule reapply job ${id} completed: ${job.processed} processed, ${job.updated} updated, cache hit rate ${hitRate}`)
+        break
+      }
+    }
+  }
+}
+
+const AUDIT_FLUSH_BATCH_SIZE = 5000
+const AUDIT_MAX_FLUSHES_PER_RUN = 10
+
+// Move buffered tag rule firings into tag_rule_executions, prune old audit rows, expire
+// old tag rule eval cache entries and drop dictionary tags nothing uses any more
+async function flushTagRuleAudit(supabase: any) {
+  for (let i = 0; i < AUDIT_MAX_FLUSHES_PER_RUN; i++) {
+    const { data: moved, error } = await supabase.rpc('flush_tag_rule_execution_buffer', {
+      p_batch_size: AUDIT_FLUSH_BATCH_SIZE,
+    })
+    if (error) {
+      console.error('Error flushing tag rule execution buffer:', error)
+      break
+    }
+    if (moved < AUDIT_FLUSH_BATCH_SIZE) break
+  }
+
+  const { error: pruneError } = await supabase.rpc('prune_tag_rule_executions')
+  if (pruneError) {
+    console.error('Error pruning tag rule executions:', pruneError)
+  }
+
+  const { error: cachePruneError } = await supabase.rpc('prune_tag_rule_eval_cache')
+  if (cachePruneError) {
+    console.error('Error pruning tag rule eval cache:', cachePruneError)
+  }
+
+  const { error: dictionaryPruneError } = await supabase.rpc('prune_tag_dictionary')
+  if (dictionaryPruneError) {
+    console.error('Error pruning tag dictionary:', dictionaryPruneError)
+  }
+}
+
+const DEFERRED_UNSUBSCRIBED_BATCH_SIZE = 1000
+const DEFERRED_UNSUBSCRIBED_MAX_BATCHES_PER_RUN = 10
+
+// Evaluate tag rules on unsubscribed contacts written since the last run
+async function applyDeferredUnsubscribedTagRules(supabase: any) {
+  for (let i = 0; i < DEFERRED_UNSUBSCRIBED_MAX_BATCHES_PER_RUN; i++) {
+    const { data: evaluated, error } = await supabase.rpc('apply_deferred_unsubscribed_tag_rules', {
+      p_batch_size: DEFERRED_UNSUBSCRIBED_BATCH_SIZE,
+    })
+    if (error) {
+      console.error('Error applying tag rules to unsubscribed contacts:', error)
+      break
+    }
+    if (evaluated < DEFERRED_UNSUBSCRIBED_BATCH_SIZE) break
+  }
+}
+
+// Drop expired segment count entries and old data change rows
+async function pruneSegmentCountCache(supabase: any) {
+  const { error } = await supabase.rpc('prune_segment_count_cache')
+  if (error) {
+    console.error('Error pruning segment count cache:', error)
+  }
+}
@@ -0,0 +1,77 @@
+import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
+import { createClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+
+// Ranked top-K search over the caller's contacts and products.
+//   POST /search/contacts  { q, limit? }
+//   POST /search/products  { q, limit?, prefix?: boolean }
+// Matching and ranking live in public.search_contacts / public.search_products (pg_trgm
+// indexes); this function validates the request and calls them with the caller's JWT.
+
+const corsHeaders = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+};
+
+const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
+const supabaseAnonKey = Deno.env.get('SUPABASE_ANON_KEY')!;
+
+const DEFAULT_LIMIT = 20;
+const MAX_LIMIT = 100;
+const MAX_QUERY_LENGTH = 200;
+
+function json(body: unknown, status = 200) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+  });
+}
+
+serve(async (req) => {
+  // Handle CORS preflight requests
+  if (req.method === 'OPTIONS') {
+    return new Response(null, { headers: corsHeaders });
+  }
+
+  const path = new URL(req.url).pathname.replace(/\/+$/, '');
+  const target = path.endsWith('/search/contacts') ? 'contacts'
+    : path.endsWith('/search/products') ? 'products'
+    : null;
+  if (!target) {
+    return json({ error: 'Not found' }, 404);
+  }
+  if (req.method !== 'POST') {
+    return json({ error: 'Method not allowed' }, 405);
+  }
+
+  const authorization = req.headers.get('Authorization');
+  if (!authorization) {
+    return json({ error: 'Missing Authorization header' }, 401);
+  }
+
+  try {
+    const body = await req.json().catch(() => ({}));
+    const q = typeof body.q === 'string' ? body.q.trim() : '';
+    const limit = Math.min(Math.max(Number(body.limit) || DEFAULT_LIMIT, 1), MAX_LIMIT);
+
+    if (!q) {
+      return json({ error: 'q is required' }, 400);
+    }
+    if (q.length > MAX_QUERY_LENGTH) {
+      return json({ error: `q must be at most ${MAX_QUERY_LENGTH} characters` }, 400);
+    }
+
+    const supabase = createClient(supabaseUrl, supabaseAnonKey, {
+      global: { headers: { Authorization: authorization } },
+    });
+
+    const { data, error } = target === 'contacts'
+      ? await supabase.rpc('search_contacts', { p_query: q, p_limit: limit })
+      : await supabase.rpc('search_products', { p_query: q, p_limit: limit, p_prefix: body.prefix === true });
+    if (error) throw error;
+
+    return json({ results: data ?? [] });
+  } catch (error) {
+    console.error('Error in search function:', error);
+    return json({ error: error.message }, 500);
+  }
+});
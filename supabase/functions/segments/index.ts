@@ -0,0 +1,80 @@
+import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
+import { createClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+
+// Audience sizing for the list manager, campaign composer and send dialog.
+//   POST /segments/count  { list_ids?, rule_config?, mode?: 'auto'|'exact'|'estimate', preview?: number }
+// Counting, estimation, previews and caching live in public.segment_count; this function
+// validates the request and calls it with the caller's JWT, so only their lists count.
+
+const corsHeaders = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+};
+
+const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
+const supabaseAnonKey = Deno.env.get('SUPABASE_ANON_KEY')!;
+
+const MAX_PREVIEW = 100;
+const MODES = ['auto', 'exact', 'estimate'];
+
+function json(body: unknown, status = 200) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+  });
+}
+
+serve(async (req) => {
+  // Handle CORS preflight requests
+  if (req.method === 'OPTIONS') {
+    return new Response(null, { headers: corsHeaders });
+  }
+
+  const path = new URL(req.url).pathname.replace(/\/+$/, '');
+  if (!path.endsWith('/segments/count')) {
+    return json({ error: 'Not found' }, 404);
+  }
+  if (req.method !== 'POST') {
+    return json({ error: 'Method not allowed' }, 405);
+  }
+
+  const authorization = req.headers.get('Authorization');
+  if (!authorization) {
+    return json({ error: 'Missing Authorization header' }, 401);
+  }
+
+  try {
+    const body = await req.json().catch(() => ({}));
+    const listIds = body.list_ids ?? null;
+    const ruleConfig = body.rule_config ?? null;
+    const mode = body.mode ?? 'auto';
+    const preview = Math.min(Math.max(Number(body.preview) || 0, 0), MAX_PREVIEW);
+
+    if (listIds !== null && (!Array.isArray(listIds) || listIds.some((id: unknown) => typeof id !== 'string'))) {
+      return json({ error: 'list_ids must be an array of list ids' }, 400);
+    }
+    if (listIds === null && ruleConfig === null) {
+      return json({ error: 'Pass list_ids, rule_config or both' }, 400);
+    }
+    if (!MODES.includes(mode)) {
+      return json({ error: `mode must be one of ${MODES.join(', ')}` }, 400);
+    }
+
+    const supabase = createClient(supabaseUrl, supabaseAnonKey, {
+      global: { headers: { Authorization: authorization } },
+    });
+
+    const { data, error } = await supabase.rpc('segment_count', {
+      p_list_ids: listIds,
+      p_rule_config: ruleConfig,
+      p_mode: mode,
+      p_preview_limit: preview,
+    });
+    if (error) throw error;
+
+    return json(data);
+  } catch (error) {
+    console.error('Error in segments function:', error);
+    return json({ error: error.message }, 500);
+  }
+});
@@ -46,31 +46,12 @@ async function getCampaign(supabase: SupabaseClient, id: string) {
 async function getContactsForLists(supabase: SupabaseClient, listIds: string[] | null): Promise<Contact[]> {
   if (!listIds || listIds.length === 0) return [];
   
-  const { data: contactLists, error } = await supabase
-    .from('contact_lists')
-    .select(`
-      contact_id,
-      contacts!inner (
-        id,
-        email,
-        first_name,
-        last_name,
-        status
-      )
-    `)
-    .in('list_id', listIds);
+  // Distinct subscribed contacts of static and dynamic lists, resolved in the database
+  const { data, error } = await supabase.rpc('resolve_list_recipients', { p_list_ids: listIds });
 
   if (error) throw error;
 
-  // Filter for subscribed contacts only and flatten the structure
-  const contacts: Contact[] = contactLists
-    ?.filter(cl => (cl.contacts as any).status === 'subscribed')
-    .map(cl => ({
-      id: (cl.contacts as any).id,
-      email: (cl.contacts as any).email,
-      first_name: (cl.contacts as any).first_name,
-      last_name: (cl.contacts as any).last_name,
-    })) || [];
+  const contacts: Contact[] = data || [];
 
   return contacts;
 }
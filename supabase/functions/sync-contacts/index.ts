@@ -1,349 +1,363 @@
 import "https://deno.land/x/xhr@0.1.0/mod.ts";
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
-import { createClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+import { createClient, SupabaseClient } from 'https://esm.sh/@supabase/supabase-js@2.52.1'
+import { claimIdempotencyKey, completeIdempotencyKey, idempotencyKeyFor, releaseIdempotencyKey } from '../_shared/idempotency.ts';
+import { rateLimitConfigFromEnv, takeToken } from '../_shared/rate-limit.ts';
+import { hasTag, mergeTags, parseTags, withoutTag } from '../_shared/tags.ts';
 
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
-  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type, idempotency-key',
 };
 
 const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
 const supabaseServiceKey = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
 
+const DEFAULT_USER_ID = '3e01343e-9ad5-452e-95ac-d16c58c6cae2';
+
+// Per-tenant write budget, overridable with SYNC_CONTACTS_RATE_CAPACITY / _RATE_PER_SECOND / _RATE_LEASE_SIZE
+const rateLimitConfig = rateLimitConfigFromEnv('SYNC_CONTACTS', {
+  capacity: 120,
+  refillPerSecond: 10,
+  leaseSize: 5,
+});
+
+function tenantOf(payload: any): string {
+  if (payload?.user_id) return String(payload.user_id);
+  if (Array.isArray(payload?.unsubscribes) && payload.unsubscribes[0]?.user_id) {
+    return String(payload.unsubscribes[0].user_id);
+  }
+  return DEFAULT_USER_ID;
+}
+
 serve(async (req) => {
   // Handle CORS preflight requests
   if (req.method === 'OPTIONS') {
     return new Response(null, { headers: corsHeaders });
   }
 
+  const supabase = createClient(supabaseUrl, supabaseServiceKey);
+  let idempotencyKey: string | null = null;
+
   try {
-    const supabase = createClient(supabaseUrl, supabaseServiceKey);
-    const payload = await req.json();
-
-    console.log('Received webhook payload:', payload);
-
-    // Handle unsubscribes format
-    if (payload.unsubscribes && Array.isArray(payload.unsubscribes)) {
-      console.log('Processing unsubscribes...');
-      
-      const results = [];
-      for (const unsubscribe of payload.unsubscribes) {
-        try {
-          const { user_id, reason = 'No longer interested', email: unsubEmail, contact_id } = unsubscribe;
-
-          // Resolve target email to unsubscribe
-          let emailToUnsub: string | null = (typeof unsubEmail === 'string' && unsubEmail.trim()) ? unsubEmail.trim().toLowerCase() : null;
-          const identifier = contact_id ?? user_id; // caller sometimes passes contact_id in user_id
-
-          if (!emailToUnsub && identifier) {
-            const idStr = String(identifier).trim();
-
-            if (idStr.includes('@')) {
-              // Identifier is actually an email
-              emailToUnsub = idStr.toLowerCase();
+    const rawBody = await req.text();
+    const payload = JSON.parse(rawBody);
+
+    // Make.com retries and duplicate checkout events deliver the same payload repeatedly;
+    // replay the stored outcome instead of touching the contacts table again
+    idempotencyKey = await idempotencyKeyFor(`sync-contacts:${tenantOf(payload)}`, req, rawBody);
+    const claim = await claimIdempotencyKey(supabase, idempotencyKey);
+
+    if (claim.kind === 'replay') {
+      console.log(`Replaying stored response for ${idempotencyKey}`);
+      return new Response(claim.response.body, {
+        status: claim.response.status,
+        headers: { ...corsHeaders, 'Content-Type': 'application/json', 'Idempotent-Replayed': 'true' },
+      });
+    }
+
+    if (claim.kind === 'in_progress') {
+      return new Response(JSON.stringify({ error: 'An identical request is already being processed' }), {
+        status: 409,
+        headers: { ...corsHeaders, 'Content-Type': 'application/json', 'Retry-After': '5' },
+      });
+    }
+
+    // Throttle runaway integrations before they reach the contacts table. Replays above
+    // cost no tokens; a throttled delivery gives its key back so the retry is processed.
+    const decision = await takeToken(supabase, `sync-contacts:${tenantOf(payload)}`, rateLimitConfig);
+    if (!decision.allowed) {
+      await releaseIdempotencyKey(supabase, idempotencyKey);
+      idempotencyKey = null;
+      return new Response(JSON.stringify({ error: 'Rate limit exceeded', retry_after: decision.retryAfterSeconds }), {
+        status: 429,
+        headers: {
+          ...corsHeaders,
+          'Content-Type': 'application/json',
+          'Retry-After': String(decision.retryAfterSeconds),
+        },
+      });
+    }
+
+    const response = await processPayload(supabase, payload);
+    await completeIdempotencyKey(supabase, idempotencyKey, {
+      status: response.status,
+      body: await response.clone().text(),
+    });
+    return response;
+
+  } catch (error) {
+    console.error('Error in sync-contacts function:', error);
+    if (idempotencyKey) {
+      await completeIdempotencyKey(supabase, idempotencyKey, { status: 500, body: '' });
+    }
+    return new Response(JSON.stringify({ error: error.message }), {
+      status: 500,
+      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    });
+  }
+});
+
+async function processPayload(supabase: SupabaseClient, payload: any): Promise<Response> {
+  console.log('Received webhook payload:', payload);
+
+  // Handle unsubscribes format
+  if (payload.unsubscribes && Array.isArray(payload.unsubscribes)) {
+    console.log('Processing unsubscribes...');
+    
+    const results = [];
+    for (const unsubscribe of payload.unsubscribes) {
+      try {
+        const { user_id, reason = 'No longer interested', email: unsubEmail, contact_id } = unsubscribe;
+
+        // Resolve target email to unsubscribe
+        let emailToUnsub: string | null = (typeof unsubEmail === 'string' && unsubEmail.trim()) ? unsubEmail.trim().toLowerCase() : null;
+        const identifier = contact_id ?? user_id; // caller sometimes passes contact_id in user_id
+
+        if (!emailToUnsub && identifier) {
+          const idStr = String(identifier).trim();
+
+          if (idStr.includes('@')) {
+            // Identifier is actually an email
+            emailToUnsub = idStr.toLowerCase();
+          } else {
+            // 1) Try resolve from contacts by contact id
+            const { data: contactById } = await supabase
+              .from('contacts')
+              .select('email')
+              .eq('id', idStr)
+              .maybeSingle();
+
+            if (contactById?.email) {
+              emailToUnsub = contactById.email.toLowerCase();
             } else {
-              // 1) Try resolve from contacts by contact id
-              const { data: contactById } = await supabase
-                .from('contacts')
+              // 2) Try resolve from unsubscribed_contacts by original_contact_id
+              const { data: unsubByOrig } = await supabase
+                .from('unsubscribed_contacts')
                 .select('email')
-                .eq('id', idStr)
+                .eq('original_contact_id', idStr)
                 .maybeSingle();
 
-              if (contactById?.email) {
-                emailToUnsub = contactById.email.toLowerCase();
-              } else {
-                // 2) Try resolve from unsubscribed_contacts by original_contact_id
-                const { data: unsubByOrig } = await supabase
-                  .from('unsubscribed_contacts')
-                  .select('email')
-                  .eq('original_contact_id', idStr)
-                  .maybeSingle();
-
-                if (unsubByOrig?.email) {
-                  emailToUnsub = unsubByOrig.email.toLowerCase();
-                }
+              if (unsubByOrig?.email) {
+                emailToUnsub = unsubByOrig.email.toLowerCase();
               }
             }
           }
+        }
 
-          if (!emailToUnsub) {
-            console.error('No email resolved for unsubscribe entry:', unsubscribe);
-            results.push({ identifier: identifier ?? null, success: false, error: 'No contact email found from identifier' });
-            continue;
-          }
+        if (!emailToUnsub) {
+          console.error('No email resolved for unsubscribe entry:', unsubscribe);
+          results.push({ identifier: identifier ?? null, success: false, error: 'No contact email found from identifier' });
+          continue;
+        }
 
-          // Perform unsubscribe using DB function
-          const { error: handleError } = await supabase.rpc('handle_unsubscribe', {
-            p_email: emailToUnsub,
-            p_user_id: '550e8400-e29b-41d4-a716-446655440000',
-            p_reason: reason
-          });
+        // Perform unsubscribe using DB function
+        const { error: handleError } = await supabase.rpc('handle_unsubscribe', {
+          p_email: emailToUnsub,
+          p_user_id: '550e8400-e29b-41d4-a716-446655440000',
+          p_reason: reason
+        });
 
-          if (handleError) {
-            console.error('Error handling unsubscribe:', handleError);
-            results.push({ email: emailToUnsub, success: false, error: handleError.message });
-            continue;
-          }
+        if (handleError) {
+          console.error('Error handling unsubscribe:', handleError);
+          results.push({ email: emailToUnsub, success: false, error: handleError.message });
+          continue;
+        }
 
-          console.log(`Processed unsubscribe for email: ${emailToUnsub}`);
-          results.push({ email: emailToUnsub, success: true });
+        console.log(`Processed unsubscribe for email: ${emailToUnsub}`);
+        results.push({ email: emailToUnsub, success: true });
 
-        } catch (error) {
-          console.error('Exception processing unsubscribe:', error);
-          results.push({ success: false, error: (error as Error).message });
-        }
+      } catch (error) {
+        console.error('Exception processing unsubscribe:', error);
+        results.push({ success: false, error: (error as Error).message });
       }
-
-      return new Response(JSON.stringify({ 
-        success: true, 
-        results,
-        message: `Processed ${results.length} unsubscribe(s)`
-      }), {
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
     }
 
-    // Handle regular contact sync format
-    const { email, name, tags = [], action = 'create', user_id, status = 'subscribed', password, contact_id } = payload;
+    return new Response(JSON.stringify({ 
+      success: true, 
+      results,
+      message: `Processed ${results.length} unsubscribe(s)`
+    }), {
+      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    });
+  }
 
-    // Normalize inputs - treat empty strings as missing
-    const normalizedEmail = typeof email === 'string' && email.trim() ? email.trim() : undefined;
-    const normalizedContactId = contact_id ? String(contact_id).trim() : undefined;
+  // Handle regular contact sync format
+  const { email, name, tags = [], action = 'create', user_id, status = 'subscribed', password, contact_id } = payload;
 
-    console.log('DEBUG: Processing payload:', {
-      hasEmail: !!normalizedEmail,
-      hasContactId: !!normalizedContactId,
-      email: normalizedEmail || 'MISSING',
-      contact_id: normalizedContactId || 'MISSING'
-    });
+  // Normalize inputs - treat empty strings as missing
+  const normalizedEmail = typeof email === 'string' && email.trim() ? email.trim() : undefined;
+  const normalizedContactId = contact_id ? String(contact_id).trim() : undefined;
 
-    let finalEmail = normalizedEmail;
-    let finalUserId = user_id || '3e01343e-9ad5-452e-95ac-d16c58c6cae2';
+  console.log('DEBUG: Processing payload:', {
+    hasEmail: !!normalizedEmail,
+    hasContactId: !!normalizedContactId,
+    email: normalizedEmail || 'MISSING',
+    contact_id: normalizedContactId || 'MISSING'
+  });
 
-    // If no email but we have contact_id, resolve it first
-    if (!finalEmail && normalizedContactId) {
-      const idTrimmed = normalizedContactId.trim();
-      console.log(`Resolving contact_id ${idTrimmed} to email...`);
-      
-      // 1) Try resolve from unsubscribed_contacts by original_contact_id
-      const { data: unsubByOrig, error: unsubOrigErr } = await supabase
+  let finalEmail = normalizedEmail;
+  let finalUserId = user_id || DEFAULT_USER_ID;
+
+  // If no email but we have contact_id, resolve it first
+  if (!finalEmail && normalizedContactId) {
+    const idTrimmed = normalizedContactId.trim();
+    console.log(`Resolving contact_id ${idTrimmed} to email...`);
+    
+    // 1) Try resolve from unsubscribed_contacts by original_contact_id
+    const { data: unsubByOrig, error: unsubOrigErr } = await supabase
+      .from('unsubscribed_contacts')
+      .select('email, user_id')
+      .eq('original_contact_id', idTrimmed)
+      .maybeSingle();
+
+    if (unsubOrigErr) {
+      console.error('Error looking up unsubscribed contact by original_contact_id:', unsubOrigErr);
+      return new Response(JSON.stringify({ 
+        error: 'Failed to fetch unsubscribed contact by contact_id', 
+        details: unsubOrigErr.message 
+      }), { 
+        status: 500, 
+        headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
+      });
+    }
+
+    if (unsubByOrig) {
+      finalEmail = unsubByOrig.email;
+      finalUserId = unsubByOrig.user_id;
+      console.log(`Found in unsubscribed_contacts (original_contact_id): ${idTrimmed} -> ${finalEmail}`);
+    } else {
+      // 2) Maybe the caller passed the unsubscribed_contacts.id instead of the original id
+      const { data: unsubById, error: unsubIdErr } = await supabase
         .from('unsubscribed_contacts')
         .select('email, user_id')
-        .eq('original_contact_id', idTrimmed)
+        .eq('id', idTrimmed)
         .maybeSingle();
-
-      if (unsubOrigErr) {
-        console.error('Error looking up unsubscribed contact by original_contact_id:', unsubOrigErr);
-        return new Response(JSON.stringify({ 
-          error: 'Failed to fetch unsubscribed contact by contact_id', 
-          details: unsubOrigErr.message 
-        }), { 
-          status: 500, 
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
-        });
+      if (unsubIdErr) {
+        console.error('Error looking up unsubscribed contact by id:', unsubIdErr);
       }
-
-      if (unsubByOrig) {
-        finalEmail = unsubByOrig.email;
-        finalUserId = unsubByOrig.user_id;
-        console.log(`Found in unsubscribed_contacts (original_contact_id): ${idTrimmed} -> ${finalEmail}`);
+      if (unsubById) {
+        finalEmail = unsubById.email;
+        finalUserId = unsubById.user_id;
+        console.log(`Found in unsubscribed_contacts (id): ${idTrimmed} -> ${finalEmail}`);
       } else {
-        // 2) Maybe the caller passed the unsubscribed_contacts.id instead of the original id
-        const { data: unsubById, error: unsubIdErr } = await supabase
-          .from('unsubscribed_contacts')
+        // 3) Fallback: Try resolve from contacts by id
+        const { data: found, error: findErr } = await supabase
+          .from('contacts')
           .select('email, user_id')
           .eq('id', idTrimmed)
           .maybeSingle();
-        if (unsubIdErr) {
-          console.error('Error looking up unsubscribed contact by id:', unsubIdErr);
+
+        if (findErr) {
+          console.error('Error looking up contact by contact_id:', findErr);
+          return new Response(JSON.stringify({ 
+            error: 'Failed to fetch contact by contact_id', 
+            details: findErr.message 
+          }), { 
+            status: 500, 
+            headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
+          });
         }
-        if (unsubById) {
-          finalEmail = unsubById.email;
-          finalUserId = unsubById.user_id;
-          console.log(`Found in unsubscribed_contacts (id): ${idTrimmed} -> ${finalEmail}`);
-        } else {
-          // 3) Fallback: Try resolve from contacts by id
-          const { data: found, error: findErr } = await supabase
-            .from('contacts')
-            .select('email, user_id')
-            .eq('id', idTrimmed)
-            .maybeSingle();
-
-          if (findErr) {
-            console.error('Error looking up contact by contact_id:', findErr);
-            return new Response(JSON.stringify({ 
-              error: 'Failed to fetch contact by contact_id', 
-              details: findErr.message 
-            }), { 
-              status: 500, 
-              headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
-            });
-          }
 
-          if (found) {
-            finalEmail = found.email;
-            finalUserId = found.user_id;
-            console.log(`Found in contacts: ${idTrimmed} -> ${finalEmail}`);
-          } else {
-            console.error('Contact not found in either contacts or unsubscribed_contacts for contact_id:', idTrimmed);
-            return new Response(JSON.stringify({ 
-              error: 'Contact not found for the provided contact_id', 
-              contact_id: idTrimmed 
-            }), { 
-              status: 404, 
-              headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
-            });
-          }
+        if (found) {
+          finalEmail = found.email;
+          finalUserId = found.user_id;
+          console.log(`Found in contacts: ${idTrimmed} -> ${finalEmail}`);
+        } else {
+          console.error('Contact not found in either contacts or unsubscribed_contacts for contact_id:', idTrimmed);
+          return new Response(JSON.stringify({ 
+            error: 'Contact not found for the provided contact_id', 
+            contact_id: idTrimmed 
+          }), { 
+            status: 404, 
+            headers: { ...corsHeaders, 'Content-Type': 'application/json' } 
+          });
         }
       }
     }
+  }
 
-    // Final validation - we must have an email at this point
-    if (!finalEmail) {
-      console.error('No email available after resolution. Payload:', payload);
-      return new Response(JSON.stringify({ 
-        error: 'Either email or valid contact_id is required for contact sync',
-        received_payload: payload 
-      }), {
-        status: 400,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
-    }
+  // Final validation - we must have an email at this point
+  if (!finalEmail) {
+    console.error('No email available after resolution. Payload:', payload);
+    return new Response(JSON.stringify({ 
+      error: 'Either email or valid contact_id is required for contact sync',
+      received_payload: payload 
+    }), {
+      status: 400,
+      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    });
+  }
 
-    console.log(`Processing contact sync for: ${finalEmail}`);
+  console.log(`Processing contact sync for: ${finalEmail}`);
 
-    // Restore unsubscribed contact if exists (maintains original contact id)
-    const { error: restoreError } = await supabase.rpc('handle_restore_contact', {
-      p_email: finalEmail,
-      p_user_id: finalUserId
-    });
+  // All lookups go through the case-insensitive email_normalized column
+  const finalEmailNormalized = finalEmail.trim().toLowerCase();
 
-    if (restoreError) {
-      console.error('Error restoring contact:', restoreError);
-    }
-    
-    // Fetch existing contact for merging and name preservation
-    const { data: existingContact } = await supabase
-      .from('contacts')
-      .select('*')
-      .eq('email', finalEmail)
-      .eq('user_id', finalUserId)
-      .maybeSingle();
+  // Restore unsubscribed contact if exists (maintains original contact id)
+  const { error: restoreError } = await supabase.rpc('handle_restore_contact', {
+    p_email: finalEmail,
+    p_user_id: finalUserId
+  });
 
-    // Helpers to normalize and parse tags
-    const splitParts = (s: string) => s.split(/[,;\n]/).map((p) => p.trim()).filter(Boolean);
-    const parseTags = (input: any): string[] => {
-      if (!input) return [];
-      if (Array.isArray(input)) {
-        return Array.from(new Set(input.flatMap((t: any) => (typeof t === 'string' ? splitParts(t) : []) )));
-      }
-      if (typeof input === 'string') return Array.from(new Set(splitParts(input)));
-      return [];
-    };
-
-    const normalize = (t: any) => (typeof t === 'string' ? t.trim() : '');
-    const existingTags = (existingContact?.tags || []).map(normalize).filter(Boolean);
-    const incomingTags = parseTags(tags);
-
-    // Name preservation and derivation
-    let first_name: string | null = null;
-    let last_name: string | null = null;
-
-    if (name && name.trim()) {
-      const nameTrimmed = name.trim();
-      const [first, ...rest] = nameTrimmed.split(/\s+/);
-      first_name = first || null;
-      last_name = rest.join(' ') || null;
-    } else if (existingContact && (existingContact.first_name || existingContact.last_name)) {
-      first_name = existingContact.first_name;
-      last_name = existingContact.last_name;
+  if (restoreError) {
+    console.error('Error restoring contact:', restoreError);
+  }
+  
+  // Fetch existing contact for merging and name preservation
+  const { data: existingContact } = await supabase
+    .from('contacts')
+    .select('*')
+    .eq('email_normalized', finalEmailNormalized)
+    .eq('user_id', finalUserId)
+    .maybeSingle();
+
+  const existingTags: string[] = existingContact?.tags || [];
+  const incomingTags = parseTags(tags);
+
+  // Name preservation and derivation
+  let first_name: string | null = null;
+  let last_name: string | null = null;
+
+  if (name && name.trim()) {
+    const nameTrimmed = name.trim();
+    const [first, ...rest] = nameTrimmed.split(/\s+/);
+    first_name = first || null;
+    last_name = rest.join(' ') || null;
+  } else if (existingContact && (existingContact.first_name || existingContact.last_name)) {
+    first_name = existingContact.first_name;
+    last_name = existingContact.last_name;
+  } else {
+    // Extract name from email - only use the part before @
+    const emailPart = finalEmail.split('@')[0];
+    const cleanedName = emailPart.replace(/[._-]/g, ' ').replace(/\d+/g, '').trim();
+    if (cleanedName) {
+      const [first, ...rest] = cleanedName.split(/\s+/);
+      first_name = first ? first.charAt(0).toUpperCase() + first.slice(1).toLowerCase() : finalEmail;
+      last_name = rest.length > 0 ? rest.join(' ').toLowerCase().replace(/\b\w/g, (l) => l.toUpperCase()) : null;
     } else {
-      // Extract name from email - only use the part before @
-      const emailPart = finalEmail.split('@')[0];
-      const cleanedName = emailPart.replace(/[._-]/g, ' ').replace(/\d+/g, '').trim();
-      if (cleanedName) {
-        const [first, ...rest] = cleanedName.split(/\s+/);
-        first_name = first ? first.charAt(0).toUpperCase() + first.slice(1).toLowerCase() : finalEmail;
-        last_name = rest.length > 0 ? rest.join(' ').toLowerCase().replace(/\b\w/g, (l) => l.toUpperCase()) : null;
-      } else {
-        // If no clean name can be extracted, just use the email part before @
-        first_name = emailPart || finalEmail;
-        last_name = null;
-      }
+      // If no clean name can be extracted, just use the email part before @
+      first_name = emailPart || finalEmail;
+      last_name = null;
     }
+  }
 
-    let finalTags = Array.from(new Set([...existingTags, ...incomingTags]));
-
-    // Validate protected tags directly before processing
-    if (finalTags.length > 0) {
-      try {
-        // Check if any of the tags are protected
-        const { data: protectedRules, error: rulesError } = await supabase
-          .from('tag_rules')
-          .select('add_tags, password')
-          .eq('user_id', finalUserId)
-          .eq('protected', true)
-          .not('add_tags', 'is', null);
-
-        if (rulesError) {
-          console.error('Error checking protected rules:', rulesError);
-          return new Response(JSON.stringify({
-            success: false,
-            error: 'Failed to validate protected tags'
-          }), {
-            status: 500,
-            headers: { 'Content-Type': 'application/json' }
-          });
-        }
-
-        // Check if any of our tags are protected
-        const protectedTags: string[] = [];
-        if (protectedRules && Array.isArray(protectedRules)) {
-          for (const rule of protectedRules) {
-            if (rule.add_tags && Array.isArray(rule.add_tags)) {
-              for (const tag of finalTags) {
-                if (rule.add_tags.includes(tag)) {
-                  protectedTags.push(tag);
-                }
-              }
-            }
-          }
-        }
-
-        // If we have protected tags, validate the password
-        if (protectedTags.length > 0) {
-          if (!password || password.trim() === '') {
-            return new Response(JSON.stringify({
-              success: false,
-              error: `Password required for protected tags: ${protectedTags.join(', ')}`
-            }), {
-              status: 400,
-              headers: { 'Content-Type': 'application/json' }
-            });
-          }
-
-          // Check if the password matches any of the protected rules
-          let validPassword = false;
-          if (protectedRules && Array.isArray(protectedRules)) {
-            validPassword = protectedRules.some(rule => 
-              rule.password === password && 
-              rule.add_tags && 
-              rule.add_tags.some(tag => protectedTags.includes(tag))
-            );
-          }
-
-          if (!validPassword) {
-            return new Response(JSON.stringify({
-              success: false,
-              error: `Invalid password for protected tags: ${protectedTags.join(', ')}`
-            }), {
-              status: 400,
-              headers: { 'Content-Type': 'application/json' }
-            });
-          }
-        }
-      } catch (error) {
-        console.error('Error in protected tag validation:', error);
+  // Case-insensitive merge in one pass; existing spellings win over incoming ones
+  let finalTags = mergeTags(existingTags, incomingTags);
+
+  // Validate protected tags directly before processing
+  if (finalTags.length > 0) {
+    try {
+      // Check if any of the tags are protected
+      const { data: protectedRules, error: rulesError } = await supabase
+        .from('tag_rules')
+        .select('add_tags, password')
+        .eq('user_id', finalUserId)
+        .eq('protected', true)
+        .not('add_tags', 'is', null);
+
+      if (rulesError) {
+        console.error('Error checking protected rules:', rulesError);
         return new Response(JSON.stringify({
           success: false,
           error: 'Failed to validate protected tags'
@@ -352,112 +366,121 @@ serve(async (req) => {
           headers: { 'Content-Type': 'application/json' }
         });
       }
-    }
-
-    // Unsubscribe/Resubscribe via 'unsub' tag (tag-based approach)
-    const hasIncomingUnsub = incomingTags.some((t) => t.toLowerCase() === 'unsub');
-    const hasExistingUnsub = finalTags.some((t) => t.toLowerCase() === 'unsub');
-    const shouldUnsub = status === 'unsubscribed' || hasIncomingUnsub;
-
-    if (shouldUnsub) {
-      if (!hasExistingUnsub) finalTags.push('unsub');
-    } else {
-      // Any interaction without explicit 'unsub' removes the tag (re-opt in)
-      finalTags = finalTags.filter((t) => t.toLowerCase() !== 'unsub');
-    }
 
-    // For subscribed status, ensure contact is in contacts table and NOT in unsubscribed_contacts
-    // First remove from unsubscribed_contacts if exists
-    await supabase
-      .from('unsubscribed_contacts')
-      .delete()
-      .eq('email', finalEmail)
-      .eq('user_id', finalUserId);
-
-    // Upsert contact with merged tags
-    const { data: contact, error: contactError } = await supabase
-      .from('contacts')
-      .upsert({
-        email: finalEmail,
-        user_id: finalUserId,
-        first_name,
-        last_name,
-        tags: finalTags,
-        status,
-        updated_at: new Date().toISOString()
-      }, {
-        onConflict: 'user_id,email'
-      })
-      .select()
-      .single();
-
-    if (contactError) {
-      console.error('Error upserting contact:', contactError);
-      return new Response(JSON.stringify({ error: 'Failed to upsert contact' }), {
-        status: 500,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
-    }
-
-    console.log('Contact upserted:', contact);
-
-    // Process dynamic lists - check if contact should be added to any rule-based lists
-    const { data: dynamicLists, error: listsError } = await supabase
-      .from('email_lists')
-      .select('*')
-      .eq('list_type', 'dynamic')
-      .eq('user_id', finalUserId);
-
-    if (listsError) {
-      console.error('Error fetching dynamic lists:', listsError);
-    } else {
-      // Process each dynamic list
-      for (const list of dynamicLists) {
-        const ruleConfig = list.rule_config;
-        if (!ruleConfig) continue;
+      // Check if any of our tags are protected
+      const protectedTagSet = new Set<string>();
+      if (protectedRules && Array.isArray(protectedRules)) {
+        const finalTagSet = new Set(finalTags);
+        for (const rule of protectedRules) {
+          if (rule.add_tags && Array.isArray(rule.add_tags)) {
+            for (const tag of rule.add_tags) {
+              if (finalTagSet.has(tag)) {
+                protectedTagSet.add(tag);
+              }
+            }
+          }
+        }
+      }
+      const protectedTags = Array.from(protectedTagSet);
 
-        let shouldInclude = false;
+      // If we have protected tags, validate the password
+      if (protectedTags.length > 0) {
+        if (!password || password.trim() === '') {
+          return new Response(JSON.stringify({
+            success: false,
+            error: `Password required for protected tags: ${protectedTags.join(', ')}`
+          }), {
+            status: 400,
+            headers: { 'Content-Type': 'application/json' }
+          });
+        }
 
-        // Check if contact matches the rule
-        if (ruleConfig.requiredTags && Array.isArray(ruleConfig.requiredTags)) {
-          shouldInclude = ruleConfig.requiredTags.some((tag: string) => 
-            finalTags.includes(typeof tag === 'string' ? tag.trim() : tag)
+        // Check if the password matches any of the protected rules
+        let validPassword = false;
+        if (protectedRules && Array.isArray(protectedRules)) {
+          validPassword = protectedRules.some(rule => 
+            rule.password === password && 
+            rule.add_tags && 
+            rule.add_tags.some(tag => protectedTagSet.has(tag))
           );
         }
 
-        if (shouldInclude) {
-          // Add contact to list (upsert to avoid duplicates)
-          const { error: membershipError } = await supabase
-            .from('contact_lists')
-            .upsert({
-              contact_id: contact.id,
-              list_id: list.id
-            }, {
-              onConflict: 'contact_id,list_id'
-            });
-
-          if (membershipError) {
-            console.error(`Error adding contact to list ${list.name}:`, membershipError);
-          } else {
-            console.log(`Added contact to dynamic list: ${list.name}`);
-          }
+        if (!validPassword) {
+          return new Response(JSON.stringify({
+            success: false,
+            error: `Invalid password for protected tags: ${protectedTags.join(', ')}`
+          }), {
+            status: 400,
+            headers: { 'Content-Type': 'application/json' }
+          });
         }
       }
+    } catch (error) {
+      console.error('Error in protected tag validation:', error);
+      return new Response(JSON.stringify({
+        success: false,
+        error: 'Failed to validate protected tags'
+      }), {
+        status: 500,
+        headers: { 'Content-Type': 'application/json' }
+      });
     }
+  }
 
-    return new Response(JSON.stringify({ 
-      success: true, 
-      contact,
-      message: 'Contact processed and dynamic lists updated'
-    }), {
-      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-    });
+  // Unsubscribe/Resubscribe via 'unsub' tag (tag-based approach)
+  const hasIncomingUnsub = hasTag(incomingTags, 'unsub');
+  const hasExistingUnsub = hasTag(finalTags, 'unsub');
+  const shouldUnsub = status === 'unsubscribed' || hasIncomingUnsub;
 
-  } catch (error) {
-    console.error('Error in sync-contacts function:', error);
-    return new Response(JSON.stringify({ error: error.message }), {
+  if (shouldUnsub) {
+    if (!hasExistingUnsub) finalTags.push('unsub');
+  } else {
+    // Any interaction without explicit 'unsub' removes the tag (re-opt in)
+    finalTags = withoutTag(finalTags, 'unsub');
+  }
+
+  // For subscribed status, ensure contact is in contacts table and NOT in unsubscribed_contacts
+  // First remove from unsubscribed_contacts if exists
+  await supabase
+    .from('unsubscribed_contacts')
+    .delete()
+    .eq('email_normalized', finalEmailNormalized)
+    .eq('user_id', finalUserId);
+
+  // Upsert contact with merged tags
+  const { data: contact, error: contactError } = await supabase
+    .from('contacts')
+    .upsert({
+      email: existingContact?.email ?? finalEmail,
+      user_id: finalUserId,
+      first_name,
+      last_name,
+      tags: finalTags,
+      status,
+      updated_at: new Date().toISOString()
+    }, {
+      onConflict: 'user_id,email_normalized'
+    })
+    .select()
+    .single();
+
+  if (contactError) {
+    console.error('Error upserting contact:', contactError);
+    return new Response(JSON.stringify({ error: 'Failed to upsert contact' }), {
       status: 500,
       headers: { ...corsHeaders, 'Content-Type': 'application/json' },
     });
   }
-});
\ No newline at end of file
+
+  console.log('Contact upserted:', contact);
+
+  // Dynamic list membership is maintained by database triggers on contacts
+
+  return new Response(JSON.stringify({ 
+    success: true, 
+    contact,
+    message: 'Contact processed and dynamic lists updated'
+  }), {
+    headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+  });
+}
\ No newline at end of file
@@ -0,0 +1,231 @@
+-- Case-insensitive contact lookups via a normalized email column
+-- Callers historically matched on the raw email column (sometimes lower-cased, sometimes not),
+-- which let "Foo@x.com" and "foo@x.com" live side by side and forced lower(email) scans.
+-- This migration:
+-- 1) Merges existing mixed-case duplicates into the oldest contact of each (user_id, email) group
+-- 2) Adds a generated email_normalized column to contacts and unsubscribed_contacts
+-- 3) Enforces uniqueness per user on the normalized email and indexes it
+-- 4) Rewrites handle_unsubscribe / handle_restore_contact to look up by the normalized column
+
+-- 1) Deduplicate contacts that only differ by email case or surrounding whitespace
+CREATE TEMP TABLE contact_email_groups AS
+SELECT id,
+       first_value(id) OVER (
+         PARTITION BY user_id, lower(btrim(email))
+         ORDER BY created_at ASC, id ASC
+       ) AS keeper_id,
+       count(*) OVER (PARTITION BY user_id, lower(btrim(email))) AS group_size
+FROM public.contacts;
+
+DELETE FROM contact_email_groups WHERE group_size = 1;
+
+-- Merge tags and keep the first non-empty name of each group on the surviving row
+UPDATE public.contacts k
+SET tags = merged.tags,
+    first_name = COALESCE(k.first_name, merged.first_name),
+    last_name = COALESCE(k.last_name, merged.last_name)
+FROM (
+  SELECT g.keeper_id,
+         array_agg(DISTINCT t.tag) FILTER (WHERE t.tag IS NOT NULL) AS tags,
+         (array_agg(c.first_name ORDER BY c.created_at) FILTER (WHERE c.first_name IS NOT NULL))[1] AS first_name,
+         (array_agg(c.last_name ORDER BY c.created_at) FILTER (WHERE c.last_name IS NOT NULL))[1] AS last_name
+  FROM contact_email_groups g
+  JOIN public.contacts c ON c.id = g.id
+  LEFT JOIN LATERAL unnest(c.tags) AS t(tag) ON true
+  GROUP BY g.keeper_id
+) merged
+WHERE k.id = merged.keeper_id;
+
+-- Move list memberships and purchases of the duplicates onto the surviving contact
+INSERT INTO public.contact_lists (contact_id, list_id)
+SELECT g.keeper_id, cl.list_id
+FROM public.contact_lists cl
+JOIN contact_email_groups g ON g.id = cl.contact_id AND g.id <> g.keeper_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO public.contact_products (contact_id, product_id, price_paid, purchased_at)
+SELECT g.keeper_id, cp.product_id, cp.price_paid, cp.purchased_at
+FROM public.contact_products cp
+JOIN contact_email_groups g ON g.id = cp.contact_id AND g.id <> g.keeper_id
+WHERE NOT EXISTS (
+  SELECT 1 FROM public.contact_products existing
+  WHERE existing.contact_id = g.keeper_id AND existing.product_id = cp.product_id
+);
+
+-- Keep pending automations and their history attached to the surviving contact
+UPDATE public.automation_actions a
+SET contact_id = g.keeper_id
+FROM contact_email_groups g
+WHERE a.contact_id = g.id AND g.id <> g.keeper_id
+  AND NOT EXISTS (
+    SELECT 1 FROM public.automation_actions existing
+    WHERE existing.automation_rule_id = a.automation_rule_id
+      AND existing.contact_id = g.keeper_id
+      AND existing.step_index = a.step_index
+      AND existing.execute_at = a.execute_at
+  );
+
+UPDATE public.automation_logs l
+SET contact_id = g.keeper_id
+FROM contact_email_groups g
+WHERE l.contact_id = g.id AND g.id <> g.keeper_id;
+
+DELETE FROM public.contact_lists
+WHERE contact_id IN (SELECT id FROM contact_email_groups WHERE id <> keeper_id);
+
+DELETE FROM public.contact_products
+WHERE contact_id IN (SELECT id FROM contact_email_groups WHERE id <> keeper_id);
+
+DELETE FROM public.contacts
+WHERE id IN (SELECT id FROM contact_email_groups WHERE id <> keeper_id);
+
+DROP TABLE contact_email_groups;
+
+-- Same cleanup for unsubscribed_contacts: keep the most recent unsubscribe per normalized email
+DELETE FROM public.unsubscribed_contacts uc
+USING public.unsubscribed_contacts newer
+WHERE uc.user_id = newer.user_id
+  AND lower(btrim(uc.email)) = lower(btrim(newer.email))
+  AND (uc.unsubscribed_at, uc.id) < (newer.unsubscribed_at, newer.id);
+
+-- 2) Generated normalized email columns
+ALTER TABLE public.contacts
+ADD COLUMN IF NOT EXISTS email_normalized TEXT GENERATED ALWAYS AS (lower(btrim(email))) STORED;
+
+ALTER TABLE public.unsubscribed_contacts
+ADD COLUMN IF NOT EXISTS email_normalized TEXT GENERATED ALWAYS AS (lower(btrim(email))) STORED;
+
+-- 3) One contact per normalized email per user, and index-backed lookups
+CREATE UNIQUE INDEX IF NOT EXISTS ux_contacts_user_email_normalized
+ON public.contacts (user_id, email_normalized);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_unsubscribed_contacts_user_email_normalized
+ON public.unsubscribed_contacts (user_id, email_normalized);
+
+-- Lookups that are not scoped to a user (e.g. campaign_sends -> contacts joins)
+DROP INDEX IF EXISTS public.idx_contacts_email;
+CREATE INDEX IF NOT EXISTS idx_contacts_email_normalized ON public.contacts (email_normalized);
+
+-- unsubscribes keeps its raw email; index the lower(email) predicate used by the functions below
+CREATE INDEX IF NOT EXISTS idx_unsubscribes_user_email_lower ON public.unsubscribes (user_id, lower(email));
+
+COMMENT ON COLUMN public.contacts.email_normalized IS 'lower(btrim(email)); use for all contact lookups by email';
+COMMENT ON INDEX ux_contacts_user_email_normalized IS 'Case-insensitive unique email per user, backs sync-contacts upserts';
+
+-- 4) Look up contacts by the normalized column
+CREATE OR REPLACE FUNCTION public.handle_unsubscribe(
+  p_email text DEFAULT NULL::text,
+  p_user_id uuid DEFAULT '550e8400-e29b-41d4-a716-446655440000'::uuid,
+  p_reason text DEFAULT NULL::text
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  contact_record RECORD;
+BEGIN
+  -- Normalize email
+  IF p_email IS NOT NULL THEN
+    p_email := lower(btrim(p_email));
+  END IF;
+
+  -- Try to find existing contact for rich data preservation
+  IF p_email IS NOT NULL THEN
+    SELECT * INTO contact_record
+    FROM public.contacts
+    WHERE user_id = p_user_id AND email_normalized = p_email
+    LIMIT 1;
+  ELSE
+    contact_record := NULL;
+  END IF;
+
+  IF contact_record IS NOT NULL THEN
+    -- Preserve full contact in unsubscribed_contacts
+    INSERT INTO public.unsubscribed_contacts (
+      user_id, email, first_name, last_name, tags, original_contact_id, unsubscribed_at
+    ) VALUES (
+      contact_record.user_id,
+      contact_record.email,
+      contact_record.first_name,
+      contact_record.last_name,
+      contact_record.tags,
+      contact_record.id,
+      now()
+    ) ON CONFLICT (user_id, email_normalized) DO UPDATE SET
+      first_name = EXCLUDED.first_name,
+      last_name = EXCLUDED.last_name,
+      tags = EXCLUDED.tags,
+      original_contact_id = EXCLUDED.original_contact_id,
+      unsubscribed_at = EXCLUDED.unsubscribed_at;
+  END IF;
+
+  -- Always upsert into unsubscribes table
+  IF p_email IS NOT NULL THEN
+    INSERT INTO public.unsubscribes (user_id, email, reason, unsubscribed_at)
+    VALUES (p_user_id, p_email, p_reason, now())
+    ON CONFLICT (user_id, email) DO UPDATE SET
+      reason = EXCLUDED.reason,
+      unsubscribed_at = EXCLUDED.unsubscribed_at;
+  END IF;
+
+  -- ALWAYS remove any contact rows for this email/user (even if not found above)
+  IF p_email IS NOT NULL THEN
+    DELETE FROM public.contacts
+    WHERE user_id = p_user_id AND email_normalized = p_email;
+  END IF;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.handle_restore_contact(p_email text, p_user_id uuid DEFAULT '550e8400-e29b-41d4-a716-446655440000'::uuid)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  unsubscribed_record RECORD;
+  v_email text := lower(btrim(p_email));
+BEGIN
+  -- Fetch matching unsubscribed record
+  SELECT * INTO unsubscribed_record
+  FROM public.unsubscribed_contacts
+  WHERE user_id = p_user_id AND email_normalized = v_email
+  LIMIT 1;
+
+  IF unsubscribed_record IS NOT NULL THEN
+    -- Remove any existing contact row for this email to ensure original ID is restored
+    DELETE FROM public.contacts
+    WHERE user_id = p_user_id AND email_normalized = v_email;
+
+    -- Insert using ORIGINAL contact id and preserved fields
+    INSERT INTO public.contacts (
+      id, user_id, email, first_name, last_name, tags, status
+    ) VALUES (
+      COALESCE(unsubscribed_record.original_contact_id, gen_random_uuid()),
+      unsubscribed_record.user_id,
+      unsubscribed_record.email,
+      unsubscribed_record.first_name,
+      unsubscribed_record.last_name,
+      unsubscribed_record.tags,
+      'subscribed'
+    )
+    ON CONFLICT (user_id, email_normalized) DO UPDATE SET
+      first_name = EXCLUDED.first_name,
+      last_name = EXCLUDED.last_name,
+      tags = EXCLUDED.tags,
+      status = 'subscribed';
+
+    -- Cleanup unsubscribed tables
+    DELETE FROM public.unsubscribed_contacts WHERE id = unsubscribed_record.id;
+    DELETE FROM public.unsubscribes WHERE user_id = p_user_id AND lower(email) = v_email;
+  ELSE
+    -- Fallback: ensure a contact exists and is marked subscribed
+    INSERT INTO public.contacts (user_id, email, status)
+    VALUES (p_user_id, p_email, 'subscribed')
+    ON CONFLICT (user_id, email_normalized) DO UPDATE SET status = 'subscribed';
+    DELETE FROM public.unsubscribes WHERE user_id = p_user_id AND lower(email) = v_email;
+  END IF;
+END;
+$function$;
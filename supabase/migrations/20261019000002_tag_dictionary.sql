@@ -0,0 +1,231 @@
+-- Per-user tag dictionary with integer tag ids stored alongside contacts.tags
+-- Tag comparisons currently re-normalize strings (lower(trim(...))) on every evaluation.
+-- This migration:
+-- 1) Creates tag_dictionary mapping each normalized tag name to a stable integer id per user
+-- 2) Adds conversion functions between text tags and tag ids
+-- 3) Adds contacts.tag_ids (sorted, distinct integer[]) kept in sync by a trigger
+-- 4) Backfills the dictionary and tag_ids, and indexes tag_ids with GIN
+-- 5) Prunes dictionary entries no contact or tag rule uses any more
+-- Tag filters (list_contacts) resolve the requested tags once and compare integer sets.
+
+-- 1) Dictionary table
+CREATE TABLE IF NOT EXISTS public.tag_dictionary (
+  id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  user_id UUID NOT NULL,
+  name TEXT NOT NULL,
+  name_normalized TEXT GENERATED ALWAYS AS (lower(btrim(name))) STORED,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_tag_dictionary_user_name
+ON public.tag_dictionary (user_id, name_normalized);
+
+ALTER TABLE public.tag_dictionary ENABLE ROW LEVEL SECURITY;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_policies
+    WHERE tablename = 'tag_dictionary'
+    AND policyname = 'Users can access their own tag dictionary'
+  ) THEN
+    CREATE POLICY "Users can access their own tag dictionary" ON public.tag_dictionary
+    FOR ALL
+    USING (
+      public.is_current_user_admin() OR auth.uid() = user_id
+    )
+    WITH CHECK (
+      public.is_current_user_admin() OR auth.uid() = user_id
+    );
+  END IF;
+END $$;
+
+-- 2) Conversion functions
+-- Writers of a user's tag ids hold this lock (shared) until commit; prune_tag_dictionary
+-- takes it exclusively, so it never deletes an id a concurrent write is about to store
+CREATE OR REPLACE FUNCTION public.tag_dictionary_lock_key(p_user_id uuid)
+RETURNS bigint
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT hashtextextended('tag_dictionary:' || p_user_id::text, 0);
+$function$;
+
+-- Resolve tags to ids, registering any tag not yet in the dictionary
+CREATE OR REPLACE FUNCTION public.tag_ids_for(p_user_id uuid, p_tags text[])
+RETURNS integer[]
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  v_ids integer[];
+BEGIN
+  IF p_tags IS NULL OR cardinality(p_tags) = 0 THEN
+    RETURN ARRAY[]::integer[];
+  END IF;
+
+  PERFORM pg_advisory_xact_lock_shared(public.tag_dictionary_lock_key(p_user_id));
+
+  -- Known tags are not written again
+  INSERT INTO public.tag_dictionary (user_id, name)
+  SELECT DISTINCT ON (lower(btrim(t))) p_user_id, btrim(t)
+  FROM unnest(p_tags) AS t
+  WHERE t IS NOT NULL AND btrim(t) <> ''
+    AND NOT EXISTS (
+      SELECT 1 FROM public.tag_dictionary d
+      WHERE d.user_id = p_user_id AND d.name_normalized = lower(btrim(t))
+    )
+  ON CONFLICT (user_id, name_normalized) DO NOTHING;
+
+  SELECT coalesce(array_agg(d.id ORDER BY d.id), ARRAY[]::integer[]) INTO v_ids
+  FROM public.tag_dictionary d
+  WHERE d.user_id = p_user_id
+    AND d.name_normalized IN (SELECT lower(btrim(t)) FROM unnest(p_tags) AS t);
+
+  RETURN v_ids;
+END;
+$function$;
+
+-- Read-only variant for filters: unknown tags are dropped, so callers matching
+-- "all" of a tag set should compare cardinality with the requested tags
+CREATE OR REPLACE FUNCTION public.lookup_tag_ids(p_user_id uuid, p_tags text[])
+RETURNS integer[]
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT coalesce(array_agg(d.id ORDER BY d.id), ARRAY[]::integer[])
+  FROM public.tag_dictionary d
+  WHERE d.user_id = p_user_id
+    AND d.name_normalized IN (SELECT lower(btrim(t)) FROM unnest(p_tags) AS t);
+$function$;
+
+-- Map ids back to display names, preserving the order of p_tag_ids
+CREATE OR REPLACE FUNCTION public.tag_names_for(p_user_id uuid, p_tag_ids integer[])
+RETURNS text[]
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT coalesce(array_agg(d.name ORDER BY ids.ord), ARRAY[]::text[])
+  FROM unnest(p_tag_ids) WITH ORDINALITY AS ids(id, ord)
+  JOIN public.tag_dictionary d ON d.id = ids.id AND d.user_id = p_user_id;
+$function$;
+
+-- 3) Integer tag column kept in sync with contacts.tags
+ALTER TABLE public.contacts
+ADD COLUMN IF NOT EXISTS tag_ids INTEGER[] NOT NULL DEFAULT '{}';
+
+COMMENT ON COLUMN public.contacts.tag_ids IS 'Sorted tag_dictionary ids for tags; maintained by trg_sync_contact_tag_ids';
+
+CREATE OR REPLACE FUNCTION public.sync_contact_tag_ids()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  -- tag_ids is derived: a write that leaves tags alone keeps the stored ids
+  IF TG_OP = 'UPDATE' AND OLD.tags IS NOT DISTINCT FROM NEW.tags THEN
+    NEW.tag_ids := OLD.tag_ids;
+    RETURN NEW;
+  END IF;
+
+  NEW.tag_ids := public.tag_ids_for(NEW.user_id, NEW.tags);
+  RETURN NEW;
+END;
+$function$;
+
+-- 4) Backfill the dictionary from contacts and tag rules, then contacts.tag_ids
+INSERT INTO public.tag_dictionary (user_id, name)
+SELECT DISTINCT ON (src.user_id, lower(btrim(src.tag))) src.user_id, btrim(src.tag)
+FROM (
+  SELECT c.user_id, t AS tag, c.created_at
+  FROM public.contacts c, unnest(c.tags) AS t
+  UNION ALL
+  SELECT r.user_id, t AS tag, r.created_at
+  FROM public.tag_rules r,
+       unnest(coalesce(r.trigger_tags, ARRAY[]::text[]) || ARRAY[r.trigger_tag]
+              || coalesce(r.add_tags, ARRAY[]::text[]) || coalesce(r.remove_tags, ARRAY[]::text[])) AS t
+) src
+WHERE src.tag IS NOT NULL AND btrim(src.tag) <> ''
+ORDER BY src.user_id, lower(btrim(src.tag)), src.created_at
+ON CONFLICT (user_id, name_normalized) DO NOTHING;
+
+UPDATE public.contacts c
+SET tag_ids = public.lookup_tag_ids(c.user_id, c.tags)
+WHERE c.tags IS NOT NULL AND cardinality(c.tags) > 0;
+
+-- Created after the backfill, which sets tag_ids without touching tags.
+-- BEFORE triggers fire in name order, so this runs after trg_apply_tag_rules_on_contact_change
+-- and sees the tags produced by the tag rules.
+DROP TRIGGER IF EXISTS trg_sync_contact_tag_ids ON public.contacts;
+CREATE TRIGGER trg_sync_contact_tag_ids
+BEFORE INSERT OR UPDATE ON public.contacts
+FOR EACH ROW
+EXECUTE FUNCTION public.sync_contact_tag_ids();
+
+-- GIN on the integer form serves &&, @> and <@ tag filters
+CREATE INDEX IF NOT EXISTS idx_contacts_tag_ids ON public.contacts USING GIN (tag_ids);
+
+COMMENT ON INDEX idx_contacts_tag_ids IS 'Integer tag set index for tag filters';
+
+-- 5) Retention: delete up to p_batch_size dictionary entries older than p_keep that no
+-- contact carries and no tag rule mentions. A tag that comes back later is registered
+-- again under a new id. Users with tag writes in flight are skipped until the next pass.
+CREATE OR REPLACE FUNCTION public.prune_tag_dictionary(
+  p_keep interval DEFAULT interval '1 day',
+  p_batch_size integer DEFAULT 5000
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid;
+  candidate_ids integer[];
+  deleted integer := 0;
+  n integer;
+BEGIN
+  FOR target_user, candidate_ids IN
+    SELECT candidate.user_id, array_agg(candidate.id)
+    FROM (
+      SELECT d.user_id, d.id
+      FROM public.tag_dictionary d
+      WHERE d.created_at < now() - p_keep
+        AND NOT EXISTS (SELECT 1 FROM public.contacts c WHERE c.tag_ids @> ARRAY[d.id])
+        AND NOT EXISTS (
+          SELECT 1 FROM public.tag_rules r
+          WHERE r.user_id = d.user_id
+            AND d.name_normalized = ANY(public.normalize_tag_array(
+              coalesce(r.trigger_tags, ARRAY[]::text[]) || ARRAY[r.trigger_tag]
+              || coalesce(r.add_tags, ARRAY[]::text[]) || coalesce(r.remove_tags, ARRAY[]::text[])))
+        )
+      LIMIT p_batch_size
+    ) candidate
+    GROUP BY candidate.user_id
+  LOOP
+    CONTINUE WHEN NOT pg_try_advisory_xact_lock(public.tag_dictionary_lock_key(target_user));
+
+    -- A new statement, so contacts committed by writers that held the lock are visible
+    DELETE FROM public.tag_dictionary d
+    WHERE d.id = ANY(candidate_ids)
+      AND NOT EXISTS (SELECT 1 FROM public.contacts c WHERE c.tag_ids @> ARRAY[d.id]);
+    GET DIAGNOSTICS n = ROW_COUNT;
+    deleted := deleted + n;
+  END LOOP;
+  RETURN deleted;
+END;
+$function$;
+
+-- Conversions run from the contacts trigger and server-side filters only
+REVOKE EXECUTE ON FUNCTION public.tag_ids_for(uuid, text[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.lookup_tag_ids(uuid, text[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.tag_names_for(uuid, integer[]) FROM PUBLIC, anon, authenticated;
+
+-- Maintenance only; run by process-automations with the service role
+REVOKE EXECUTE ON FUNCTION public.prune_tag_dictionary(interval, integer) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,43 @@
+-- Durable dedupe table for webhook ingestion (sync-contacts)
+-- Each delivery is keyed by its Idempotency-Key header or a SHA-256 of the payload.
+-- The first delivery claims the key ('processing'); once handled the response is stored
+-- ('completed') and repeated deliveries replay it without touching contacts.
+CREATE TABLE IF NOT EXISTS public.webhook_idempotency_keys (
+  idempotency_key TEXT PRIMARY KEY,
+  status TEXT NOT NULL DEFAULT 'processing' CHECK (status IN ('processing', 'completed')),
+  response_status INTEGER,
+  response_body JSONB,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  completed_at TIMESTAMP WITH TIME ZONE,
+  expires_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now() + interval '24 hours'
+);
+
+-- Only the service role (edge functions) reads and writes this table
+ALTER TABLE public.webhook_idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_webhook_idempotency_keys_expires_at ON public.webhook_idempotency_keys(expires_at);
+
+-- Remove expired keys in bounded batches; returns the number of rows deleted
+CREATE OR REPLACE FUNCTION public.prune_webhook_idempotency_keys(p_batch_size integer DEFAULT 5000)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deleted_count integer;
+BEGIN
+  DELETE FROM public.webhook_idempotency_keys
+  WHERE idempotency_key IN (
+    SELECT idempotency_key
+    FROM public.webhook_idempotency_keys
+    WHERE expires_at < now()
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_count = ROW_COUNT;
+  RETURN deleted_count;
+END;
+$function$;
+
+-- Only edge functions (service role) prune keys
+REVOKE EXECUTE ON FUNCTION public.prune_webhook_idempotency_keys(integer) FROM PUBLIC, anon, authenticated;
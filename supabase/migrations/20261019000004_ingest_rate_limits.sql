@@ -0,0 +1,117 @@
+-- Per-tenant token buckets for contact ingestion (sync-contacts)
+-- Edge function isolates lease tokens from these shared buckets in small batches and
+-- spend them from memory, so the database is consulted once per lease, not per request.
+CREATE TABLE IF NOT EXISTS public.ingest_rate_limits (
+  bucket_key TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Admitted/throttled request counts per bucket and minute
+CREATE TABLE IF NOT EXISTS public.ingest_rate_limit_metrics (
+  bucket_key TEXT NOT NULL,
+  window_start TIMESTAMP WITH TIME ZONE NOT NULL,
+  admitted INTEGER NOT NULL DEFAULT 0,
+  throttled INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (bucket_key, window_start)
+);
+
+-- Only the service role (edge functions) reads and writes these tables
+ALTER TABLE public.ingest_rate_limits ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ingest_rate_limit_metrics ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_ingest_rate_limit_metrics_window_start ON public.ingest_rate_limit_metrics(window_start);
+
+-- Refill the bucket, grant up to p_requested whole tokens and record the caller's
+-- admitted/throttled counters in the same round trip. p_requested = 0 only flushes metrics.
+-- retry_after_seconds is 0 when anything was granted, otherwise the time until one token refills.
+CREATE OR REPLACE FUNCTION public.acquire_ingest_tokens(
+  p_bucket_key text,
+  p_requested integer,
+  p_capacity double precision,
+  p_refill_per_second double precision,
+  p_admitted integer DEFAULT 0,
+  p_throttled integer DEFAULT 0
+)
+RETURNS TABLE(granted integer, retry_after_seconds double precision)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  current_tokens double precision;
+  last_refill timestamp with time zone;
+  grant_count integer := 0;
+BEGIN
+  INSERT INTO public.ingest_rate_limits (bucket_key, tokens, updated_at)
+  VALUES (p_bucket_key, p_capacity, now())
+  ON CONFLICT (bucket_key) DO NOTHING;
+
+  SELECT tokens, updated_at INTO current_tokens, last_refill
+  FROM public.ingest_rate_limits
+  WHERE bucket_key = p_bucket_key
+  FOR UPDATE;
+
+  current_tokens := LEAST(
+    p_capacity,
+    current_tokens + GREATEST(0, EXTRACT(EPOCH FROM (now() - last_refill))) * p_refill_per_second
+  );
+
+  IF p_requested > 0 THEN
+    grant_count := LEAST(p_requested, floor(current_tokens)::integer);
+    current_tokens := current_tokens - grant_count;
+  END IF;
+
+  UPDATE public.ingest_rate_limits
+  SET tokens = current_tokens, updated_at = now()
+  WHERE bucket_key = p_bucket_key;
+
+  IF p_admitted > 0 OR p_throttled > 0 THEN
+    INSERT INTO public.ingest_rate_limit_metrics (bucket_key, window_start, admitted, throttled)
+    VALUES (p_bucket_key, date_trunc('minute', now()), p_admitted, p_throttled)
+    ON CONFLICT (bucket_key, window_start) DO UPDATE
+    SET admitted = ingest_rate_limit_metrics.admitted + EXCLUDED.admitted,
+        throttled = ingest_rate_limit_metrics.throttled + EXCLUDED.throttled;
+  END IF;
+
+  granted := grant_count;
+  IF grant_count > 0 OR p_requested = 0 THEN
+    retry_after_seconds := 0;
+  ELSIF p_refill_per_second <= 0 THEN
+    retry_after_seconds := 60;
+  ELSE
+    retry_after_seconds := (1 - current_tokens) / p_refill_per_second;
+  END IF;
+  RETURN NEXT;
+END;
+$function$;
+
+-- Remove metric windows older than p_keep in bounded batches; returns the number of rows deleted
+CREATE OR REPLACE FUNCTION public.prune_ingest_rate_limit_metrics(
+  p_keep interval DEFAULT interval '7 days',
+  p_batch_size integer DEFAULT 5000
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deleted_count integer;
+BEGIN
+  DELETE FROM public.ingest_rate_limit_metrics
+  WHERE (bucket_key, window_start) IN (
+    SELECT bucket_key, window_start
+    FROM public.ingest_rate_limit_metrics
+    WHERE window_start < now() - p_keep
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_count = ROW_COUNT;
+  RETURN deleted_count;
+END;
+$function$;
+
+-- Only edge functions (service role) spend tokens and prune metrics; bucket keys and
+-- capacities are caller-supplied, so clients must not reach these
+REVOKE EXECUTE ON FUNCTION public.acquire_ingest_tokens(text, integer, double precision, double precision, integer, integer) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.prune_ingest_rate_limit_metrics(interval, integer) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,140 @@
+-- Set-based tag rule evaluation
+-- Rules carry precompiled, lowercased trigger/add/remove arrays (generated columns), and
+-- apply_tag_rules_pure compares them against the contact's normalized tags with && and @>
+-- instead of nested FOR loops over lower(trim()) strings.
+-- Add and remove are now case-insensitive as well, matching the trigger comparison.
+
+-- Trimmed, lowercased, de-duplicated, sorted; blanks and NULLs dropped
+CREATE OR REPLACE FUNCTION public.normalize_tag_array(p_tags text[])
+RETURNS text[]
+LANGUAGE sql
+IMMUTABLE
+PARALLEL SAFE
+AS $function$
+  SELECT COALESCE(array_agg(DISTINCT lower(trim(t))), ARRAY[]::text[])
+  FROM unnest(p_tags) AS t
+  WHERE t IS NOT NULL AND trim(t) <> '';
+$function$;
+
+-- Trimmed tags with blanks and case-insensitive duplicates dropped; the first spelling wins
+CREATE OR REPLACE FUNCTION public.clean_tag_array(p_tags text[])
+RETURNS text[]
+LANGUAGE sql
+IMMUTABLE
+PARALLEL SAFE
+AS $function$
+  SELECT COALESCE(array_agg(tag ORDER BY ord), ARRAY[]::text[])
+  FROM (
+    SELECT DISTINCT ON (lower(trim(t))) trim(t) AS tag, ord
+    FROM unnest(p_tags) WITH ORDINALITY AS u(t, ord)
+    WHERE t IS NOT NULL AND trim(t) <> ''
+    ORDER BY lower(trim(t)), ord
+  ) first_spellings;
+$function$;
+
+ALTER TABLE public.tag_rules
+  ADD COLUMN IF NOT EXISTS trigger_tags_normalized text[] GENERATED ALWAYS AS (
+    public.normalize_tag_array(COALESCE(NULLIF(trigger_tags, ARRAY[]::text[]), ARRAY[trigger_tag]))
+  ) STORED,
+  ADD COLUMN IF NOT EXISTS add_tags_normalized text[] GENERATED ALWAYS AS (
+    public.normalize_tag_array(add_tags)
+  ) STORED,
+  ADD COLUMN IF NOT EXISTS remove_tags_normalized text[] GENERATED ALWAYS AS (
+    public.normalize_tag_array(remove_tags)
+  ) STORED;
+
+-- Rules are evaluated per user in creation order
+CREATE INDEX IF NOT EXISTS idx_tag_rules_user_enabled_created
+  ON public.tag_rules(user_id, created_at, id)
+  WHERE enabled = true;
+
+CREATE OR REPLACE FUNCTION public.apply_tag_rules_pure(p_user_id uuid, p_tags text[])
+RETURNS text[]
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_record RECORD;
+  updated_tags text[] := COALESCE(p_tags, ARRAY[]::text[]);
+  current_normalized text[];
+  rule_changed boolean;
+  has_changes boolean := false;
+BEGIN
+  current_normalized := public.normalize_tag_array(updated_tags);
+
+  -- Rules only change tags after one fires, so if no rule matches the incoming tags
+  -- none can match later either
+  IF NOT EXISTS (
+    SELECT 1
+    FROM public.tag_rules r
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+      AND CASE WHEN COALESCE(r.trigger_match_type, 'any') = 'all'
+               THEN current_normalized @> r.trigger_tags_normalized
+               ELSE current_normalized && r.trigger_tags_normalized
+          END
+  ) THEN
+    RETURN p_tags;
+  END IF;
+
+  -- Rules see the tags produced by earlier rules, so they still run in creation order
+  FOR rule_record IN
+    SELECT r.trigger_tags_normalized, r.trigger_match_type, r.replace_all_tags,
+           r.add_tags, r.add_tags_normalized, r.remove_tags_normalized
+    FROM public.tag_rules r
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+    ORDER BY r.created_at ASC, r.id ASC
+  LOOP
+    IF COALESCE(rule_record.trigger_match_type, 'any') = 'all' THEN
+      CONTINUE WHEN NOT current_normalized @> rule_record.trigger_tags_normalized;
+    ELSE
+      CONTINUE WHEN NOT current_normalized && rule_record.trigger_tags_normalized;
+    END IF;
+
+    rule_changed := false;
+
+    IF COALESCE(rule_record.replace_all_tags, false) THEN
+      IF rule_record.add_tags_normalized <> ARRAY[]::text[] THEN
+        updated_tags := public.clean_tag_array(rule_record.add_tags);
+        rule_changed := true;
+      END IF;
+    ELSE
+      IF NOT current_normalized @> rule_record.add_tags_normalized THEN
+        updated_tags := updated_tags || ARRAY(
+          SELECT tag
+          FROM unnest(public.clean_tag_array(rule_record.add_tags)) WITH ORDINALITY AS a(tag, ord)
+          WHERE lower(tag) <> ALL(current_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+
+      IF current_normalized && rule_record.remove_tags_normalized THEN
+        updated_tags := ARRAY(
+          SELECT tag
+          FROM unnest(updated_tags) WITH ORDINALITY AS u(tag, ord)
+          WHERE lower(trim(tag)) <> ALL(rule_record.remove_tags_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+    END IF;
+
+    IF rule_changed THEN
+      current_normalized := public.normalize_tag_array(updated_tags);
+      has_changes := true;
+    END IF;
+  END LOOP;
+
+  IF has_changes THEN
+    RETURN updated_tags;
+  ELSE
+    RETURN p_tags; -- unchanged
+  END IF;
+END;
+$function$;
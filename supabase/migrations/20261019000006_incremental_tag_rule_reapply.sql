@@ -0,0 +1,385 @@
+-- Incremental reapply of tag rules
+-- A rule change no longer rewrites every contact of the user inside the saving transaction.
+-- on_tag_rule_change enqueues a tag_rule_reapply_jobs row scoped to the tags the change can
+-- affect; callers drain it with run_tag_rule_reapply_job, one committed chunk per call,
+-- and only rows whose computed tags differ are written.
+
+-- Case-insensitive tag lookups (tag rules compare normalized tags, so the raw
+-- idx_contacts_tags index can't answer them)
+CREATE INDEX IF NOT EXISTS idx_contacts_tags_normalized
+  ON public.contacts USING GIN (public.normalize_tag_array(tags));
+CREATE INDEX IF NOT EXISTS idx_unsubscribed_contacts_tags_normalized
+  ON public.unsubscribed_contacts USING GIN (public.normalize_tag_array(tags));
+
+CREATE TABLE IF NOT EXISTS public.tag_rule_reapply_jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_id UUID NOT NULL,
+  -- Normalized tags selecting the contacts to re-evaluate; NULL means every contact
+  trigger_tags TEXT[],
+  status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'completed')),
+  phase TEXT NOT NULL DEFAULT 'contacts' CHECK (phase IN ('contacts', 'unsubscribed')),
+  last_id UUID,
+  total INTEGER,
+  processed INTEGER NOT NULL DEFAULT 0,
+  updated INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  completed_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE public.tag_rule_reapply_jobs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own tag rule reapply jobs"
+ON public.tag_rule_reapply_jobs
+FOR SELECT
+USING (auth.uid() = user_id);
+
+CREATE INDEX IF NOT EXISTS idx_tag_rule_reapply_jobs_pending
+  ON public.tag_rule_reapply_jobs(user_id, created_at)
+  WHERE status = 'pending';
+
+-- Whether the caller may act on p_user_id's data: signed-in users on their own, admins on
+-- anyone's. Without a signed-in user only the service role and database sessions outside
+-- the API (migrations, cron) pass; anon-key requests carry role 'anon' and are refused.
+CREATE OR REPLACE FUNCTION public.can_act_for(p_user_id uuid)
+RETURNS boolean
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT CASE
+    WHEN auth.uid() IS NOT NULL THEN COALESCE(auth.uid() = p_user_id, false) OR public.is_current_user_admin()
+    ELSE COALESCE(auth.role(), 'service_role') = 'service_role'
+  END;
+$function$;
+
+-- Expand normalized tags with the triggers of every enabled rule that can add one of
+-- them, until nothing new is added. A contact can only reach a rule through these tags.
+CREATE OR REPLACE FUNCTION public.tag_rule_upstream_triggers(p_user_id uuid, p_tags text[])
+RETURNS text[]
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  closure text[] := public.normalize_tag_array(p_tags);
+  expanded text[];
+BEGIN
+  LOOP
+    SELECT public.normalize_tag_array(closure || COALESCE(array_agg(t), ARRAY[]::text[]))
+    INTO expanded
+    FROM public.tag_rules r, unnest(r.trigger_tags_normalized) AS t
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.add_tags_normalized && closure;
+
+    EXIT WHEN expanded <@ closure;
+    closure := expanded;
+  END LOOP;
+  RETURN closure;
+END;
+$function$;
+
+-- Queue a reapply for p_user_id. p_trigger_tags NULL re-evaluates every contact.
+-- A job that hasn't started yet absorbs the new tags instead of queueing another one.
+CREATE OR REPLACE FUNCTION public.enqueue_tag_rule_reapply(p_user_id uuid, p_trigger_tags text[] DEFAULT NULL)
+RETURNS uuid
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  scope text[];
+  job_id uuid;
+BEGIN
+  IF NOT public.can_act_for(p_user_id) THEN
+    RAISE EXCEPTION 'Not allowed to reapply tag rules for user %', p_user_id;
+  END IF;
+
+  IF p_trigger_tags IS NOT NULL THEN
+    scope := public.tag_rule_upstream_triggers(p_user_id, p_trigger_tags);
+    IF scope = ARRAY[]::text[] THEN
+      RETURN NULL; -- nothing can be affected
+    END IF;
+  END IF;
+
+  SELECT id INTO job_id
+  FROM public.tag_rule_reapply_jobs
+  WHERE user_id = p_user_id
+    AND status = 'pending'
+    AND phase = 'contacts'
+    AND last_id IS NULL
+  ORDER BY created_at
+  LIMIT 1
+  FOR UPDATE;
+
+  IF job_id IS NOT NULL THEN
+    UPDATE public.tag_rule_reapply_jobs
+    SET trigger_tags = CASE
+          WHEN trigger_tags IS NULL OR scope IS NULL THEN NULL
+          ELSE public.normalize_tag_array(trigger_tags || scope)
+        END,
+        total = NULL,
+        updated_at = now()
+    WHERE id = job_id;
+    RETURN job_id;
+  END IF;
+
+  INSERT INTO public.tag_rule_reapply_jobs (user_id, trigger_tags)
+  VALUES (p_user_id, scope)
+  RETURNING id INTO job_id;
+  RETURN job_id;
+END;
+$function$;
+
+-- Process the next chunk of a reapply job and return its progress. Each call is meant to
+-- run in its own transaction (one RPC call, or one COMMIT in reapply_tag_rules_incremental),
+-- so row locks are held for at most p_chunk_size contacts.
+CREATE OR REPLACE FUNCTION public.run_tag_rule_reapply_job(p_job_id uuid, p_chunk_size integer DEFAULT 500)
+RETURNS public.tag_rule_reapply_jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  job public.tag_rule_reapply_jobs;
+  batch_count integer := 0;
+  changed_count integer := 0;
+  batch_last uuid;
+BEGIN
+  -- Serializes concurrent drainers of the same job
+  SELECT * INTO job FROM public.tag_rule_reapply_jobs WHERE id = p_job_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Tag rule reapply job % not found', p_job_id;
+  END IF;
+  IF NOT public.can_act_for(job.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to run tag rule reapply job %', p_job_id;
+  END IF;
+  IF job.status = 'completed' THEN
+    RETURN job;
+  END IF;
+
+  IF job.total IS NULL THEN
+    SELECT
+      (SELECT count(*) FROM public.contacts c
+       WHERE c.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags))
+      +
+      (SELECT count(*) FROM public.unsubscribed_contacts uc
+       WHERE uc.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags))
+    INTO job.total;
+  END IF;
+
+  IF job.phase = 'contacts' THEN
+    WITH batch AS (
+      SELECT c.id, c.tags
+      FROM public.contacts c
+      WHERE c.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR c.id > job.last_id)
+      ORDER BY c.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.contacts c
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE c.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING c.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed)
+    INTO batch_count, batch_last, changed_count
+    FROM evaluated e;
+  ELSE
+    WITH batch AS (
+      SELECT uc.id, uc.tags
+      FROM public.unsubscribed_contacts uc
+      WHERE uc.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR uc.id > job.last_id)
+      ORDER BY uc.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.unsubscribed_contacts uc
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE uc.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING uc.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed)
+    INTO batch_count, batch_last, changed_count
+    FROM evaluated e;
+  END IF;
+
+  job.processed := job.processed + batch_count;
+  job.updated := job.updated + changed_count;
+  job.last_id := COALESCE(batch_last, job.last_id);
+
+  IF batch_count < p_chunk_size THEN
+    IF job.phase = 'contacts' THEN
+      job.phase := 'unsubscribed';
+      job.last_id := NULL;
+    ELSE
+      job.status := 'completed';
+      job.completed_at := now();
+    END IF;
+  END IF;
+
+  UPDATE public.tag_rule_reapply_jobs
+  SET status = job.status,
+      phase = job.phase,
+      last_id = job.last_id,
+      total = job.total,
+      processed = job.processed,
+      updated = job.updated,
+      updated_at = now(),
+      completed_at = job.completed_at
+  WHERE id = job.id
+  RETURNING * INTO job;
+
+  RETURN job;
+END;
+$function$;
+
+-- Drain a reapply from SQL (psql, pg_cron), committing after every chunk:
+--   CALL public.reapply_tag_rules_incremental('<user id>');
+-- Transaction control isn't allowed in SECURITY DEFINER procedures, so run it as an owner.
+CREATE OR REPLACE PROCEDURE public.reapply_tag_rules_incremental(
+  p_user_id uuid,
+  p_trigger_tags text[] DEFAULT NULL,
+  p_chunk_size integer DEFAULT 500
+)
+LANGUAGE plpgsql
+AS $procedure$
+DECLARE
+  job_id uuid;
+  job public.tag_rule_reapply_jobs;
+BEGIN
+  job_id := public.enqueue_tag_rule_reapply(p_user_id, p_trigger_tags);
+  COMMIT;
+  IF job_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  LOOP
+    job := public.run_tag_rule_reapply_job(job_id, p_chunk_size);
+    COMMIT;
+    RAISE NOTICE 'Tag rule reapply %: % of % processed, % updated (%)',
+      job_id, job.processed, job.total, job.updated, job.phase;
+    EXIT WHEN job.status = 'completed';
+  END LOOP;
+END;
+$procedure$;
+
+-- Full reapply (kept for existing callers): still one statement, but unchanged rows are skipped
+CREATE OR REPLACE FUNCTION public.reapply_tag_rules_for_user(p_user_id uuid)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  IF NOT public.can_act_for(p_user_id) THEN
+    RAISE EXCEPTION 'Not allowed to reapply tag rules for user %', p_user_id;
+  END IF;
+
+  UPDATE public.contacts c
+  SET tags = e.new_tags
+  FROM (
+    SELECT id, tags, public.apply_tag_rules_pure(user_id, tags) AS new_tags
+    FROM public.contacts
+    WHERE user_id = p_user_id
+  ) e
+  WHERE c.id = e.id
+    AND e.new_tags IS DISTINCT FROM e.tags;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.reapply_tag_rules_to_unsubscribed_contacts(p_user_id uuid)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  IF NOT public.can_act_for(p_user_id) THEN
+    RAISE EXCEPTION 'Not allowed to reapply tag rules for user %', p_user_id;
+  END IF;
+
+  UPDATE public.unsubscribed_contacts uc
+  SET tags = e.new_tags
+  FROM (
+    SELECT id, tags, public.apply_tag_rules_pure(user_id, tags) AS new_tags
+    FROM public.unsubscribed_contacts
+    WHERE user_id = p_user_id
+  ) e
+  WHERE uc.id = e.id
+    AND e.new_tags IS DISTINCT FROM e.tags;
+END;
+$function$;
+
+-- Rule changes enqueue a scoped reapply instead of rewriting every contact in the
+-- saving transaction. Affected contacts are those carrying the old or new triggers,
+-- or the triggers of rules adding a tag this rule removes (deleting a remove can let
+-- another rule's add show through). replace_all rules can affect anything.
+CREATE OR REPLACE FUNCTION public.on_tag_rule_change()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid;
+  removed text[] := ARRAY[]::text[];
+  scope text[] := ARRAY[]::text[];
+BEGIN
+  target_user := COALESCE(NEW.user_id, OLD.user_id);
+  IF target_user IS NULL THEN
+    RETURN COALESCE(NEW, OLD);
+  END IF;
+
+  IF (TG_OP <> 'INSERT' AND COALESCE(OLD.replace_all_tags, false))
+     OR (TG_OP <> 'DELETE' AND COALESCE(NEW.replace_all_tags, false)) THEN
+    PERFORM public.enqueue_tag_rule_reapply(target_user, NULL);
+    RETURN COALESCE(NEW, OLD);
+  END IF;
+
+  IF TG_OP <> 'INSERT' THEN
+    scope := scope || OLD.trigger_tags_normalized;
+    removed := removed || OLD.remove_tags_normalized;
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    scope := scope || NEW.trigger_tags_normalized;
+    removed := removed || NEW.remove_tags_normalized;
+  END IF;
+
+  IF removed <> ARRAY[]::text[] THEN
+    scope := scope || ARRAY(
+      SELECT t
+      FROM public.tag_rules r, unnest(r.trigger_tags_normalized) AS t
+      WHERE r.user_id = target_user
+        AND r.enabled = true
+        AND r.add_tags_normalized && removed
+    );
+  END IF;
+
+  PERFORM public.enqueue_tag_rule_reapply(target_user, scope);
+  RETURN COALESCE(NEW, OLD);
+END;
+$function$;
+
+-- Clients reach these with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.enqueue_tag_rule_reapply(uuid, text[]) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.run_tag_rule_reapply_job(uuid, integer) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.reapply_tag_rules_for_user(uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.reapply_tag_rules_to_unsubscribed_contacts(uuid) FROM PUBLIC, anon;
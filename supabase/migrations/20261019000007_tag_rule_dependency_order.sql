@@ -0,0 +1,255 @@
+-- Fixed-point tag rule chaining
+-- Rule B depends on rule A when A can change B's trigger condition: A adds or removes one of
+-- B's trigger tags (for a replace_all rule, whose output is its add_tags, that means adding
+-- one). Each user's enabled rules are compiled into a
+-- versioned rule set evaluated in topological order of that graph, so when A adds a tag
+-- that triggers B, B always runs after A and one evaluation reaches the fixed point.
+-- Saving a rule that closes a cycle is rejected.
+
+CREATE TABLE IF NOT EXISTS public.tag_rule_sets (
+  user_id UUID PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 1,
+  -- Enabled rule ids in evaluation order
+  rule_order UUID[] NOT NULL DEFAULT ARRAY[]::uuid[],
+  -- Rules on a dependency cycle (only possible for rule sets saved before cycle checks);
+  -- they keep creation order relative to each other
+  cycle_rule_ids UUID[] NOT NULL DEFAULT ARRAY[]::uuid[],
+  compiled_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.tag_rule_sets ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own tag rule sets"
+ON public.tag_rule_sets
+FOR SELECT
+USING (auth.uid() = user_id);
+
+-- Build the dependency graph for p_user_id's enabled rules, order it (Kahn's algorithm,
+-- ties broken by creation order) and store it as the next rule-set version
+CREATE OR REPLACE FUNCTION public.compile_tag_rule_set(p_user_id uuid)
+RETURNS public.tag_rule_sets
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_ids uuid[];
+  edge_src uuid[];
+  edge_dst uuid[];
+  ordered uuid[] := ARRAY[]::uuid[];
+  remaining uuid[];
+  layer uuid[];
+  cyclic uuid[];
+  result public.tag_rule_sets;
+BEGIN
+  SELECT COALESCE(array_agg(r.id ORDER BY r.created_at, r.id), ARRAY[]::uuid[])
+  INTO rule_ids
+  FROM public.tag_rules r
+  WHERE r.user_id = p_user_id
+    AND r.enabled = true
+    AND r.trigger_tags_normalized <> ARRAY[]::text[];
+
+  -- a -> b: a can change whether b's triggers match. Self edges are harmless
+  -- (a rule adding or removing its own trigger still fires once) and are ignored.
+  -- replace_all rules get no blanket edges: two of them on unrelated triggers must not
+  -- form a cycle.
+  SELECT COALESCE(array_agg(a.id), ARRAY[]::uuid[]), COALESCE(array_agg(b.id), ARRAY[]::uuid[])
+  INTO edge_src, edge_dst
+  FROM public.tag_rules a
+  JOIN public.tag_rules b
+    ON b.user_id = a.user_id
+   AND b.id <> a.id
+  WHERE a.id = ANY(rule_ids)
+    AND b.id = ANY(rule_ids)
+    AND (a.add_tags_normalized || a.remove_tags_normalized) && b.trigger_tags_normalized;
+
+  remaining := rule_ids;
+  LOOP
+    -- Rules with no remaining predecessors
+    layer := ARRAY(
+      SELECT id
+      FROM unnest(remaining) WITH ORDINALITY AS r(id, pos)
+      WHERE NOT EXISTS (
+        SELECT 1
+        FROM unnest(edge_src, edge_dst) AS e(src, dst)
+        WHERE e.dst = r.id
+          AND e.src = ANY(remaining)
+      )
+      ORDER BY pos
+    );
+    EXIT WHEN layer = ARRAY[]::uuid[];
+    ordered := ordered || layer;
+    remaining := ARRAY(
+      SELECT id FROM unnest(remaining) WITH ORDINALITY AS r(id, pos)
+      WHERE id <> ALL(layer)
+      ORDER BY pos
+    );
+  END LOOP;
+
+  -- What is left is on a cycle or downstream of one; peel off rules with no remaining
+  -- successors to keep only the cycles themselves
+  cyclic := remaining;
+  LOOP
+    layer := ARRAY(
+      SELECT id
+      FROM unnest(cyclic) AS r(id)
+      WHERE NOT EXISTS (
+        SELECT 1
+        FROM unnest(edge_src, edge_dst) AS e(src, dst)
+        WHERE e.src = r.id
+          AND e.dst = ANY(cyclic)
+      )
+    );
+    EXIT WHEN layer = ARRAY[]::uuid[];
+    cyclic := ARRAY(SELECT id FROM unnest(cyclic) AS r(id) WHERE id <> ALL(layer));
+  END LOOP;
+
+  INSERT INTO public.tag_rule_sets (user_id, version, rule_order, cycle_rule_ids, compiled_at)
+  VALUES (p_user_id, 1, ordered || remaining, cyclic, now())
+  ON CONFLICT (user_id) DO UPDATE
+  SET version = tag_rule_sets.version + 1,
+      rule_order = EXCLUDED.rule_order,
+      cycle_rule_ids = EXCLUDED.cycle_rule_ids,
+      compiled_at = EXCLUDED.compiled_at
+  RETURNING * INTO result;
+
+  RETURN result;
+END;
+$function$;
+
+-- Recompile on every rule change; reject a save that puts the saved rule on a cycle
+CREATE OR REPLACE FUNCTION public.on_tag_rule_set_change()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_set public.tag_rule_sets;
+  cycle_names text;
+BEGIN
+  rule_set := public.compile_tag_rule_set(COALESCE(NEW.user_id, OLD.user_id));
+
+  IF TG_OP <> 'DELETE' AND NEW.id = ANY(rule_set.cycle_rule_ids) THEN
+    SELECT string_agg(COALESCE(r.name, r.id::text), ', ' ORDER BY r.created_at)
+    INTO cycle_names
+    FROM public.tag_rules r
+    WHERE r.id = ANY(rule_set.cycle_rule_ids);
+
+    RAISE EXCEPTION 'Tag rule "%" creates a cycle with: %', COALESCE(NEW.name, NEW.id::text), cycle_names
+      USING ERRCODE = 'check_violation',
+            HINT = 'Rules on a cycle add or remove each other''s trigger tags. Change their trigger, add or remove tags so one of them no longer affects the other.';
+  END IF;
+
+  RETURN COALESCE(NEW, OLD);
+END;
+$function$;
+
+-- AFTER triggers fire in name order, so the rule set is recompiled (or the save rejected)
+-- before trg_on_tag_rule_change queues a reapply
+DROP TRIGGER IF EXISTS trg_compile_tag_rule_set ON public.tag_rules;
+CREATE TRIGGER trg_compile_tag_rule_set
+AFTER INSERT OR UPDATE OR DELETE ON public.tag_rules
+FOR EACH ROW
+EXECUTE FUNCTION public.on_tag_rule_set_change();
+
+-- Compile existing rule sets; pre-existing cycles are recorded, not rejected
+SELECT public.compile_tag_rule_set(user_id)
+FROM (SELECT DISTINCT user_id FROM public.tag_rules) users;
+
+-- Evaluate rules in rule-set order instead of creation order
+CREATE OR REPLACE FUNCTION public.apply_tag_rules_pure(p_user_id uuid, p_tags text[])
+RETURNS text[]
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_record RECORD;
+  updated_tags text[] := COALESCE(p_tags, ARRAY[]::text[]);
+  current_normalized text[];
+  rule_changed boolean;
+  has_changes boolean := false;
+BEGIN
+  current_normalized := public.normalize_tag_array(updated_tags);
+
+  -- Rules only change tags after one fires, so if no rule matches the incoming tags
+  -- none can match later either
+  IF NOT EXISTS (
+    SELECT 1
+    FROM public.tag_rules r
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+      AND CASE WHEN COALESCE(r.trigger_match_type, 'any') = 'all'
+               THEN current_normalized @> r.trigger_tags_normalized
+               ELSE current_normalized && r.trigger_tags_normalized
+          END
+  ) THEN
+    RETURN p_tags;
+  END IF;
+
+  -- Topological order: every rule runs after the rules that can change its triggers
+  FOR rule_record IN
+    SELECT r.trigger_tags_normalized, r.trigger_match_type, r.replace_all_tags,
+           r.add_tags, r.add_tags_normalized, r.remove_tags_normalized
+    FROM public.tag_rule_sets rs
+    CROSS JOIN LATERAL unnest(rs.rule_order) WITH ORDINALITY AS o(rule_id, pos)
+    JOIN public.tag_rules r ON r.id = o.rule_id
+    WHERE rs.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+    ORDER BY o.pos
+  LOOP
+    IF COALESCE(rule_record.trigger_match_type, 'any') = 'all' THEN
+      CONTINUE WHEN NOT current_normalized @> rule_record.trigger_tags_normalized;
+    ELSE
+      CONTINUE WHEN NOT current_normalized && rule_record.trigger_tags_normalized;
+    END IF;
+
+    rule_changed := false;
+
+    IF COALESCE(rule_record.replace_all_tags, false) THEN
+      IF rule_record.add_tags_normalized <> ARRAY[]::text[] THEN
+        updated_tags := public.clean_tag_array(rule_record.add_tags);
+        rule_changed := true;
+      END IF;
+    ELSE
+      IF NOT current_normalized @> rule_record.add_tags_normalized THEN
+        updated_tags := updated_tags || ARRAY(
+          SELECT tag
+          FROM unnest(public.clean_tag_array(rule_record.add_tags)) WITH ORDINALITY AS a(tag, ord)
+          WHERE lower(tag) <> ALL(current_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+
+      IF current_normalized && rule_record.remove_tags_normalized THEN
+        updated_tags := ARRAY(
+          SELECT tag
+          FROM unnest(updated_tags) WITH ORDINALITY AS u(tag, ord)
+          WHERE lower(trim(tag)) <> ALL(rule_record.remove_tags_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+    END IF;
+
+    IF rule_changed THEN
+      current_normalized := public.normalize_tag_array(updated_tags);
+      has_changes := true;
+    END IF;
+  END LOOP;
+
+  IF has_changes THEN
+    RETURN updated_tags;
+  ELSE
+    RETURN p_tags; -- unchanged
+  END IF;
+END;
+$function$;
+
+-- Recompiled from the tag_rules trigger only
+REVOKE EXECUTE ON FUNCTION public.compile_tag_rule_set(uuid) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,394 @@
+-- Memoized tag rule evaluation
+-- Rule outcomes depend only on the contact's normalized tag set, and most contacts share a
+-- few distinct combinations. apply_tag_rules_pure now caches, per user and rule-set
+-- version, the delta a tag set produces (tags removed from the input, tags appended, or a
+-- full replacement) and applies it to each row's own spelling and order of tags.
+-- Entries for older versions are dropped whenever the rule set is recompiled, and entries
+-- older than a day are pruned by process-automations so the cache stays bounded.
+
+CREATE TABLE IF NOT EXISTS public.tag_rule_eval_cache (
+  user_id UUID NOT NULL,
+  rule_set_version BIGINT NOT NULL,
+  -- md5 of the normalized tag array
+  tag_set_hash UUID NOT NULL,
+  unchanged BOOLEAN NOT NULL,
+  replaced BOOLEAN NOT NULL DEFAULT false,
+  -- Normalized tags filtered out of the input; NULL when no removal happened
+  removed TEXT[],
+  appended TEXT[] NOT NULL DEFAULT ARRAY[]::text[],
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, rule_set_version, tag_set_hash)
+);
+
+-- Internal to the rule engine; no client access
+ALTER TABLE public.tag_rule_eval_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_tag_rule_eval_cache_created_at
+  ON public.tag_rule_eval_cache(created_at);
+
+ALTER TABLE public.tag_rule_reapply_jobs
+  ADD COLUMN IF NOT EXISTS cache_hits BIGINT NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS cache_misses BIGINT NOT NULL DEFAULT 0;
+
+-- Drop cache entries of superseded rule-set versions
+CREATE OR REPLACE FUNCTION public.on_tag_rule_set_version_change()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  DELETE FROM public.tag_rule_eval_cache
+  WHERE user_id = NEW.user_id
+    AND rule_set_version < NEW.version;
+  RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_invalidate_tag_rule_eval_cache ON public.tag_rule_sets;
+CREATE TRIGGER trg_invalidate_tag_rule_eval_cache
+AFTER UPDATE OF version ON public.tag_rule_sets
+FOR EACH ROW
+EXECUTE FUNCTION public.on_tag_rule_set_version_change();
+
+-- Cache hits and misses of the current session
+CREATE OR REPLACE FUNCTION public.tag_rule_cache_stats()
+RETURNS TABLE(hits bigint, misses bigint, hit_rate numeric)
+LANGUAGE sql
+STABLE
+AS $function$
+  SELECT h, m, CASE WHEN h + m > 0 THEN round(h::numeric / (h + m), 4) ELSE NULL END
+  FROM (
+    SELECT COALESCE(NULLIF(current_setting('tag_rules.cache_hits', true), ''), '0')::bigint AS h,
+           COALESCE(NULLIF(current_setting('tag_rules.cache_misses', true), ''), '0')::bigint AS m
+  ) counters;
+$function$;
+
+-- Evaluate the rule set against a normalized tag set and describe the result as a delta:
+-- unchanged (no rule fired), replaced (appended is the whole result), otherwise the input
+-- minus the tags in removed (if not NULL) followed by appended.
+-- Same steps as the previous apply_tag_rules_pure loop.
+CREATE OR REPLACE FUNCTION public.tag_rule_delta(
+  p_user_id uuid,
+  p_normalized text[],
+  OUT unchanged boolean,
+  OUT replaced boolean,
+  OUT removed text[],
+  OUT appended text[]
+)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_record RECORD;
+  input_normalized text[] := COALESCE(p_normalized, ARRAY[]::text[]);
+  current_normalized text[] := COALESCE(p_normalized, ARRAY[]::text[]);
+  rule_changed boolean;
+BEGIN
+  unchanged := true;
+  replaced := false;
+  removed := NULL;
+  appended := ARRAY[]::text[];
+
+  -- Rules only change tags after one fires, so if no rule matches the incoming tags
+  -- none can match later either
+  IF NOT EXISTS (
+    SELECT 1
+    FROM public.tag_rules r
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+      AND CASE WHEN COALESCE(r.trigger_match_type, 'any') = 'all'
+               THEN current_normalized @> r.trigger_tags_normalized
+               ELSE current_normalized && r.trigger_tags_normalized
+          END
+  ) THEN
+    RETURN;
+  END IF;
+
+  -- Topological order: every rule runs after the rules that can change its triggers
+  FOR rule_record IN
+    SELECT r.trigger_tags_normalized, r.trigger_match_type, r.replace_all_tags,
+           r.add_tags, r.add_tags_normalized, r.remove_tags_normalized
+    FROM public.tag_rule_sets rs
+    CROSS JOIN LATERAL unnest(rs.rule_order) WITH ORDINALITY AS o(rule_id, pos)
+    JOIN public.tag_rules r ON r.id = o.rule_id
+    WHERE rs.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+    ORDER BY o.pos
+  LOOP
+    IF COALESCE(rule_record.trigger_match_type, 'any') = 'all' THEN
+      CONTINUE WHEN NOT current_normalized @> rule_record.trigger_tags_normalized;
+    ELSE
+      CONTINUE WHEN NOT current_normalized && rule_record.trigger_tags_normalized;
+    END IF;
+
+    rule_changed := false;
+
+    IF COALESCE(rule_record.replace_all_tags, false) THEN
+      IF rule_record.add_tags_normalized <> ARRAY[]::text[] THEN
+        replaced := true;
+        removed := NULL;
+        appended := public.clean_tag_array(rule_record.add_tags);
+        rule_changed := true;
+      END IF;
+    ELSE
+      IF NOT current_normalized @> rule_record.add_tags_normalized THEN
+        appended := appended || ARRAY(
+          SELECT tag
+          FROM unnest(public.clean_tag_array(rule_record.add_tags)) WITH ORDINALITY AS a(tag, ord)
+          WHERE lower(tag) <> ALL(current_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+
+      IF current_normalized && rule_record.remove_tags_normalized THEN
+        IF NOT replaced THEN
+          removed := public.normalize_tag_array(COALESCE(removed, ARRAY[]::text[]) || rule_record.remove_tags_normalized);
+        END IF;
+        appended := ARRAY(
+          SELECT tag
+          FROM unnest(appended) WITH ORDINALITY AS u(tag, ord)
+          WHERE lower(trim(tag)) <> ALL(rule_record.remove_tags_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+    END IF;
+
+    IF rule_changed THEN
+      unchanged := false;
+      IF replaced THEN
+        current_normalized := public.normalize_tag_array(appended);
+      ELSE
+        current_normalized := public.normalize_tag_array(
+          ARRAY(SELECT t FROM unnest(input_normalized) AS t WHERE t <> ALL(COALESCE(removed, ARRAY[]::text[])))
+          || appended
+        );
+      END IF;
+    END IF;
+  END LOOP;
+END;
+$function$;
+
+-- Volatile now: misses are written to tag_rule_eval_cache
+CREATE OR REPLACE FUNCTION public.apply_tag_rules_pure(p_user_id uuid, p_tags text[])
+RETURNS text[]
+LANGUAGE plpgsql
+VOLATILE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  normalized text[] := public.normalize_tag_array(p_tags);
+  tag_hash uuid;
+  current_version bigint;
+  delta RECORD;
+BEGIN
+  SELECT version INTO current_version FROM public.tag_rule_sets WHERE user_id = p_user_id;
+  IF NOT FOUND THEN
+    RETURN p_tags; -- user has never had rules
+  END IF;
+
+  tag_hash := md5(array_to_string(normalized, chr(31)))::uuid;
+
+  SELECT c.unchanged, c.replaced, c.removed, c.appended INTO delta
+  FROM public.tag_rule_eval_cache c
+  WHERE c.user_id = p_user_id
+    AND c.rule_set_version = current_version
+    AND c.tag_set_hash = tag_hash;
+
+  IF FOUND THEN
+    PERFORM set_config('tag_rules.cache_hits',
+      (COALESCE(NULLIF(current_setting('tag_rules.cache_hits', true), ''), '0')::bigint + 1)::text, false);
+  ELSE
+    SELECT d.unchanged, d.replaced, d.removed, d.appended INTO delta
+    FROM public.tag_rule_delta(p_user_id, normalized) d;
+
+    INSERT INTO public.tag_rule_eval_cache (user_id, rule_set_version, tag_set_hash, unchanged, replaced, removed, appended)
+    VALUES (p_user_id, current_version, tag_hash, delta.unchanged, delta.replaced, delta.removed, delta.appended)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM set_config('tag_rules.cache_misses',
+      (COALESCE(NULLIF(current_setting('tag_rules.cache_misses', true), ''), '0')::bigint + 1)::text, false);
+  END IF;
+
+  IF delta.unchanged THEN
+    RETURN p_tags;
+  ELSIF delta.replaced THEN
+    RETURN delta.appended;
+  ELSIF delta.removed IS NULL THEN
+    RETURN COALESCE(p_tags, ARRAY[]::text[]) || delta.appended;
+  ELSE
+    RETURN ARRAY(
+      SELECT tag
+      FROM unnest(COALESCE(p_tags, ARRAY[]::text[])) WITH ORDINALITY AS u(tag, ord)
+      WHERE lower(trim(tag)) <> ALL(delta.removed)
+      ORDER BY ord
+    ) || delta.appended;
+  END IF;
+END;
+$function$;
+
+-- Record cache hits and misses per reapply job
+CREATE OR REPLACE FUNCTION public.run_tag_rule_reapply_job(p_job_id uuid, p_chunk_size integer DEFAULT 500)
+RETURNS public.tag_rule_reapply_jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  job public.tag_rule_reapply_jobs;
+  batch_count integer := 0;
+  changed_count integer := 0;
+  batch_last uuid;
+  hits_before bigint;
+  misses_before bigint;
+BEGIN
+  -- Serializes concurrent drainers of the same job
+  SELECT * INTO job FROM public.tag_rule_reapply_jobs WHERE id = p_job_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Tag rule reapply job % not found', p_job_id;
+  END IF;
+  IF NOT public.can_act_for(job.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to run tag rule reapply job %', p_job_id;
+  END IF;
+  IF job.status = 'completed' THEN
+    RETURN job;
+  END IF;
+
+  IF job.total IS NULL THEN
+    SELECT
+      (SELECT count(*) FROM public.contacts c
+       WHERE c.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags))
+      +
+      (SELECT count(*) FROM public.unsubscribed_contacts uc
+       WHERE uc.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags))
+    INTO job.total;
+  END IF;
+
+  SELECT s.hits, s.misses INTO hits_before, misses_before FROM public.tag_rule_cache_stats() s;
+
+  IF job.phase = 'contacts' THEN
+    WITH batch AS (
+      SELECT c.id, c.tags
+      FROM public.contacts c
+      WHERE c.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR c.id > job.last_id)
+      ORDER BY c.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.contacts c
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE c.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING c.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed)
+    INTO batch_count, batch_last, changed_count
+    FROM evaluated e;
+  ELSE
+    WITH batch AS (
+      SELECT uc.id, uc.tags
+      FROM public.unsubscribed_contacts uc
+      WHERE uc.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR uc.id > job.last_id)
+      ORDER BY uc.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.unsubscribed_contacts uc
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE uc.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING uc.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed)
+    INTO batch_count, batch_last, changed_count
+    FROM evaluated e;
+  END IF;
+
+  SELECT job.cache_hits + s.hits - hits_before, job.cache_misses + s.misses - misses_before
+  INTO job.cache_hits, job.cache_misses
+  FROM public.tag_rule_cache_stats() s;
+
+  job.processed := job.processed + batch_count;
+  job.updated := job.updated + changed_count;
+  job.last_id := COALESCE(batch_last, job.last_id);
+
+  IF batch_count < p_chunk_size THEN
+    IF job.phase = 'contacts' THEN
+      job.phase := 'unsubscribed';
+      job.last_id := NULL;
+    ELSE
+      job.status := 'completed';
+      job.completed_at := now();
+    END IF;
+  END IF;
+
+  UPDATE public.tag_rule_reapply_jobs
+  SET status = job.status,
+      phase = job.phase,
+      last_id = job.last_id,
+      total = job.total,
+      processed = job.processed,
+      updated = job.updated,
+      cache_hits = job.cache_hits,
+      cache_misses = job.cache_misses,
+      updated_at = now(),
+      completed_at = job.completed_at
+  WHERE id = job.id
+  RETURNING * INTO job;
+
+  RETURN job;
+END;
+$function$;
+
+-- Retention: delete up to p_batch_size cache entries older than p_keep. A pruned tag set
+-- that is still in use is simply evaluated and cached again on its next miss.
+CREATE OR REPLACE FUNCTION public.prune_tag_rule_eval_cache(
+  p_keep interval DEFAULT interval '1 day',
+  p_batch_size integer DEFAULT 5000
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deleted integer;
+BEGIN
+  DELETE FROM public.tag_rule_eval_cache
+  WHERE (user_id, rule_set_version, tag_set_hash) IN (
+    SELECT user_id, rule_set_version, tag_set_hash
+    FROM public.tag_rule_eval_cache
+    WHERE created_at < now() - p_keep
+    ORDER BY created_at
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted = ROW_COUNT;
+  RETURN deleted;
+END;
+$function$;
+
+-- Maintenance only; run by process-automations with the service role
+REVOKE EXECUTE ON FUNCTION public.prune_tag_rule_eval_cache(interval, integer) FROM PUBLIC, anon, authenticated;
+
+-- Rule evaluation runs from SECURITY DEFINER triggers and reapply jobs only
+REVOKE EXECUTE ON FUNCTION public.apply_tag_rules_pure(uuid, text[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.tag_rule_delta(uuid, text[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,597 @@
+-- Batched tag rule auditing
+-- tag_rule_executions carries four indexes, so one row per rule firing turns a large
+-- reapply into as many extra indexed inserts. Auditing is now configured per user
+-- (user_settings.tag_rule_audit_mode):
+--   off      nothing is recorded
+--   summary  per-rule counts per reapply job in tag_rule_execution_summaries (default)
+--   sample   summary, plus per-contact rows for tag_rule_audit_sample_rate of the changes
+--   full     summary, plus per-contact rows for every change
+-- Reapply jobs write summaries and per-contact rows with one statement per chunk. Rule
+-- firings on ordinary contact writes go to an unlogged, unindexed buffer that
+-- flush_tag_rule_execution_buffer moves into tag_rule_executions in bulk.
+-- prune_tag_rule_executions removes old audit rows in batches.
+
+ALTER TABLE public.user_settings
+  ADD COLUMN IF NOT EXISTS tag_rule_audit_mode TEXT NOT NULL DEFAULT 'summary'
+    CHECK (tag_rule_audit_mode IN ('off', 'summary', 'sample', 'full')),
+  ADD COLUMN IF NOT EXISTS tag_rule_audit_sample_rate NUMERIC NOT NULL DEFAULT 0.01
+    CHECK (tag_rule_audit_sample_rate >= 0 AND tag_rule_audit_sample_rate <= 1);
+
+CREATE TABLE IF NOT EXISTS public.tag_rule_execution_summaries (
+  job_id UUID NOT NULL REFERENCES public.tag_rule_reapply_jobs(id) ON DELETE CASCADE,
+  rule_id UUID NOT NULL REFERENCES public.tag_rules(id) ON DELETE CASCADE,
+  user_id UUID NOT NULL,
+  contacts_changed BIGINT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (job_id, rule_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tag_rule_execution_summaries_updated_at
+ON public.tag_rule_execution_summaries (updated_at);
+
+ALTER TABLE public.tag_rule_execution_summaries ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own tag rule execution summaries"
+ON public.tag_rule_execution_summaries
+FOR SELECT
+USING (public.is_current_user_admin() OR auth.uid() = user_id);
+
+-- Unlogged: a crash loses at most the audit rows not yet flushed
+CREATE UNLOGGED TABLE IF NOT EXISTS public.tag_rule_execution_buffer (
+  id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  user_id UUID NOT NULL,
+  contact_id UUID NOT NULL,
+  rule_ids UUID[] NOT NULL,
+  tags_before TEXT[] NOT NULL,
+  tags_after TEXT[] NOT NULL,
+  buffered_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Internal to the rule engine; no client access
+ALTER TABLE public.tag_rule_execution_buffer ENABLE ROW LEVEL SECURITY;
+
+-- Rules that changed the tags, in evaluation order. Existing entries predate the column.
+ALTER TABLE public.tag_rule_eval_cache
+  ADD COLUMN IF NOT EXISTS fired_rule_ids UUID[] NOT NULL DEFAULT ARRAY[]::uuid[];
+
+DELETE FROM public.tag_rule_eval_cache;
+
+CREATE OR REPLACE FUNCTION public.tag_rule_audit_settings(p_user_id uuid, OUT mode text, OUT sample_rate numeric)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT COALESCE(s.tag_rule_audit_mode, 'summary'), COALESCE(s.tag_rule_audit_sample_rate, 0.01)
+  FROM (SELECT 1) one
+  LEFT JOIN public.user_settings s ON s.user_id = p_user_id
+  LIMIT 1;
+$function$;
+
+-- Cache key of a normalized tag array
+CREATE OR REPLACE FUNCTION public.tag_set_hash(p_normalized text[])
+RETURNS uuid
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT md5(array_to_string(p_normalized, chr(31)))::uuid;
+$function$;
+
+-- Same evaluation as before; also reports which rules changed the tags
+DROP FUNCTION IF EXISTS public.tag_rule_delta(uuid, text[]);
+
+CREATE OR REPLACE FUNCTION public.tag_rule_delta(
+  p_user_id uuid,
+  p_normalized text[],
+  OUT unchanged boolean,
+  OUT replaced boolean,
+  OUT removed text[],
+  OUT appended text[],
+  OUT fired_rule_ids uuid[]
+)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  rule_record RECORD;
+  input_normalized text[] := COALESCE(p_normalized, ARRAY[]::text[]);
+  current_normalized text[] := COALESCE(p_normalized, ARRAY[]::text[]);
+  rule_changed boolean;
+BEGIN
+  unchanged := true;
+  replaced := false;
+  removed := NULL;
+  appended := ARRAY[]::text[];
+  fired_rule_ids := ARRAY[]::uuid[];
+
+  -- Rules only change tags after one fires, so if no rule matches the incoming tags
+  -- none can match later either
+  IF NOT EXISTS (
+    SELECT 1
+    FROM public.tag_rules r
+    WHERE r.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+      AND CASE WHEN COALESCE(r.trigger_match_type, 'any') = 'all'
+               THEN current_normalized @> r.trigger_tags_normalized
+               ELSE current_normalized && r.trigger_tags_normalized
+          END
+  ) THEN
+    RETURN;
+  END IF;
+
+  -- Topological order: every rule runs after the rules that can change its triggers
+  FOR rule_record IN
+    SELECT r.id, r.trigger_tags_normalized, r.trigger_match_type, r.replace_all_tags,
+           r.add_tags, r.add_tags_normalized, r.remove_tags_normalized
+    FROM public.tag_rule_sets rs
+    CROSS JOIN LATERAL unnest(rs.rule_order) WITH ORDINALITY AS o(rule_id, pos)
+    JOIN public.tag_rules r ON r.id = o.rule_id
+    WHERE rs.user_id = p_user_id
+      AND r.enabled = true
+      AND r.trigger_tags_normalized <> ARRAY[]::text[]
+    ORDER BY o.pos
+  LOOP
+    IF COALESCE(rule_record.trigger_match_type, 'any') = 'all' THEN
+      CONTINUE WHEN NOT current_normalized @> rule_record.trigger_tags_normalized;
+    ELSE
+      CONTINUE WHEN NOT current_normalized && rule_record.trigger_tags_normalized;
+    END IF;
+
+    rule_changed := false;
+
+    IF COALESCE(rule_record.replace_all_tags, false) THEN
+      IF rule_record.add_tags_normalized <> ARRAY[]::text[] THEN
+        replaced := true;
+        removed := NULL;
+        appended := public.clean_tag_array(rule_record.add_tags);
+        rule_changed := true;
+      END IF;
+    ELSE
+      IF NOT current_normalized @> rule_record.add_tags_normalized THEN
+        appended := appended || ARRAY(
+          SELECT tag
+          FROM unnest(public.clean_tag_array(rule_record.add_tags)) WITH ORDINALITY AS a(tag, ord)
+          WHERE lower(tag) <> ALL(current_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+
+      IF current_normalized && rule_record.remove_tags_normalized THEN
+        IF NOT replaced THEN
+          removed := public.normalize_tag_array(COALESCE(removed, ARRAY[]::text[]) || rule_record.remove_tags_normalized);
+        END IF;
+        appended := ARRAY(
+          SELECT tag
+          FROM unnest(appended) WITH ORDINALITY AS u(tag, ord)
+          WHERE lower(trim(tag)) <> ALL(rule_record.remove_tags_normalized)
+          ORDER BY ord
+        );
+        rule_changed := true;
+      END IF;
+    END IF;
+
+    IF rule_changed THEN
+      unchanged := false;
+      fired_rule_ids := fired_rule_ids || rule_record.id;
+      IF replaced THEN
+        current_normalized := public.normalize_tag_array(appended);
+      ELSE
+        current_normalized := public.normalize_tag_array(
+          ARRAY(SELECT t FROM unnest(input_normalized) AS t WHERE t <> ALL(COALESCE(removed, ARRAY[]::text[])))
+          || appended
+        );
+      END IF;
+    END IF;
+  END LOOP;
+END;
+$function$;
+
+-- Store the fired rules with each cache entry
+CREATE OR REPLACE FUNCTION public.apply_tag_rules_pure(p_user_id uuid, p_tags text[])
+RETURNS text[]
+LANGUAGE plpgsql
+VOLATILE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  normalized text[] := public.normalize_tag_array(p_tags);
+  tag_hash uuid;
+  current_version bigint;
+  delta RECORD;
+BEGIN
+  SELECT version INTO current_version FROM public.tag_rule_sets WHERE user_id = p_user_id;
+  IF NOT FOUND THEN
+    RETURN p_tags; -- user has never had rules
+  END IF;
+
+  tag_hash := public.tag_set_hash(normalized);
+
+  SELECT c.unchanged, c.replaced, c.removed, c.appended INTO delta
+  FROM public.tag_rule_eval_cache c
+  WHERE c.user_id = p_user_id
+    AND c.rule_set_version = current_version
+    AND c.tag_set_hash = tag_hash;
+
+  IF FOUND THEN
+    PERFORM set_config('tag_rules.cache_hits',
+      (COALESCE(NULLIF(current_setting('tag_rules.cache_hits', true), ''), '0')::bigint + 1)::text, false);
+  ELSE
+    SELECT d.unchanged, d.replaced, d.removed, d.appended, d.fired_rule_ids INTO delta
+    FROM public.tag_rule_delta(p_user_id, normalized) d;
+
+    INSERT INTO public.tag_rule_eval_cache (user_id, rule_set_version, tag_set_hash, unchanged, replaced, removed,
+                                            appended, fired_rule_ids)
+    VALUES (p_user_id, current_version, tag_hash, delta.unchanged, delta.replaced, delta.removed, delta.appended,
+            delta.fired_rule_ids)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM set_config('tag_rules.cache_misses',
+      (COALESCE(NULLIF(current_setting('tag_rules.cache_misses', true), ''), '0')::bigint + 1)::text, false);
+  END IF;
+
+  IF delta.unchanged THEN
+    RETURN p_tags;
+  ELSIF delta.replaced THEN
+    RETURN delta.appended;
+  ELSIF delta.removed IS NULL THEN
+    RETURN COALESCE(p_tags, ARRAY[]::text[]) || delta.appended;
+  ELSE
+    RETURN ARRAY(
+      SELECT tag
+      FROM unnest(COALESCE(p_tags, ARRAY[]::text[])) WITH ORDINALITY AS u(tag, ord)
+      WHERE lower(trim(tag)) <> ALL(delta.removed)
+      ORDER BY ord
+    ) || delta.appended;
+  END IF;
+END;
+$function$;
+
+-- tag_rule_delta was dropped and recreated, so it is back to the default grants
+REVOKE EXECUTE ON FUNCTION public.tag_rule_delta(uuid, text[]) FROM PUBLIC, anon, authenticated;
+
+-- Contact writes: evaluate rules as before and buffer sampled firings
+CREATE OR REPLACE FUNCTION public.apply_tag_rules_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  tags_before text[];
+  audit RECORD;
+  fired uuid[];
+BEGIN
+  -- Only process if tags actually changed to avoid extra work
+  IF TG_OP = 'UPDATE' AND OLD.tags IS NOT DISTINCT FROM NEW.tags THEN
+    RETURN NEW;
+  END IF;
+
+  tags_before := NEW.tags;
+  NEW.tags := public.apply_tag_rules_pure(NEW.user_id, NEW.tags);
+  IF NEW.tags IS NOT DISTINCT FROM tags_before THEN
+    RETURN NEW;
+  END IF;
+
+  SELECT * INTO audit FROM public.tag_rule_audit_settings(NEW.user_id);
+  IF audit.mode = 'full' OR (audit.mode = 'sample' AND random() < audit.sample_rate) THEN
+    -- apply_tag_rules_pure has just looked up or written this entry
+    SELECT c.fired_rule_ids INTO fired
+    FROM public.tag_rule_sets rs
+    JOIN public.tag_rule_eval_cache c
+      ON c.user_id = rs.user_id
+     AND c.rule_set_version = rs.version
+    WHERE rs.user_id = NEW.user_id
+      AND c.tag_set_hash = public.tag_set_hash(public.normalize_tag_array(tags_before));
+
+    INSERT INTO public.tag_rule_execution_buffer (user_id, contact_id, rule_ids, tags_before, tags_after)
+    VALUES (NEW.user_id, NEW.id, COALESCE(fired, ARRAY[]::uuid[]), COALESCE(tags_before, ARRAY[]::text[]),
+            COALESCE(NEW.tags, ARRAY[]::text[]));
+  END IF;
+
+  RETURN NEW;
+END;
+$function$;
+
+-- Move buffered firings into tag_rule_executions in one statement; buffered contacts that
+-- no longer exist are dropped. Returns the number of buffer rows consumed.
+CREATE OR REPLACE FUNCTION public.flush_tag_rule_execution_buffer(p_batch_size integer DEFAULT 5000)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  moved_count integer;
+BEGIN
+  WITH moved AS (
+    DELETE FROM public.tag_rule_execution_buffer
+    WHERE id IN (
+      SELECT id
+      FROM public.tag_rule_execution_buffer
+      ORDER BY id
+      LIMIT p_batch_size
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+  ), logged AS (
+    INSERT INTO public.tag_rule_executions (
+      rule_id, rule_name, contact_id, contact_email, user_id, triggered_at, trigger_match_type,
+      trigger_tags_before, trigger_tags_after, tags_added, tags_removed, tags_before, tags_after,
+      execution_successful
+    )
+    SELECT r.id, r.name, ct.id, ct.email, m.user_id, m.buffered_at, COALESCE(r.trigger_match_type, 'any'),
+           m.tags_before, m.tags_after, r.add_tags, r.remove_tags, m.tags_before, m.tags_after,
+           true
+    FROM moved m
+    JOIN public.contacts ct ON ct.id = m.contact_id
+    CROSS JOIN LATERAL unnest(m.rule_ids) AS f(rule_id)
+    JOIN public.tag_rules r ON r.id = f.rule_id
+    RETURNING 1
+  )
+  SELECT count(*) INTO moved_count FROM moved;
+
+  RETURN moved_count;
+END;
+$function$;
+
+-- Audit one reapply chunk. p_changed holds {id, hash, tags_before} for each contact the
+-- chunk changed; p_contacts is false for unsubscribed contacts, which
+-- tag_rule_executions cannot reference.
+CREATE OR REPLACE FUNCTION public.log_tag_rule_reapply_chunk(
+  p_job_id uuid,
+  p_user_id uuid,
+  p_changed jsonb,
+  p_contacts boolean
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  audit RECORD;
+  current_version bigint;
+BEGIN
+  IF p_changed IS NULL OR jsonb_array_length(p_changed) = 0 THEN
+    RETURN;
+  END IF;
+
+  SELECT * INTO audit FROM public.tag_rule_audit_settings(p_user_id);
+  IF audit.mode = 'off' THEN
+    RETURN;
+  END IF;
+
+  SELECT version INTO current_version FROM public.tag_rule_sets WHERE user_id = p_user_id;
+
+  INSERT INTO public.tag_rule_execution_summaries (job_id, rule_id, user_id, contacts_changed)
+  SELECT p_job_id, f.rule_id, p_user_id, count(*)
+  FROM jsonb_array_elements(p_changed) AS ch(entry)
+  JOIN public.tag_rule_eval_cache c
+    ON c.user_id = p_user_id
+   AND c.rule_set_version = current_version
+   AND c.tag_set_hash = (ch.entry->>'hash')::uuid
+  CROSS JOIN LATERAL unnest(c.fired_rule_ids) AS f(rule_id)
+  WHERE EXISTS (SELECT 1 FROM public.tag_rules r WHERE r.id = f.rule_id)
+  GROUP BY f.rule_id
+  ON CONFLICT (job_id, rule_id) DO UPDATE
+  SET contacts_changed = tag_rule_execution_summaries.contacts_changed + EXCLUDED.contacts_changed,
+      updated_at = now();
+
+  IF NOT p_contacts OR audit.mode NOT IN ('sample', 'full') THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO public.tag_rule_executions (
+    rule_id, rule_name, contact_id, contact_email, user_id, trigger_match_type,
+    trigger_tags_before, trigger_tags_after, tags_added, tags_removed, tags_before, tags_after,
+    execution_successful
+  )
+  SELECT r.id, r.name, ct.id, ct.email, p_user_id, COALESCE(r.trigger_match_type, 'any'),
+         s.tags_before, COALESCE(ct.tags, ARRAY[]::text[]), r.add_tags, r.remove_tags, s.tags_before, COALESCE(ct.tags, ARRAY[]::text[]),
+         true
+  FROM (
+    SELECT (ch.entry->>'id')::uuid AS contact_id,
+           (ch.entry->>'hash')::uuid AS tag_hash,
+           ARRAY(SELECT jsonb_array_elements_text(COALESCE(ch.entry->'tags_before', '[]'::jsonb))) AS tags_before
+    FROM jsonb_array_elements(p_changed) AS ch(entry)
+    WHERE audit.mode = 'full' OR random() < audit.sample_rate
+  ) s
+  JOIN public.contacts ct ON ct.id = s.contact_id
+  JOIN public.tag_rule_eval_cache c
+    ON c.user_id = p_user_id
+   AND c.rule_set_version = current_version
+   AND c.tag_set_hash = s.tag_hash
+  CROSS JOIN LATERAL unnest(c.fired_rule_ids) AS f(rule_id)
+  JOIN public.tag_rules r ON r.id = f.rule_id;
+END;
+$function$;
+
+-- Audit each chunk in bulk. The chunk statement cannot see the cache entries it writes,
+-- so the changed rows are collected and logged by a separate statement.
+CREATE OR REPLACE FUNCTION public.run_tag_rule_reapply_job(p_job_id uuid, p_chunk_size integer DEFAULT 500)
+RETURNS public.tag_rule_reapply_jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  job public.tag_rule_reapply_jobs;
+  batch_count integer := 0;
+  changed_count integer := 0;
+  batch_last uuid;
+  changed_rows jsonb;
+  hits_before bigint;
+  misses_before bigint;
+BEGIN
+  -- Serializes concurrent drainers of the same job
+  SELECT * INTO job FROM public.tag_rule_reapply_jobs WHERE id = p_job_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Tag rule reapply job % not found', p_job_id;
+  END IF;
+  IF NOT public.can_act_for(job.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to run tag rule reapply job %', p_job_id;
+  END IF;
+  IF job.status = 'completed' THEN
+    RETURN job;
+  END IF;
+
+  IF job.total IS NULL THEN
+    SELECT
+      (SELECT count(*) FROM public.contacts c
+       WHERE c.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags))
+      +
+      (SELECT count(*) FROM public.unsubscribed_contacts uc
+       WHERE uc.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags))
+    INTO job.total;
+  END IF;
+
+  SELECT s.hits, s.misses INTO hits_before, misses_before FROM public.tag_rule_cache_stats() s;
+
+  IF job.phase = 'contacts' THEN
+    WITH batch AS (
+      SELECT c.id, c.tags
+      FROM public.contacts c
+      WHERE c.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR c.id > job.last_id)
+      ORDER BY c.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.contacts c
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE c.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING c.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed),
+           jsonb_agg(jsonb_build_object(
+             'id', e.id,
+             'hash', public.tag_set_hash(public.normalize_tag_array(e.tags)),
+             'tags_before', to_jsonb(COALESCE(e.tags, ARRAY[]::text[]))
+           )) FILTER (WHERE e.new_tags IS DISTINCT FROM e.tags)
+    INTO batch_count, batch_last, changed_count, changed_rows
+    FROM evaluated e;
+  ELSE
+    WITH batch AS (
+      SELECT uc.id, uc.tags
+      FROM public.unsubscribed_contacts uc
+      WHERE uc.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR uc.id > job.last_id)
+      ORDER BY uc.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.unsubscribed_contacts uc
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE uc.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING uc.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed),
+           jsonb_agg(jsonb_build_object(
+             'id', e.id,
+             'hash', public.tag_set_hash(public.normalize_tag_array(e.tags))
+           )) FILTER (WHERE e.new_tags IS DISTINCT FROM e.tags)
+    INTO batch_count, batch_last, changed_count, changed_rows
+    FROM evaluated e;
+  END IF;
+
+  PERFORM public.log_tag_rule_reapply_chunk(job.id, job.user_id, changed_rows, job.phase = 'contacts');
+
+  SELECT job.cache_hits + s.hits - hits_before, job.cache_misses + s.misses - misses_before
+  INTO job.cache_hits, job.cache_misses
+  FROM public.tag_rule_cache_stats() s;
+
+  job.processed := job.processed + batch_count;
+  job.updated := job.updated + changed_count;
+  job.last_id := COALESCE(batch_last, job.last_id);
+
+  IF batch_count < p_chunk_size THEN
+    IF job.phase = 'contacts' THEN
+      job.phase := 'unsubscribed';
+      job.last_id := NULL;
+    ELSE
+      job.status := 'completed';
+      job.completed_at := now();
+    END IF;
+  END IF;
+
+  UPDATE public.tag_rule_reapply_jobs
+  SET status = job.status,
+      phase = job.phase,
+      last_id = job.last_id,
+      total = job.total,
+      processed = job.processed,
+      updated = job.updated,
+      cache_hits = job.cache_hits,
+      cache_misses = job.cache_misses,
+      updated_at = now(),
+      completed_at = job.completed_at
+  WHERE id = job.id
+  RETURNING * INTO job;
+
+  RETURN job;
+END;
+$function$;
+
+-- Retention: delete up to p_batch_size audit rows and summaries older than p_keep.
+-- Call repeatedly until it returns 0 to catch up on a large backlog.
+CREATE OR REPLACE FUNCTION public.prune_tag_rule_executions(
+  p_keep interval DEFAULT interval '30 days',
+  p_batch_size integer DEFAULT 5000
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deleted_executions integer;
+  deleted_summaries integer;
+BEGIN
+  DELETE FROM public.tag_rule_executions
+  WHERE id IN (
+    SELECT id
+    FROM public.tag_rule_executions
+    WHERE triggered_at < now() - p_keep
+    ORDER BY triggered_at
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_executions = ROW_COUNT;
+
+  DELETE FROM public.tag_rule_execution_summaries
+  WHERE (job_id, rule_id) IN (
+    SELECT job_id, rule_id
+    FROM public.tag_rule_execution_summaries
+    WHERE updated_at < now() - p_keep
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_summaries = ROW_COUNT;
+
+  RETURN deleted_executions + deleted_summaries;
+END;
+$function$;
+
+-- Audit plumbing runs from triggers and reapply jobs; nothing here is for clients
+REVOKE EXECUTE ON FUNCTION public.tag_rule_audit_settings(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.log_tag_rule_reapply_chunk(uuid, uuid, jsonb, boolean) FROM PUBLIC, anon, authenticated;
+
+-- Maintenance only; run by process-automations with the service role
+REVOKE EXECUTE ON FUNCTION public.flush_tag_rule_execution_buffer(integer) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.prune_tag_rule_executions(interval, integer) FROM PUBLIC, anon, authenticated;
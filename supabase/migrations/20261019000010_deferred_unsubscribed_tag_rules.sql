@@ -0,0 +1,343 @@
+-- Tag rules on unsubscribed_contacts without per-row trigger cost
+-- apply_tag_rules_unsubscribed_trigger evaluated rules on every unsubscribed_contacts
+-- write, so bulk unsubscribe imports paid for rules on contacts who will never be emailed
+-- again. The trigger is dropped; rows now carry tag_rules_pending, set on insert and on
+-- tag edits, and each user picks a policy (user_settings.unsubscribed_tag_rule_policy):
+--   deferred    pending rows are evaluated in batches by
+--               apply_deferred_unsubscribed_tag_rules, and reapply jobs still cover
+--               unsubscribed contacts (default, closest to the old behaviour)
+--   on_restore  unsubscribed tags are left as they are; rules run when
+--               handle_restore_contact inserts the contact again, through
+--               trg_apply_tag_rules_on_contact_change
+-- handle_unsubscribe moves a contact whose tags were already evaluated, so the move is
+-- written as not pending.
+
+ALTER TABLE public.user_settings
+  ADD COLUMN IF NOT EXISTS unsubscribed_tag_rule_policy TEXT NOT NULL DEFAULT 'deferred'
+    CHECK (unsubscribed_tag_rule_policy IN ('deferred', 'on_restore'));
+
+-- Existing rows were evaluated by the trigger; new rows are pending unless the writer
+-- says otherwise
+ALTER TABLE public.unsubscribed_contacts
+  ADD COLUMN IF NOT EXISTS tag_rules_pending BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE public.unsubscribed_contacts
+  ALTER COLUMN tag_rules_pending SET DEFAULT true;
+
+CREATE INDEX IF NOT EXISTS idx_unsubscribed_contacts_tag_rules_pending
+ON public.unsubscribed_contacts (id)
+WHERE tag_rules_pending;
+
+DROP TRIGGER IF EXISTS apply_tag_rules_unsubscribed_trigger ON public.unsubscribed_contacts;
+DROP FUNCTION IF EXISTS public.apply_tag_rules_to_unsubscribed();
+
+-- Tag edits on existing rows are pending again. Writers that evaluate rules clear the flag
+-- in the same update; one that writes false over a row that was not pending gets an
+-- extra (unchanging) evaluation from the next deferred pass.
+CREATE OR REPLACE FUNCTION public.mark_unsubscribed_tag_rules_pending()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $function$
+BEGIN
+  IF NEW.tags IS DISTINCT FROM OLD.tags
+     AND NEW.tag_rules_pending IS NOT DISTINCT FROM OLD.tag_rules_pending THEN
+    NEW.tag_rules_pending := true;
+  END IF;
+  RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_unsubscribed_contacts_tag_rules_pending ON public.unsubscribed_contacts;
+CREATE TRIGGER trg_unsubscribed_contacts_tag_rules_pending
+BEFORE UPDATE OF tags ON public.unsubscribed_contacts
+FOR EACH ROW
+EXECUTE FUNCTION public.mark_unsubscribed_tag_rules_pending();
+
+CREATE OR REPLACE FUNCTION public.unsubscribed_tag_rule_policy(p_user_id uuid)
+RETURNS text
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT CASE
+    WHEN EXISTS (
+      SELECT 1 FROM public.user_settings s
+      WHERE s.user_id = p_user_id
+        AND s.unsubscribed_tag_rule_policy = 'on_restore'
+    ) THEN 'on_restore'
+    ELSE 'deferred'
+  END;
+$function$;
+
+-- Background pass: evaluate up to p_batch_size pending rows of users on the deferred
+-- policy in one statement. Returns the number of rows evaluated.
+CREATE OR REPLACE FUNCTION public.apply_deferred_unsubscribed_tag_rules(p_batch_size integer DEFAULT 1000)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  evaluated_count integer;
+BEGIN
+  WITH batch AS (
+    SELECT uc.id, uc.user_id, uc.tags
+    FROM public.unsubscribed_contacts uc
+    WHERE uc.tag_rules_pending
+      AND NOT EXISTS (
+        SELECT 1 FROM public.user_settings s
+        WHERE s.user_id = uc.user_id
+          AND s.unsubscribed_tag_rule_policy = 'on_restore'
+      )
+    ORDER BY uc.id
+    LIMIT p_batch_size
+    FOR UPDATE OF uc SKIP LOCKED
+  )
+  UPDATE public.unsubscribed_contacts uc
+  SET tags = public.apply_tag_rules_pure(b.user_id, b.tags),
+      tag_rules_pending = false
+  FROM batch b
+  WHERE uc.id = b.id;
+  GET DIAGNOSTICS evaluated_count = ROW_COUNT;
+
+  RETURN evaluated_count;
+END;
+$function$;
+
+-- Explicit full reapply also settles pending rows
+CREATE OR REPLACE FUNCTION public.reapply_tag_rules_to_unsubscribed_contacts(p_user_id uuid)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  IF NOT public.can_act_for(p_user_id) THEN
+    RAISE EXCEPTION 'Not allowed to reapply tag rules for user %', p_user_id;
+  END IF;
+
+  UPDATE public.unsubscribed_contacts uc
+  SET tags = e.new_tags,
+      tag_rules_pending = false
+  FROM (
+    SELECT id, tags, tag_rules_pending, public.apply_tag_rules_pure(user_id, tags) AS new_tags
+    FROM public.unsubscribed_contacts
+    WHERE user_id = p_user_id
+  ) e
+  WHERE uc.id = e.id
+    AND (e.tag_rules_pending OR e.new_tags IS DISTINCT FROM e.tags);
+END;
+$function$;
+
+-- Pure move: the contact's tags are already evaluated
+CREATE OR REPLACE FUNCTION public.handle_unsubscribe(
+  p_email text DEFAULT NULL::text,
+  p_user_id uuid DEFAULT '550e8400-e29b-41d4-a716-446655440000'::uuid,
+  p_reason text DEFAULT NULL::text
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  contact_record RECORD;
+BEGIN
+  -- Normalize email
+  IF p_email IS NOT NULL THEN
+    p_email := lower(btrim(p_email));
+  END IF;
+
+  -- Try to find existing contact for rich data preservation
+  IF p_email IS NOT NULL THEN
+    SELECT * INTO contact_record
+    FROM public.contacts
+    WHERE user_id = p_user_id AND email_normalized = p_email
+    LIMIT 1;
+  ELSE
+    contact_record := NULL;
+  END IF;
+
+  IF contact_record IS NOT NULL THEN
+    -- Preserve full contact in unsubscribed_contacts
+    INSERT INTO public.unsubscribed_contacts (
+      user_id, email, first_name, last_name, tags, original_contact_id, unsubscribed_at, tag_rules_pending
+    ) VALUES (
+      contact_record.user_id,
+      contact_record.email,
+      contact_record.first_name,
+      contact_record.last_name,
+      contact_record.tags,
+      contact_record.id,
+      now(),
+      false
+    ) ON CONFLICT (user_id, email_normalized) DO UPDATE SET
+      first_name = EXCLUDED.first_name,
+      last_name = EXCLUDED.last_name,
+      tags = EXCLUDED.tags,
+      original_contact_id = EXCLUDED.original_contact_id,
+      unsubscribed_at = EXCLUDED.unsubscribed_at,
+      tag_rules_pending = EXCLUDED.tag_rules_pending;
+  END IF;
+
+  -- Always upsert into unsubscribes table
+  IF p_email IS NOT NULL THEN
+    INSERT INTO public.unsubscribes (user_id, email, reason, unsubscribed_at)
+    VALUES (p_user_id, p_email, p_reason, now())
+    ON CONFLICT (user_id, email) DO UPDATE SET
+      reason = EXCLUDED.reason,
+      unsubscribed_at = EXCLUDED.unsubscribed_at;
+  END IF;
+
+  -- ALWAYS remove any contact rows for this email/user (even if not found above)
+  IF p_email IS NOT NULL THEN
+    DELETE FROM public.contacts
+    WHERE user_id = p_user_id AND email_normalized = p_email;
+  END IF;
+END;
+$function$;
+
+-- Reapply jobs skip the unsubscribed phase for users on the on_restore policy
+CREATE OR REPLACE FUNCTION public.run_tag_rule_reapply_job(p_job_id uuid, p_chunk_size integer DEFAULT 500)
+RETURNS public.tag_rule_reapply_jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  job public.tag_rule_reapply_jobs;
+  batch_count integer := 0;
+  changed_count integer := 0;
+  batch_last uuid;
+  changed_rows jsonb;
+  hits_before bigint;
+  misses_before bigint;
+  include_unsubscribed boolean;
+BEGIN
+  -- Serializes concurrent drainers of the same job
+  SELECT * INTO job FROM public.tag_rule_reapply_jobs WHERE id = p_job_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Tag rule reapply job % not found', p_job_id;
+  END IF;
+  IF NOT public.can_act_for(job.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to run tag rule reapply job %', p_job_id;
+  END IF;
+  IF job.status = 'completed' THEN
+    RETURN job;
+  END IF;
+
+  include_unsubscribed := public.unsubscribed_tag_rule_policy(job.user_id) = 'deferred';
+
+  IF job.total IS NULL THEN
+    SELECT
+      (SELECT count(*) FROM public.contacts c
+       WHERE c.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags))
+      +
+      (SELECT count(*) FROM public.unsubscribed_contacts uc
+       WHERE include_unsubscribed
+         AND uc.user_id = job.user_id
+         AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags))
+    INTO job.total;
+  END IF;
+
+  SELECT s.hits, s.misses INTO hits_before, misses_before FROM public.tag_rule_cache_stats() s;
+
+  IF job.phase = 'contacts' THEN
+    WITH batch AS (
+      SELECT c.id, c.tags
+      FROM public.contacts c
+      WHERE c.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(c.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR c.id > job.last_id)
+      ORDER BY c.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.contacts c
+      SET tags = e.new_tags
+      FROM evaluated e
+      WHERE c.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING c.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed),
+           jsonb_agg(jsonb_build_object(
+             'id', e.id,
+             'hash', public.tag_set_hash(public.normalize_tag_array(e.tags)),
+             'tags_before', to_jsonb(COALESCE(e.tags, ARRAY[]::text[]))
+           )) FILTER (WHERE e.new_tags IS DISTINCT FROM e.tags)
+    INTO batch_count, batch_last, changed_count, changed_rows
+    FROM evaluated e;
+  ELSE
+    WITH batch AS (
+      SELECT uc.id, uc.tags
+      FROM public.unsubscribed_contacts uc
+      WHERE uc.user_id = job.user_id
+        AND (job.trigger_tags IS NULL OR public.normalize_tag_array(uc.tags) && job.trigger_tags)
+        AND (job.last_id IS NULL OR uc.id > job.last_id)
+      ORDER BY uc.id
+      LIMIT p_chunk_size
+    ), evaluated AS (
+      SELECT b.id, b.tags, public.apply_tag_rules_pure(job.user_id, b.tags) AS new_tags
+      FROM batch b
+    ), changed AS (
+      UPDATE public.unsubscribed_contacts uc
+      SET tags = e.new_tags,
+          tag_rules_pending = false
+      FROM evaluated e
+      WHERE uc.id = e.id
+        AND e.new_tags IS DISTINCT FROM e.tags
+      RETURNING uc.id
+    )
+    SELECT count(*), (array_agg(e.id ORDER BY e.id DESC))[1], (SELECT count(*) FROM changed),
+           jsonb_agg(jsonb_build_object(
+             'id', e.id,
+             'hash', public.tag_set_hash(public.normalize_tag_array(e.tags))
+           )) FILTER (WHERE e.new_tags IS DISTINCT FROM e.tags)
+    INTO batch_count, batch_last, changed_count, changed_rows
+    FROM evaluated e;
+  END IF;
+
+  PERFORM public.log_tag_rule_reapply_chunk(job.id, job.user_id, changed_rows, job.phase = 'contacts');
+
+  SELECT job.cache_hits + s.hits - hits_before, job.cache_misses + s.misses - misses_before
+  INTO job.cache_hits, job.cache_misses
+  FROM public.tag_rule_cache_stats() s;
+
+  job.processed := job.processed + batch_count;
+  job.updated := job.updated + changed_count;
+  job.last_id := COALESCE(batch_last, job.last_id);
+
+  IF batch_count < p_chunk_size THEN
+    IF job.phase = 'contacts' AND include_unsubscribed THEN
+      job.phase := 'unsubscribed';
+      job.last_id := NULL;
+    ELSE
+      job.status := 'completed';
+      job.completed_at := now();
+    END IF;
+  END IF;
+
+  UPDATE public.tag_rule_reapply_jobs
+  SET status = job.status,
+      phase = job.phase,
+      last_id = job.last_id,
+      total = job.total,
+      processed = job.processed,
+      updated = job.updated,
+      cache_hits = job.cache_hits,
+      cache_misses = job.cache_misses,
+      updated_at = now(),
+      completed_at = job.completed_at
+  WHERE id = job.id
+  RETURNING * INTO job;
+
+  RETURN job;
+END;
+$function$;
+
+-- Maintenance only; run by process-automations with the service role
+REVOKE EXECUTE ON FUNCTION public.apply_deferred_unsubscribed_tag_rules(integer) FROM PUBLIC, anon, authenticated;
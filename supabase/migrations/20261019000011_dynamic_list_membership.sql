@@ -0,0 +1,254 @@
+-- Server-side dynamic list membership
+-- Dynamic lists used to be populated from the browser (SmartListManager re-queried every
+-- dynamic list on each load), so contact_lists was only as fresh as the last page view
+-- and campaigns could miss or keep contacts. Membership is now maintained here:
+--   * email_lists.rule_tags_normalized holds the tags a dynamic list's rules reference
+--   * statement-level triggers on contacts re-evaluate changed contacts against the
+--     dynamic lists that reference their old or new tags, set-based per statement
+--   * saving a dynamic list rebuilds it; rebuild_dynamic_list / rebuild_dynamic_lists
+--     are the full rebuild commands
+-- Matching keeps the client's semantics: subscribed contacts carrying any of the list's
+-- has_any_tags values (legacy requiredTags), case-insensitive.
+
+-- Normalized tags referenced by a dynamic list's rule_config
+CREATE OR REPLACE FUNCTION public.dynamic_list_tags(p_list_type text, p_rule_config jsonb)
+RETURNS text[]
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT CASE WHEN p_list_type = 'dynamic' AND p_rule_config IS NOT NULL THEN
+    public.normalize_tag_array(ARRAY(
+      SELECT jsonb_array_elements_text(r->'values')
+      FROM jsonb_array_elements(
+        CASE WHEN jsonb_typeof(p_rule_config->'rules') = 'array' THEN p_rule_config->'rules' ELSE '[]'::jsonb END
+      ) AS r
+      WHERE r->>'type' = 'has_any_tags'
+        AND jsonb_typeof(r->'values') = 'array'
+      UNION ALL
+      SELECT jsonb_array_elements_text(p_rule_config->'requiredTags')
+      WHERE jsonb_typeof(p_rule_config->'rules') IS DISTINCT FROM 'array'
+        AND jsonb_typeof(p_rule_config->'requiredTags') = 'array'
+    ))
+  ELSE ARRAY[]::text[]
+  END;
+$function$;
+
+ALTER TABLE public.email_lists
+  ADD COLUMN IF NOT EXISTS rule_tags_normalized TEXT[]
+    GENERATED ALWAYS AS (public.dynamic_list_tags(list_type, rule_config)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_email_lists_rule_tags_normalized
+ON public.email_lists USING GIN (rule_tags_normalized)
+WHERE list_type = 'dynamic';
+
+CREATE OR REPLACE FUNCTION public.dynamic_list_matches(p_rule_tags text[], p_tags_normalized text[], p_status text)
+RETURNS boolean
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT p_status = 'subscribed' AND p_tags_normalized && p_rule_tags;
+$function$;
+
+-- Bring contact_lists for one dynamic list in line with its rules; returns the member count
+CREATE OR REPLACE FUNCTION public.rebuild_dynamic_list(p_list_id uuid)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record public.email_lists;
+  member_count integer;
+BEGIN
+  SELECT * INTO list_record FROM public.email_lists WHERE id = p_list_id;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'List % not found', p_list_id;
+  END IF;
+  IF NOT public.can_act_for(list_record.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to rebuild list %', p_list_id;
+  END IF;
+  IF list_record.list_type <> 'dynamic' THEN
+    RETURN (SELECT count(*) FROM public.contact_lists WHERE list_id = p_list_id);
+  END IF;
+
+  DELETE FROM public.contact_lists cl
+  WHERE cl.list_id = p_list_id
+    AND NOT EXISTS (
+      SELECT 1 FROM public.contacts c
+      WHERE c.id = cl.contact_id
+        AND c.user_id = list_record.user_id
+        AND public.dynamic_list_matches(list_record.rule_tags_normalized, public.normalize_tag_array(c.tags), c.status)
+    );
+
+  INSERT INTO public.contact_lists (contact_id, list_id)
+  SELECT c.id, p_list_id
+  FROM public.contacts c
+  WHERE c.user_id = list_record.user_id
+    AND public.normalize_tag_array(c.tags) && list_record.rule_tags_normalized
+    AND public.dynamic_list_matches(list_record.rule_tags_normalized, public.normalize_tag_array(c.tags), c.status)
+  ON CONFLICT DO NOTHING;
+
+  SELECT count(*) INTO member_count FROM public.contact_lists WHERE list_id = p_list_id;
+  RETURN member_count;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.rebuild_dynamic_lists(p_user_id uuid)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_id uuid;
+  rebuilt integer := 0;
+BEGIN
+  IF NOT public.can_act_for(p_user_id) THEN
+    RAISE EXCEPTION 'Not allowed to rebuild lists for user %', p_user_id;
+  END IF;
+
+  FOR list_id IN
+    SELECT id FROM public.email_lists WHERE user_id = p_user_id AND list_type = 'dynamic' ORDER BY created_at
+  LOOP
+    PERFORM public.rebuild_dynamic_list(list_id);
+    rebuilt := rebuilt + 1;
+  END LOOP;
+
+  RETURN rebuilt;
+END;
+$function$;
+
+-- Clients reach these with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.rebuild_dynamic_list(uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.rebuild_dynamic_lists(uuid) FROM PUBLIC, anon;
+
+-- Re-evaluate the contacts written by one statement against the dynamic lists that
+-- reference their old or new tags. p_old_tags is NULL for inserts.
+CREATE OR REPLACE FUNCTION public.sync_dynamic_list_membership(
+  p_contact_ids uuid[],
+  p_old_tags jsonb DEFAULT NULL
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  -- Insert and delete touch disjoint rows, so one statement does both
+  WITH candidates AS (
+    SELECT c.id AS contact_id, l.id AS list_id,
+           public.dynamic_list_matches(l.rule_tags_normalized, public.normalize_tag_array(c.tags), c.status) AS matches
+    FROM public.contacts c
+    JOIN public.email_lists l
+      ON l.user_id = c.user_id
+     AND l.list_type = 'dynamic'
+     AND l.rule_tags_normalized && (
+       public.normalize_tag_array(c.tags)
+       || public.normalize_tag_array(ARRAY(
+            SELECT jsonb_array_elements_text(COALESCE(p_old_tags->(c.id::text), '[]'::jsonb))
+          ))
+     )
+    WHERE c.id = ANY(p_contact_ids)
+  ), added AS (
+    INSERT INTO public.contact_lists (contact_id, list_id)
+    SELECT contact_id, list_id FROM candidates WHERE matches
+    ON CONFLICT DO NOTHING
+  )
+  DELETE FROM public.contact_lists cl
+  USING candidates d
+  WHERE NOT d.matches
+    AND cl.contact_id = d.contact_id
+    AND cl.list_id = d.list_id;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.on_contacts_inserted_sync_lists()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  contact_ids uuid[];
+BEGIN
+  SELECT array_agg(n.id) INTO contact_ids
+  FROM new_rows n
+  WHERE EXISTS (
+    SELECT 1 FROM public.email_lists l
+    WHERE l.user_id = n.user_id AND l.list_type = 'dynamic'
+  );
+
+  IF contact_ids IS NOT NULL THEN
+    PERFORM public.sync_dynamic_list_membership(contact_ids);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.on_contacts_updated_sync_lists()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  contact_ids uuid[];
+  old_tags jsonb;
+BEGIN
+  SELECT array_agg(n.id), jsonb_object_agg(n.id::text, to_jsonb(COALESCE(o.tags, ARRAY[]::text[])))
+  INTO contact_ids, old_tags
+  FROM new_rows n
+  JOIN old_rows o ON o.id = n.id
+  WHERE (n.tags IS DISTINCT FROM o.tags OR n.status IS DISTINCT FROM o.status)
+    AND EXISTS (
+      SELECT 1 FROM public.email_lists l
+      WHERE l.user_id = n.user_id AND l.list_type = 'dynamic'
+    );
+
+  IF contact_ids IS NOT NULL THEN
+    PERFORM public.sync_dynamic_list_membership(contact_ids, old_tags);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS trg_contacts_inserted_sync_lists ON public.contacts;
+CREATE TRIGGER trg_contacts_inserted_sync_lists
+AFTER INSERT ON public.contacts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contacts_inserted_sync_lists();
+
+DROP TRIGGER IF EXISTS trg_contacts_updated_sync_lists ON public.contacts;
+CREATE TRIGGER trg_contacts_updated_sync_lists
+AFTER UPDATE ON public.contacts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contacts_updated_sync_lists();
+
+-- Saving a dynamic list (or turning it into one) rebuilds its membership
+CREATE OR REPLACE FUNCTION public.on_email_list_rules_change()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  IF NEW.list_type = 'dynamic' THEN
+    PERFORM public.rebuild_dynamic_list(NEW.id);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_email_list_rules_change ON public.email_lists;
+CREATE TRIGGER trg_email_list_rules_change
+AFTER INSERT OR UPDATE OF list_type, rule_config ON public.email_lists
+FOR EACH ROW
+EXECUTE FUNCTION public.on_email_list_rules_change();
+
+-- Bring existing dynamic lists up to date
+SELECT public.rebuild_dynamic_list(id)
+FROM public.email_lists
+WHERE list_type = 'dynamic';
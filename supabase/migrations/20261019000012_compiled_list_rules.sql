@@ -0,0 +1,648 @@
+-- Compiled dynamic list rules
+-- DynamicListRuleBuilder saves typed rules (has_any_tags, has_all_tags, not_has_tags,
+-- in_any_lists, in_all_lists, not_in_lists) combined with globalOperator, but only the
+-- legacy requiredTags array was ever evaluated. compile_list_rules turns a full
+-- rule_config into one SQL predicate over contacts c:
+--   * tag rules use normalize_tag_array(c.tags) with && / @>, served by the GIN
+--     expression index idx_contacts_tags_normalized
+--   * list rules are EXISTS / count probes on contact_lists
+--   * has_any_products / not_has_products join contact_products and products
+--     (values are product ids or names)
+--   * rule_config.status filters on contact status ('subscribed' by default, 'any'
+--     for no filter)
+-- Literals are embedded with format('%L'), so the predicate is safe to EXECUTE.
+-- The predicate is cached per list and rule_version in dynamic_list_predicates and is
+-- used for membership maintenance, rebuilds, counts, previews and recipient resolution.
+-- Membership is kept current by statement triggers on contacts, contact_lists (lists
+-- referenced by list rules) and contact_products (lists with product rules).
+
+-- Tags referenced by any tag rule (positive or negative)
+CREATE OR REPLACE FUNCTION public.dynamic_list_tags(p_list_type text, p_rule_config jsonb)
+RETURNS text[]
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT CASE WHEN p_list_type = 'dynamic' AND p_rule_config IS NOT NULL THEN
+    public.normalize_tag_array(ARRAY(
+      SELECT jsonb_array_elements_text(r->'values')
+      FROM jsonb_array_elements(
+        CASE WHEN jsonb_typeof(p_rule_config->'rules') = 'array' THEN p_rule_config->'rules' ELSE '[]'::jsonb END
+      ) AS r
+      WHERE r->>'type' IN ('has_any_tags', 'has_all_tags', 'not_has_tags')
+        AND jsonb_typeof(r->'values') = 'array'
+      UNION ALL
+      SELECT jsonb_array_elements_text(p_rule_config->'requiredTags')
+      WHERE jsonb_typeof(p_rule_config->'rules') IS DISTINCT FROM 'array'
+        AND jsonb_typeof(p_rule_config->'requiredTags') = 'array'
+    ))
+  ELSE ARRAY[]::text[]
+  END;
+$function$;
+
+-- Lists referenced by list rules
+CREATE OR REPLACE FUNCTION public.dynamic_list_rule_list_ids(p_list_type text, p_rule_config jsonb)
+RETURNS uuid[]
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT CASE WHEN p_list_type = 'dynamic' AND jsonb_typeof(p_rule_config->'rules') = 'array' THEN
+    ARRAY(
+      SELECT DISTINCT v::uuid
+      FROM jsonb_array_elements(p_rule_config->'rules') AS r
+      CROSS JOIN LATERAL jsonb_array_elements_text(
+        CASE WHEN jsonb_typeof(r->'values') = 'array' THEN r->'values' ELSE '[]'::jsonb END
+      ) AS v
+      WHERE r->>'type' IN ('in_any_lists', 'in_all_lists', 'not_in_lists')
+        AND v ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+    )
+  ELSE ARRAY[]::uuid[]
+  END;
+$function$;
+
+-- Effective rules of a rule_config: known type, non-empty values. Legacy requiredTags
+-- becomes a single has_any_tags rule.
+CREATE OR REPLACE FUNCTION public.dynamic_list_effective_rules(p_rule_config jsonb)
+RETURNS TABLE(rule_type text, rule_values text[])
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT r->>'type', ARRAY(SELECT jsonb_array_elements_text(r->'values'))
+  FROM jsonb_array_elements(
+    CASE
+      WHEN jsonb_typeof(p_rule_config->'rules') = 'array' THEN p_rule_config->'rules'
+      WHEN jsonb_typeof(p_rule_config->'requiredTags') = 'array'
+        THEN jsonb_build_array(jsonb_build_object('type', 'has_any_tags', 'values', p_rule_config->'requiredTags'))
+      ELSE '[]'::jsonb
+    END
+  ) AS r
+  WHERE jsonb_typeof(r->'values') = 'array'
+    AND jsonb_array_length(r->'values') > 0
+    AND r->>'type' IN ('has_any_tags', 'has_all_tags', 'not_has_tags', 'in_any_lists', 'in_all_lists',
+                       'not_in_lists', 'has_any_products', 'not_has_products');
+$function$;
+
+-- True when a list has product rules, so purchases must re-evaluate it
+CREATE OR REPLACE FUNCTION public.dynamic_list_has_product_rules(p_list_type text, p_rule_config jsonb)
+RETURNS boolean
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT p_list_type = 'dynamic' AND EXISTS (
+    SELECT 1 FROM public.dynamic_list_effective_rules(p_rule_config)
+    WHERE rule_type IN ('has_any_products', 'not_has_products')
+  );
+$function$;
+
+-- True when a contact can only match while carrying one of the list's tags, so tag
+-- writes that touch none of them can skip the list
+CREATE OR REPLACE FUNCTION public.dynamic_list_needs_tags(p_list_type text, p_rule_config jsonb)
+RETURNS boolean
+LANGUAGE sql
+IMMUTABLE
+AS $function$
+  SELECT p_list_type = 'dynamic' AND CASE
+    WHEN lower(COALESCE(p_rule_config->>'globalOperator', 'and')) = 'or' THEN
+      bool_and(rule_type IN ('has_any_tags', 'has_all_tags')) IS TRUE
+    ELSE
+      bool_or(rule_type IN ('has_any_tags', 'has_all_tags')) IS TRUE
+  END
+  FROM public.dynamic_list_effective_rules(p_rule_config);
+$function$;
+
+CREATE OR REPLACE FUNCTION public.compile_list_rules(p_rule_config jsonb)
+RETURNS text
+LANGUAGE plpgsql
+IMMUTABLE
+AS $function$
+DECLARE
+  rule_record RECORD;
+  normalized text[];
+  ids uuid[];
+  parts text[] := ARRAY[]::text[];
+  combinator text;
+  status text := COALESCE(NULLIF(p_rule_config->>'status', ''), 'subscribed');
+  tags_expr constant text := 'public.normalize_tag_array(c.tags)';
+BEGIN
+  combinator := CASE WHEN lower(COALESCE(p_rule_config->>'globalOperator', 'and')) = 'or' THEN ' OR ' ELSE ' AND ' END;
+
+  FOR rule_record IN SELECT * FROM public.dynamic_list_effective_rules(p_rule_config) LOOP
+    normalized := public.normalize_tag_array(rule_record.rule_values);
+    ids := ARRAY(
+      SELECT DISTINCT v::uuid FROM unnest(rule_record.rule_values) AS v
+      WHERE v ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+    );
+
+    CASE rule_record.rule_type
+      WHEN 'has_any_tags' THEN
+        parts := parts || format('%s && %L::text[]', tags_expr, normalized);
+      WHEN 'has_all_tags' THEN
+        parts := parts || format('%s @> %L::text[]', tags_expr, normalized);
+      WHEN 'not_has_tags' THEN
+        parts := parts || format('NOT (%s && %L::text[])', tags_expr, normalized);
+      WHEN 'in_any_lists' THEN
+        parts := parts || format(
+          'EXISTS (SELECT 1 FROM public.contact_lists cl WHERE cl.contact_id = c.id AND cl.list_id = ANY(%L::uuid[]))',
+          ids);
+      WHEN 'in_all_lists' THEN
+        IF cardinality(ids) = 0 THEN
+          parts := parts || 'false'::text; -- no valid list ids: nothing can be in all of them
+          CONTINUE;
+        END IF;
+        parts := parts || format(
+          '(SELECT count(DISTINCT cl.list_id) FROM public.contact_lists cl WHERE cl.contact_id = c.id AND cl.list_id = ANY(%L::uuid[])) = %s',
+          ids, cardinality(ids));
+      WHEN 'not_in_lists' THEN
+        parts := parts || format(
+          'NOT EXISTS (SELECT 1 FROM public.contact_lists cl WHERE cl.contact_id = c.id AND cl.list_id = ANY(%L::uuid[]))',
+          ids);
+      WHEN 'has_any_products' THEN
+        parts := parts || format(
+          'EXISTS (SELECT 1 FROM public.contact_products cp JOIN public.products p ON p.id = cp.product_id '
+          'WHERE cp.contact_id = c.id AND (p.id = ANY(%L::uuid[]) OR lower(trim(p.name)) = ANY(%L::text[])))',
+          ids, normalized);
+      WHEN 'not_has_products' THEN
+        parts := parts || format(
+          'NOT EXISTS (SELECT 1 FROM public.contact_products cp JOIN public.products p ON p.id = cp.product_id '
+          'WHERE cp.contact_id = c.id AND (p.id = ANY(%L::uuid[]) OR lower(trim(p.name)) = ANY(%L::text[])))',
+          ids, normalized);
+    END CASE;
+  END LOOP;
+
+  IF cardinality(parts) = 0 THEN
+    RETURN 'false'; -- no usable rules: the list is empty
+  END IF;
+
+  IF status = 'any' THEN
+    RETURN format('(%s)', array_to_string(parts, combinator));
+  END IF;
+  RETURN format('c.status = %L AND (%s)', status, array_to_string(parts, combinator));
+END;
+$function$;
+
+ALTER TABLE public.email_lists
+  ADD COLUMN IF NOT EXISTS rule_list_ids UUID[]
+    GENERATED ALWAYS AS (public.dynamic_list_rule_list_ids(list_type, rule_config)) STORED,
+  ADD COLUMN IF NOT EXISTS rule_needs_tags BOOLEAN
+    GENERATED ALWAYS AS (public.dynamic_list_needs_tags(list_type, rule_config)) STORED,
+  ADD COLUMN IF NOT EXISTS rule_has_products BOOLEAN
+    GENERATED ALWAYS AS (public.dynamic_list_has_product_rules(list_type, rule_config)) STORED,
+  ADD COLUMN IF NOT EXISTS rule_version BIGINT NOT NULL DEFAULT 1;
+
+CREATE INDEX IF NOT EXISTS idx_email_lists_rule_list_ids
+ON public.email_lists USING GIN (rule_list_ids)
+WHERE list_type = 'dynamic';
+
+CREATE TABLE IF NOT EXISTS public.dynamic_list_predicates (
+  list_id UUID PRIMARY KEY REFERENCES public.email_lists(id) ON DELETE CASCADE,
+  rule_version BIGINT NOT NULL,
+  predicate TEXT NOT NULL,
+  compiled_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Internal to the list engine; no client access
+ALTER TABLE public.dynamic_list_predicates ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION public.bump_email_list_rule_version()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $function$
+BEGIN
+  IF NEW.rule_config IS DISTINCT FROM OLD.rule_config OR NEW.list_type IS DISTINCT FROM OLD.list_type THEN
+    NEW.rule_version := OLD.rule_version + 1;
+  END IF;
+  RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_bump_email_list_rule_version ON public.email_lists;
+CREATE TRIGGER trg_bump_email_list_rule_version
+BEFORE UPDATE ON public.email_lists
+FOR EACH ROW
+EXECUTE FUNCTION public.bump_email_list_rule_version();
+
+-- Cached predicate of a saved dynamic list
+CREATE OR REPLACE FUNCTION public.dynamic_list_predicate(p_list_id uuid)
+RETURNS text
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record public.email_lists;
+  cached public.dynamic_list_predicates;
+BEGIN
+  SELECT * INTO list_record FROM public.email_lists WHERE id = p_list_id;
+  IF NOT FOUND OR list_record.list_type <> 'dynamic' THEN
+    RETURN 'false';
+  END IF;
+
+  SELECT * INTO cached FROM public.dynamic_list_predicates WHERE list_id = p_list_id;
+  IF FOUND AND cached.rule_version = list_record.rule_version THEN
+    RETURN cached.predicate;
+  END IF;
+
+  cached.predicate := public.compile_list_rules(list_record.rule_config);
+  INSERT INTO public.dynamic_list_predicates (list_id, rule_version, predicate, compiled_at)
+  VALUES (p_list_id, list_record.rule_version, cached.predicate, now())
+  ON CONFLICT (list_id) DO UPDATE
+  SET rule_version = EXCLUDED.rule_version,
+      predicate = EXCLUDED.predicate,
+      compiled_at = EXCLUDED.compiled_at;
+
+  RETURN cached.predicate;
+END;
+$function$;
+
+-- Resolve the user a count / preview runs for: the caller, or p_user_id for admins and
+-- the service role
+CREATE OR REPLACE FUNCTION public.list_rules_user(p_user_id uuid)
+RETURNS uuid
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'p_user_id is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to query contacts of user %', target_user;
+  END IF;
+  RETURN target_user;
+END;
+$function$;
+
+-- Members of a saved dynamic list evaluated from its rules. Not STABLE: the first call
+-- after a rule change writes the predicate cache.
+CREATE OR REPLACE FUNCTION public.dynamic_list_contact_ids(p_list_id uuid)
+RETURNS SETOF uuid
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_user uuid;
+BEGIN
+  SELECT user_id INTO list_user FROM public.email_lists WHERE id = p_list_id;
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+  IF NOT public.can_act_for(list_user) THEN
+    RAISE EXCEPTION 'Not allowed to read list %', p_list_id;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT c.id FROM public.contacts c WHERE c.user_id = $1 AND (%s)',
+    public.dynamic_list_predicate(p_list_id)
+  ) USING list_user;
+END;
+$function$;
+
+-- Count for an unsaved rule_config (DynamicListRuleBuilder estimate)
+CREATE OR REPLACE FUNCTION public.count_list_rule_matches(p_rule_config jsonb, p_user_id uuid DEFAULT NULL)
+RETURNS bigint
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  matched bigint;
+BEGIN
+  EXECUTE format(
+    'SELECT count(*) FROM public.contacts c WHERE c.user_id = $1 AND (%s)',
+    public.compile_list_rules(p_rule_config)
+  ) INTO matched USING public.list_rules_user(p_user_id);
+  RETURN matched;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.preview_list_rule_matches(
+  p_rule_config jsonb,
+  p_user_id uuid DEFAULT NULL,
+  p_limit integer DEFAULT 20
+)
+RETURNS SETOF public.contacts
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  RETURN QUERY EXECUTE format(
+    'SELECT c.* FROM public.contacts c WHERE c.user_id = $1 AND (%s) ORDER BY c.created_at DESC LIMIT $2',
+    public.compile_list_rules(p_rule_config)
+  ) USING public.list_rules_user(p_user_id), p_limit;
+END;
+$function$;
+
+-- Subscribed recipients of a campaign's lists: static lists from contact_lists, dynamic
+-- lists straight from their compiled rules. Both halves only return contacts of the
+-- list's owner and are driven by the contact_lists and contacts indexes.
+CREATE OR REPLACE FUNCTION public.resolve_list_recipients(p_list_ids uuid[])
+RETURNS TABLE(id uuid, email text, first_name text, last_name text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record RECORD;
+  contact_ids uuid[] := ARRAY[]::uuid[];
+  list_contact_ids uuid[];
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM public.email_lists l
+    WHERE l.id = ANY(p_list_ids) AND NOT public.can_act_for(l.user_id)
+  ) THEN
+    RAISE EXCEPTION 'Not allowed to read these lists';
+  END IF;
+
+  FOR list_record IN
+    SELECT l.id, l.user_id FROM public.email_lists l
+    WHERE l.id = ANY(p_list_ids) AND l.list_type = 'dynamic'
+  LOOP
+    EXECUTE format(
+      'SELECT array_agg(c.id) FROM public.contacts c WHERE c.user_id = $1 AND (%s)',
+      public.dynamic_list_predicate(list_record.id)
+    ) INTO list_contact_ids USING list_record.user_id;
+    contact_ids := contact_ids || COALESCE(list_contact_ids, ARRAY[]::uuid[]);
+  END LOOP;
+
+  RETURN QUERY
+  SELECT c.id, c.email, c.first_name, c.last_name
+  FROM public.contacts c
+  WHERE c.id = ANY(contact_ids)
+    AND c.status = 'subscribed'
+  UNION
+  SELECT c.id, c.email, c.first_name, c.last_name
+  FROM public.email_lists l
+  JOIN public.contact_lists cl ON cl.list_id = l.id
+  JOIN public.contacts c ON c.id = cl.contact_id AND c.user_id = l.user_id
+  WHERE l.id = ANY(p_list_ids)
+    AND l.list_type <> 'dynamic'
+    AND c.status = 'subscribed';
+END;
+$function$;
+
+-- Sync the given contacts' membership of one dynamic list
+CREATE OR REPLACE FUNCTION public.sync_dynamic_list_contacts(p_list_id uuid, p_contact_ids uuid[])
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_user uuid;
+BEGIN
+  SELECT user_id INTO list_user FROM public.email_lists WHERE id = p_list_id AND list_type = 'dynamic';
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  -- Insert and delete touch disjoint rows, so one statement does both
+  EXECUTE format($sql$
+    WITH evaluated AS (
+      SELECT c.id, COALESCE((%s), false) AS matches
+      FROM public.contacts c
+      WHERE c.id = ANY($1) AND c.user_id = $2
+    ), added AS (
+      INSERT INTO public.contact_lists (contact_id, list_id)
+      SELECT id, $3 FROM evaluated WHERE matches
+      ON CONFLICT DO NOTHING
+    )
+    DELETE FROM public.contact_lists cl
+    USING evaluated e
+    WHERE NOT e.matches
+      AND cl.contact_id = e.id
+      AND cl.list_id = $3
+  $sql$, public.dynamic_list_predicate(p_list_id)) USING p_contact_ids, list_user, p_list_id;
+END;
+$function$;
+
+-- Contacts trigger entry point: every dynamic list that references the contacts' old or
+-- new tags, plus lists that can match without any of their tags
+CREATE OR REPLACE FUNCTION public.sync_dynamic_list_membership(
+  p_contact_ids uuid[],
+  p_old_tags jsonb DEFAULT NULL
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record RECORD;
+BEGIN
+  FOR list_record IN
+    SELECT l.id, array_agg(c.id) AS contact_ids
+    FROM public.contacts c
+    JOIN public.email_lists l
+      ON l.user_id = c.user_id
+     AND l.list_type = 'dynamic'
+    WHERE c.id = ANY(p_contact_ids)
+      AND (
+        NOT l.rule_needs_tags
+        OR l.rule_tags_normalized && (
+          public.normalize_tag_array(c.tags)
+          || public.normalize_tag_array(ARRAY(
+               SELECT jsonb_array_elements_text(COALESCE(p_old_tags->(c.id::text), '[]'::jsonb))
+             ))
+        )
+      )
+    GROUP BY l.id
+  LOOP
+    PERFORM public.sync_dynamic_list_contacts(list_record.id, list_record.contact_ids);
+  END LOOP;
+END;
+$function$;
+
+-- Membership changes of a list re-evaluate the dynamic lists whose rules reference it.
+-- Nested depth is capped so lists referencing each other cannot recurse forever.
+CREATE OR REPLACE FUNCTION public.sync_lists_referencing(p_list_ids uuid[], p_contact_ids uuid[])
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record RECORD;
+BEGIN
+  IF pg_trigger_depth() > 8 THEN
+    RETURN;
+  END IF;
+
+  FOR list_record IN
+    SELECT l.id, array_agg(DISTINCT ch.contact_id) AS contact_ids
+    FROM unnest(p_list_ids, p_contact_ids) AS ch(list_id, contact_id)
+    JOIN public.email_lists l
+      ON l.list_type = 'dynamic'
+     AND l.rule_list_ids @> ARRAY[ch.list_id]
+     AND l.id <> ch.list_id
+    GROUP BY l.id
+  LOOP
+    PERFORM public.sync_dynamic_list_contacts(list_record.id, list_record.contact_ids);
+  END LOOP;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.on_contact_lists_changed_sync_lists()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_ids uuid[];
+  contact_ids uuid[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(list_id), array_agg(contact_id) INTO list_ids, contact_ids FROM new_rows;
+  ELSE
+    SELECT array_agg(list_id), array_agg(contact_id) INTO list_ids, contact_ids FROM old_rows;
+  END IF;
+
+  IF list_ids IS NOT NULL AND EXISTS (
+    SELECT 1 FROM public.email_lists l
+    WHERE l.list_type = 'dynamic' AND l.rule_list_ids && list_ids
+  ) THEN
+    PERFORM public.sync_lists_referencing(list_ids, contact_ids);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_contact_lists_inserted_sync_lists ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_inserted_sync_lists
+AFTER INSERT ON public.contact_lists
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_lists_changed_sync_lists();
+
+DROP TRIGGER IF EXISTS trg_contact_lists_deleted_sync_lists ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_deleted_sync_lists
+AFTER DELETE ON public.contact_lists
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_lists_changed_sync_lists();
+
+-- Purchases re-evaluate the owner's dynamic lists that have product rules
+CREATE OR REPLACE FUNCTION public.on_contact_products_changed_sync_lists()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  contact_ids uuid[];
+  list_record RECORD;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(DISTINCT contact_id) INTO contact_ids FROM new_rows;
+  ELSE
+    SELECT array_agg(DISTINCT contact_id) INTO contact_ids FROM old_rows;
+  END IF;
+
+  IF contact_ids IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  FOR list_record IN
+    SELECT l.id, array_agg(c.id) AS contact_ids
+    FROM public.contacts c
+    JOIN public.email_lists l
+      ON l.user_id = c.user_id
+     AND l.list_type = 'dynamic'
+     AND l.rule_has_products
+    WHERE c.id = ANY(contact_ids)
+    GROUP BY l.id
+  LOOP
+    PERFORM public.sync_dynamic_list_contacts(list_record.id, list_record.contact_ids);
+  END LOOP;
+  RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trg_contact_products_inserted_sync_lists ON public.contact_products;
+CREATE TRIGGER trg_contact_products_inserted_sync_lists
+AFTER INSERT ON public.contact_products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_products_changed_sync_lists();
+
+DROP TRIGGER IF EXISTS trg_contact_products_deleted_sync_lists ON public.contact_products;
+CREATE TRIGGER trg_contact_products_deleted_sync_lists
+AFTER DELETE ON public.contact_products
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_products_changed_sync_lists();
+
+-- Full rebuild from the compiled predicate
+CREATE OR REPLACE FUNCTION public.rebuild_dynamic_list(p_list_id uuid)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_record public.email_lists;
+  predicate text;
+  member_count integer;
+BEGIN
+  SELECT * INTO list_record FROM public.email_lists WHERE id = p_list_id;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'List % not found', p_list_id;
+  END IF;
+  IF NOT public.can_act_for(list_record.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to rebuild list %', p_list_id;
+  END IF;
+  IF list_record.list_type <> 'dynamic' THEN
+    RETURN (SELECT count(*) FROM public.contact_lists WHERE list_id = p_list_id);
+  END IF;
+
+  predicate := public.dynamic_list_predicate(p_list_id);
+
+  EXECUTE format($sql$
+    DELETE FROM public.contact_lists cl
+    WHERE cl.list_id = $1
+      AND NOT EXISTS (
+        SELECT 1 FROM public.contacts c
+        WHERE c.id = cl.contact_id
+          AND c.user_id = $2
+          AND (%s)
+      )
+  $sql$, predicate) USING p_list_id, list_record.user_id;
+
+  EXECUTE format($sql$
+    INSERT INTO public.contact_lists (contact_id, list_id)
+    SELECT c.id, $1
+    FROM public.contacts c
+    WHERE c.user_id = $2
+      AND (%s)
+    ON CONFLICT DO NOTHING
+  $sql$, predicate) USING p_list_id, list_record.user_id;
+
+  SELECT count(*) INTO member_count FROM public.contact_lists WHERE list_id = p_list_id;
+  RETURN member_count;
+END;
+$function$;
+
+-- Recompute the generated rule columns (and rebuild) for existing dynamic lists
+UPDATE public.email_lists
+SET rule_config = rule_config
+WHERE list_type = 'dynamic';
+
+-- Clients reach these with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.list_rules_user(uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.dynamic_list_contact_ids(uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.count_list_rule_matches(jsonb, uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.preview_list_rule_matches(jsonb, uuid, integer) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.resolve_list_recipients(uuid[]) FROM PUBLIC, anon;
+
+-- Membership maintenance runs from triggers only
+REVOKE EXECUTE ON FUNCTION public.dynamic_list_predicate(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.sync_dynamic_list_contacts(uuid, uuid[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.sync_dynamic_list_membership(uuid[], jsonb) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.sync_lists_referencing(uuid[], uuid[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,384 @@
+-- Audience counts and previews
+-- The list manager, campaign composer and SendCampaignModal counted recipients by
+-- fetching every membership row. segment_count answers "how many contacts do these
+-- lists and rules reach" in the database and returns a sampled preview:
+--   * exact counts evaluate the compiled predicate (compile_list_rules /
+--     dynamic_list_predicate) with count(*)
+--   * for large accounts, 'auto' mode estimates from a sample of the user's own contacts:
+--     contact ids are random uuids, so the run of ids following a random start is a
+--     uniform sample, read off idx_contacts_user_id_id, and it is scaled by the user's
+--     contact total
+--   * results are cached per user and segment hash for a couple of minutes; the hash
+--     includes the user's data version, so any contact, membership or purchase write
+--     misses the cache. Writes only append to segment_data_changes, so concurrent writers
+--     of one account never wait on a shared version row.
+
+CREATE TABLE IF NOT EXISTS public.segment_count_cache (
+  user_id UUID NOT NULL,
+  segment_hash TEXT NOT NULL,
+  result JSONB NOT NULL,
+  computed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, segment_hash)
+);
+
+-- Internal bookkeeping; reached through segment_count only
+ALTER TABLE public.segment_count_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_user_id_id ON public.contacts(user_id, id);
+
+-- One row per user per write statement on contacts, contact_lists or contact_products.
+-- Insert-only; old rows are removed by prune_segment_count_cache.
+CREATE TABLE IF NOT EXISTS public.segment_data_changes (
+  id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  user_id UUID NOT NULL,
+  changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_segment_data_changes_user_id
+ON public.segment_data_changes (user_id, id);
+
+-- Internal bookkeeping; reached through segment_count only
+ALTER TABLE public.segment_data_changes ENABLE ROW LEVEL SECURITY;
+
+-- Changes to a user's segment inputs. Both the count and the highest id are part of the
+-- version: a write that commits after a later-numbered one still moves the count, and
+-- pruning moves it too, which only costs a cache miss.
+CREATE OR REPLACE FUNCTION public.segment_data_version(p_user_id uuid)
+RETURNS text
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  SELECT count(*) || ':' || COALESCE(max(id), 0)
+  FROM public.segment_data_changes
+  WHERE user_id = p_user_id;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.on_segment_data_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  IF TG_TABLE_NAME = 'contacts' THEN
+    IF TG_OP = 'INSERT' THEN
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT user_id FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT user_id FROM old_rows;
+    ELSE
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT user_id FROM new_rows
+      UNION
+      SELECT user_id FROM old_rows;
+    END IF;
+  ELSIF TG_TABLE_NAME = 'contact_lists' THEN
+    IF TG_OP = 'INSERT' THEN
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT l.user_id
+      FROM (SELECT DISTINCT list_id FROM new_rows) r
+      JOIN public.email_lists l ON l.id = r.list_id;
+    ELSE
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT l.user_id
+      FROM (SELECT DISTINCT list_id FROM old_rows) r
+      JOIN public.email_lists l ON l.id = r.list_id;
+    END IF;
+  ELSE
+    IF TG_OP = 'INSERT' THEN
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT p.user_id
+      FROM (SELECT DISTINCT product_id FROM new_rows) r
+      JOIN public.products p ON p.id = r.product_id;
+    ELSE
+      INSERT INTO public.segment_data_changes (user_id)
+      SELECT DISTINCT p.user_id
+      FROM (SELECT DISTINCT product_id FROM old_rows) r
+      JOIN public.products p ON p.id = r.product_id;
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS trg_contacts_inserted_segment_data ON public.contacts;
+CREATE TRIGGER trg_contacts_inserted_segment_data
+AFTER INSERT ON public.contacts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contacts_updated_segment_data ON public.contacts;
+CREATE TRIGGER trg_contacts_updated_segment_data
+AFTER UPDATE ON public.contacts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contacts_deleted_segment_data ON public.contacts;
+CREATE TRIGGER trg_contacts_deleted_segment_data
+AFTER DELETE ON public.contacts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contact_lists_inserted_segment_data ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_inserted_segment_data
+AFTER INSERT ON public.contact_lists
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contact_lists_deleted_segment_data ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_deleted_segment_data
+AFTER DELETE ON public.contact_lists
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contact_products_inserted_segment_data ON public.contact_products;
+CREATE TRIGGER trg_contact_products_inserted_segment_data
+AFTER INSERT ON public.contact_products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+DROP TRIGGER IF EXISTS trg_contact_products_deleted_segment_data ON public.contact_products;
+CREATE TRIGGER trg_contact_products_deleted_segment_data
+AFTER DELETE ON public.contact_products
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_segment_data_changed();
+
+-- Predicate over contacts c for "subscribed members of these lists, matching these rules".
+-- Either part may be omitted; lists not owned by p_user_id are ignored.
+CREATE OR REPLACE FUNCTION public.compile_segment(p_user_id uuid, p_list_ids uuid[], p_rule_config jsonb)
+RETURNS text
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  list_parts text[] := ARRAY[]::text[];
+  static_ids uuid[];
+  dynamic_id uuid;
+  lists_predicate text;
+  rules_predicate text;
+BEGIN
+  IF p_list_ids IS NOT NULL THEN
+    SELECT array_agg(id) INTO static_ids
+    FROM public.email_lists
+    WHERE id = ANY(p_list_ids) AND user_id = p_user_id AND list_type <> 'dynamic';
+    IF static_ids IS NOT NULL THEN
+      list_parts := list_parts || format(
+        'EXISTS (SELECT 1 FROM public.contact_lists cl WHERE cl.contact_id = c.id AND cl.list_id = ANY(%L::uuid[]))',
+        static_ids);
+    END IF;
+
+    FOR dynamic_id IN
+      SELECT id FROM public.email_lists
+      WHERE id = ANY(p_list_ids) AND user_id = p_user_id AND list_type = 'dynamic'
+      ORDER BY id
+    LOOP
+      list_parts := list_parts || format('(%s)', public.dynamic_list_predicate(dynamic_id));
+    END LOOP;
+
+    lists_predicate := CASE WHEN cardinality(list_parts) = 0 THEN 'false'
+      ELSE format('c.status = %L AND (%s)', 'subscribed', array_to_string(list_parts, ' OR '))
+    END;
+  END IF;
+
+  IF p_rule_config IS NOT NULL THEN
+    rules_predicate := public.compile_list_rules(p_rule_config);
+  END IF;
+
+  IF lists_predicate IS NULL AND rules_predicate IS NULL THEN
+    RETURN 'false';
+  END IF;
+  RETURN concat_ws(' AND ', '(' || lists_predicate || ')', '(' || rules_predicate || ')');
+END;
+$function$;
+
+-- Count and sampled preview of a segment.
+-- p_mode: 'exact', 'estimate', or 'auto' (estimate once the account has more than
+-- 50k contacts). Estimates sample 20k of the user's contacts.
+CREATE OR REPLACE FUNCTION public.segment_count(
+  p_list_ids uuid[] DEFAULT NULL,
+  p_rule_config jsonb DEFAULT NULL,
+  p_mode text DEFAULT 'auto',
+  p_preview_limit integer DEFAULT 0,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := public.list_rules_user(p_user_id);
+  hash text;
+  cached public.segment_count_cache;
+  predicate text;
+  contact_total bigint;
+  sample_start uuid := gen_random_uuid();
+  sample_percent numeric;
+  sampled bigint;
+  sampled_matches bigint;
+  matched bigint;
+  is_estimate boolean := false;
+  preview jsonb := '[]'::jsonb;
+  summary jsonb;
+  cache_ttl constant interval := interval '2 minutes';
+  exact_limit constant bigint := 50000;
+  sample_target constant bigint := 20000;
+BEGIN
+  IF p_mode NOT IN ('auto', 'exact', 'estimate') THEN
+    RAISE EXCEPTION 'Unknown count mode %', p_mode;
+  END IF;
+
+  -- Lists enter the hash with their rule_version so rule edits miss the cache, and the
+  -- data version so contact, membership and purchase writes do
+  hash := md5(jsonb_build_object(
+    'data_version', public.segment_data_version(target_user),
+    'lists', (
+      SELECT COALESCE(jsonb_agg(jsonb_build_array(l.id, l.rule_version) ORDER BY l.id), '[]'::jsonb)
+      FROM public.email_lists l
+      WHERE l.id = ANY(COALESCE(p_list_ids, ARRAY[]::uuid[]))
+    ),
+    'has_lists', p_list_ids IS NOT NULL,
+    'rules', p_rule_config,
+    'mode', p_mode,
+    'preview', p_preview_limit
+  )::text);
+
+  SELECT * INTO cached FROM public.segment_count_cache
+  WHERE user_id = target_user AND segment_hash = hash AND computed_at > now() - cache_ttl;
+  IF FOUND THEN
+    RETURN cached.result || jsonb_build_object('cached', true);
+  END IF;
+
+  predicate := public.compile_segment(target_user, p_list_ids, p_rule_config);
+
+  IF p_mode <> 'exact' THEN
+    -- Index-only over the user's entries; far cheaper than evaluating the predicate
+    SELECT count(*) INTO contact_total FROM public.contacts WHERE user_id = target_user;
+  END IF;
+
+  IF p_mode = 'estimate' OR (p_mode = 'auto' AND contact_total > exact_limit) THEN
+    -- The user's ids from sample_start on, wrapping around to the lowest ones
+    EXECUTE format($sql$
+      SELECT count(*), count(*) FILTER (WHERE %s)
+      FROM (
+        SELECT * FROM (
+          (SELECT * FROM public.contacts WHERE user_id = $1 AND id >= $2 ORDER BY id LIMIT $3)
+          UNION ALL
+          (SELECT * FROM public.contacts WHERE user_id = $1 AND id < $2 ORDER BY id LIMIT $3)
+        ) wrapped
+        LIMIT $3
+      ) c
+    $sql$, predicate) INTO sampled, sampled_matches USING target_user, sample_start, sample_target;
+
+    IF sampled < contact_total THEN
+      matched := round(sampled_matches::numeric * contact_total / sampled);
+      sample_percent := round(100.0 * sampled / contact_total, 2);
+      is_estimate := true;
+    ELSE
+      matched := sampled_matches; -- the sample was the whole account
+    END IF;
+  END IF;
+
+  IF matched IS NULL THEN
+    EXECUTE format('SELECT count(*) FROM public.contacts c WHERE c.user_id = $1 AND (%s)', predicate)
+    INTO matched USING target_user;
+  END IF;
+
+  IF p_preview_limit > 0 AND matched > 0 THEN
+    -- Matches from the same random start on, so the preview is a random pick
+    EXECUTE format($sql$
+      SELECT COALESCE(jsonb_agg(to_jsonb(t)), '[]'::jsonb)
+      FROM (
+        SELECT * FROM (
+          (SELECT c.id, c.email, c.first_name, c.last_name, c.status, c.tags
+           FROM public.contacts c
+           WHERE c.user_id = $1 AND c.id >= $2 AND (%s)
+           ORDER BY c.id
+           LIMIT $3)
+          UNION ALL
+          (SELECT c.id, c.email, c.first_name, c.last_name, c.status, c.tags
+           FROM public.contacts c
+           WHERE c.user_id = $1 AND c.id < $2 AND (%s)
+           ORDER BY c.id
+           LIMIT $3)
+        ) wrapped
+        LIMIT $3
+      ) t
+    $sql$, predicate, predicate) INTO preview USING target_user, sample_start, p_preview_limit;
+  END IF;
+
+  summary := jsonb_build_object(
+    'count', matched,
+    'is_estimate', is_estimate,
+    'sample_percent', sample_percent,
+    'computed_at', now(),
+    'preview', preview
+  );
+
+  INSERT INTO public.segment_count_cache (user_id, segment_hash, result, computed_at)
+  VALUES (target_user, hash, summary, now())
+  ON CONFLICT (user_id, segment_hash) DO UPDATE
+  SET result = EXCLUDED.result,
+      computed_at = EXCLUDED.computed_at;
+
+  RETURN summary || jsonb_build_object('cached', false);
+END;
+$function$;
+
+-- Retention: delete up to p_batch_size cache entries older than p_keep (entries are only
+-- served for a couple of minutes) and data change rows older than p_keep. Removing change
+-- rows moves those users' data versions, so their next counts are computed afresh.
+CREATE OR REPLACE FUNCTION public.prune_segment_count_cache(
+  p_keep interval DEFAULT interval '1 hour',
+  p_batch_size integer DEFAULT 5000
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deleted_entries integer;
+  deleted_changes integer;
+BEGIN
+  DELETE FROM public.segment_count_cache
+  WHERE (user_id, segment_hash) IN (
+    SELECT user_id, segment_hash
+    FROM public.segment_count_cache
+    WHERE computed_at < now() - p_keep
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_entries = ROW_COUNT;
+
+  -- Ids grow with time, so the oldest rows are read first off the primary key
+  DELETE FROM public.segment_data_changes
+  WHERE id IN (
+    SELECT id
+    FROM public.segment_data_changes
+    WHERE changed_at < now() - p_keep
+    ORDER BY id
+    LIMIT p_batch_size
+  );
+  GET DIAGNOSTICS deleted_changes = ROW_COUNT;
+
+  RETURN deleted_entries + deleted_changes;
+END;
+$function$;
+
+-- Clients reach segment_count with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.segment_count(uuid[], jsonb, text, integer, uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.compile_segment(uuid, uuid[], jsonb) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.segment_data_version(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.prune_segment_count_cache(interval, integer) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,94 @@
+-- Server-side "duplicate as static list"
+-- SmartListManager copied a dynamic list by reading every membership into the browser
+-- and inserting it back. duplicate_list_as_static snapshots the list in one
+-- INSERT ... SELECT: dynamic lists straight from their compiled rules (so the copy
+-- reflects the rules right now, not the last sync), static lists from contact_lists.
+
+CREATE OR REPLACE FUNCTION public.duplicate_list_as_static(
+  p_list_id uuid,
+  p_name text DEFAULT NULL,
+  p_description text DEFAULT NULL,
+  OUT new_list_id uuid,
+  OUT member_count bigint
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  source public.email_lists;
+BEGIN
+  SELECT * INTO source FROM public.email_lists WHERE id = p_list_id;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'List % not found', p_list_id;
+  END IF;
+  IF NOT public.can_act_for(source.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to duplicate list %', p_list_id;
+  END IF;
+
+  INSERT INTO public.email_lists (name, description, user_id, list_type, rule_config)
+  VALUES (
+    COALESCE(NULLIF(trim(p_name), ''), source.name || ' (Copy)'),
+    COALESCE(p_description, 'Static copy of ' || source.name),
+    source.user_id,
+    'static',
+    NULL
+  )
+  RETURNING id INTO new_list_id;
+
+  IF source.list_type = 'dynamic' THEN
+    EXECUTE format($sql$
+      INSERT INTO public.contact_lists (contact_id, list_id)
+      SELECT c.id, $1
+      FROM public.contacts c
+      WHERE c.user_id = $2
+        AND (%s)
+    $sql$, public.dynamic_list_predicate(p_list_id)) USING new_list_id, source.user_id;
+  ELSE
+    INSERT INTO public.contact_lists (contact_id, list_id)
+    SELECT cl.contact_id, new_list_id
+    FROM public.contact_lists cl
+    WHERE cl.list_id = p_list_id;
+  END IF;
+  GET DIAGNOSTICS member_count = ROW_COUNT;
+END;
+$function$;
+
+-- Clients reach this with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.duplicate_list_as_static(uuid, text, text) FROM PUBLIC, anon;
+
+-- Large membership inserts (duplicates, rebuilds) only need the distinct list ids to
+-- decide whether any dynamic list depends on them; collect contact ids only then
+CREATE OR REPLACE FUNCTION public.on_contact_lists_changed_sync_lists()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  changed_list_ids uuid[];
+  list_ids uuid[];
+  contact_ids uuid[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(DISTINCT list_id) INTO changed_list_ids FROM new_rows;
+  ELSE
+    SELECT array_agg(DISTINCT list_id) INTO changed_list_ids FROM old_rows;
+  END IF;
+
+  IF changed_list_ids IS NULL OR NOT EXISTS (
+    SELECT 1 FROM public.email_lists l
+    WHERE l.list_type = 'dynamic' AND l.rule_list_ids && changed_list_ids
+  ) THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(list_id), array_agg(contact_id) INTO list_ids, contact_ids FROM new_rows;
+  ELSE
+    SELECT array_agg(list_id), array_agg(contact_id) INTO list_ids, contact_ids FROM old_rows;
+  END IF;
+  PERFORM public.sync_lists_referencing(list_ids, contact_ids);
+  RETURN NULL;
+END;
+$function$;
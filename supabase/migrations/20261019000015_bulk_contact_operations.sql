@@ -0,0 +1,281 @@
+-- Set-based bulk tag and list operations
+-- Bulk "add tags", "remove tags", "add to lists" and "remove from lists" used to write one
+-- contact (or one contact/list pair) per request from the browser. They now run as a
+-- contact_bulk_jobs row drained by run_contact_bulk_job, one statement per chunk:
+--   * the selection is an explicit id set, a segment filter (list ids and/or rule_config,
+--     compiled once with compile_segment), or both
+--   * tag operations only rewrite contacts whose tags actually change, so the tag rule
+--     trigger fires once per affected row and untouched rows cost nothing
+--   * list operations are INSERT ... ON CONFLICT DO NOTHING / DELETE per chunk
+-- Callers loop on run_contact_bulk_job and show processed/total as progress.
+
+CREATE TABLE IF NOT EXISTS public.contact_bulk_jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_id UUID NOT NULL,
+  operation TEXT NOT NULL CHECK (operation IN ('add_tags', 'remove_tags', 'add_to_lists', 'remove_from_lists')),
+  tags TEXT[],
+  list_ids UUID[],
+  -- Selection: explicit ids, a compiled segment predicate over contacts c, or both (AND)
+  contact_ids UUID[],
+  predicate TEXT,
+  status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'completed')),
+  last_id UUID,
+  total INTEGER,
+  processed INTEGER NOT NULL DEFAULT 0,
+  changed INTEGER NOT NULL DEFAULT 0,
+  -- Tag operations: [{contact_id, added, removed}] for the chunk processed last, so the
+  -- caller can fire tag automations for exactly the contacts that changed
+  last_changes JSONB NOT NULL DEFAULT '[]'::jsonb,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  completed_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE public.contact_bulk_jobs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own contact bulk jobs"
+ON public.contact_bulk_jobs
+FOR SELECT
+USING (auth.uid() = user_id);
+
+CREATE INDEX IF NOT EXISTS idx_contact_bulk_jobs_pending
+  ON public.contact_bulk_jobs(user_id, created_at)
+  WHERE status = 'pending';
+
+-- Queue a bulk operation over p_contact_ids and/or the segment described by
+-- p_filter_list_ids / p_filter_rule_config (same shapes as segment_count).
+-- Lists to change must belong to the user and be static: dynamic lists follow their rules.
+CREATE OR REPLACE FUNCTION public.enqueue_contact_bulk_job(
+  p_operation text,
+  p_tags text[] DEFAULT NULL,
+  p_list_ids uuid[] DEFAULT NULL,
+  p_contact_ids uuid[] DEFAULT NULL,
+  p_filter_list_ids uuid[] DEFAULT NULL,
+  p_filter_rule_config jsonb DEFAULT NULL,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS uuid
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+  clean_tags text[];
+  target_lists uuid[];
+  selection_predicate text;
+  job_id uuid;
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'A user is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to change contacts of user %', target_user;
+  END IF;
+  IF p_contact_ids IS NULL AND p_filter_list_ids IS NULL AND p_filter_rule_config IS NULL THEN
+    RAISE EXCEPTION 'Pass contact ids, a filter or both';
+  END IF;
+
+  IF p_operation IN ('add_tags', 'remove_tags') THEN
+    clean_tags := public.clean_tag_array(p_tags);
+    IF cardinality(clean_tags) = 0 THEN
+      RAISE EXCEPTION 'No tags given for %', p_operation;
+    END IF;
+  ELSIF p_operation IN ('add_to_lists', 'remove_from_lists') THEN
+    SELECT array_agg(id ORDER BY id) INTO target_lists
+    FROM public.email_lists
+    WHERE id = ANY(p_list_ids) AND user_id = target_user AND list_type <> 'dynamic';
+    IF target_lists IS NULL THEN
+      RAISE EXCEPTION 'No static lists of user % given for %', target_user, p_operation;
+    END IF;
+  ELSE
+    RAISE EXCEPTION 'Unknown bulk operation %', p_operation;
+  END IF;
+
+  IF p_filter_list_ids IS NOT NULL OR p_filter_rule_config IS NOT NULL THEN
+    selection_predicate := public.compile_segment(target_user, p_filter_list_ids, p_filter_rule_config);
+  END IF;
+
+  INSERT INTO public.contact_bulk_jobs (user_id, operation, tags, list_ids, contact_ids, predicate)
+  VALUES (
+    target_user,
+    p_operation,
+    clean_tags,
+    target_lists,
+    (SELECT array_agg(DISTINCT id) FROM unnest(p_contact_ids) AS id WHERE id IS NOT NULL),
+    selection_predicate
+  )
+  RETURNING id INTO job_id;
+  RETURN job_id;
+END;
+$function$;
+
+-- Process the next chunk (keyset on contacts.id) of a bulk job and return its progress.
+-- Like run_tag_rule_reapply_job, each call is meant to be its own transaction.
+CREATE OR REPLACE FUNCTION public.run_contact_bulk_job(p_job_id uuid, p_chunk_size integer DEFAULT 1000)
+RETURNS public.contact_bulk_jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  job public.contact_bulk_jobs;
+  selection text;
+  batch_count integer := 0;
+  changed_count integer := 0;
+  batch_last uuid;
+  changes jsonb := '[]'::jsonb;
+  needs_change text;
+  new_tags text;
+BEGIN
+  -- Serializes concurrent drainers of the same job
+  SELECT * INTO job FROM public.contact_bulk_jobs WHERE id = p_job_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Contact bulk job % not found', p_job_id;
+  END IF;
+  IF NOT public.can_act_for(job.user_id) THEN
+    RAISE EXCEPTION 'Not allowed to run contact bulk job %', p_job_id;
+  END IF;
+  IF job.status = 'completed' THEN
+    RETURN job;
+  END IF;
+
+  -- $1 user, $2 explicit ids, $3 keyset cursor
+  selection := format(
+    'c.user_id = $1 AND ($2::uuid[] IS NULL OR c.id = ANY($2)) AND (%s)',
+    COALESCE(job.predicate, 'true'));
+
+  IF job.total IS NULL THEN
+    EXECUTE format('SELECT count(*) FROM public.contacts c WHERE %s', selection)
+    INTO job.total USING job.user_id, job.contact_ids;
+  END IF;
+
+  IF job.operation IN ('add_tags', 'remove_tags') THEN
+    -- Added tags keep their spelling and go after existing ones; removal is
+    -- case-insensitive. Rows already in the target state are skipped.
+    IF job.operation = 'add_tags' THEN
+      needs_change := 'NOT public.normalize_tag_array(b.tags) @> public.normalize_tag_array($4)';
+      new_tags := 'public.clean_tag_array(COALESCE(c.tags, ARRAY[]::text[]) || $4)';
+    ELSE
+      needs_change := 'public.normalize_tag_array(b.tags) && public.normalize_tag_array($4)';
+      new_tags := 'ARRAY(SELECT t FROM unnest(c.tags) WITH ORDINALITY AS u(t, ord) '
+        'WHERE lower(trim(t)) <> ALL(public.normalize_tag_array($4)) ORDER BY ord)';
+    END IF;
+
+    -- $4 tags, $5 chunk size. Old tags come from the batch snapshot since RETURNING
+    -- only sees the new ones.
+    EXECUTE format($sql$
+      WITH batch AS (
+        SELECT c.id, c.tags
+        FROM public.contacts c
+        WHERE %s
+          AND ($3::uuid IS NULL OR c.id > $3)
+        ORDER BY c.id
+        LIMIT $5
+      ), targeted AS (
+        SELECT b.id, b.tags
+        FROM batch b
+        WHERE %s
+      ), updated AS (
+        UPDATE public.contacts c
+        SET tags = %s
+        FROM targeted
+        WHERE c.id = targeted.id
+        RETURNING c.id, targeted.tags AS old_tags, c.tags AS new_tags
+      )
+      SELECT
+        (SELECT count(*) FROM batch),
+        (SELECT id FROM batch ORDER BY id DESC LIMIT 1),
+        (SELECT count(*) FROM updated),
+        COALESCE((
+          SELECT jsonb_agg(jsonb_build_object(
+            'contact_id', u.id,
+            'added', to_jsonb(ARRAY(
+              SELECT unnest(public.normalize_tag_array(u.new_tags))
+              EXCEPT SELECT unnest(public.normalize_tag_array(u.old_tags)))),
+            'removed', to_jsonb(ARRAY(
+              SELECT unnest(public.normalize_tag_array(u.old_tags))
+              EXCEPT SELECT unnest(public.normalize_tag_array(u.new_tags))))
+          ))
+          FROM updated u
+        ), '[]'::jsonb)
+    $sql$, selection, needs_change, new_tags)
+    INTO batch_count, batch_last, changed_count, changes
+    USING job.user_id, job.contact_ids, job.last_id, job.tags, p_chunk_size;
+  ELSIF job.operation = 'add_to_lists' THEN
+    -- $4 lists, $5 chunk size
+    EXECUTE format($sql$
+      WITH batch AS (
+        SELECT c.id
+        FROM public.contacts c
+        WHERE %s
+          AND ($3::uuid IS NULL OR c.id > $3)
+        ORDER BY c.id
+        LIMIT $5
+      ), added AS (
+        INSERT INTO public.contact_lists (contact_id, list_id)
+        SELECT b.id, l.list_id
+        FROM batch b CROSS JOIN unnest($4::uuid[]) AS l(list_id)
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+      )
+      SELECT
+        (SELECT count(*) FROM batch),
+        (SELECT id FROM batch ORDER BY id DESC LIMIT 1),
+        (SELECT count(*) FROM added)
+    $sql$, selection)
+    INTO batch_count, batch_last, changed_count
+    USING job.user_id, job.contact_ids, job.last_id, job.list_ids, p_chunk_size;
+  ELSE
+    EXECUTE format($sql$
+      WITH batch AS (
+        SELECT c.id
+        FROM public.contacts c
+        WHERE %s
+          AND ($3::uuid IS NULL OR c.id > $3)
+        ORDER BY c.id
+        LIMIT $5
+      ), removed AS (
+        DELETE FROM public.contact_lists cl
+        USING batch b
+        WHERE cl.contact_id = b.id
+          AND cl.list_id = ANY($4::uuid[])
+        RETURNING 1
+      )
+      SELECT
+        (SELECT count(*) FROM batch),
+        (SELECT id FROM batch ORDER BY id DESC LIMIT 1),
+        (SELECT count(*) FROM removed)
+    $sql$, selection)
+    INTO batch_count, batch_last, changed_count
+    USING job.user_id, job.contact_ids, job.last_id, job.list_ids, p_chunk_size;
+  END IF;
+
+  job.processed := job.processed + batch_count;
+  job.changed := job.changed + changed_count;
+  job.last_id := COALESCE(batch_last, job.last_id);
+
+  IF batch_count < p_chunk_size THEN
+    job.status := 'completed';
+    job.completed_at := now();
+  END IF;
+
+  UPDATE public.contact_bulk_jobs
+  SET status = job.status,
+      last_id = job.last_id,
+      total = job.total,
+      processed = job.processed,
+      changed = job.changed,
+      last_changes = changes,
+      updated_at = now(),
+      completed_at = job.completed_at
+  WHERE id = job.id
+  RETURNING * INTO job;
+
+  RETURN job;
+END;
+$function$;
+
+-- Clients reach these with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.enqueue_contact_bulk_job(text, text[], uuid[], uuid[], uuid[], jsonb, uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.run_contact_bulk_job(uuid, integer) FROM PUBLIC, anon;
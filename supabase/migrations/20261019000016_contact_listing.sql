@@ -0,0 +1,122 @@
+-- Server-filtered, keyset-paginated contact listing
+-- The contact manager paged with OFFSET and filtered/searched the fetched rows in the
+-- browser, and loaded every contact's tags and every membership up front. list_contacts
+-- does the filtering in the database and pages by (created_at, id):
+--   * the default listing (one status, newest first) walks idx_contacts_user_status_created;
+--     the cursor is an index condition on created_at and ties on id are resolved by an
+--     incremental sort, so every page reads about p_limit rows however large the account
+--   * tag filters resolve the requested tags to dictionary ids once and compare them with
+--     contacts.tag_ids on idx_contacts_tag_ids; lists use idx_contact_lists_list_contact
+--     and search the trigram indexes below (ILIKE '%term%' on email, first and last name)
+--   * it returns SETOF contacts, so callers pick sparse fields with PostgREST's select
+-- Only the filters that are set end up in the statement, so each combination gets its own
+-- plan instead of a generic one full of "param IS NULL OR ..." branches.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_email_trgm
+  ON public.contacts USING GIN (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_contacts_first_name_trgm
+  ON public.contacts USING GIN (first_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_contacts_last_name_trgm
+  ON public.contacts USING GIN (last_name gin_trgm_ops);
+
+-- Escape LIKE wildcards so user input matches literally
+CREATE OR REPLACE FUNCTION public.like_escape(p_text text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+PARALLEL SAFE
+AS $function$
+  SELECT replace(replace(replace(p_text, '\', '\\'), '%', '\%'), '_', '\_');
+$function$;
+
+-- One page of p_user_id's contacts, newest first. Pass the created_at and id of the last
+-- row of the previous page as p_after_created_at / p_after_id to get the next page.
+--   p_status          'subscribed' by default; 'any' for every status
+--   p_tags            contacts carrying all of them (any of them with p_match_all_tags false)
+--   p_exclude_tags    contacts carrying none of them
+--   p_list_id         members of a list (dynamic list membership is kept in contact_lists)
+--   p_product_id      contacts who bought the product
+--   p_search          substring of email, first or last name (case-insensitive)
+CREATE OR REPLACE FUNCTION public.list_contacts(
+  p_limit integer DEFAULT 50,
+  p_after_created_at timestamp with time zone DEFAULT NULL,
+  p_after_id uuid DEFAULT NULL,
+  p_status text DEFAULT 'subscribed',
+  p_tags text[] DEFAULT NULL,
+  p_match_all_tags boolean DEFAULT true,
+  p_exclude_tags text[] DEFAULT NULL,
+  p_list_id uuid DEFAULT NULL,
+  p_product_id uuid DEFAULT NULL,
+  p_search text DEFAULT NULL,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS SETOF public.contacts
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+  conditions text[] := ARRAY['c.user_id = $1'];
+  search_pattern text;
+  filter_tag_ids integer[];
+  exclude_tag_ids integer[];
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'A user is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to list contacts of user %', target_user;
+  END IF;
+
+  IF COALESCE(p_status, 'any') <> 'any' THEN
+    conditions := conditions || 'c.status = $2'::text;
+  END IF;
+  IF p_after_created_at IS NOT NULL THEN
+    conditions := conditions || CASE WHEN p_after_id IS NULL
+      THEN 'c.created_at < $3'
+      ELSE 'c.created_at <= $3 AND (c.created_at < $3 OR c.id < $4)'
+    END;
+  END IF;
+  IF cardinality(public.normalize_tag_array(p_tags)) > 0 THEN
+    filter_tag_ids := public.lookup_tag_ids(target_user, p_tags);
+    IF p_match_all_tags AND cardinality(filter_tag_ids) < cardinality(public.normalize_tag_array(p_tags)) THEN
+      conditions := conditions || 'false'::text; -- a tag no contact carries
+    ELSE
+      conditions := conditions || CASE WHEN p_match_all_tags
+        THEN 'c.tag_ids @> $5'
+        ELSE 'c.tag_ids && $5'
+      END;
+    END IF;
+  END IF;
+  IF cardinality(public.normalize_tag_array(p_exclude_tags)) > 0 THEN
+    exclude_tag_ids := public.lookup_tag_ids(target_user, p_exclude_tags);
+    conditions := conditions || 'NOT c.tag_ids && $6'::text;
+  END IF;
+  IF p_list_id IS NOT NULL THEN
+    conditions := conditions ||
+      'EXISTS (SELECT 1 FROM public.contact_lists cl WHERE cl.list_id = $7 AND cl.contact_id = c.id)'::text;
+  END IF;
+  IF p_product_id IS NOT NULL THEN
+    conditions := conditions ||
+      'EXISTS (SELECT 1 FROM public.contact_products cp WHERE cp.product_id = $8 AND cp.contact_id = c.id)'::text;
+  END IF;
+  IF NULLIF(trim(p_search), '') IS NOT NULL THEN
+    search_pattern := '%' || public.like_escape(trim(p_search)) || '%';
+    conditions := conditions ||
+      '(c.email ILIKE $9 OR c.first_name ILIKE $9 OR c.last_name ILIKE $9)'::text;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT c.* FROM public.contacts c WHERE %s ORDER BY c.created_at DESC, c.id DESC LIMIT $10',
+    array_to_string(conditions, ' AND ')
+  ) USING target_user, p_status, p_after_created_at, p_after_id, filter_tag_ids, exclude_tag_ids,
+    p_list_id, p_product_id, search_pattern, LEAST(GREATEST(COALESCE(p_limit, 50), 1), 500);
+END;
+$function$;
+
+-- Clients reach this with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.list_contacts(integer, timestamp with time zone, uuid, text, text[], boolean, text[], uuid, uuid, text, uuid) FROM PUBLIC, anon;
@@ -0,0 +1,173 @@
+-- Ranked trigram search over contacts and products
+-- Contact search and the AI prompt's product autocomplete matched substrings over arrays
+-- fetched into the browser. These functions answer them from pg_trgm GIN indexes
+-- (contacts' email/first/last name indexes come with list_contacts):
+--   * search_contacts: top-K contacts for a fragment, fuzzy (word similarity) as well as
+--     substring, ranked exact > prefix > substring > fuzzy
+--   * search_products: the same for product names; p_prefix restricts to names starting
+--     with the query, which is what autocomplete completes
+--   * match_products_in_text: products whose name appears in a prompt
+-- The search predicates are index-backed, so only matching rows are read and ranked.
+-- match_products_in_text is not: the text is the long side, and a trigram index on
+-- products.name cannot find names contained in it (p.name <<% p_text has the indexed
+-- column on the wrong side). It reads the user's products through their user_id index
+-- and checks each name with strpos, which is linear in the size of the catalogue.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm
+  ON public.products USING GIN (name gin_trgm_ops);
+
+-- Rank of p_value for p_query: 3 exact, 2 prefix, 1 substring, else word similarity (< 1)
+CREATE OR REPLACE FUNCTION public.search_rank(p_value text, p_query text)
+RETURNS real
+LANGUAGE sql
+IMMUTABLE
+PARALLEL SAFE
+AS $function$
+  SELECT CASE
+    WHEN p_value IS NULL THEN 0
+    WHEN lower(p_value) = lower(p_query) THEN 3
+    WHEN lower(p_value) LIKE public.like_escape(lower(p_query)) || '%' THEN 2
+    WHEN lower(p_value) LIKE '%' || public.like_escape(lower(p_query)) || '%' THEN 1
+    ELSE word_similarity(p_query, p_value)
+  END::real;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.search_contacts(
+  p_query text,
+  p_limit integer DEFAULT 20,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS TABLE(id uuid, email text, first_name text, last_name text, status text, tags text[], score real)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+#variable_conflict use_column
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+  search_term text := trim(p_query);
+  pattern text;
+  top_k integer := LEAST(GREATEST(COALESCE(p_limit, 20), 1), 100);
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'A user is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to search contacts of user %', target_user;
+  END IF;
+  IF COALESCE(search_term, '') = '' THEN
+    RETURN;
+  END IF;
+
+  -- One or two characters carry no full trigram: match prefixes only
+  IF length(search_term) < 3 THEN
+    pattern := public.like_escape(search_term) || '%';
+    RETURN QUERY
+    SELECT c.id, c.email::text, c.first_name::text, c.last_name::text, c.status::text, c.tags,
+           GREATEST(public.search_rank(c.email, search_term), public.search_rank(c.first_name, search_term),
+                    public.search_rank(c.last_name, search_term)) AS score
+    FROM public.contacts c
+    WHERE c.user_id = target_user
+      AND (c.email ILIKE pattern OR c.first_name ILIKE pattern OR c.last_name ILIKE pattern)
+    ORDER BY score DESC, c.created_at DESC
+    LIMIT top_k;
+    RETURN;
+  END IF;
+
+  pattern := '%' || public.like_escape(search_term) || '%';
+  RETURN QUERY
+  SELECT c.id, c.email::text, c.first_name::text, c.last_name::text, c.status::text, c.tags,
+         GREATEST(public.search_rank(c.email, search_term), public.search_rank(c.first_name, search_term),
+                  public.search_rank(c.last_name, search_term)) AS score
+  FROM public.contacts c
+  WHERE c.user_id = target_user
+    AND (c.email ILIKE pattern OR c.first_name ILIKE pattern OR c.last_name ILIKE pattern
+         OR search_term <% c.email OR search_term <% c.first_name OR search_term <% c.last_name)
+  ORDER BY score DESC, c.created_at DESC
+  LIMIT top_k;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.search_products(
+  p_query text,
+  p_limit integer DEFAULT 10,
+  p_prefix boolean DEFAULT false,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS SETOF public.products
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+  search_term text := trim(p_query);
+  top_k integer := LEAST(GREATEST(COALESCE(p_limit, 10), 1), 100);
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'A user is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to search products of user %', target_user;
+  END IF;
+  IF COALESCE(search_term, '') = '' THEN
+    RETURN;
+  END IF;
+
+  IF p_prefix OR length(search_term) < 3 THEN
+    RETURN QUERY
+    SELECT p.*
+    FROM public.products p
+    WHERE p.user_id = target_user
+      AND p.name ILIKE public.like_escape(search_term) || '%'
+    ORDER BY public.search_rank(p.name, search_term) DESC, length(p.name), p.name
+    LIMIT top_k;
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  SELECT p.*
+  FROM public.products p
+  WHERE p.user_id = target_user
+    AND (p.name ILIKE '%' || public.like_escape(search_term) || '%' OR search_term <% p.name)
+  ORDER BY public.search_rank(p.name, search_term) DESC, length(p.name), p.name
+  LIMIT top_k;
+END;
+$function$;
+
+-- Products named anywhere in p_text (case-insensitive), for prompt enrichment
+CREATE OR REPLACE FUNCTION public.match_products_in_text(p_text text, p_user_id uuid DEFAULT NULL)
+RETURNS SETOF public.products
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := COALESCE(p_user_id, auth.uid());
+BEGIN
+  IF target_user IS NULL THEN
+    RAISE EXCEPTION 'A user is required';
+  END IF;
+  IF NOT public.can_act_for(target_user) THEN
+    RAISE EXCEPTION 'Not allowed to read products of user %', target_user;
+  END IF;
+
+  RETURN QUERY
+  SELECT p.*
+  FROM public.products p
+  WHERE p.user_id = target_user
+    AND trim(p.name) <> ''
+    AND strpos(lower(p_text), lower(trim(p.name))) > 0
+  ORDER BY p.created_at DESC;
+END;
+$function$;
+
+-- Clients reach these with their own JWT; the anon key has no business here
+REVOKE EXECUTE ON FUNCTION public.search_contacts(text, integer, uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.search_products(text, integer, boolean, uuid) FROM PUBLIC, anon;
+REVOKE EXECUTE ON FUNCTION public.match_products_in_text(text, uuid) FROM PUBLIC, anon;
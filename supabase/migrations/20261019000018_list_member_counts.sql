@@ -0,0 +1,374 @@
+-- Per-list member counters
+-- List cards counted members with one count query per list (or tallied fetched rows).
+-- email_list_member_counts keeps, per list, the number of memberships and the number whose
+-- contact is subscribed, maintained by statement-level triggers:
+--   * contact_lists insert/delete apply per-list deltas, one upsert per statement
+--   * contact status changes move subscribed_count for the contact's lists
+--   * contact deletes take the subscribed delta of their cascaded memberships from the
+--     deleted contacts' status
+-- The list overview embeds the counters in its email_lists select, and segment_count
+-- answers a single list without rules from them.
+
+CREATE TABLE IF NOT EXISTS public.email_list_member_counts (
+  list_id UUID PRIMARY KEY REFERENCES public.email_lists(id) ON DELETE CASCADE,
+  member_count BIGINT NOT NULL DEFAULT 0,
+  subscribed_count BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.email_list_member_counts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view counts of their own lists"
+ON public.email_list_member_counts
+FOR SELECT
+USING (
+  EXISTS (
+    SELECT 1 FROM public.email_lists l
+    WHERE l.id = list_id
+      AND (l.user_id = auth.uid() OR public.is_current_user_admin())
+  )
+);
+
+-- Add per-list deltas: [{list_id, members, subscribed}]
+CREATE OR REPLACE FUNCTION public.apply_list_member_count_deltas(p_deltas jsonb)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+  INSERT INTO public.email_list_member_counts AS n (list_id, member_count, subscribed_count, updated_at)
+  SELECT d.list_id, d.members, d.subscribed, now()
+  FROM jsonb_to_recordset(p_deltas) AS d(list_id uuid, members bigint, subscribed bigint)
+  JOIN public.email_lists l ON l.id = d.list_id
+  WHERE d.members <> 0 OR d.subscribed <> 0
+  ORDER BY d.list_id
+  ON CONFLICT (list_id) DO UPDATE
+  SET member_count = n.member_count + EXCLUDED.member_count,
+      subscribed_count = n.subscribed_count + EXCLUDED.subscribed_count,
+      updated_at = EXCLUDED.updated_at;
+$function$;
+
+-- Only the triggers below may move counters
+REVOKE EXECUTE ON FUNCTION public.apply_list_member_count_deltas(jsonb) FROM PUBLIC, anon, authenticated;
+
+-- Memberships removed by a contact delete cascade, waiting for the contacts delete trigger
+-- to supply their contact's status. Entries only live inside the deleting transaction.
+CREATE UNLOGGED TABLE IF NOT EXISTS public.email_list_member_count_orphans (
+  contact_id UUID NOT NULL,
+  list_id UUID NOT NULL,
+  PRIMARY KEY (contact_id, list_id)
+);
+
+-- Internal to the counters; no client access
+ALTER TABLE public.email_list_member_count_orphans ENABLE ROW LEVEL SECURITY;
+
+-- Recount lists from scratch (backfill, repair)
+CREATE OR REPLACE FUNCTION public.recount_list_members(p_list_ids uuid[] DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  recounted integer;
+BEGIN
+  INSERT INTO public.email_list_member_counts AS n (list_id, member_count, subscribed_count, updated_at)
+  SELECT l.id,
+         count(cl.contact_id),
+         count(cl.contact_id) FILTER (WHERE c.status = 'subscribed'),
+         now()
+  FROM public.email_lists l
+  LEFT JOIN public.contact_lists cl ON cl.list_id = l.id
+  LEFT JOIN public.contacts c ON c.id = cl.contact_id
+  WHERE p_list_ids IS NULL OR l.id = ANY(p_list_ids)
+  GROUP BY l.id
+  ORDER BY l.id
+  ON CONFLICT (list_id) DO UPDATE
+  SET member_count = EXCLUDED.member_count,
+      subscribed_count = EXCLUDED.subscribed_count,
+      updated_at = EXCLUDED.updated_at;
+  GET DIAGNOSTICS recounted = ROW_COUNT;
+  RETURN recounted;
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.on_contact_lists_changed_member_counts()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deltas jsonb;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT jsonb_agg(jsonb_build_object('list_id', list_id, 'members', members, 'subscribed', subscribed))
+    INTO deltas
+    FROM (
+      SELECT r.list_id, count(*) AS members, count(*) FILTER (WHERE c.status = 'subscribed') AS subscribed
+      FROM new_rows r
+      LEFT JOIN public.contacts c ON c.id = r.contact_id
+      GROUP BY r.list_id
+    ) per_list;
+  ELSE
+    -- A membership whose contact is already gone (the contacts delete cascade) no longer
+    -- tells whether it was counted as subscribed: its member delta applies now, and
+    -- trg_contacts_deleted_list_counts settles subscribed_count from the contact's status
+    INSERT INTO public.email_list_member_count_orphans (contact_id, list_id)
+    SELECT r.contact_id, r.list_id
+    FROM old_rows r
+    WHERE NOT EXISTS (SELECT 1 FROM public.contacts c WHERE c.id = r.contact_id)
+    ON CONFLICT DO NOTHING;
+
+    SELECT jsonb_agg(jsonb_build_object('list_id', list_id, 'members', -members, 'subscribed', -subscribed))
+    INTO deltas
+    FROM (
+      SELECT r.list_id, count(*) AS members, count(*) FILTER (WHERE c.status = 'subscribed') AS subscribed
+      FROM old_rows r
+      LEFT JOIN public.contacts c ON c.id = r.contact_id
+      GROUP BY r.list_id
+    ) per_list;
+  END IF;
+
+  IF deltas IS NOT NULL THEN
+    PERFORM public.apply_list_member_count_deltas(deltas);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+-- Status changes move subscribed_count for the lists the contact is in right now. This
+-- must run before trg_contacts_updated_sync_lists (triggers fire in name order): the
+-- dynamic list sync then adds or removes memberships under the new status, and the
+-- contact_lists triggers count those with it.
+CREATE OR REPLACE FUNCTION public.on_contacts_status_changed_member_counts()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deltas jsonb;
+BEGIN
+  SELECT jsonb_agg(jsonb_build_object('list_id', list_id, 'members', 0, 'subscribed', subscribed))
+  INTO deltas
+  FROM (
+    SELECT cl.list_id,
+           sum(CASE WHEN n.status = 'subscribed' THEN 1 ELSE -1 END) AS subscribed
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    JOIN public.contact_lists cl ON cl.contact_id = n.id
+    WHERE (n.status = 'subscribed') IS DISTINCT FROM (o.status = 'subscribed')
+    GROUP BY cl.list_id
+  ) per_list;
+
+  IF deltas IS NOT NULL THEN
+    PERFORM public.apply_list_member_count_deltas(deltas);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+-- Deleted contacts: their memberships were removed by the cascade before this runs, with
+-- only the member delta applied; old_rows has the status for the subscribed delta
+CREATE OR REPLACE FUNCTION public.on_contacts_deleted_member_counts()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  deltas jsonb;
+BEGIN
+  WITH settled AS (
+    DELETE FROM public.email_list_member_count_orphans o
+    USING old_rows d
+    WHERE o.contact_id = d.id
+    RETURNING o.list_id, d.status
+  )
+  SELECT jsonb_agg(jsonb_build_object('list_id', list_id, 'members', 0, 'subscribed', -subscribed))
+  INTO deltas
+  FROM (
+    SELECT list_id, count(*) AS subscribed
+    FROM settled
+    WHERE status = 'subscribed'
+    GROUP BY list_id
+  ) per_list;
+
+  IF deltas IS NOT NULL THEN
+    PERFORM public.apply_list_member_count_deltas(deltas);
+  END IF;
+  RETURN NULL;
+END;
+$function$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS trg_contact_lists_inserted_member_counts ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_inserted_member_counts
+AFTER INSERT ON public.contact_lists
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_lists_changed_member_counts();
+
+DROP TRIGGER IF EXISTS trg_contact_lists_deleted_member_counts ON public.contact_lists;
+CREATE TRIGGER trg_contact_lists_deleted_member_counts
+AFTER DELETE ON public.contact_lists
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contact_lists_changed_member_counts();
+
+DROP TRIGGER IF EXISTS trg_contacts_updated_list_counts ON public.contacts;
+CREATE TRIGGER trg_contacts_updated_list_counts
+AFTER UPDATE ON public.contacts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contacts_status_changed_member_counts();
+
+DROP TRIGGER IF EXISTS trg_contacts_deleted_list_counts ON public.contacts;
+CREATE TRIGGER trg_contacts_deleted_list_counts
+AFTER DELETE ON public.contacts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION public.on_contacts_deleted_member_counts();
+
+SELECT public.recount_list_members();
+
+CREATE OR REPLACE FUNCTION public.segment_count(
+  p_list_ids uuid[] DEFAULT NULL,
+  p_rule_config jsonb DEFAULT NULL,
+  p_mode text DEFAULT 'auto',
+  p_preview_limit integer DEFAULT 0,
+  p_user_id uuid DEFAULT NULL
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  target_user uuid := public.list_rules_user(p_user_id);
+  hash text;
+  cached public.segment_count_cache;
+  predicate text;
+  contact_total bigint;
+  sample_start uuid := gen_random_uuid();
+  sample_percent numeric;
+  sampled bigint;
+  sampled_matches bigint;
+  matched bigint;
+  is_estimate boolean := false;
+  preview jsonb := '[]'::jsonb;
+  summary jsonb;
+  cache_ttl constant interval := interval '2 minutes';
+  exact_limit constant bigint := 50000;
+  sample_target constant bigint := 20000;
+BEGIN
+  IF p_mode NOT IN ('auto', 'exact', 'estimate') THEN
+    RAISE EXCEPTION 'Unknown count mode %', p_mode;
+  END IF;
+
+  -- Lists enter the hash with their rule_version and the time their member counters last
+  -- moved, and the data version covers contact, membership and purchase writes
+  hash := md5(jsonb_build_object(
+    'data_version', public.segment_data_version(target_user),
+    'lists', (
+      SELECT COALESCE(jsonb_agg(jsonb_build_array(l.id, l.rule_version, n.updated_at) ORDER BY l.id), '[]'::jsonb)
+      FROM public.email_lists l
+      LEFT JOIN public.email_list_member_counts n ON n.list_id = l.id
+      WHERE l.id = ANY(COALESCE(p_list_ids, ARRAY[]::uuid[]))
+    ),
+    'has_lists', p_list_ids IS NOT NULL,
+    'rules', p_rule_config,
+    'mode', p_mode,
+    'preview', p_preview_limit
+  )::text);
+
+  SELECT * INTO cached FROM public.segment_count_cache
+  WHERE user_id = target_user AND segment_hash = hash AND computed_at > now() - cache_ttl;
+  IF FOUND THEN
+    RETURN cached.result || jsonb_build_object('cached', true);
+  END IF;
+
+  predicate := public.compile_segment(target_user, p_list_ids, p_rule_config);
+
+  -- One list without rules: its maintained subscribed-member counter is the exact count
+  IF p_rule_config IS NULL AND cardinality(p_list_ids) = 1 THEN
+    SELECT COALESCE(n.subscribed_count, 0) INTO matched
+    FROM public.email_lists l
+    LEFT JOIN public.email_list_member_counts n ON n.list_id = l.id
+    WHERE l.id = p_list_ids[1] AND l.user_id = target_user;
+  END IF;
+
+  IF matched IS NULL AND p_mode <> 'exact' THEN
+    -- Index-only over the user's entries; far cheaper than evaluating the predicate
+    SELECT count(*) INTO contact_total FROM public.contacts WHERE user_id = target_user;
+  END IF;
+
+  IF matched IS NULL AND (p_mode = 'estimate' OR (p_mode = 'auto' AND contact_total > exact_limit)) THEN
+    -- The user's ids from sample_start on, wrapping around to the lowest ones
+    EXECUTE format($sql$
+      SELECT count(*), count(*) FILTER (WHERE %s)
+      FROM (
+        SELECT * FROM (
+          (SELECT * FROM public.contacts WHERE user_id = $1 AND id >= $2 ORDER BY id LIMIT $3)
+          UNION ALL
+          (SELECT * FROM public.contacts WHERE user_id = $1 AND id < $2 ORDER BY id LIMIT $3)
+        ) wrapped
+        LIMIT $3
+      ) c
+    $sql$, predicate) INTO sampled, sampled_matches USING target_user, sample_start, sample_target;
+
+    IF sampled < contact_total THEN
+      matched := round(sampled_matches::numeric * contact_total / sampled);
+      sample_percent := round(100.0 * sampled / contact_total, 2);
+      is_estimate := true;
+    ELSE
+      matched := sampled_matches; -- the sample was the whole account
+    END IF;
+  END IF;
+
+  IF matched IS NULL THEN
+    EXECUTE format('SELECT count(*) FROM public.contacts c WHERE c.user_id = $1 AND (%s)', predicate)
+    INTO matched USING target_user;
+  END IF;
+
+  IF p_preview_limit > 0 AND matched > 0 THEN
+    -- Matches from the same random start on, so the preview is a random pick
+    EXECUTE format($sql$
+      SELECT COALESCE(jsonb_agg(to_jsonb(t)), '[]'::jsonb)
+      FROM (
+        SELECT * FROM (
+          (SELECT c.id, c.email, c.first_name, c.last_name, c.status, c.tags
+           FROM public.contacts c
+           WHERE c.user_id = $1 AND c.id >= $2 AND (%s)
+           ORDER BY c.id
+           LIMIT $3)
+          UNION ALL
+          (SELECT c.id, c.email, c.first_name, c.last_name, c.status, c.tags
+           FROM public.contacts c
+           WHERE c.user_id = $1 AND c.id < $2 AND (%s)
+           ORDER BY c.id
+           LIMIT $3)
+        ) wrapped
+        LIMIT $3
+      ) t
+    $sql$, predicate, predicate) INTO preview USING target_user, sample_start, p_preview_limit;
+  END IF;
+
+  summary := jsonb_build_object(
+    'count', matched,
+    'is_estimate', is_estimate,
+    'sample_percent', sample_percent,
+    'computed_at', now(),
+    'preview', preview
+  );
+
+  INSERT INTO public.segment_count_cache (user_id, segment_hash, result, computed_at)
+  VALUES (target_user, hash, summary, now())
+  ON CONFLICT (user_id, segment_hash) DO UPDATE
+  SET result = EXCLUDED.result,
+      computed_at = EXCLUDED.computed_at;
+
+  RETURN summary || jsonb_build_object('cached', false);
+END;
+$function$;
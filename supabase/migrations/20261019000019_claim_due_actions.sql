@@ -0,0 +1,119 @@
+-- Lease-based claiming of due automation actions
+-- Executors (the automation-engine worker, process-automations) selected pending due
+-- actions and then marked each one 'executing' with its own update, so two overlapping
+-- runs could pick up the same action and send its email twice. claim_due_actions claims a
+-- batch in one statement:
+--   * due rows are locked with FOR UPDATE SKIP LOCKED, so concurrent callers get disjoint
+--     batches instead of waiting on each other
+--   * claimed rows become 'executing' with a lease and the claim's token; an executor that
+--     dies mid-batch leaves rows whose lease runs out, and the next claim picks them up again
+--   * executors renew the lease of a long batch with renew_action_leases
+--   * every claim counts an attempt; an action whose lease ran out p_max_attempts times
+--     (say, one that crashes its executor) is marked failed instead of claimed again
+
+ALTER TABLE public.automation_actions
+ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE,
+ADD COLUMN IF NOT EXISTS claim_token UUID,
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN public.automation_actions.lease_expires_at IS 'While executing: when the claiming executor''s lease runs out and the action may be claimed again';
+COMMENT ON COLUMN public.automation_actions.claim_token IS 'Token of the claim_due_actions call holding the action; renewals and outcomes must present it';
+COMMENT ON COLUMN public.automation_actions.attempts IS 'Number of times the action has been claimed';
+
+-- Rows left 'executing' by the old executors never got a lease; let them expire soon
+UPDATE public.automation_actions
+SET lease_expires_at = updated_at + interval '15 minutes'
+WHERE status = 'executing'
+  AND lease_expires_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_automation_actions_lease_expires_at
+  ON public.automation_actions(lease_expires_at) WHERE status = 'executing';
+
+CREATE INDEX IF NOT EXISTS idx_automation_actions_claim_token
+  ON public.automation_actions(claim_token) WHERE status = 'executing';
+
+-- Claim up to p_batch_size due actions (oldest execute_at first) for p_lease_seconds.
+-- Returns the claimed rows, already marked 'executing' and sharing one claim_token.
+CREATE OR REPLACE FUNCTION public.claim_due_actions(
+  p_batch_size integer DEFAULT 50,
+  p_lease_seconds integer DEFAULT 300,
+  p_max_attempts integer DEFAULT 5
+)
+RETURNS SETOF public.automation_actions
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  token uuid := gen_random_uuid();
+BEGIN
+  IF COALESCE(p_lease_seconds, 0) <= 0 THEN
+    RAISE EXCEPTION 'p_lease_seconds must be positive';
+  END IF;
+
+  -- Expired leases that used up their attempts are not claimed again
+  WITH exhausted AS (
+    SELECT a.id
+    FROM public.automation_actions a
+    WHERE a.status = 'executing'
+      AND a.lease_expires_at <= now()
+      AND a.attempts >= GREATEST(COALESCE(p_max_attempts, 5), 1)
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE public.automation_actions a
+  SET status = 'failed',
+      executed_at = now(),
+      error_message = format('Lease expired after %s attempts', a.attempts),
+      lease_expires_at = NULL,
+      claim_token = NULL
+  FROM exhausted
+  WHERE a.id = exhausted.id;
+
+  RETURN QUERY
+  WITH due AS (
+    SELECT a.id
+    FROM public.automation_actions a
+    WHERE (a.status = 'pending' AND a.execute_at <= now())
+       OR (a.status = 'executing' AND a.lease_expires_at <= now())
+    ORDER BY a.execute_at
+    LIMIT GREATEST(COALESCE(p_batch_size, 50), 1)
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE public.automation_actions a
+  SET status = 'executing',
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      claim_token = token,
+      attempts = a.attempts + 1
+  FROM due
+  WHERE a.id = due.id
+  RETURNING a.*;
+END;
+$function$;
+
+-- Extend the lease of the actions of one claim that are still executing and still held by
+-- it. Returns how many were renewed.
+CREATE OR REPLACE FUNCTION public.renew_action_leases(p_claim_token uuid, p_lease_seconds integer DEFAULT 300)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  renewed integer;
+BEGIN
+  IF COALESCE(p_lease_seconds, 0) <= 0 THEN
+    RAISE EXCEPTION 'p_lease_seconds must be positive';
+  END IF;
+
+  UPDATE public.automation_actions
+  SET lease_expires_at = GREATEST(lease_expires_at, now() + make_interval(secs => p_lease_seconds))
+  WHERE claim_token = p_claim_token
+    AND status = 'executing';
+  GET DIAGNOSTICS renewed = ROW_COUNT;
+  RETURN renewed;
+END;
+$function$;
+
+-- Only executors running with the service role claim actions
+REVOKE EXECUTE ON FUNCTION public.claim_due_actions(integer, integer, integer) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.renew_action_leases(uuid, integer) FROM PUBLIC, anon, authenticated;
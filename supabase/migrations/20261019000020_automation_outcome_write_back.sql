@@ -0,0 +1,107 @@
+-- Bulk write-back of automation outcomes
+-- Every executed action cost the automation engine 5-6 writes: the action status PATCH,
+-- the next step's INSERT, a log INSERT and a read-then-PATCH of the rule's success or
+-- failure count, which also lost increments when executors ran concurrently. Executors now
+-- collect outcomes as actions finish and record them a few dozen at a time with one call:
+--   * apply_automation_rule_stat_deltas adds summed per-rule deltas in one UPDATE
+--   * record_automation_outcomes finishes claimed actions, inserts next steps and logs and
+--     applies the rule deltas in one transaction, one statement per table
+-- Only actions still held by the reporting claim (claim_due_actions' claim_token) are
+-- finished, and next steps, logs and deltas of any other action are dropped: an action
+-- whose lease ran out and was claimed again is reported by its new executor. Rows whose
+-- rule or contact was deleted meanwhile are skipped instead of failing the whole call.
+
+-- p_deltas: [{rule_id, triggered?, succeeded?, failed?, last_triggered_at?}]; several entries
+-- for the same rule are summed
+CREATE OR REPLACE FUNCTION public.apply_automation_rule_stat_deltas(p_deltas jsonb)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+BEGIN
+  UPDATE public.automation_rules r
+  SET trigger_count = r.trigger_count + d.triggered,
+      success_count = r.success_count + d.succeeded,
+      failure_count = r.failure_count + d.failed,
+      last_triggered_at = GREATEST(r.last_triggered_at, d.last_triggered_at)
+  FROM (
+    SELECT x.rule_id,
+           sum(COALESCE(x.triggered, 0))::integer AS triggered,
+           sum(COALESCE(x.succeeded, 0))::integer AS succeeded,
+           sum(COALESCE(x.failed, 0))::integer AS failed,
+           max(x.last_triggered_at) AS last_triggered_at
+    FROM jsonb_to_recordset(COALESCE(p_deltas, '[]'::jsonb))
+      AS x(rule_id uuid, triggered integer, succeeded integer, failed integer, last_triggered_at timestamp with time zone)
+    GROUP BY x.rule_id
+  ) d
+  WHERE r.id = d.rule_id;
+END;
+$function$;
+
+-- p_actions:      [{id, claim_token, status, executed_at, error_message}] final state of claimed actions
+-- p_next_actions: [{automation_action_id, automation_rule_id, contact_id, execute_at, step_index}]
+--                 steps to schedule after the given action
+-- p_logs:         [{automation_rule_id, automation_action_id, contact_id, event_type, status, message}]
+-- p_rule_stats:   as for apply_automation_rule_stat_deltas, plus the automation_action_id
+--                 each entry comes from
+CREATE OR REPLACE FUNCTION public.record_automation_outcomes(
+  p_actions jsonb DEFAULT '[]'::jsonb,
+  p_next_actions jsonb DEFAULT '[]'::jsonb,
+  p_logs jsonb DEFAULT '[]'::jsonb,
+  p_rule_stats jsonb DEFAULT '[]'::jsonb
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $function$
+DECLARE
+  finished uuid[];
+BEGIN
+  WITH done AS (
+    UPDATE public.automation_actions a
+    SET status = o.status,
+        executed_at = o.executed_at,
+        error_message = o.error_message,
+        lease_expires_at = NULL,
+        claim_token = NULL
+    FROM jsonb_to_recordset(COALESCE(p_actions, '[]'::jsonb))
+      AS o(id uuid, claim_token uuid, status text, executed_at timestamp with time zone, error_message text)
+    WHERE a.id = o.id
+      AND a.status = 'executing'
+      AND a.claim_token = o.claim_token
+    RETURNING a.id
+  )
+  SELECT COALESCE(array_agg(id), ARRAY[]::uuid[]) INTO finished FROM done;
+
+  -- A step already scheduled for the same time (a retried call) is left alone
+  INSERT INTO public.automation_actions (automation_rule_id, contact_id, status, execute_at, step_index)
+  SELECT n.automation_rule_id, n.contact_id, 'pending', n.execute_at, n.step_index
+  FROM jsonb_to_recordset(COALESCE(p_next_actions, '[]'::jsonb))
+    AS n(automation_action_id uuid, automation_rule_id uuid, contact_id uuid, execute_at timestamp with time zone,
+         step_index integer)
+  WHERE n.automation_action_id = ANY(finished)
+    AND EXISTS (SELECT 1 FROM public.automation_rules r WHERE r.id = n.automation_rule_id)
+    AND EXISTS (SELECT 1 FROM public.contacts c WHERE c.id = n.contact_id)
+  ON CONFLICT DO NOTHING;
+
+  INSERT INTO public.automation_logs (automation_rule_id, automation_action_id, contact_id, event_type, status, message)
+  SELECT l.automation_rule_id, l.automation_action_id, l.contact_id, l.event_type, l.status, l.message
+  FROM jsonb_to_recordset(COALESCE(p_logs, '[]'::jsonb))
+    AS l(automation_rule_id uuid, automation_action_id uuid, contact_id uuid, event_type text, status text, message text)
+  WHERE l.automation_action_id = ANY(finished)
+    AND EXISTS (SELECT 1 FROM public.automation_rules r WHERE r.id = l.automation_rule_id)
+    AND EXISTS (SELECT 1 FROM public.contacts c WHERE c.id = l.contact_id);
+
+  PERFORM public.apply_automation_rule_stat_deltas((
+    SELECT COALESCE(jsonb_agg(d), '[]'::jsonb)
+    FROM jsonb_array_elements(COALESCE(p_rule_stats, '[]'::jsonb)) AS d
+    WHERE (d->>'automation_action_id')::uuid = ANY(finished)
+  ));
+END;
+$function$;
+
+-- Only executors running with the service role record outcomes
+REVOKE EXECUTE ON FUNCTION public.apply_automation_rule_stat_deltas(jsonb) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.record_automation_outcomes(jsonb, jsonb, jsonb, jsonb) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Synthetic contact data for benchmarks and simulations.
+Produces contacts shaped like rows of public.contacts (email, tags, ...) with
+realistic tag spellings: mixed case, stray whitespace and repeated tags.
+"""
+
+import random
+import uuid
+
+DEFAULT_SEED = 1234
+
+
+def make_tag_vocabulary(size, seed=DEFAULT_SEED):
+    """Return `size` distinct canonical tag names (product, campaign and status style)"""
+    rng = random.Random(seed)
+    prefixes = ["product", "campaign", "interest", "source", "status", "purchased", "webinar", "course"]
+    vocabulary = []
+    seen = set()
+    while len(vocabulary) < size:
+        tag = f"{rng.choice(prefixes)}-{len(vocabulary)}"
+        if tag not in seen:
+            seen.add(tag)
+            vocabulary.append(tag)
+    return vocabulary
+
+
+def messy_spelling(tag, rng):
+    """Vary case and whitespace the way Make.com and manual edits do"""
+    roll = rng.random()
+    if roll < 0.1:
+        tag = tag.upper()
+    elif roll < 0.2:
+        tag = tag.title()
+    if rng.random() < 0.1:
+        tag = f" {tag} "
+    return tag
+
+
+def random_tags(vocabulary, count, rng, messy=True):
+    count = min(count, len(vocabulary))
+    tags = rng.sample(vocabulary, count)
+    if messy:
+        tags = [messy_spelling(tag, rng) for tag in tags]
+    return tags
+
+
+def generate_contacts(count, tags_per_contact, vocabulary, user_id=None, seed=DEFAULT_SEED, messy=True):
+    """
+    Generate `count` contact dicts. `tags_per_contact` is an int or an (min, max) tuple.
+    """
+    rng = random.Random(seed)
+    user_id = user_id or str(uuid.UUID(int=rng.getrandbits(128)))
+    contacts = []
+    for i in range(count):
+        if isinstance(tags_per_contact, tuple):
+            n_tags = rng.randint(*tags_per_contact)
+        else:
+            n_tags = tags_per_contact
+        contacts.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": user_id,
+            "email": f"contact{i}@example.com",
+            "first_name": f"Contact{i}",
+            "last_name": None,
+            "status": "subscribed",
+            "tags": random_tags(vocabulary, n_tags, rng, messy=messy),
+        })
+    return contacts
+
+
+def generate_tag_rules(count, vocabulary, seed=DEFAULT_SEED, start=None):
+    """
+    Generate `count` tag_rules rows without dependency cycles (cyclic rule sets are
+    rejected on save): a rule only adds or removes tags that no earlier rule triggers on.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1, tzinfo=timezone.utc)
+    used_triggers = set()
+    rules = []
+    for i in range(count):
+        triggers = rng.sample(vocabulary, rng.randint(1, 3))
+        used_triggers.update(triggers)
+        free = [tag for tag in rng.sample(vocabulary, min(len(vocabulary), 12)) if tag not in used_triggers]
+        add_tags = free[: rng.randint(1, 2)]
+        remove_tags = free[len(add_tags): len(add_tags) + rng.randint(0, 1)]
+        rules.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"rule {i}",
+            "created_at": (start + timedelta(seconds=i)).isoformat(),
+            "enabled": True,
+            "trigger_tag": triggers[0],
+            "trigger_tags": triggers,
+            "trigger_match_type": "all" if rng.random() < 0.25 else "any",
+            "add_tags": add_tags,
+            "remove_tags": remove_tags,
+            "replace_all_tags": False,
+        })
+    return rules
+
+
+if __name__ == "__main__":
+    vocab = make_tag_vocabulary(20)
+    for contact in generate_contacts(3, (2, 5), vocab):
+        print(contact["email"], contact["tags"])
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tag Pipeline Micro-benchmark
+Compares the tag parsing/merge steps of sync-contacts before and after the shared
+tag module (supabase/functions/_shared/tags.ts), for 1-1000 tags per contact.
+
+Two modes:
+  python tag_pipeline_benchmark.py
+      Runs Python mirrors of both algorithms in-process.
+  python tag_pipeline_benchmark.py --url http://localhost:54321/functions/v1/sync-contacts
+      Also posts payloads to a locally served sync-contacts function
+      (`supabase functions serve`) and reports request latency.
+"""
+
+import argparse
+import re
+import statistics
+import sys
+import time
+import uuid
+
+from synthetic_contacts import generate_contacts, make_tag_vocabulary, random_tags
+
+TAG_COUNTS = [1, 10, 100, 250, 500, 1000]
+
+
+# --- Previous sync-contacts behaviour -------------------------------------------------
+
+def legacy_pipeline(existing, incoming, protected_rules, dynamic_lists):
+    def split_parts(s):
+        return [p.strip() for p in re.split(r"[,;\n]", s) if p.strip()]
+
+    incoming_tags = list(dict.fromkeys(t for item in incoming for t in split_parts(item)))
+    existing_tags = [t.strip() for t in existing if t.strip()]
+    final_tags = list(dict.fromkeys(existing_tags + incoming_tags))
+
+    # rule.add_tags.includes(tag) for every tag of every protected rule
+    protected = [tag for rule in protected_rules for tag in final_tags if tag in rule]
+
+    if any(t.lower() == "unsub" for t in incoming_tags):
+        if not any(t.lower() == "unsub" for t in final_tags):
+            final_tags.append("unsub")
+    else:
+        final_tags = [t for t in final_tags if t.lower() != "unsub"]
+
+    # requiredTags.some(tag => finalTags.includes(tag)) per dynamic list
+    memberships = [any(tag in final_tags for tag in required) for required in dynamic_lists]
+    return final_tags, protected, memberships
+
+
+# --- Shared tag module behaviour ------------------------------------------------------
+
+TAG_SEPARATOR = re.compile(r"[,;\n]")
+_canonical_cache = {}
+
+
+def canonical_tag(tag):
+    canonical = _canonical_cache.get(tag)
+    if canonical is None:
+        canonical = tag.strip().lower()
+        _canonical_cache[tag] = canonical
+    return canonical
+
+
+def merge_tags(*lists):
+    seen = set()
+    merged = []
+    for tags in lists:
+        for tag in tags:
+            trimmed = tag.strip()
+            if not trimmed:
+                continue
+            canonical = canonical_tag(trimmed)
+            if canonical in seen:
+                continue
+            seen.add(canonical)
+            merged.append(trimmed)
+    return merged
+
+
+def shared_pipeline(existing, incoming, protected_rules, dynamic_lists):
+    incoming_tags = merge_tags([p for item in incoming for p in TAG_SEPARATOR.split(item)])
+    final_tags = merge_tags(existing, incoming_tags)
+
+    final_set = set(final_tags)
+    protected = {tag for rule in protected_rules for tag in rule if tag in final_set}
+
+    if any(canonical_tag(t) == "unsub" for t in incoming_tags):
+        if not any(canonical_tag(t) == "unsub" for t in final_tags):
+            final_tags.append("unsub")
+    else:
+        final_tags = [t for t in final_tags if canonical_tag(t) != "unsub"]
+
+    final_set = set(final_tags)
+    memberships = [any(tag in final_set for tag in required) for required in dynamic_lists]
+    return final_tags, protected, memberships
+
+
+def time_call(fn, args, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def run_in_process(repeats):
+    import random
+
+    rng = random.Random(42)
+    vocabulary = make_tag_vocabulary(3000)
+    protected_rules = [random_tags(vocabulary, 5, rng, messy=False) for _ in range(20)]
+    dynamic_lists = [random_tags(vocabulary, 3, rng, messy=False) for _ in range(25)]
+
+    print(f"{'tags':>6} | {'legacy (us)':>12} | {'shared (us)':>12} | {'speedup':>8}")
+    print("-" * 48)
+    for count in TAG_COUNTS:
+        existing = random_tags(vocabulary, count, rng)
+        # Incoming overlaps half of the existing tags with different spellings
+        incoming = [", ".join(t.upper() for t in existing[: count // 2])] + random_tags(vocabulary, count - count // 2, rng)
+        args = (existing, incoming, protected_rules, dynamic_lists)
+        legacy_us = time_call(legacy_pipeline, args, repeats)
+        shared_us = time_call(shared_pipeline, args, repeats)
+        print(f"{count:>6} | {legacy_us:>12.1f} | {shared_us:>12.1f} | {legacy_us / shared_us:>7.1f}x")
+
+
+def run_against_function(url, api_key, requests_per_size):
+    import requests
+
+    vocabulary = make_tag_vocabulary(3000)
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    print(f"\nPosting to {url}")
+    print(f"{'tags':>6} | {'p50 (ms)':>10} | {'p95 (ms)':>10} | {'errors':>6}")
+    print("-" * 42)
+    for count in TAG_COUNTS:
+        latencies = []
+        errors = 0
+        contacts = generate_contacts(requests_per_size, count, vocabulary, seed=count)
+        for contact in contacts:
+            payload = {
+                "email": f"bench-{uuid.uuid4().hex[:12]}@example.com",
+                "name": contact["first_name"],
+                "tags": contact["tags"],
+            }
+            start = time.perf_counter()
+            response = requests.post(url, json=payload, headers=headers, timeout=60)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{count:>6} | {statistics.median(latencies):>10.1f} | {p95:>10.1f} | {errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=200, help="in-process repetitions per size")
+    parser.add_argument("--url", help="locally served sync-contacts function URL")
+    parser.add_argument("--api-key", help="anon or service key for the local function")
+    parser.add_argument("--requests", type=int, default=20, help="HTTP requests per size")
+    args = parser.parse_args()
+
+    run_in_process(args.repeats)
+    if args.url:
+        run_against_function(args.url, args.api_key, args.requests)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
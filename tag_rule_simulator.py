@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Offline Tag Rule Simulator
+Evaluates tag_rules against a contacts snapshot with the same semantics as
+apply_tag_rules_pure (dependency order, case-insensitive matching, replace_all),
+without touching the database, and summarizes what a reapply would change.
+
+Tags are interned into ids and stored column-wise: each tag is a bitset over all
+contacts (a Python int), so every rule is evaluated for all contacts at once with
+a handful of AND/OR/NOT operations.
+
+Usage:
+  # Synthetic snapshot and rules
+  python tag_rule_simulator.py --synthetic-contacts 100000 --synthetic-rules 200
+
+  # Exported rules (JSON) and contacts (JSON or CSV with a tags column)
+  python tag_rule_simulator.py --rules tag_rules.json --contacts contacts.csv --candidate new_rule.json
+
+  # Straight from a Postgres copy of the database (needs psycopg2)
+  python tag_rule_simulator.py --dsn postgresql://... --user-id <uuid> --candidate new_rule.json
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+
+# Per-row cost of a reapply (evaluate + write), measured with tag_rules_benchmark.py
+DEFAULT_EVAL_US = 60.0
+DEFAULT_WRITE_US = 400.0
+
+
+def normalize_tags(tags):
+    """Python mirror of public.normalize_tag_array"""
+    return sorted({t.strip().lower() for t in tags or [] if t is not None and t.strip()})
+
+
+def clean_tags(tags):
+    """Python mirror of public.clean_tag_array"""
+    seen = set()
+    cleaned = []
+    for t in tags or []:
+        if t is None or not t.strip():
+            continue
+        key = t.strip().lower()
+        if key not in seen:
+            seen.add(key)
+            cleaned.append(t.strip())
+    return cleaned
+
+
+@dataclass
+class Rule:
+    id: str
+    name: str
+    created_at: str
+    trigger: list
+    match_all: bool
+    add: list
+    add_clean: list
+    remove: list
+    replace_all: bool
+    enabled: bool = True
+
+    @classmethod
+    def from_row(cls, row):
+        trigger_tags = row.get("trigger_tags") or [row.get("trigger_tag")]
+        return cls(
+            id=str(row.get("id") or uuid.uuid4()),
+            name=row.get("name") or "",
+            created_at=str(row.get("created_at") or ""),
+            trigger=normalize_tags(trigger_tags),
+            match_all=(row.get("trigger_match_type") or "any") == "all",
+            add=normalize_tags(row.get("add_tags")),
+            add_clean=clean_tags(row.get("add_tags")),
+            remove=normalize_tags(row.get("remove_tags")),
+            replace_all=bool(row.get("replace_all_tags")),
+            enabled=row.get("enabled", True) is not False,
+        )
+
+
+def rule_order(rules):
+    """
+    Python mirror of public.compile_tag_rule_set: Kahn's algorithm by layers with ties
+    broken by (created_at, id). Returns (ordered rules, ids of rules on a cycle).
+    """
+    active = sorted((r for r in rules if r.enabled and r.trigger), key=lambda r: (r.created_at, r.id))
+    edges = {r.id: set() for r in active}  # dst -> sources
+    for a in active:
+        touched = set(a.add) | set(a.remove)
+        for b in active:
+            if a.id != b.id and touched & set(b.trigger):
+                edges[b.id].add(a.id)
+
+    ordered = []
+    remaining = active
+    while True:
+        remaining_ids = {r.id for r in remaining}
+        layer = [r for r in remaining if not (edges[r.id] & remaining_ids)]
+        if not layer:
+            break
+        ordered.extend(layer)
+        layer_ids = {r.id for r in layer}
+        remaining = [r for r in remaining if r.id not in layer_ids]
+
+    cyclic = {r.id for r in remaining}
+    while True:
+        leaves = {rid for rid in cyclic if not any(rid in edges[dst] for dst in cyclic)}
+        if not leaves:
+            break
+        cyclic -= leaves
+    return ordered + remaining, cyclic
+
+
+class Snapshot:
+    """Contacts as per-tag bitsets; bit i is contact i"""
+
+    def __init__(self, contacts):
+        self.contacts = contacts
+        self.size = len(contacts)
+        self.columns = {}
+        for i, contact in enumerate(contacts):
+            bit = 1 << i
+            for tag in normalize_tags(contact.get("tags")):
+                self.columns[tag] = self.columns.get(tag, 0) | bit
+
+    def tags_of(self, columns, index):
+        bit = 1 << index
+        return sorted(tag for tag, col in columns.items() if col & bit)
+
+
+@dataclass
+class RuleEffect:
+    rule: Rule
+    matched: int = 0
+    changed: int = 0
+    added: Counter = field(default_factory=Counter)
+    removed: Counter = field(default_factory=Counter)
+
+
+def simulate(rules, snapshot):
+    """
+    Apply rules to every contact. Returns (final columns, per-rule effects in evaluation order).
+    Mirrors apply_tag_rules_pure step by step, including that a rule's removals only apply
+    to contacts that carried a remove tag before the rule ran.
+    """
+    ordered, _ = rule_order(rules)
+    columns = dict(snapshot.columns)
+    everyone = (1 << snapshot.size) - 1
+    effects = []
+
+    for rule in ordered:
+        effect = RuleEffect(rule)
+        effects.append(effect)
+
+        if rule.match_all:
+            fired = everyone
+            for tag in rule.trigger:
+                fired &= columns.get(tag, 0)
+        else:
+            fired = 0
+            for tag in rule.trigger:
+                fired |= columns.get(tag, 0)
+        if not fired:
+            continue
+        effect.matched = bin(fired).count("1")
+        changed = 0
+
+        if rule.replace_all:
+            if not rule.add:
+                continue
+            for tag in list(columns):
+                if tag in rule.add:
+                    continue
+                dropped = columns[tag] & fired
+                if dropped:
+                    effect.removed[tag] += bin(dropped).count("1")
+                    changed |= dropped
+                    columns[tag] &= ~fired
+            for tag in rule.add:
+                gained = fired & ~columns.get(tag, 0)
+                if gained:
+                    effect.added[tag] += bin(gained).count("1")
+                    changed |= gained
+                columns[tag] = columns.get(tag, 0) | fired
+        else:
+            had_remove_tag = 0
+            for tag in rule.remove:
+                had_remove_tag |= columns.get(tag, 0)
+            strip = fired & had_remove_tag
+
+            for tag in rule.add:
+                gained = fired & ~columns.get(tag, 0)
+                if gained:
+                    effect.added[tag] += bin(gained).count("1")
+                    changed |= gained
+                columns[tag] = columns.get(tag, 0) | fired
+            for tag in rule.remove:
+                dropped = columns.get(tag, 0) & strip
+                if dropped:
+                    effect.removed[tag] += bin(dropped).count("1")
+                    changed |= dropped
+                    columns[tag] &= ~strip
+
+        effect.changed = bin(changed).count("1")
+
+    return columns, effects
+
+
+def diff_columns(before, after):
+    """Contacts whose tag set differs, plus per-tag added/removed counts"""
+    changed = 0
+    added = Counter()
+    removed = Counter()
+    for tag in set(before) | set(after):
+        b = before.get(tag, 0)
+        a = after.get(tag, 0)
+        if a & ~b:
+            added[tag] = bin(a & ~b).count("1")
+        if b & ~a:
+            removed[tag] = bin(b & ~a).count("1")
+        changed |= a ^ b
+    return bin(changed).count("1"), added, removed
+
+
+def reapply_scope(rules, changed_rules, snapshot):
+    """
+    Contacts a reapply job would scan for a change to `changed_rules`, mirroring
+    on_tag_rule_change and tag_rule_upstream_triggers
+    """
+    active = [r for r in rules if r.enabled]
+    if any(r.replace_all for r in changed_rules):
+        return snapshot.size
+    scope = set()
+    removed = set()
+    for rule in changed_rules:
+        scope |= set(rule.trigger)
+        removed |= set(rule.remove)
+    scope |= {t for r in active if set(r.add) & removed for t in r.trigger}
+    while True:
+        expanded = scope | {t for r in active if set(r.add) & scope for t in r.trigger}
+        if expanded == scope:
+            break
+        scope = expanded
+    selected = 0
+    for tag in scope:
+        selected |= snapshot.columns.get(tag, 0)
+    return bin(selected).count("1")
+
+
+# --- Loading ------------------------------------------------------------------------------
+
+def parse_tags_cell(value):
+    """Tags from an export cell: JSON array, Postgres array literal or comma separated"""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    value = value.strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        return json.loads(value)
+    if value.startswith("{") and value.endswith("}"):
+        return next(csv.reader([value[1:-1]], skipinitialspace=True), [])
+    return [t for t in value.split(",")]
+
+
+def load_contacts_file(path):
+    if path.endswith(".json"):
+        with open(path) as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+    return [{"id": row.get("id"), "email": row.get("email"), "tags": parse_tags_cell(row.get("tags"))} for row in rows]
+
+
+def load_rules_file(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+RULE_COLUMNS = ("id, name, created_at, enabled, trigger_tag, trigger_tags, trigger_match_type, "
+                "add_tags, remove_tags, replace_all_tags")
+
+
+def load_from_postgres(dsn, user_id):
+    import psycopg2
+    import psycopg2.extras
+
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(f"SELECT {RULE_COLUMNS} FROM public.tag_rules WHERE user_id = %s", (user_id,))
+        rules = [dict(r, id=str(r["id"]), created_at=r["created_at"].isoformat()) for r in cur.fetchall()]
+        cur.execute("SELECT id, email, tags FROM public.contacts WHERE user_id = %s ORDER BY id", (user_id,))
+        contacts = [dict(c, id=str(c["id"])) for c in cur.fetchall()]
+    finally:
+        conn.close()
+    return rules, contacts
+
+
+# --- Report -------------------------------------------------------------------------------
+
+def print_tag_counts(title, counts, limit):
+    if not counts:
+        return
+    print(f"  {title}:")
+    for tag, count in counts.most_common(limit):
+        print(f"    {tag:<40} {count:>10}")
+
+
+def report(snapshot, rules, candidates, eval_us, write_us, top):
+    start = time.perf_counter()
+    all_rules = rules + candidates
+    columns, effects = simulate(all_rules, snapshot)
+    elapsed = time.perf_counter() - start
+
+    _, cyclic = rule_order(all_rules)
+    changed, added, removed = diff_columns(snapshot.columns, columns)
+
+    print(f"Simulated {len(all_rules)} rules over {snapshot.size} contacts in {elapsed:.2f}s")
+    if cyclic:
+        names = [r.name or r.id for r in all_rules if r.id in cyclic]
+        print(f"⚠️  Rules on a dependency cycle (saving would be rejected): {', '.join(names)}")
+
+    print(f"\nContacts changed by a full reapply: {changed}")
+    print_tag_counts("Tags added", added, top)
+    print_tag_counts("Tags removed", removed, top)
+
+    print(f"\n{'rule':<40} | {'matched':>9} | {'changed':>9} | {'added':>7} | {'removed':>7}")
+    print("-" * 84)
+    for effect in sorted(effects, key=lambda e: e.changed, reverse=True)[:top]:
+        print(f"{(effect.rule.name or effect.rule.id)[:40]:<40} | {effect.matched:>9} | {effect.changed:>9} | "
+              f"{sum(effect.added.values()):>7} | {sum(effect.removed.values()):>7}")
+
+    if candidates:
+        baseline, _ = simulate(rules, snapshot)
+        candidate_changed, candidate_added, candidate_removed = diff_columns(baseline, columns)
+        scanned = reapply_scope(all_rules, candidates, snapshot)
+        estimate = (scanned * eval_us + candidate_changed * write_us) / 1e6
+        print(f"\nCandidate rule(s): {', '.join(r.name or r.id for r in candidates)}")
+        print(f"  Contacts changed relative to current rules: {candidate_changed}")
+        print_tag_counts("Tags added", candidate_added, top)
+        print_tag_counts("Tags removed", candidate_removed, top)
+        print(f"  Reapply would scan {scanned} contacts, estimated {estimate:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", help="tag_rules export (JSON list of rows)")
+    parser.add_argument("--contacts", help="contacts export (JSON or CSV with a tags column)")
+    parser.add_argument("--dsn", help="load rules and contacts from Postgres")
+    parser.add_argument("--user-id", help="user whose rules and contacts to load with --dsn")
+    parser.add_argument("--candidate", action="append", default=[], help="rule(s) to backtest (JSON row or list)")
+    parser.add_argument("--synthetic-contacts", type=int, default=0)
+    parser.add_argument("--synthetic-rules", type=int, default=0)
+    parser.add_argument("--synthetic-tags", type=int, default=20, help="tags per synthetic contact")
+    parser.add_argument("--eval-us", type=float, default=DEFAULT_EVAL_US, help="per-row evaluation cost")
+    parser.add_argument("--write-us", type=float, default=DEFAULT_WRITE_US, help="per-row write cost")
+    parser.add_argument("--top", type=int, default=15, help="rows shown per table")
+    args = parser.parse_args()
+
+    rule_rows, contacts = [], []
+    if args.dsn:
+        if not args.user_id:
+            parser.error("--dsn requires --user-id")
+        rule_rows, contacts = load_from_postgres(args.dsn, args.user_id)
+    if args.rules:
+        rule_rows = load_rules_file(args.rules)
+    if args.contacts:
+        contacts = load_contacts_file(args.contacts)
+    if args.synthetic_contacts or args.synthetic_rules:
+        from synthetic_contacts import generate_contacts, generate_tag_rules, make_tag_vocabulary
+
+        vocabulary = make_tag_vocabulary(max(200, args.synthetic_rules * 4))
+        if args.synthetic_contacts:
+            contacts = generate_contacts(args.synthetic_contacts, (1, args.synthetic_tags), vocabulary)
+        if args.synthetic_rules:
+            rule_rows = generate_tag_rules(args.synthetic_rules, vocabulary)
+
+    if not contacts:
+        parser.error("no contacts: pass --contacts, --dsn/--user-id or --synthetic-contacts")
+
+    candidates = [Rule.from_row(row) for path in args.candidate for row in load_rules_file(path)]
+    report(Snapshot(contacts), [Rule.from_row(r) for r in rule_rows], candidates, args.eval_us, args.write_us, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,17 +13,32 @@ if (!supabaseServiceKey) {
 
 const supabase = createClient(supabaseUrl, supabaseServiceKey);
 
+// Record the outcome of a claimed action and release its lease, only while this run
+// still holds the claim (see process-automations). Returns whether it was still held.
+async function finishAction(action: any, fields: Record<string, unknown>) {
+  const { data, error } = await supabase
+    .from('automation_actions')
+    .update({ ...fields, lease_expires_at: null, claim_token: null })
+    .eq('id', action.id)
+    .eq('claim_token', action.claim_token)
+    .eq('status', 'executing')
+    .select('id');
+
+  if (error) {
+    console.error(`Error recording outcome of action ${action.id}:`, error);
+    return false;
+  }
+  return data.length > 0;
+}
+
 async function processPendingActions() {
   try {
-    // Get all pending actions that are due
-    const now = new Date().toISOString();
-    const { data: actions, error: actionsError } = await supabase
-      .from('automation_actions')
-      .select('*')
-      .eq('status', 'pending')
-      .lte('execute_at', now)
-      .order('execute_at', { ascending: true })
-      .limit(50);
+    // Claim due actions (marked as executing, leased for 5 minutes) so this script never
+    // processes an action the edge function or worker is running at the same time
+    const { data: actions, error: actionsError } = await supabase.rpc('claim_due_actions', {
+      p_batch_size: 50,
+      p_lease_seconds: 300,
+    });
 
     if (actionsError) throw actionsError;
 
@@ -32,18 +47,12 @@ async function processPendingActions() {
       return;
     }
 
-    console.log(`Found ${actions.length} pending actions to process`);
+    console.log(`Claimed ${actions.length} due actions to process`);
 
     for (const action of actions) {
       try {
         console.log(`\nProcessing action ${action.id} for contact ${action.contact_id}`);
         
-        // Mark as executing
-        await supabase
-          .from('automation_actions')
-          .update({ status: 'executing' })
-          .eq('id', action.id);
-
         // Get automation rule
         const { data: rule, error: ruleError } = await supabase
           .from('automation_rules')
@@ -53,14 +62,11 @@ async function processPendingActions() {
 
         if (ruleError || !rule || !rule.enabled) {
           console.error('Rule not found or disabled:', ruleError);
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'skipped',
-              executed_at: new Date().toISOString(),
-              error_message: 'Rule not found or disabled'
-            })
-            .eq('id', action.id);
+          await finishAction(action, {
+            status: 'skipped',
+            executed_at: new Date().toISOString(),
+            error_message: 'Rule not found or disabled'
+          });
           continue;
         }
 
@@ -73,14 +79,11 @@ async function processPendingActions() {
 
         if (contactError || !contact || contact.status !== 'subscribed') {
           console.error('Contact not found or unsubscribed:', contactError);
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'skipped',
-              executed_at: new Date().toISOString(),
-              error_message: 'Contact not found or unsubscribed'
-            })
-            .eq('id', action.id);
+          await finishAction(action, {
+            status: 'skipped',
+            executed_at: new Date().toISOString(),
+            error_message: 'Contact not found or unsubscribed'
+          });
           continue;
         }
 
@@ -98,13 +101,10 @@ async function processPendingActions() {
 
         if (!currentStep) {
           // All steps completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id);
+          await finishAction(action, {
+            status: 'completed',
+            executed_at: new Date().toISOString()
+          });
           console.log('All steps completed');
           continue;
         }
@@ -198,13 +198,10 @@ async function processPendingActions() {
             console.log('✅ Webhook called successfully!');
           }
         } else if (currentStep.type === 'stop') {
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id);
+          await finishAction(action, {
+            status: 'completed',
+            executed_at: new Date().toISOString()
+          });
           console.log('Automation stopped');
           continue;
         }
@@ -213,6 +210,17 @@ async function processPendingActions() {
           throw new Error(`Failed to execute step: ${currentStep.type}`);
         }
 
+        // Complete the action before scheduling the next step: if the lease ran out and
+        // another executor re-claimed it, that executor schedules it instead
+        const stillHeld = await finishAction(action, {
+          status: 'completed',
+          executed_at: new Date().toISOString()
+        });
+        if (!stillHeld) {
+          console.warn(`Action ${action.id} was re-claimed by another executor; leaving its next step to it`);
+          continue;
+        }
+
         // Check if there's a next step
         const nextStepIndex = stepIndex + 1;
         const nextStep = steps[nextStepIndex];
@@ -260,24 +268,6 @@ async function processPendingActions() {
               execute_at: executeAt.toISOString(),
               step_index: nextStepIndex,
             });
-
-          // Mark current action as completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id);
-        } else {
-          // All steps completed
-          await supabase
-            .from('automation_actions')
-            .update({
-              status: 'completed',
-              executed_at: new Date().toISOString()
-            })
-            .eq('id', action.id);
         }
 
         // Log success
@@ -296,14 +286,11 @@ async function processPendingActions() {
       } catch (error: any) {
         console.error(`❌ Error processing action ${action.id}:`, error);
         
-        await supabase
-          .from('automation_actions')
-          .update({
-            status: 'failed',
-            executed_at: new Date().toISOString(),
-            error_message: error.message
-          })
-          .eq('id', action.id);
+        await finishAction(action, {
+          status: 'failed',
+          executed_at: new Date().toISOString(),
+          error_message: error.message
+        });
 
         await supabase
           .from('automation_logs')